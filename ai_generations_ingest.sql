@@ -0,0 +1,15 @@
+-- MailoReply AI - Batched Generation Ingest
+-- Idempotency keys for ai_generations rows written by services/ingest.py
+-- Safe to run multiple times
+
+-- Client-generated key per generation event; retried deliveries carry the same key
+ALTER TABLE public.ai_generations
+  ADD COLUMN IF NOT EXISTS idempotency_key UUID;
+
+-- Rows written by the older per-event paths have no key and are not constrained.
+-- created_at is part of the key so the same index works once ai_generations is
+-- partitioned by month (ai_generations_partitioning.sql); a redelivered event
+-- carries its original created_at, so duplicates still collide.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ai_generations_idempotency_key
+  ON public.ai_generations (idempotency_key, created_at)
+  WHERE idempotency_key IS NOT NULL;
@@ -0,0 +1,92 @@
+-- MailoReply AI - Monthly Partitioning for ai_generations
+-- Turns ai_generations into a table range-partitioned by created_at, one partition per month (UTC).
+-- Existing rows are not copied: the current table becomes a single "legacy" partition holding
+-- everything before next month, and monthly partitions take over from there. New partitions are
+-- pre-created and old ones detached/archived by services/partitions.py.
+--
+-- Takes an ACCESS EXCLUSIVE lock on ai_generations for the duration; the new composite indexes are
+-- built on the legacy partition inside the same transaction, so run it in a quiet window.
+-- Run after ai_generations_ingest.sql. Safe to run multiple times.
+
+DO $$
+DECLARE
+  cutover TIMESTAMPTZ := (DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '1 month') AT TIME ZONE 'UTC';
+  month_start TIMESTAMPTZ;
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_partitioned_table pt
+    JOIN pg_class c ON c.oid = pt.partrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relname = 'ai_generations'
+  ) THEN
+    RAISE NOTICE 'ai_generations is already partitioned';
+    RETURN;
+  END IF;
+
+  LOCK TABLE public.ai_generations IN ACCESS EXCLUSIVE MODE;
+
+  -- The partition key must be NOT NULL and part of the primary key
+  UPDATE public.ai_generations SET created_at = NOW() WHERE created_at IS NULL;
+  ALTER TABLE public.ai_generations ALTER COLUMN created_at SET NOT NULL;
+  ALTER TABLE public.ai_generations DROP CONSTRAINT IF EXISTS ai_generations_pkey;
+  ALTER TABLE public.ai_generations ADD CONSTRAINT ai_generations_legacy_pkey PRIMARY KEY (id, created_at);
+
+  ALTER TABLE public.ai_generations RENAME TO ai_generations_legacy;
+  ALTER INDEX IF EXISTS public.idx_ai_generations_created RENAME TO idx_ai_generations_legacy_created;
+  ALTER INDEX IF EXISTS public.idx_ai_generations_idempotency_key RENAME TO idx_ai_generations_legacy_idempotency_key;
+  -- Superseded by (user_id, created_at) below
+  DROP INDEX IF EXISTS public.idx_ai_generations_user;
+
+  -- Lets ATTACH PARTITION skip its validation scan
+  EXECUTE format(
+    'ALTER TABLE public.ai_generations_legacy ADD CONSTRAINT ai_generations_legacy_range CHECK (created_at < %L)',
+    cutover
+  );
+
+  CREATE TABLE public.ai_generations (
+    LIKE public.ai_generations_legacy INCLUDING DEFAULTS
+  ) PARTITION BY RANGE (created_at);
+
+  ALTER TABLE public.ai_generations ADD PRIMARY KEY (id, created_at);
+  ALTER TABLE public.ai_generations
+    ADD CONSTRAINT ai_generations_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+  ALTER TABLE public.ai_generations
+    ADD CONSTRAINT ai_generations_company_id_fkey FOREIGN KEY (company_id) REFERENCES public.companies(id) ON DELETE SET NULL;
+
+  EXECUTE format(
+    'ALTER TABLE public.ai_generations ATTACH PARTITION public.ai_generations_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+    cutover
+  );
+
+  -- Created on the parent so every partition gets them; matching legacy indexes are reused
+  CREATE INDEX idx_ai_generations_created ON public.ai_generations (created_at);
+  CREATE INDEX idx_ai_generations_user_created ON public.ai_generations (user_id, created_at);
+  CREATE INDEX idx_ai_generations_company_created ON public.ai_generations (company_id, created_at);
+  CREATE UNIQUE INDEX idx_ai_generations_idempotency_key
+    ON public.ai_generations (idempotency_key, created_at)
+    WHERE idempotency_key IS NOT NULL;
+
+  -- First monthly partitions; services/partitions.py keeps creating them ahead of time
+  FOR i IN 0..2 LOOP
+    month_start := cutover + make_interval(months => i);
+    EXECUTE format(
+      'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.ai_generations FOR VALUES FROM (%L) TO (%L)',
+      'ai_generations_p' || to_char(month_start AT TIME ZONE 'UTC', 'YYYYMM'),
+      month_start,
+      month_start + INTERVAL '1 month'
+    );
+  END LOOP;
+
+  -- Same access rules as before (see final_rls_fix.sql)
+  ALTER TABLE public.ai_generations ENABLE ROW LEVEL SECURITY;
+
+  CREATE POLICY "generations_basic_read" ON public.ai_generations
+    FOR SELECT
+    USING (user_id = auth.uid());
+
+  CREATE POLICY "generations_basic_insert" ON public.ai_generations
+    FOR INSERT
+    WITH CHECK (user_id = auth.uid());
+
+  GRANT SELECT, INSERT ON public.ai_generations TO authenticated;
+END $$;
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+ai_generations Partitioning Benchmark
+Measures what monthly range partitioning (ai_generations_partitioning.sql) buys the
+dashboard queries once ai_generations holds tens of millions of rows.
+
+Two copies of the same synthetic history are loaded into a scratch schema: a single
+flat table indexed like ai_generations is today, and a table partitioned by month with
+the indexes the migration creates. The user usage breakdown (get_user_usage_breakdown in
+client/lib/enhanced-usage-tracking.ts), recent activity and the admin analytics
+aggregates run against both. The suite checks that both return the same answers, that
+last-month queries only touch the partitions they need, compares latencies with the
+harness bootstrap gate, and times VACUUM of the flat table against VACUUM of the
+current partition.
+
+Loading 50M rows twice takes a while, so the scratch schema is kept between runs and
+reused when it already holds the requested rows; pass --drop-bench to remove it.
+
+Usage: python ai_generations_partitioning_test.py [--rows=50000000] [--months=24]
+       [--users=20000] [--trials=15] [--drop-bench]
+"""
+
+import json
+import time
+import asyncio
+import asyncpg
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, compare_samples, measure, scenario_option, suite_options
+from harness.config import db_config
+from harness.instrumentation import InstrumentedConnection
+
+BENCH_SCHEMA = 'partition_bench'
+LAYOUTS = {
+    'flat': f'{BENCH_SCHEMA}.generations_flat',
+    'monthly': f'{BENCH_SCHEMA}.generations_monthly'
+}
+
+# One month of synthetic rows; the current month stops at NOW()
+LOAD_MONTH_SQL = """
+INSERT INTO {table} (id, user_id, company_id, source, generation_type, language, tone,
+                     input_length, output_length, encrypted, success, created_at)
+SELECT gen_random_uuid(),
+       md5('u' || u)::uuid,
+       CASE WHEN u % 3 = 0 THEN md5('c' || (u % 200))::uuid END,
+       CASE WHEN random() < 0.6 THEN 'website' ELSE 'extension' END::generation_source,
+       CASE WHEN random() < 0.7 THEN 'reply' ELSE 'email' END,
+       'English',
+       'Professional',
+       (random() * 2000)::int,
+       (random() * 1500)::int,
+       random() < 0.2,
+       random() > 0.03,
+       $1::timestamptz + random() * (LEAST($1::timestamptz + INTERVAL '1 month', NOW()) - $1::timestamptz)
+FROM (SELECT (random() * ($3 - 1))::int AS u FROM generate_series(1, $2)) g
+"""
+
+# The dashboard reads, with {table} standing in for public.ai_generations
+QUERIES = {
+    'usage_breakdown': ("""
+        SELECT COUNT(*) FILTER (WHERE source = 'website' AND created_at >= DATE_TRUNC('day', NOW())) AS website_today,
+               COUNT(*) FILTER (WHERE source = 'extension' AND created_at >= DATE_TRUNC('day', NOW())) AS extension_today,
+               COUNT(*) FILTER (WHERE source = 'website') AS website_month,
+               COUNT(*) FILTER (WHERE source = 'extension') AS extension_month
+        FROM {table}
+        WHERE user_id = $1 AND created_at >= DATE_TRUNC('month', NOW())
+    """, True),
+    'recent_activity': ("""
+        SELECT id, source, generation_type, created_at
+        FROM {table}
+        WHERE user_id = $1
+        ORDER BY created_at DESC
+        LIMIT 10
+    """, True),
+    'admin_last_month': ("""
+        SELECT COUNT(*) FILTER (WHERE success) AS successful, COUNT(DISTINCT user_id) AS active_users
+        FROM {table}
+        WHERE created_at >= DATE_TRUNC('month', NOW()) - INTERVAL '1 month'
+          AND created_at < DATE_TRUNC('month', NOW())
+    """, False),
+    'admin_company_30d': ("""
+        SELECT company_id, COUNT(*) AS generations
+        FROM {table}
+        WHERE company_id IS NOT NULL AND created_at >= NOW() - INTERVAL '30 days'
+        GROUP BY company_id
+        ORDER BY generations DESC, company_id
+        LIMIT 20
+    """, False)
+}
+
+# Queries bounded to the last month or two; these must prune and must not get slower
+PRUNED_QUERIES = ('usage_breakdown', 'admin_last_month', 'admin_company_30d')
+
+
+class PartitioningBenchmarkTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, rows: int = 50_000_000, months: int = 24, users: int = 20000, trials: int = 15,
+                 drop_bench: bool = False, **options):
+        super().__init__(**options)
+        self.rows = rows
+        self.months = months
+        self.users = users
+        self.trials = trials
+        self.drop_bench = drop_bench
+        self.db_pool = None
+        self.bench_user = None
+        self.timings: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Initialize the database connection pool"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=1, max_size=2, command_timeout=None,
+                connection_class=InstrumentedConnection
+            )
+            print("✅ Database pool initialized")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Drop the scratch schema if asked to, and close the pool"""
+        if self.db_pool:
+            if self.drop_bench:
+                async with self.db_pool.acquire() as conn:
+                    await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+            await self.db_pool.close()
+
+    async def loaded_rows(self, conn) -> int:
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", LAYOUTS['monthly'])
+        if not exists:
+            return -1
+        return await conn.fetchval(f"SELECT COUNT(*) FROM {LAYOUTS['monthly']}")
+
+    async def create_layouts(self, conn):
+        await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        await conn.execute(f"""
+            CREATE TABLE {LAYOUTS['flat']} (LIKE public.ai_generations INCLUDING DEFAULTS);
+            ALTER TABLE {LAYOUTS['flat']} ADD PRIMARY KEY (id);
+            CREATE TABLE {LAYOUTS['monthly']} (LIKE public.ai_generations INCLUDING DEFAULTS)
+                PARTITION BY RANGE (created_at);
+            ALTER TABLE {LAYOUTS['monthly']} ADD PRIMARY KEY (id, created_at);
+        """)
+        for offset in range(self.months):
+            # Partition names follow services/partitions.py
+            await conn.execute(f"""
+                DO $$
+                DECLARE start TIMESTAMPTZ := DATE_TRUNC('month', NOW()) - INTERVAL '{offset} months';
+                BEGIN
+                  EXECUTE format('CREATE TABLE {BENCH_SCHEMA}.%I PARTITION OF {LAYOUTS['monthly']} '
+                                 'FOR VALUES FROM (%L) TO (%L)',
+                                 'generations_monthly_p' || to_char(start, 'YYYYMM'),
+                                 start, start + INTERVAL '1 month');
+                END $$
+            """)
+
+    async def load(self, conn):
+        rows_per_month = self.rows // self.months
+        month_starts = await conn.fetch(
+            "SELECT DATE_TRUNC('month', NOW()) - make_interval(months => m) AS start "
+            "FROM generate_series(0, $1 - 1) m ORDER BY start", self.months
+        )
+        for index, row in enumerate(month_starts, 1):
+            await conn.execute(LOAD_MONTH_SQL.format(table=LAYOUTS['flat']), row['start'], rows_per_month,
+                               self.users)
+            print(f"   loaded month {index}/{self.months} ({row['start']:%Y-%m})")
+        # Identical rows in both layouts, so answers can be compared exactly
+        await conn.execute(f"INSERT INTO {LAYOUTS['monthly']} SELECT * FROM {LAYOUTS['flat']}")
+
+        # Flat: the indexes ai_generations has today; monthly: the ones the migration adds
+        await conn.execute(f"""
+            CREATE INDEX ON {LAYOUTS['flat']} (user_id);
+            CREATE INDEX ON {LAYOUTS['flat']} (created_at);
+            CREATE INDEX ON {LAYOUTS['monthly']} (user_id, created_at);
+            CREATE INDEX ON {LAYOUTS['monthly']} (created_at);
+            CREATE INDEX ON {LAYOUTS['monthly']} (company_id, created_at);
+        """)
+        await conn.execute(f"VACUUM ANALYZE {LAYOUTS['flat']}")
+        await conn.execute(f"VACUUM ANALYZE {LAYOUTS['monthly']}")
+
+    async def run_query(self, conn, name: str, layout: str):
+        sql, per_user = QUERIES[name]
+        sql = sql.format(table=LAYOUTS[layout])
+        if per_user:
+            return await conn.fetch(sql, self.bench_user)
+        return await conn.fetch(sql)
+
+    async def partitions_scanned(self, conn, name: str) -> List[str]:
+        """Partitions the executor actually visited (plan-time and run-time pruning applied)"""
+        sql, per_user = QUERIES[name]
+        explain = f"EXPLAIN (ANALYZE, FORMAT JSON) {sql.format(table=LAYOUTS['monthly'])}"
+        plan = await conn.fetchval(explain, self.bench_user) if per_user else await conn.fetchval(explain)
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+
+        scanned = set()
+
+        def walk(node):
+            relation = node.get('Relation Name', '')
+            if relation.startswith('generations_monthly_p') and node.get('Actual Loops', 0) > 0:
+                scanned.add(relation)
+            for child in node.get('Plans', []):
+                walk(child)
+
+        walk(plan[0]['Plan'])
+        return sorted(scanned)
+
+    async def test_load_datasets(self):
+        """Test 1: Flat and monthly copies of the same synthetic history"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                existing = await self.loaded_rows(conn)
+                expected = (self.rows // self.months) * self.months
+                started = time.perf_counter()
+                if existing != expected:
+                    await self.create_layouts(conn)
+                    await self.load(conn)
+                    action = f"loaded in {time.perf_counter() - started:.0f}s"
+                else:
+                    action = "reused from an earlier run"
+                self.bench_user = await conn.fetchval("SELECT md5('u1')::uuid")
+                partitions = await conn.fetchval(
+                    "SELECT COUNT(*) FROM pg_inherits WHERE inhparent = $1::regclass", LAYOUTS['monthly'])
+                flat_size = await conn.fetchval(
+                    "SELECT pg_size_pretty(pg_total_relation_size($1::regclass))", LAYOUTS['flat'])
+
+            self.log_test_result(
+                "Partitioning - Datasets",
+                True,
+                f"{expected} rows over {self.months} months ({partitions} partitions), {action}",
+                {'rows': expected, 'months': self.months, 'partitions': partitions, 'flat_size': flat_size}
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Partitioning - Datasets", False, f"Load failed: {str(e)}")
+            return False
+
+    async def test_results_match(self):
+        """Test 2: Every dashboard query answers the same on both layouts"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                differing = []
+                for name in QUERIES:
+                    flat = [tuple(row) for row in await self.run_query(conn, name, 'flat')]
+                    monthly = [tuple(row) for row in await self.run_query(conn, name, 'monthly')]
+                    if flat != monthly:
+                        differing.append(name)
+            if differing:
+                self.log_test_result("Partitioning - Same Answers", False,
+                                     f"Layouts disagree on: {', '.join(differing)}")
+                return False
+            self.log_test_result("Partitioning - Same Answers", True, f"All {len(QUERIES)} queries agree")
+            return True
+        except Exception as e:
+            self.log_test_result("Partitioning - Same Answers", False, f"Query failed: {str(e)}")
+            return False
+
+    async def test_partition_pruning(self):
+        """Test 3: Last-month queries only visit the current and previous partitions"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                scanned = {name: await self.partitions_scanned(conn, name) for name in QUERIES}
+            too_wide = [name for name in PRUNED_QUERIES if len(scanned[name]) > 2]
+            details = {name: len(partitions) for name, partitions in scanned.items()}
+            if too_wide:
+                self.log_test_result("Partitioning - Pruning", False,
+                                     f"Not pruned: {', '.join(too_wide)}", scanned)
+                return False
+            self.log_test_result(
+                "Partitioning - Pruning",
+                True,
+                "Partitions visited: " + ", ".join(f"{name} {count}" for name, count in details.items()),
+                scanned
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Partitioning - Pruning", False, f"EXPLAIN failed: {str(e)}")
+            return False
+
+    async def test_query_latency(self):
+        """Test 4: Flat vs monthly latency per query; pruned queries must not regress"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                for name in QUERIES:
+                    samples = {}
+                    for layout in LAYOUTS:
+                        samples[layout] = await measure(
+                            lambda layout=layout: self.run_query(conn, name, layout),
+                            self.trials, warmup=1, calls_per_trial=3
+                        )
+                    self.timings[name] = compare_samples(samples['flat'], samples['monthly'])
+
+            regressions = [name for name in PRUNED_QUERIES if self.timings[name]['verdict'] == 'regression']
+            summary = ", ".join(f"{name} x{1 / result['ratio']:.1f}" for name, result in self.timings.items())
+            if regressions:
+                self.log_test_result("Partitioning - Latency", False,
+                                     f"Slower when partitioned: {', '.join(regressions)}", self.timings)
+                return False
+            self.log_test_result("Partitioning - Latency", True, f"Speedup vs flat: {summary}", self.timings)
+            return True
+        except Exception as e:
+            self.log_test_result("Partitioning - Latency", False, f"Timing failed: {str(e)}")
+            return False
+
+    async def test_vacuum_scope(self):
+        """Test 5: VACUUM of the whole flat table vs the current partition"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                current = await conn.fetchval(
+                    "SELECT $1 || '.generations_monthly_p' || to_char(NOW(), 'YYYYMM')", BENCH_SCHEMA)
+                durations = {}
+                for label, table in (('flat', LAYOUTS['flat']), ('current_partition', current)):
+                    # Dirty the visibility map the way fresh inserts do, then vacuum
+                    await conn.execute(f"""
+                        UPDATE {table} SET output_length = output_length
+                        WHERE created_at >= DATE_TRUNC('month', NOW()) AND random() < 0.01
+                    """)
+                    started = time.perf_counter()
+                    await conn.execute(f"VACUUM (ANALYZE) {table}")
+                    durations[label] = round((time.perf_counter() - started) * 1000, 1)
+            self.log_test_result(
+                "Partitioning - Vacuum Scope",
+                True,
+                f"VACUUM flat {durations['flat']} ms vs current partition {durations['current_partition']} ms",
+                durations
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Partitioning - Vacuum Scope", False, f"VACUUM failed: {str(e)}")
+            return False
+
+    def print_latency_table(self):
+        if not self.timings:
+            return
+        print("📊 Median ms, flat vs monthly")
+        for name, result in self.timings.items():
+            print(f"   {name:<20} {result['baseline_median_ms']:>10.2f} {result['candidate_median_ms']:>10.2f}"
+                  f"   {result['verdict']}")
+
+    async def run_all_tests(self):
+        """Run the partitioning benchmark"""
+        print("🚀 Starting ai_generations Partitioning Benchmark")
+        print(f"   {self.rows} rows over {self.months} months from {self.users} users")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_load_datasets,
+            self.test_results_match,
+            self.test_partition_pruning,
+            self.test_query_latency,
+            self.test_vacuum_scope
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        self.print_latency_table()
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Monthly partitions prune and keep dashboard queries fast!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = PartitioningBenchmarkTester(
+        rows=scenario_option(argv, 'rows', 50_000_000),
+        months=scenario_option(argv, 'months', 24),
+        users=scenario_option(argv, 'users', 20000),
+        trials=scenario_option(argv, 'trials', 15),
+        drop_bench='--drop-bench' in argv,
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
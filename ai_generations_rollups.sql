@@ -0,0 +1,259 @@
+-- MailoReply AI - Daily Usage Rollups
+-- Per-user and per-company daily generation counts by source, generation_type, language and tone,
+-- kept up to date from ai_generations by services/rollups.py, plus the dashboard reads built on them.
+-- Run after ai_generations_partitioning.sql. Safe to run multiple times.
+--
+-- After the first run, backfill history once with: python -m services.rollups --rebuild
+
+-- 1. INGEST ORDER FOR ai_generations
+-- created_at is when the generation happened and may be in the past (batched and offline
+-- extension events keep their original time), so the rollup job follows ingested_at instead.
+-- No default on ADD COLUMN: existing rows stay NULL (no table rewrite) and are covered by --rebuild.
+ALTER TABLE public.ai_generations ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE public.ai_generations ALTER COLUMN ingested_at SET DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS idx_ai_generations_ingested ON public.ai_generations (ingested_at);
+
+-- 2. ROLLUP TABLES
+-- Days are UTC. Counts are additive, so a refresh only ever adds the rows ingested since the
+-- last one.
+CREATE TABLE IF NOT EXISTS public.usage_daily_user (
+  user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+  day DATE NOT NULL,
+  source generation_source NOT NULL,
+  generation_type TEXT NOT NULL,
+  language TEXT NOT NULL,
+  tone TEXT NOT NULL,
+  generations INTEGER NOT NULL DEFAULT 0,
+  successful INTEGER NOT NULL DEFAULT 0,
+  input_chars BIGINT NOT NULL DEFAULT 0,
+  output_chars BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, day, source, generation_type, language, tone)
+);
+
+-- Keyed on ai_generations.company_id, i.e. the company at generation time
+CREATE TABLE IF NOT EXISTS public.usage_daily_company (
+  company_id UUID NOT NULL REFERENCES public.companies(id) ON DELETE CASCADE,
+  day DATE NOT NULL,
+  source generation_source NOT NULL,
+  generation_type TEXT NOT NULL,
+  language TEXT NOT NULL,
+  tone TEXT NOT NULL,
+  generations INTEGER NOT NULL DEFAULT 0,
+  successful INTEGER NOT NULL DEFAULT 0,
+  input_chars BIGINT NOT NULL DEFAULT 0,
+  output_chars BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (company_id, day, source, generation_type, language, tone)
+);
+
+CREATE INDEX IF NOT EXISTS idx_usage_daily_user_day ON public.usage_daily_user (day);
+
+-- Rows with ingested_at < watermark (or NULL, after --rebuild) are in the rollups
+CREATE TABLE IF NOT EXISTS public.usage_rollup_state (
+  name TEXT PRIMARY KEY,
+  watermark TIMESTAMP WITH TIME ZONE NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO public.usage_rollup_state (name, watermark)
+VALUES ('ai_generations', NOW())
+ON CONFLICT (name) DO NOTHING;
+
+-- 3. DASHBOARD READS
+
+-- Usage card for getEnhancedUsageStats (client/lib/enhanced-usage-tracking.ts).
+-- Counts successful generations: rollups up to the watermark plus the few raw rows since.
+CREATE OR REPLACE FUNCTION public.get_user_usage_breakdown(user_uuid UUID DEFAULT NULL)
+RETURNS JSON AS $$
+DECLARE
+  target_user_id UUID;
+  user_record RECORD;
+  rolled_up_to TIMESTAMP WITH TIME ZONE;
+  today DATE := (NOW() AT TIME ZONE 'UTC')::date;
+  month_start DATE := DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC')::date;
+  counts RECORD;
+  device_count INTEGER;
+  recent JSON;
+BEGIN
+  -- Get the user ID (default to current authenticated user)
+  target_user_id := COALESCE(user_uuid, auth.uid());
+
+  -- Security check: users can only see their own usage
+  IF target_user_id != auth.uid() THEN
+    IF NOT EXISTS (SELECT 1 FROM public.users WHERE id = auth.uid() AND role = 'superuser') THEN
+      RAISE EXCEPTION 'Access denied: can only view your own usage';
+    END IF;
+  END IF;
+
+  SELECT daily_usage, daily_limit, monthly_usage, monthly_limit, device_limit INTO user_record
+  FROM public.users
+  WHERE id = target_user_id;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT watermark INTO rolled_up_to FROM public.usage_rollup_state WHERE name = 'ai_generations';
+
+  SELECT
+    COALESCE(SUM(successful) FILTER (WHERE source = 'website' AND day = today), 0) AS website_today,
+    COALESCE(SUM(successful) FILTER (WHERE source = 'extension' AND day = today), 0) AS extension_today,
+    COALESCE(SUM(successful) FILTER (WHERE source = 'website' AND day >= month_start), 0) AS website_month,
+    COALESCE(SUM(successful) FILTER (WHERE source = 'extension' AND day >= month_start), 0) AS extension_month,
+    COALESCE(SUM(successful) FILTER (WHERE source = 'website'), 0) AS total_website,
+    COALESCE(SUM(successful) FILTER (WHERE source = 'extension'), 0) AS total_extension
+  INTO counts
+  FROM (
+    SELECT r.day, r.source, r.successful
+    FROM public.usage_daily_user r
+    WHERE r.user_id = target_user_id
+    UNION ALL
+    -- Not rolled up yet. The created_at bound keeps this on the (user_id, created_at) index;
+    -- events that arrive more than an hour late show up after the next refresh instead.
+    SELECT (g.created_at AT TIME ZONE 'UTC')::date, g.source, 1
+    FROM public.ai_generations g
+    WHERE g.user_id = target_user_id
+      AND g.success
+      AND g.ingested_at >= rolled_up_to
+      AND g.created_at >= rolled_up_to - INTERVAL '1 hour'
+  ) usage;
+
+  SELECT COUNT(*) INTO device_count FROM public.user_devices WHERE user_id = target_user_id;
+
+  SELECT COALESCE(json_agg(a), '[]'::json) INTO recent
+  FROM (
+    SELECT g.id, g.source, g.generation_type, g.created_at, g.success
+    FROM public.ai_generations g
+    WHERE g.user_id = target_user_id
+      AND g.created_at >= NOW() - INTERVAL '30 days'
+    ORDER BY g.created_at DESC
+    LIMIT 10
+  ) a;
+
+  RETURN json_build_object(
+    'daily_used', user_record.daily_usage,
+    'daily_limit', user_record.daily_limit,
+    'monthly_used', user_record.monthly_usage,
+    'monthly_limit', user_record.monthly_limit,
+    'device_count', device_count,
+    'device_limit', user_record.device_limit,
+    'is_unlimited', user_record.monthly_limit = -1,
+    'website_today', counts.website_today,
+    'extension_today', counts.extension_today,
+    'website_month', counts.website_month,
+    'extension_month', counts.extension_month,
+    'total_website', counts.total_website,
+    'total_extension', counts.total_extension,
+    'recent_activity', recent
+  );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Daily company usage for enterprise managers, up to the rollup watermark
+CREATE OR REPLACE FUNCTION public.get_company_usage_daily(company_uuid UUID DEFAULT NULL, days INTEGER DEFAULT 30)
+RETURNS TABLE (
+  day DATE,
+  source generation_source,
+  generation_type TEXT,
+  language TEXT,
+  tone TEXT,
+  generations INTEGER,
+  successful INTEGER
+) AS $$
+DECLARE
+  target_company_id UUID;
+BEGIN
+  -- Default to the caller's company
+  target_company_id := COALESCE(
+    company_uuid,
+    (SELECT u.company_id FROM public.users u WHERE u.id = auth.uid())
+  );
+
+  -- Security check: managers of the company and superusers only
+  IF NOT EXISTS (
+    SELECT 1 FROM public.users u
+    WHERE u.id = auth.uid()
+      AND ((u.role = 'enterprise_manager' AND u.company_id = target_company_id) OR u.role = 'superuser')
+  ) THEN
+    RAISE EXCEPTION 'Access denied: only company managers can view company usage';
+  END IF;
+
+  RETURN QUERY
+  SELECT r.day, r.source, r.generation_type, r.language, r.tone, r.generations, r.successful
+  FROM public.usage_daily_company r
+  WHERE r.company_id = target_company_id
+    AND r.day > (NOW() AT TIME ZONE 'UTC')::date - days
+  ORDER BY r.day DESC, r.source, r.generation_type, r.language, r.tone;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Per-company totals for the superuser enterprise list, one call for every company on the page
+CREATE OR REPLACE FUNCTION public.get_companies_usage_totals(company_uuids UUID[], days INTEGER DEFAULT 30)
+RETURNS TABLE (
+  company_id UUID,
+  generations BIGINT,
+  successful BIGINT
+) AS $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM public.users WHERE id = auth.uid() AND role = 'superuser') THEN
+    RAISE EXCEPTION 'Access denied: superusers only';
+  END IF;
+
+  RETURN QUERY
+  SELECT r.company_id, SUM(r.generations)::BIGINT, SUM(r.successful)::BIGINT
+  FROM public.usage_daily_company r
+  WHERE r.company_id = ANY(company_uuids)
+    AND r.day > (NOW() AT TIME ZONE 'UTC')::date - days
+  GROUP BY r.company_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Platform-wide daily totals for the admin analytics page
+CREATE OR REPLACE FUNCTION public.get_platform_usage_daily(days INTEGER DEFAULT 30)
+RETURNS TABLE (
+  day DATE,
+  source generation_source,
+  generations BIGINT,
+  successful BIGINT,
+  active_users BIGINT
+) AS $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM public.users WHERE id = auth.uid() AND role = 'superuser') THEN
+    RAISE EXCEPTION 'Access denied: superusers only';
+  END IF;
+
+  RETURN QUERY
+  SELECT r.day, r.source, SUM(r.generations)::BIGINT, SUM(r.successful)::BIGINT, COUNT(DISTINCT r.user_id)
+  FROM public.usage_daily_user r
+  WHERE r.day > (NOW() AT TIME ZONE 'UTC')::date - days
+  GROUP BY r.day, r.source
+  ORDER BY r.day DESC, r.source;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+GRANT EXECUTE ON FUNCTION public.get_user_usage_breakdown TO authenticated;
+GRANT EXECUTE ON FUNCTION public.get_company_usage_daily TO authenticated;
+GRANT EXECUTE ON FUNCTION public.get_companies_usage_totals TO authenticated;
+GRANT EXECUTE ON FUNCTION public.get_platform_usage_daily TO authenticated;
+
+-- 4. RLS
+-- Written only by the rollup job (service role); readable like the rows they summarize
+ALTER TABLE public.usage_daily_user ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.usage_daily_company ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.usage_rollup_state ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "usage_daily_user_read" ON public.usage_daily_user;
+CREATE POLICY "usage_daily_user_read" ON public.usage_daily_user
+  FOR SELECT
+  USING (user_id = auth.uid());
+
+DROP POLICY IF EXISTS "usage_daily_company_read" ON public.usage_daily_company;
+CREATE POLICY "usage_daily_company_read" ON public.usage_daily_company
+  FOR SELECT
+  USING (
+    company_id = (
+      SELECT company_id
+      FROM public.users
+      WHERE id = auth.uid() AND role = 'enterprise_manager'
+    )
+  );
@@ -8,31 +8,18 @@ Tests code structure, logic validation, and API endpoint structure.
 import json
 import uuid
 import re
+import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 import sys
 
-class EnterpriseInvitationSimulatedTester:
-    def __init__(self):
-        self.test_results = []
-        
-    def log_test_result(self, test_name: str, success: bool, message: str, details: Dict = None):
-        """Log test result"""
-        result = {
-            'test': test_name,
-            'success': success,
-            'message': message,
-            'details': details or {},
-            'timestamp': datetime.now().isoformat()
-        }
-        self.test_results.append(result)
-        
-        status = "✅" if success else "❌"
-        print(f"{status} {test_name}: {message}")
+from harness import TesterBase, depends_on, suite_options
+
+class EnterpriseInvitationSimulatedTester(TesterBase):
+    def __init__(self, **options):
+        super().__init__(**options)
         
-        if details and not success:
-            print(f"   Details: {details}")
-    
+    @depends_on(files=('enterprise_invitation_system.sql',))
     def test_sql_schema_structure(self):
         """Test 1: Validate SQL schema structure from enterprise_invitation_system.sql"""
         try:
@@ -139,6 +126,7 @@ class EnterpriseInvitationSimulatedTester:
             )
             return False
     
+    @depends_on(files=('enterprise_invitation_system.sql',))
     def test_function_logic_validation(self):
         """Test 2: Validate function logic in SQL functions"""
         try:
@@ -237,6 +225,7 @@ class EnterpriseInvitationSimulatedTester:
             )
             return False
     
+    @depends_on(files=('client/pages/SuperAdmin.tsx',))
     def test_superadmin_ui_structure(self):
         """Test 3: Validate SuperAdmin UI component structure"""
         try:
@@ -351,6 +340,7 @@ class EnterpriseInvitationSimulatedTester:
             )
             return False
     
+    @depends_on(files=('client/lib/enterprise-email-service.ts',))
     def test_email_service_structure(self):
         """Test 4: Validate email service structure"""
         try:
@@ -451,6 +441,7 @@ class EnterpriseInvitationSimulatedTester:
             )
             return False
     
+    @depends_on()
     def test_invitation_workflow_logic(self):
         """Test 5: Validate invitation workflow logic"""
         try:
@@ -558,6 +549,7 @@ class EnterpriseInvitationSimulatedTester:
             )
             return False
     
+    @depends_on(files=('enterprise_invitation_system.sql', 'client/pages/SuperAdmin.tsx'))
     def test_security_considerations(self):
         """Test 6: Validate security considerations"""
         try:
@@ -669,6 +661,7 @@ class EnterpriseInvitationSimulatedTester:
             )
             return False
     
+    @depends_on(files=('client/lib/supabase.ts', 'client/lib/enterprise-email-service.ts'))
     def test_integration_points(self):
         """Test 7: Validate integration points"""
         try:
@@ -779,21 +772,7 @@ class EnterpriseInvitationSimulatedTester:
             self.test_integration_points
         ]
         
-        passed = 0
-        failed = 0
-        
-        for test in tests:
-            try:
-                result = test()
-                if result:
-                    passed += 1
-                else:
-                    failed += 1
-            except Exception as e:
-                print(f"❌ Test {test.__name__} crashed: {e}")
-                failed += 1
-            
-            print()  # Add spacing between tests
+        passed, failed, cached = asyncio.run(self.run_tests(tests))
         
         # Summary
         print("=" * 70)
@@ -801,7 +780,9 @@ class EnterpriseInvitationSimulatedTester:
         print("=" * 70)
         print(f"✅ Passed: {passed}")
         print(f"❌ Failed: {failed}")
-        print(f"📈 Success Rate: {(passed / (passed + failed) * 100):.1f}%")
+        if cached:
+            print(f"⏭️ Cached: {cached}")
+        print(f"📈 Success Rate: {((passed + cached) / (passed + failed + cached) * 100):.1f}%")
         
         if failed == 0:
             print("\n🎉 All simulated tests passed! Code structure and logic are correct.")
@@ -813,7 +794,7 @@ class EnterpriseInvitationSimulatedTester:
 
 def main():
     """Main test runner"""
-    tester = EnterpriseInvitationSimulatedTester()
+    tester = EnterpriseInvitationSimulatedTester(**suite_options(sys.argv[1:]))
     success = tester.run_all_tests()
     
     # Exit with appropriate code
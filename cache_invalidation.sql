@@ -0,0 +1,106 @@
+-- MailoReply AI - Cache Invalidation Notifications
+-- Triggers that announce changes to cached rows on the cache_invalidation channel, for
+-- services/invalidation.py to fan out to the in-process caches (the gateway's quota cache,
+-- the extension template bundles, the template usage access cache).
+-- Run after complete_user_limits_update.sql, supabase_stripe_schema_compatible.sql and
+-- enhanced_template_management.sql. Safe to run multiple times.
+--
+-- Payloads are '<kind>:<uuid>', about 45 bytes:
+--   user:<user id>                  role, status, limits, company or email changed, or user deleted
+--   settings:<user id>              user_settings row changed
+--   user_templates:<user id>        one of the user's templates changed
+--   company_templates:<company id>  a company template was added, edited, approved, rejected or removed
+--
+-- NOTIFY is transactional: listeners hear about a change only once it has committed, and a
+-- transaction that repeats a payload delivers it once.
+
+-- 1. USERS
+-- Limits are set by update_user_limits_trigger (BEFORE), so this AFTER trigger sees the final
+-- row. Role changes from update_user_role_from_subscription_trigger arrive here as UPDATEs.
+-- Usage counters are not watched: they change on every generation and the quota cache
+-- accounts for them itself.
+CREATE OR REPLACE FUNCTION public.notify_user_invalidation()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify('cache_invalidation', 'user:' || OLD.id);
+  ELSE
+    PERFORM pg_notify('cache_invalidation', 'user:' || NEW.id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_user_invalidation_trigger ON public.users;
+CREATE TRIGGER notify_user_invalidation_trigger
+  AFTER UPDATE ON public.users
+  FOR EACH ROW
+  WHEN ((OLD.role, OLD.status, OLD.company_id, OLD.email, OLD.daily_limit, OLD.monthly_limit, OLD.device_limit)
+        IS DISTINCT FROM
+        (NEW.role, NEW.status, NEW.company_id, NEW.email, NEW.daily_limit, NEW.monthly_limit, NEW.device_limit))
+  EXECUTE FUNCTION public.notify_user_invalidation();
+
+DROP TRIGGER IF EXISTS notify_user_deleted_trigger ON public.users;
+CREATE TRIGGER notify_user_deleted_trigger
+  AFTER DELETE ON public.users
+  FOR EACH ROW
+  EXECUTE FUNCTION public.notify_user_invalidation();
+
+-- 2. USER SETTINGS
+CREATE OR REPLACE FUNCTION public.notify_settings_invalidation()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify('cache_invalidation', 'settings:' || OLD.user_id);
+  ELSE
+    PERFORM pg_notify('cache_invalidation', 'settings:' || NEW.user_id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_settings_invalidation_trigger ON public.user_settings;
+CREATE TRIGGER notify_settings_invalidation_trigger
+  AFTER INSERT OR UPDATE OR DELETE ON public.user_settings
+  FOR EACH ROW
+  EXECUTE FUNCTION public.notify_settings_invalidation();
+
+-- 3. TEMPLATES
+-- approve_template and reject_template are UPDATEs here. A template that is, or was, visible
+-- company-wide notifies the company as well as its owner. Updates that only touch
+-- usage_count or updated_at (increment_template_usage) stay quiet.
+CREATE OR REPLACE FUNCTION public.notify_template_invalidation()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM pg_notify('cache_invalidation', 'user_templates:' || OLD.user_id);
+    IF OLD.company_id IS NOT NULL AND OLD.visibility = 'company' THEN
+      PERFORM pg_notify('cache_invalidation', 'company_templates:' || OLD.company_id);
+    END IF;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM pg_notify('cache_invalidation', 'user_templates:' || NEW.user_id);
+    IF NEW.company_id IS NOT NULL AND NEW.visibility = 'company' THEN
+      PERFORM pg_notify('cache_invalidation', 'company_templates:' || NEW.company_id);
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_template_invalidation_trigger ON public.templates;
+CREATE TRIGGER notify_template_invalidation_trigger
+  AFTER UPDATE ON public.templates
+  FOR EACH ROW
+  WHEN ((OLD.user_id, OLD.company_id, OLD.title, OLD.content, OLD.subject, OLD.hotkey, OLD.visibility,
+         OLD.approved_at)
+        IS DISTINCT FROM
+        (NEW.user_id, NEW.company_id, NEW.title, NEW.content, NEW.subject, NEW.hotkey, NEW.visibility,
+         NEW.approved_at))
+  EXECUTE FUNCTION public.notify_template_invalidation();
+
+DROP TRIGGER IF EXISTS notify_template_changed_trigger ON public.templates;
+CREATE TRIGGER notify_template_changed_trigger
+  AFTER INSERT OR DELETE ON public.templates
+  FOR EACH ROW
+  EXECUTE FUNCTION public.notify_template_invalidation();
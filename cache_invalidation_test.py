@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Cache Invalidation Test
+Checks cache_invalidation.sql and services.invalidation.InvalidationBus end to end. The
+gateway's QuotaCache and the extension TemplateBundleCache are both given TTLs of an hour,
+so only a notification can make them reread anything.
+
+Role and status changes must reach the quota cache, within milliseconds of commit. An
+approval must reach every member's template bundle. Usage counters and template use
+counts must stay quiet. When the listener's backend is killed, the bus must reconnect
+and resync, which also covers a change made while it was away. A mass update beyond the
+burst size must turn into one resync rather than a flood.
+
+Usage: python cache_invalidation_test.py [--users=50] [--changes=20] [--burst=20]
+"""
+
+import asyncio
+import asyncpg
+import statistics
+import time
+import uuid
+from typing import Callable, List, Tuple
+import sys
+
+from harness import TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.gateway import QuotaCache
+from services.invalidation import KINDS, InvalidationBus
+from services.template_bundles import TemplateBundleCache
+
+
+class CacheInvalidationTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 50, changes: int = 20, burst: int = 20, **options):
+        super().__init__(**options)
+        self.users = users
+        self.changes = changes
+        self.burst = burst
+        self.db_pool = None
+        self.bus = None
+        self.quotas = None
+        self.bundles = None
+        self.user_ids: List = []
+        self.company = None
+        self.pending_id = None
+        self.events: List[Tuple[str, uuid.UUID, float]] = []
+        self.resyncs = 0
+
+    async def setup(self):
+        """Seed users and a company, and wire both caches to a running bus"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=10, connection_class=InstrumentedConnection
+            )
+            async with self.db_pool.acquire() as conn:
+                self.user_ids = await seed_users(conn, self.users, role='free')
+                self.company = await seed_company(conn, users=3, devices_per_user=0)
+                self.pending_id = await conn.fetchval("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, hotkey, visibility)
+                    VALUES ($1, $2, 'Awaiting approval', 'Pending body', 'pending', 'pending_approval')
+                    RETURNING id
+                """, self.company['user_ids'][0], self.company['company_id'])
+                await conn.execute("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, hotkey, visibility,
+                                                  approved_by, approved_at)
+                    VALUES ($1, $2, 'Approved', 'Approved body', 'approved', 'company', $1, NOW())
+                """, self.company['manager_id'], self.company['company_id'])
+
+            self.quotas = QuotaCache(self.db_pool, ttl=3600.0)
+            self.bundles = TemplateBundleCache(self.db_pool, check_interval=3600.0)
+            self.bus = InvalidationBus(db_config(), coalesce=0.01, burst=self.burst, keepalive=1.0, max_backoff=1.0)
+            for kind in KINDS:
+                self.bus.subscribe(kind, lambda key, kind=kind: self.events.append((kind, key, time.perf_counter())))
+            self.bus.subscribe('user', self.quotas.invalidate)
+            self.bus.subscribe('user', self.bundles.invalidate)
+            self.bus.subscribe('user_templates', self.bundles.invalidate)
+            self.bus.subscribe('company_templates', self.bundles.invalidate_company)
+            self.bus.on_resync(self.quotas.invalidate_all)
+            self.bus.on_resync(self.bundles.invalidate_all)
+            self.bus.on_resync(self._count_resync)
+            self.bus.start()
+            await asyncio.wait_for(self.bus.connected.wait(), 10)
+            print(f"✅ Bus listening; {self.users} users and a 3-member company seeded")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize invalidation test: {e}")
+            return False
+
+    def _count_resync(self):
+        self.resyncs += 1
+
+    async def cleanup(self):
+        """Stop the bus, remove seeded users and the company, and close the pool"""
+        if self.bus:
+            await self.bus.stop()
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", self.user_ids)
+                if self.company:
+                    await conn.execute("DELETE FROM public.users WHERE company_id = $1", self.company['company_id'])
+                    await conn.execute("DELETE FROM public.companies WHERE id = $1", self.company['company_id'])
+            await self.db_pool.close()
+
+    async def wait_until(self, condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.005)
+        return True
+
+    def seen(self, kind: str, key) -> bool:
+        return any(k == kind and e == key for k, e, _ in self.events)
+
+    async def test_role_change_reaches_quota_cache(self):
+        """Test 1: Role and status changes drop cached quotas, with commit-to-handler latency"""
+        try:
+            latencies, stale = [], []
+            async with self.db_pool.acquire() as conn:
+                for user_id in self.user_ids[:self.changes]:
+                    await self.quotas.get(user_id)
+                    started = time.perf_counter()
+                    await conn.execute("UPDATE public.users SET role = 'pro' WHERE id = $1", user_id)
+                    if not await self.wait_until(lambda: user_id not in self.quotas.entries):
+                        stale.append(str(user_id))
+                        continue
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    quota = await self.quotas.get(user_id)
+                    if quota.role != 'pro' or quota.monthly_limit != 100:
+                        stale.append(str(user_id))
+
+                status_user = self.user_ids[self.changes]
+                await self.quotas.get(status_user)
+                await conn.execute("UPDATE public.users SET status = 'suspended' WHERE id = $1", status_user)
+                suspended = await self.wait_until(lambda: status_user not in self.quotas.entries)
+                _, reason = await self.quotas.check(status_user)
+
+            success = not stale and suspended and reason == 'Account is not active'
+            details = {'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+                       'max_ms': round(max(latencies), 2) if latencies else None, 'stale': stale[:5]}
+            self.log_test_result("Invalidation - Quota Cache", success,
+                                 f"{len(latencies)} role changes invalidated (p50 {details['p50_ms']} ms, "
+                                 f"max {details['max_ms']} ms); suspension denied immediately" if success
+                                 else f"{len(stale)} stale quotas; suspension seen: {suspended}", details)
+            return success
+        except Exception as e:
+            self.log_test_result("Invalidation - Quota Cache", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_approval_reaches_bundles(self):
+        """Test 2: approve_template invalidates every member's bundle despite the hour-long check interval"""
+        try:
+            members = self.company['user_ids']
+            before = {user_id: (await self.bundles.sync(user_id))[1]['version'] for user_id in members}
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("SELECT public.approve_template($1, $2)", self.pending_id,
+                                   self.company['manager_id'])
+            notified = await self.wait_until(lambda: self.seen('company_templates', self.company['company_id']))
+            await asyncio.sleep(self.bus.coalesce * 2)
+
+            missing = []
+            for user_id in members:
+                status, delta = await self.bundles.sync(user_id, before[user_id])
+                if status != 200 or str(self.pending_id) not in delta['templates']:
+                    missing.append(str(user_id))
+            success = notified and not missing
+            self.log_test_result("Invalidation - Template Bundles", success,
+                                 f"Approval reached all {len(members)} members as a delta" if success
+                                 else f"notified: {notified}; {len(missing)} members still stale",
+                                 {'missing': missing})
+            return success
+        except Exception as e:
+            self.log_test_result("Invalidation - Template Bundles", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_counters_stay_quiet(self):
+        """Test 3: increment_user_usage and increment_template_usage send no notifications"""
+        try:
+            user_id = self.user_ids[-1]
+            member = self.company['user_ids'][1]
+            async with self.db_pool.acquire() as conn:
+                template_id = await conn.fetchval(
+                    "SELECT id FROM public.templates WHERE company_id = $1 AND visibility = 'company' LIMIT 1",
+                    self.company['company_id'])
+                baseline = self.bus.stats['notifications']
+                for _ in range(5):
+                    await conn.execute("SELECT public.increment_user_usage($1)", user_id)
+                    await conn.execute("SELECT public.increment_template_usage($1, $2)", template_id, member)
+                # A change that does notify, so there is something to wait for
+                await conn.execute("UPDATE public.users SET role = 'pro' WHERE id = $1", user_id)
+            await self.wait_until(lambda: self.seen('user', user_id))
+            extra = self.bus.stats['notifications'] - baseline - 1
+            self.log_test_result("Invalidation - Counters Quiet", extra == 0,
+                                 "10 counter updates sent no notifications" if extra == 0
+                                 else f"{extra} unexpected notifications", self.bus.stats)
+            return extra == 0
+        except Exception as e:
+            self.log_test_result("Invalidation - Counters Quiet", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_reconnect_resyncs(self):
+        """Test 4: Killing the listener backend leads to a reconnect and a resync that covers the gap"""
+        try:
+            user_id = self.user_ids[self.changes + 1]
+            await self.quotas.get(user_id)
+            connects, resyncs = self.bus.stats['connects'], self.resyncs
+            pid = self.bus.backend_pid()
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("SELECT pg_terminate_backend($1)", pid)
+                await self.wait_until(lambda: not self.bus.connected.is_set(), timeout=3.0)
+                # Made while nobody is listening
+                await conn.execute("UPDATE public.users SET role = 'pro_plus' WHERE id = $1", user_id)
+            reconnected = await self.wait_until(lambda: self.bus.stats['connects'] > connects, timeout=15.0)
+            quota = await self.quotas.get(user_id)
+            success = reconnected and self.resyncs > resyncs and quota.role == 'pro_plus'
+            self.log_test_result("Invalidation - Reconnect", success,
+                                 "Listener reconnected and resynced; change made during the gap is visible"
+                                 if success else f"reconnected: {reconnected}, role seen: {quota.role}",
+                                 self.bus.stats)
+            return success
+        except Exception as e:
+            self.log_test_result("Invalidation - Reconnect", False, f"Reconnect check failed: {str(e)}")
+            return False
+
+    async def test_burst_becomes_resync(self):
+        """Test 5: A mass update beyond the burst size is handled as one resync"""
+        try:
+            await asyncio.gather(*[self.quotas.get(user_id) for user_id in self.user_ids])
+            bursts, resyncs = self.bus.stats['bursts'], self.resyncs
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("UPDATE public.users SET role = 'pro_plus' WHERE id = ANY($1::uuid[])",
+                                   self.user_ids)
+            handled = await self.wait_until(lambda: self.bus.stats['bursts'] > bursts)
+            success = handled and self.resyncs == resyncs + 1 and not self.quotas.entries
+            self.log_test_result("Invalidation - Burst", success,
+                                 f"{self.users} notifications in one commit became one resync" if success
+                                 else f"bursts {self.bus.stats['bursts'] - bursts}, resyncs "
+                                      f"{self.resyncs - resyncs}, {len(self.quotas.entries)} entries left",
+                                 self.bus.stats)
+            return success
+        except Exception as e:
+            self.log_test_result("Invalidation - Burst", False, f"Burst check failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the cache invalidation checks"""
+        print("🚀 Starting Cache Invalidation Test")
+        print(f"   {self.users} users, {self.changes} role changes, burst size {self.burst}")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_role_change_reaches_quota_cache,
+            self.test_approval_reaches_bundles,
+            self.test_counters_stay_quiet,
+            self.test_reconnect_resyncs,
+            self.test_burst_becomes_resync
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Caches hear about every change that matters!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = CacheInvalidationTester(
+        users=scenario_option(argv, 'users', 50),
+        changes=scenario_option(argv, 'changes', 20),
+        burst=scenario_option(argv, 'burst', 20),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
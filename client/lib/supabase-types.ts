@@ -239,6 +239,44 @@ export interface Database {
           updated_at?: string;
         };
       };
+      usage_daily_user: {
+        Row: {
+          user_id: string;
+          day: string;
+          source: 'website' | 'extension';
+          generation_type: string;
+          language: string;
+          tone: string;
+          generations: number;
+          successful: number;
+          input_chars: number;
+          output_chars: number;
+        };
+        Insert: {
+          user_id: string;
+          day: string;
+          source: 'website' | 'extension';
+          generation_type: string;
+          language: string;
+          tone: string;
+          generations?: number;
+          successful?: number;
+          input_chars?: number;
+          output_chars?: number;
+        };
+        Update: {
+          user_id?: string;
+          day?: string;
+          source?: 'website' | 'extension';
+          generation_type?: string;
+          language?: string;
+          tone?: string;
+          generations?: number;
+          successful?: number;
+          input_chars?: number;
+          output_chars?: number;
+        };
+      };
     };
     Views: {
       [_ in never]: never;
@@ -264,6 +302,71 @@ export interface Database {
         Args: Record<PropertyKey, never>;
         Returns: void;
       };
+      reset_user_usage: {
+        Args: {
+          user_uuid: string;
+        };
+        Returns: void;
+      };
+      get_user_usage_breakdown: {
+        Args: {
+          user_uuid?: string;
+        };
+        Returns: {
+          daily_used: number;
+          daily_limit: number;
+          monthly_used: number;
+          monthly_limit: number;
+          device_count: number;
+          device_limit: number;
+          is_unlimited: boolean;
+          website_today: number;
+          extension_today: number;
+          website_month: number;
+          extension_month: number;
+          total_website: number;
+          total_extension: number;
+          recent_activity: Pick<Database['public']['Tables']['ai_generations']['Row'], 'id' | 'source' | 'generation_type' | 'created_at' | 'success'>[];
+        } | null;
+      };
+      get_company_usage_daily: {
+        Args: {
+          company_uuid?: string;
+          days?: number;
+        };
+        Returns: {
+          day: string;
+          source: 'website' | 'extension';
+          generation_type: string;
+          language: string;
+          tone: string;
+          generations: number;
+          successful: number;
+        }[];
+      };
+      get_companies_usage_totals: {
+        Args: {
+          company_uuids: string[];
+          days?: number;
+        };
+        Returns: {
+          company_id: string;
+          generations: number;
+          successful: number;
+        }[];
+      };
+      get_platform_usage_daily: {
+        Args: {
+          days?: number;
+        };
+        Returns: {
+          day: string;
+          source: 'website' | 'extension';
+          generations: number;
+          successful: number;
+          active_users: number;
+        }[];
+      };
     };
     Enums: {
       user_role: 'superuser' | 'enterprise_manager' | 'enterprise_user' | 'pro_plus' | 'pro' | 'free';
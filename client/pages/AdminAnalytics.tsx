@@ -18,6 +18,7 @@ import {
   Globe
 } from "lucide-react";
 import { useAuth } from "@/contexts/AuthContext";
+import { supabase } from "@/lib/supabase";
 import PressureMonitor from "@/components/PressureMonitor";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 
@@ -120,6 +121,19 @@ const getRecentActivity = (): UserActivity[] => {
   return activities;
 };
 
+// Successful generations since the start of the month, from the daily rollups
+const getMonthGenerations = async (): Promise<number | null> => {
+  if (!supabase) return null;
+  const today = new Date();
+  const { data, error } = await supabase
+    .rpc('get_platform_usage_daily', { days: today.getUTCDate() });
+  if (error || !data) {
+    console.error('Error fetching platform usage:', error);
+    return null;
+  }
+  return data.reduce((total, row) => total + row.successful, 0);
+};
+
 const getPlanDistribution = (): PlanDistribution => {
   return {
     free: 867,
@@ -137,6 +151,17 @@ export default function AdminAnalytics() {
   const [isRefreshing, setIsRefreshing] = useState(false);
   const [lastUpdate, setLastUpdate] = useState(new Date());
 
+  const refreshGenerations = async () => {
+    const totalAIGenerations = await getMonthGenerations();
+    if (totalAIGenerations !== null) {
+      setStats(prev => ({ ...prev, totalAIGenerations }));
+    }
+  };
+
+  useEffect(() => {
+    refreshGenerations();
+  }, []);
+
   // Simulate real-time updates
   useEffect(() => {
     const interval = setInterval(() => {
@@ -144,7 +169,6 @@ export default function AdminAnalytics() {
       setStats(prev => ({
         ...prev,
         activeUsers: prev.activeUsers + Math.floor(Math.random() * 5) - 2,
-        totalAIGenerations: prev.totalAIGenerations + Math.floor(Math.random() * 3),
         avgResponseTime: prev.avgResponseTime + Math.floor(Math.random() * 20) - 10,
         systemLoad: Math.max(20, Math.min(90, prev.systemLoad + Math.floor(Math.random() * 10) - 5))
       }));
@@ -176,6 +200,7 @@ export default function AdminAnalytics() {
     // Simulate API call
     await new Promise(resolve => setTimeout(resolve, 1000));
     setStats(getSystemStats());
+    await refreshGenerations();
     setActivities(getRecentActivity());
     setPlanDistribution(getPlanDistribution());
     setLastUpdate(new Date());
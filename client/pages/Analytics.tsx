@@ -86,11 +86,23 @@ export default function Analytics() {
         .from('companies')
         .select('*', { count: 'exact', head: true });
 
-      // Get total AI generations
-      const { count: totalGenerations } = await supabase
-        .from('ai_generations')
-        .select('*', { count: 'exact', head: true })
-        .eq('success', true);
+      // AI generations over the last 30 days against the 30 before, from the daily rollups
+      const { data: platformUsage } = await supabase
+        .rpc('get_platform_usage_daily', { days: 60 });
+
+      const monthAgo = new Date();
+      monthAgo.setDate(monthAgo.getDate() - 30);
+      const monthAgoDay = monthAgo.toISOString().slice(0, 10);
+
+      let totalGenerations = 0;
+      let lastMonthGenerations = 0;
+      (platformUsage || []).forEach(row => {
+        if (row.day > monthAgoDay) {
+          totalGenerations += row.successful;
+        } else {
+          lastMonthGenerations += row.successful;
+        }
+      });
 
       // Calculate monthly revenue (simplified - based on user roles)
       const { data: paidUsers } = await supabase
@@ -120,19 +132,13 @@ export default function Analytics() {
         .lt('created_at', lastMonth.toISOString())
         .neq('role', 'superuser');
 
-      const { count: lastMonthGenerations } = await supabase
-        .from('ai_generations')
-        .select('*', { count: 'exact', head: true })
-        .lt('created_at', lastMonth.toISOString())
-        .eq('success', true);
-
       const userGrowthRate = lastMonthUsers ? (((totalUsers || 0) - lastMonthUsers) / lastMonthUsers * 100) : 0;
-      const generationGrowthRate = lastMonthGenerations ? (((totalGenerations || 0) - lastMonthGenerations) / lastMonthGenerations * 100) : 0;
+      const generationGrowthRate = lastMonthGenerations ? ((totalGenerations - lastMonthGenerations) / lastMonthGenerations * 100) : 0;
 
       setAnalyticsData({
         totalUsers: totalUsers || 0,
         totalEnterprises: totalEnterprises || 0,
-        totalGenerations: totalGenerations || 0,
+        totalGenerations,
         monthlyRevenue,
         userGrowth: `${userGrowthRate > 0 ? '+' : ''}${userGrowthRate.toFixed(1)}%`,
         enterpriseGrowth: '+15%', // Placeholder
@@ -146,44 +152,52 @@ export default function Analytics() {
 
   const fetchUserAnalytics = async () => {
     try {
-      // Get user's AI generations
-      const { count: myGenerations } = await supabase
-        .from('ai_generations')
-        .select('*', { count: 'exact', head: true })
-        .eq('user_id', user!.id)
-        .eq('success', true);
+      // All-time total from the rollup-backed breakdown
+      const { data: breakdown } = await supabase
+        .rpc('get_user_usage_breakdown', { user_uuid: user!.id });
+      const myGenerations = breakdown ? (breakdown.total_website || 0) + (breakdown.total_extension || 0) : 0;
 
       // Calculate time saved (assuming 2 minutes saved per generation)
-      const timeSaved = (myGenerations || 0) * 2;
-
-      // Get templates used (simplified - count distinct template usage)
-      const { count: templatesUsed } = await supabase
-        .from('ai_generations')
-        .select('*', { count: 'exact', head: true })
+      const timeSaved = myGenerations * 2;
+
+      // The user's own daily rollup rows for the last 30 days
+      const monthAgo = new Date();
+      monthAgo.setDate(monthAgo.getDate() - 30);
+      const { data: dailyUsage } = await supabase
+        .from('usage_daily_user')
+        .select('day, generation_type, generations, successful')
         .eq('user_id', user!.id)
-        .not('intent', 'is', null);
+        .gte('day', monthAgo.toISOString().slice(0, 10));
+
+      const lastWeek = new Date();
+      lastWeek.setDate(lastWeek.getDate() - 7);
+      const lastWeekDay = lastWeek.toISOString().slice(0, 10);
+
+      // Templates used (simplified - replies carry an intent) and this week's generations
+      let templatesUsed = 0;
+      let thisWeekGenerations = 0;
+      (dailyUsage || []).forEach(row => {
+        if (row.generation_type === 'reply') {
+          templatesUsed += row.generations;
+        }
+        if (row.day >= lastWeekDay) {
+          thisWeekGenerations += row.successful;
+        }
+      });
 
       // Calculate daily average
       const accountAge = user!.created_at ? Math.max(1, Math.floor((Date.now() - new Date(user!.created_at).getTime()) / (1000 * 60 * 60 * 24))) : 1;
-      const dailyAverage = (myGenerations || 0) / accountAge;
+      const dailyAverage = myGenerations / accountAge;
 
       // Get growth data (simplified)
-      const lastWeek = new Date();
-      lastWeek.setDate(lastWeek.getDate() - 7);
-
-      const { count: lastWeekGenerations } = await supabase
-        .from('ai_generations')
-        .select('*', { count: 'exact', head: true })
-        .eq('user_id', user!.id)
-        .lt('created_at', lastWeek.toISOString())
-        .eq('success', true);
+      const lastWeekGenerations = myGenerations - thisWeekGenerations;
 
-      const generationGrowthRate = lastWeekGenerations ? (((myGenerations || 0) - lastWeekGenerations) / lastWeekGenerations * 100) : 0;
+      const generationGrowthRate = lastWeekGenerations ? ((myGenerations - lastWeekGenerations) / lastWeekGenerations * 100) : 0;
 
       setUserAnalytics({
-        myGenerations: myGenerations || 0,
+        myGenerations,
         timeSaved,
-        templatesUsed: templatesUsed || 0,
+        templatesUsed,
         dailyAverage: Math.round(dailyAverage * 10) / 10,
         generationGrowth: `${generationGrowthRate > 0 ? '+' : ''}${generationGrowthRate.toFixed(1)}%`,
         timeSavedGrowth: `${generationGrowthRate > 0 ? '+' : ''}${(generationGrowthRate * 2).toFixed(1)}%`,
@@ -197,10 +211,15 @@ export default function Analytics() {
 
   const fetchRecentActivity = async () => {
     try {
+      // Newest five from the last 30 days; the created_at bound keeps this on the
+      // created_at indexes of the recent partitions
+      const monthAgo = new Date();
+      monthAgo.setDate(monthAgo.getDate() - 30);
       const query = supabase
         .from('ai_generations')
         .select('*')
         .eq('success', true)
+        .gte('created_at', monthAgo.toISOString())
         .order('created_at', { ascending: false })
         .limit(5);
 
@@ -250,7 +269,7 @@ export default function Analytics() {
   const metrics = isSuperuser && analyticsData ? [
     { name: 'Total Users', value: analyticsData.totalUsers.toLocaleString(), change: analyticsData.userGrowth, icon: Users },
     { name: 'Total Enterprises', value: analyticsData.totalEnterprises.toString(), change: analyticsData.enterpriseGrowth, icon: Building2 },
-    { name: 'AI Generations', value: analyticsData.totalGenerations.toLocaleString(), change: analyticsData.generationGrowth, icon: Bot },
+    { name: 'AI Generations (30 days)', value: analyticsData.totalGenerations.toLocaleString(), change: analyticsData.generationGrowth, icon: Bot },
     { name: 'Monthly Revenue', value: `$${analyticsData.monthlyRevenue.toLocaleString()}`, change: analyticsData.revenueGrowth, icon: DollarSign }
   ] : userAnalytics ? [
     { name: 'AI Generations', value: userAnalytics.myGenerations.toString(), change: userAnalytics.generationGrowth, icon: Bot },
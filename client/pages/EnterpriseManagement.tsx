@@ -100,14 +100,32 @@ export default function EnterpriseManagement() {
         console.error('Error fetching companies:', companiesError);
         setEnterprises([]);
       } else {
+        // This month's generations per company, from the daily rollups in one call
+        const { data: usage, error: usageError } = await supabase
+          .rpc('get_companies_usage_totals', {
+            company_uuids: companies.map(company => company.id),
+            days: new Date().getUTCDate()
+          });
+
+        if (usageError) {
+          console.error('Error fetching company usage:', usageError);
+          alert(`Error loading company usage: ${usageError.message}`);
+          setEnterprises([]);
+          return;
+        }
+
+        // Companies without rollup rows this month have no generations
+        const usageByCompany = new Map((usage || []).map(row => [row.company_id, Number(row.successful)]));
+        const companyUsage = companies.map(company => usageByCompany.get(company.id) ?? 0);
+
         // Transform Supabase data to Enterprise format
-        const transformedEnterprises: Enterprise[] = companies.map(company => ({
+        const transformedEnterprises: Enterprise[] = companies.map((company, index) => ({
           id: company.id,
           name: company.name,
           domain: company.domain || '',
           users: company.current_users || 0,
           maxUsers: company.max_users || 0,
-          generationsUsed: 0, // TODO: Calculate from ai_generations table
+          generationsUsed: companyUsage[index],
           generationsLimit: -1, // Unlimited for enterprises
           monthlyPayment: 999.99, // Fixed value since column doesn't exist in schema
           status: company.status === 'active' ? 'active' : 'suspended',
@@ -126,7 +144,7 @@ export default function EnterpriseManagement() {
           totalEnterprises,
           totalUsers,
           totalRevenue,
-          totalGenerations: 0 // TODO: Calculate from ai_generations table
+          totalGenerations: companyUsage.reduce((sum, used) => sum + used, 0)
         });
       }
     } catch (error) {
@@ -0,0 +1,88 @@
+-- MailoReply AI - Company Usage Sketches
+-- One row per company and UTC day holding a HyperLogLog of the active users and a t-digest of
+-- generations per active user, maintained by services/company_sketches.py. Sketches merge across
+-- days, so "distinct users this month" and "p95 generations per user" come from at most a few
+-- dozen small rows instead of a GROUP BY over ai_generations.
+-- Run after ai_generations_rollups.sql. Safe to run multiple times.
+--
+-- After the first run, backfill history once with: python -m services.company_sketches --rebuild
+
+-- 1. SKETCH TABLE
+-- distinct_users and user_counts are serialized services.sketches.HyperLogLog and TDigest.
+-- The estimate columns are precomputed from them at write time for readers without the sketch code.
+CREATE TABLE IF NOT EXISTS public.company_usage_sketches (
+  company_id UUID NOT NULL REFERENCES public.companies(id) ON DELETE CASCADE,
+  day DATE NOT NULL,
+  generations BIGINT NOT NULL DEFAULT 0,
+  distinct_users BYTEA NOT NULL,
+  user_counts BYTEA NOT NULL,
+  distinct_users_estimate INTEGER NOT NULL DEFAULT 0,
+  p50_per_user REAL,
+  p95_per_user REAL,
+  -- Generations ingested after the day was closed: counted in generations and distinct_users,
+  -- but not in user_counts
+  late_generations BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (company_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_company_usage_sketches_day ON public.company_usage_sketches (day);
+
+-- Same watermark table as the rollups, under its own name
+INSERT INTO public.usage_rollup_state (name, watermark)
+VALUES ('company_sketches', NOW())
+ON CONFLICT (name) DO NOTHING;
+
+-- 2. DASHBOARD READ
+-- Per-day estimates for enterprise managers; ranges are merged by the sketch service
+CREATE OR REPLACE FUNCTION public.get_company_usage_sketch(company_uuid UUID DEFAULT NULL, days INTEGER DEFAULT 30)
+RETURNS TABLE (
+  day DATE,
+  generations BIGINT,
+  distinct_users INTEGER,
+  p50_per_user REAL,
+  p95_per_user REAL
+) AS $$
+DECLARE
+  target_company_id UUID;
+BEGIN
+  -- Default to the caller's company
+  target_company_id := COALESCE(
+    company_uuid,
+    (SELECT u.company_id FROM public.users u WHERE u.id = auth.uid())
+  );
+
+  -- Security check: managers of the company and superusers only
+  IF NOT EXISTS (
+    SELECT 1 FROM public.users u
+    WHERE u.id = auth.uid()
+      AND ((u.role = 'enterprise_manager' AND u.company_id = target_company_id) OR u.role = 'superuser')
+  ) THEN
+    RAISE EXCEPTION 'Access denied: only company managers can view company usage';
+  END IF;
+
+  RETURN QUERY
+  SELECT s.day, s.generations, s.distinct_users_estimate, s.p50_per_user, s.p95_per_user
+  FROM public.company_usage_sketches s
+  WHERE s.company_id = target_company_id
+    AND s.day > (NOW() AT TIME ZONE 'UTC')::date - days
+  ORDER BY s.day DESC;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+GRANT EXECUTE ON FUNCTION public.get_company_usage_sketch TO authenticated;
+
+-- 3. RLS
+-- Written only by the sketch job (service role)
+ALTER TABLE public.company_usage_sketches ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "company_usage_sketches_read" ON public.company_usage_sketches;
+CREATE POLICY "company_usage_sketches_read" ON public.company_usage_sketches
+  FOR SELECT
+  USING (
+    company_id = (
+      SELECT company_id
+      FROM public.users
+      WHERE id = auth.uid() AND role = 'enterprise_manager'
+    )
+  );
@@ -48,15 +48,32 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- 1.1 Per-User Counter Reset
+-- Starts a new day or month for one user. reset_daily_usage() and reset_monthly_usage() rewrite
+-- every stale row of the table, and calling them here made the first request after midnight
+-- pay for all users. The rest of the table is reset in chunks by services/usage_reset.py.
+CREATE OR REPLACE FUNCTION public.reset_user_usage(user_uuid UUID)
+RETURNS void AS $$
+BEGIN
+  UPDATE public.users
+  SET
+    daily_usage = CASE WHEN last_daily_reset < CURRENT_DATE THEN 0 ELSE daily_usage END,
+    monthly_usage = CASE WHEN last_monthly_reset < DATE_TRUNC('month', CURRENT_DATE) THEN 0 ELSE monthly_usage END,
+    last_daily_reset = GREATEST(last_daily_reset, CURRENT_DATE),
+    last_monthly_reset = GREATEST(last_monthly_reset, DATE_TRUNC('month', CURRENT_DATE)::DATE)
+  WHERE id = user_uuid
+    AND (last_daily_reset < CURRENT_DATE OR last_monthly_reset < DATE_TRUNC('month', CURRENT_DATE));
+END;
+$$ LANGUAGE plpgsql;
+
 -- 2. Updated Usage Enforcement Function (Corrected for Pro users)
 CREATE OR REPLACE FUNCTION public.can_user_generate(user_uuid UUID)
 RETURNS boolean AS $$
 DECLARE
   user_record RECORD;
 BEGIN
-  -- Reset counters if needed
-  PERFORM public.reset_daily_usage();
-  PERFORM public.reset_monthly_usage();
+  -- Reset this user's counters if needed
+  PERFORM public.reset_user_usage(user_uuid);
   
   -- Get user with current usage
   SELECT role, daily_limit, monthly_limit, daily_usage, monthly_usage
@@ -122,9 +139,8 @@ RETURNS void AS $$
 DECLARE
   user_role user_role;
 BEGIN
-  -- Reset counters if needed
-  PERFORM public.reset_daily_usage();
-  PERFORM public.reset_monthly_usage();
+  -- Reset this user's counters if needed
+  PERFORM public.reset_user_usage(user_uuid);
   
   -- Get user role
   SELECT role INTO user_role
@@ -195,9 +211,11 @@ BEGIN
   END IF;
   
   -- Check if this exact device is already registered
+  -- (the parameter is qualified: a bare device_fingerprint = device_fingerprint
+  -- compares the column with itself and matches any device of the user)
   SELECT EXISTS(
-    SELECT 1 FROM public.user_devices 
-    WHERE user_id = user_uuid AND device_fingerprint = device_fingerprint
+    SELECT 1 FROM public.user_devices ud
+    WHERE ud.user_id = user_uuid AND ud.device_fingerprint = can_register_device.device_fingerprint
   ) INTO device_exists;
   
   -- If device already exists, allow (user can re-authenticate on same device)
@@ -215,6 +233,29 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- 4.1 Device Limit Check, single statement (extension login fast path)
+-- Same answer as can_register_device in one SQL statement: no plpgsql context,
+-- and the device count stops at the user's limit instead of scanning every row.
+CREATE OR REPLACE FUNCTION public.can_register_device_fast(user_uuid UUID, device_fingerprint TEXT)
+RETURNS boolean AS $$
+  SELECT COALESCE((
+    SELECT CASE
+      WHEN u.device_limit = -1 THEN true
+      WHEN EXISTS (
+        SELECT 1 FROM public.user_devices ud
+        WHERE ud.user_id = u.id AND ud.device_fingerprint = $2
+      ) THEN true
+      ELSE (
+        SELECT COUNT(*) FROM (
+          SELECT 1 FROM public.user_devices ud WHERE ud.user_id = u.id LIMIT GREATEST(u.device_limit, 0)
+        ) registered
+      ) < u.device_limit
+    END
+    FROM public.users u
+    WHERE u.id = user_uuid AND u.status = 'active'
+  ), false);
+$$ LANGUAGE sql STABLE;
+
 -- 5. Update trigger
 DROP TRIGGER IF EXISTS update_user_limits_trigger ON public.users;
 CREATE TRIGGER update_user_limits_trigger
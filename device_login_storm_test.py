@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Extension Login Storm Test
+Simulates the morning rush of users starting the Chrome extension: every start runs
+registerDevice (client/lib/enhanced-usage-tracking.ts), i.e. can_register_device
+followed by an upsert into user_devices.
+
+Logins arrive as a Poisson process compressed into --window seconds. Most reuse the
+fingerprint already registered for the user; the rest come from a browser the user has
+not registered yet, which users at their device limit must be refused. The same plan
+is replayed against can_register_device and the single-statement
+can_register_device_fast, each on its own freshly seeded users, and both must reach
+the same decisions.
+
+Usage: python device_login_storm_test.py [--users=2000] [--window=30] [--concurrency=50]
+"""
+
+import time
+import random
+import asyncio
+import asyncpg
+from typing import Dict, List, Tuple
+import sys
+
+from harness import TesterBase, depends_on, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_devices, seed_users
+from harness.instrumentation import Histogram, InstrumentedConnection
+
+VARIANTS = {
+    'plpgsql': 'can_register_device',
+    'single_statement': 'can_register_device_fast'
+}
+
+# (role, share of users); device_limit comes from update_user_limits
+ROLE_MIX = [('free', 0.6), ('pro', 0.2), ('pro_plus', 0.15), ('superuser', 0.05)]
+
+# Fingerprint used on a login: the registered device, or a browser not seen before
+FINGERPRINT_MIX = [('fp-1', 0.9), ('new', 0.1)]
+
+
+class DeviceLoginStormTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 2000, window: float = 30.0, concurrency: int = 50, seed: int = 7, **options):
+        super().__init__(**options)
+        self.users = users
+        self.window = window
+        self.concurrency = concurrency
+        self.seed = seed
+        self.db_pool = None
+        self.storm_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Initialize the database connection pool"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(),
+                min_size=self.concurrency,
+                max_size=self.concurrency,
+                connection_class=InstrumentedConnection
+            )
+            print(f"✅ Database pool initialized ({self.concurrency} connections)")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Close the connection pool"""
+        if self.db_pool:
+            await self.db_pool.close()
+
+    def plan(self) -> Tuple[List[str], List[Tuple[float, int, str]]]:
+        """Roles per user and (arrival offset, user index, fingerprint) per login"""
+        rng = random.Random(self.seed)
+        roles = rng.choices([r for r, _ in ROLE_MIX], [w for _, w in ROLE_MIX], k=self.users)
+
+        logins = []
+        offset = 0.0
+        rate = self.users / self.window
+        for index in rng.sample(range(self.users), self.users):
+            offset += rng.expovariate(rate)
+            fingerprint = rng.choices([f for f, _ in FINGERPRINT_MIX], [w for _, w in FINGERPRINT_MIX])[0]
+            if fingerprint == 'new':
+                fingerprint = f"fp-new-{index}"
+            logins.append((offset, index, fingerprint))
+        return roles, logins
+
+    async def seed_population(self, roles: List[str]) -> List:
+        """Users in plan order, each with fingerprint fp-1 registered"""
+        user_ids = [None] * len(roles)
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                for role in {r for r, _ in ROLE_MIX}:
+                    positions = [i for i, r in enumerate(roles) if r == role]
+                    ids = await seed_users(conn, len(positions), role=role)
+                    for position, user_id in zip(positions, ids):
+                        user_ids[position] = user_id
+                await seed_devices(conn, user_ids, devices_per_user=1)
+        return user_ids
+
+    async def remove_population(self, user_ids: List):
+        async with self.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", user_ids)
+
+    async def login(self, function: str, user_id, fingerprint: str) -> bool:
+        """registerDevice: check, then upsert the device when allowed"""
+        async with self.db_pool.acquire() as conn:
+            allowed = await conn.fetchval(f"SELECT public.{function}($1, $2)", user_id, fingerprint)
+            if allowed:
+                await conn.execute("""
+                    INSERT INTO public.user_devices (user_id, device_fingerprint, device_name, last_active)
+                    VALUES ($1, $2, 'Chrome Extension', NOW())
+                    ON CONFLICT (user_id, device_fingerprint) DO UPDATE SET last_active = EXCLUDED.last_active
+                """, user_id, fingerprint)
+            return bool(allowed)
+
+    async def run_storm(self, variant: str) -> Dict:
+        roles, logins = self.plan()
+        user_ids = await self.seed_population(roles)
+        function = VARIANTS[variant]
+        service = Histogram()
+        queueing = Histogram()
+        decisions: Dict[Tuple[int, str], bool] = {}
+
+        async def arrive(offset, index, fingerprint, started):
+            await asyncio.sleep(max(0.0, started + offset - time.perf_counter()))
+            scheduled = started + offset
+            begun = time.perf_counter()
+            queueing.record(max(0.0, begun - scheduled) * 1000)
+            try:
+                decisions[(index, fingerprint)] = await self.login(function, user_ids[index], fingerprint)
+            finally:
+                service.record((time.perf_counter() - begun) * 1000)
+
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(arrive(o, i, f, started) for o, i, f in logins))
+            elapsed = time.perf_counter() - started
+        finally:
+            await self.remove_population(user_ids)
+
+        return {
+            'variant': variant,
+            'logins': len(logins),
+            'allowed': sum(decisions.values()),
+            'denied': len(decisions) - sum(decisions.values()),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_logins': round(len(logins) / elapsed, 1),
+            'latency': service.summary(),
+            'queueing': queueing.summary(),
+            'decisions': decisions
+        }
+
+    @depends_on(files=('complete_user_limits_update.sql',), tables=('users', 'user_devices'),
+                rpcs=('can_register_device', 'can_register_device_fast'))
+    async def test_fingerprint_probe_is_exact(self):
+        """Test 1: An unknown fingerprint is not mistaken for the user's registered device"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                transaction = conn.transaction()
+                await transaction.start()
+                try:
+                    [user_id] = await seed_users(conn, 1, role='free')
+                    await seed_devices(conn, [user_id], devices_per_user=1)
+                    results = {}
+                    for variant, function in VARIANTS.items():
+                        results[variant] = {
+                            'registered': await conn.fetchval(f"SELECT public.{function}($1, 'fp-1')", user_id),
+                            'unknown': await conn.fetchval(f"SELECT public.{function}($1, 'fp-unknown')", user_id)
+                        }
+                finally:
+                    await transaction.rollback()
+
+            wrong = {v: r for v, r in results.items() if r != {'registered': True, 'unknown': False}}
+            if wrong:
+                self.log_test_result(
+                    "Device Probe Exactness",
+                    False,
+                    "Free user at its 1-device limit was allowed a new fingerprint "
+                    "(device_fingerprint compared with itself?)",
+                    results
+                )
+                return False
+
+            self.log_test_result(
+                "Device Probe Exactness",
+                True,
+                "Registered fingerprint allowed, unknown fingerprint denied at the device limit",
+                results
+            )
+            return True
+
+        except Exception as e:
+            self.log_test_result(
+                "Device Probe Exactness",
+                False,
+                f"Device probe check failed: {str(e)}"
+            )
+            return False
+
+    async def storm(self, variant: str, name: str) -> bool:
+        try:
+            result = await self.run_storm(variant)
+            self.storm_results[variant] = result
+            details = {k: v for k, v in result.items() if k != 'decisions'}
+            self.log_test_result(
+                name,
+                True,
+                f"{result['logins']} logins in {result['elapsed_s']}s ({result['throughput_logins']}/s), "
+                f"p50 {result['latency']['p50_ms']:.1f} ms, p99 {result['latency']['p99_ms']:.1f} ms, "
+                f"{result['denied']} denied",
+                details
+            )
+            return True
+        except Exception as e:
+            self.log_test_result(name, False, f"Login storm failed: {str(e)}")
+            return False
+
+    async def test_login_storm_plpgsql(self):
+        """Test 2: Login storm against can_register_device"""
+        return await self.storm('plpgsql', "Login Storm - can_register_device")
+
+    async def test_login_storm_single_statement(self):
+        """Test 3: Login storm against can_register_device_fast"""
+        return await self.storm('single_statement', "Login Storm - can_register_device_fast")
+
+    async def test_variants_agree(self):
+        """Test 4: Both variants made the same decision for every login"""
+        if len(self.storm_results) < 2:
+            self.log_test_result("Variant Agreement", False, "Both storms must complete first")
+            return False
+
+        reference = self.storm_results['plpgsql']['decisions']
+        candidate = self.storm_results['single_statement']['decisions']
+        mismatches = [
+            {'user_index': index, 'fingerprint': fingerprint,
+             'plpgsql': allowed, 'single_statement': candidate.get((index, fingerprint))}
+            for (index, fingerprint), allowed in reference.items()
+            if candidate.get((index, fingerprint)) != allowed
+        ]
+        if mismatches:
+            self.log_test_result(
+                "Variant Agreement",
+                False,
+                f"{len(mismatches)} of {len(reference)} logins decided differently",
+                {'mismatches': mismatches[:20]}
+            )
+            return False
+
+        speedup = (self.storm_results['plpgsql']['latency']['p50_ms']
+                   / max(self.storm_results['single_statement']['latency']['p50_ms'], 0.001))
+        self.log_test_result(
+            "Variant Agreement",
+            True,
+            f"All {len(reference)} decisions match; single statement p50 x{speedup:.2f} faster"
+        )
+        return True
+
+    async def run_all_tests(self):
+        """Run the login storm tests in sequence"""
+        print("🚀 Starting Extension Login Storm Test")
+        print(f"   {self.users} users over {self.window}s, {self.concurrency} connections")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_fingerprint_probe_is_exact,
+            self.test_login_storm_plpgsql,
+            self.test_login_storm_single_statement,
+            self.test_variants_agree
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+        if cached:
+            print(f"⏭️ Cached: {cached}")
+        print(f"📈 Success Rate: {((passed + cached) / (passed + failed + cached) * 100):.1f}%")
+
+        if failed == 0:
+            print("🎉 All login storm tests passed!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = DeviceLoginStormTester(
+        users=scenario_option(argv, 'users', 2000),
+        window=scenario_option(argv, 'window', 30.0, float),
+        concurrency=scenario_option(argv, 'concurrency', 50),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Encryption Test
+Checks services.encryption against client/lib/enhanced-encryption.ts and benchmarks
+its throughput. Needs no database.
+
+The reference payload below came from the browser code path: Web Crypto PBKDF2 then
+AES-GCM, with a fixed IV so it can be reproduced. Python must decrypt it and produce
+it byte for byte. Tampered payloads and wrong keys must fail the way the client
+fails. The key cache must stay bounded and derive each key once under concurrency.
+An email change must re-encrypt cleanly.
+
+The benchmark compares three ways of encrypting `messages` messages spread over
+`users` users. In the first, every message derives its own key, which is what
+per-message code costs without a cache. It is timed on a sample and reported per
+message. The second is the cached service, one message at a time. The third is
+encrypt_batch from a cold cache, so its single derivation per user is paid inside
+the timing.
+
+Usage: python encryption_test.py [--messages=2000] [--users=50] [--trials=5] [--workers=0]
+"""
+
+import asyncio
+import base64
+import os
+import threading
+import time
+from typing import List
+import sys
+
+from harness import TesterBase, compare_samples, scenario_option, suite_options
+from services.encryption import (
+    DecryptionError,
+    EncryptionService,
+    KeyCache,
+    decrypt_with_key,
+    derive_user_key,
+    encrypt_with_key,
+    is_encrypted,
+)
+
+REFERENCE = {
+    'user_id': '3f0c9a4e-8d2b-4c1a-9e7f-5b6d2a1c0e84',
+    'email': 'ana@example.com',
+    'iv': bytes(range(1, 13)),
+    'plaintext': 'Can we move the meeting to Thursday? — Ana 😊',
+    'payload': 'v2:AQIDBAUGBwgJCgsMD+LVEIyON+rKl7KVAF41sxUocEbFdcPXFxT43qvuUu/CVdQoU6BrDgWMzwJyaGmRSbRKXgXto1db7IcSYSkWC6Q='
+}
+
+
+class EncryptionTester(TesterBase):
+
+    def __init__(self, messages: int = 2000, users: int = 50, trials: int = 5, workers: int = 0, **options):
+        super().__init__(**options)
+        self.messages = messages
+        self.users = users
+        self.trials = trials
+        self.workers = workers or None
+        self.service = None
+        self.reference_key = None
+
+    async def setup(self):
+        """Create the encryption service and derive the reference key"""
+        try:
+            self.service = EncryptionService(workers=self.workers)
+            self.reference_key = derive_user_key(REFERENCE['user_id'], REFERENCE['email'])
+            print(f"✅ Encryption service ready ({self.workers or os.cpu_count()} workers)")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize encryption service: {e}")
+            return False
+
+    async def cleanup(self):
+        if self.service:
+            self.service.close()
+
+    def workload(self) -> List:
+        return [(f"bench-user-{i % self.users}", f"user{i % self.users}@bench.test",
+                 f"Message {i}: following up on the proposal we discussed last week.")
+                for i in range(self.messages)]
+
+    async def test_wire_compatibility(self):
+        """Test 1: The client's payload decrypts, and the same IV reproduces it exactly"""
+        try:
+            decrypted = decrypt_with_key(self.reference_key, REFERENCE['payload'])
+            produced = encrypt_with_key(self.reference_key, REFERENCE['plaintext'], iv=REFERENCE['iv'])
+            legacy = decrypt_with_key(self.reference_key, REFERENCE['payload'][3:])
+            success = decrypted == legacy == REFERENCE['plaintext'] and produced == REFERENCE['payload']
+            self.log_test_result("Encryption - Wire Compatibility", success,
+                                 "Web Crypto payload decrypts and is reproduced byte for byte" if success
+                                 else "Payloads differ from the client's",
+                                 {'decrypted': decrypted, 'produced': produced})
+            return success
+        except Exception as e:
+            self.log_test_result("Encryption - Wire Compatibility", False, f"Compatibility check failed: {str(e)}")
+            return False
+
+    async def test_rejects_tampering(self):
+        """Test 2: Flipped bytes, truncation and wrong keys fail to decrypt"""
+        try:
+            raw = bytearray(base64.b64decode(REFERENCE['payload'][3:]))
+            raw[20] ^= 0x01
+            cases = {
+                'flipped byte': (self.reference_key, 'v2:' + base64.b64encode(bytes(raw)).decode()),
+                'truncated': (self.reference_key, REFERENCE['payload'][:30]),
+                'not base64': (self.reference_key, 'v2:not*base64'),
+                'email missing': (derive_user_key(REFERENCE['user_id']), REFERENCE['payload']),
+                'other user': (derive_user_key('someone-else', REFERENCE['email']), REFERENCE['payload'])
+            }
+            accepted = []
+            for name, (key, payload) in cases.items():
+                try:
+                    decrypt_with_key(key, payload)
+                    accepted.append(name)
+                except DecryptionError:
+                    pass
+            detection = is_encrypted(REFERENCE['payload']) and not is_encrypted('Plain reply text')
+            success = not accepted and detection
+            self.log_test_result("Encryption - Rejects Tampering", success,
+                                 f"All {len(cases)} bad payloads rejected" if success
+                                 else f"Accepted: {accepted}; is_encrypted ok: {detection}")
+            return success
+        except Exception as e:
+            self.log_test_result("Encryption - Rejects Tampering", False, f"Tampering check failed: {str(e)}")
+            return False
+
+    async def test_key_cache(self):
+        """Test 3: Concurrent misses derive once, the LRU stays bounded and forget drops a user's keys"""
+        try:
+            keys = KeyCache(max_entries=4)
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(keys.get('hot-user', 'hot@bench.test')))
+                       for _ in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            derivations = keys.stats['derivations']
+            single_flight = derivations == 1 and len(set(results)) == 1 and len(results) == 16
+
+            for i in range(5):
+                keys.get(f"user-{i}")
+            bounded = len(keys.keys) == 4 and keys.stats['evicted'] == 2
+            keys.forget('user-4')
+            forgotten = ('user-4', None) not in keys.keys
+            success = single_flight and bounded and forgotten
+            self.log_test_result("Encryption - Key Cache", success,
+                                 f"16 concurrent lookups, {derivations} derivation; "
+                                 f"bounded at 4 with {keys.stats['evicted']} evictions",
+                                 keys.summary())
+            return success
+        except Exception as e:
+            self.log_test_result("Encryption - Key Cache", False, f"Cache check failed: {str(e)}")
+            return False
+
+    async def test_reencrypt_on_email_change(self):
+        """Test 4: reencrypt_batch moves payloads to the new email's key and flags corrupt ones"""
+        try:
+            items = self.workload()[:200]
+            encrypted = self.service.encrypt_batch(items)
+            encrypted[7] = encrypted[7][:-8] + 'AAAAAAA='
+            moved = self.service.reencrypt_batch([
+                (user_id, email, f"new-{email}", payload) for (user_id, email, _), payload in zip(items, encrypted)
+            ])
+            decrypted = self.service.decrypt_batch([
+                (user_id, f"new-{email}", payload) for (user_id, email, _), payload in zip(items, moved)
+                if payload is not None
+            ])
+            expected = [plaintext for i, (_, _, plaintext) in enumerate(items) if i != 7]
+            stale = self.service.decrypt_batch([(items[0][0], items[0][1], moved[0])])
+            success = moved[7] is None and decrypted == expected and stale == [None]
+            self.log_test_result("Encryption - Re-encrypt", success,
+                                 f"{len(expected)} payloads moved to the new key, 1 corrupt payload flagged; "
+                                 f"old key no longer decrypts" if success else "Re-encrypted payloads are wrong",
+                                 self.service.stats)
+            return success
+        except Exception as e:
+            self.log_test_result("Encryption - Re-encrypt", False, f"Re-encryption failed: {str(e)}")
+            return False
+
+    async def test_throughput(self):
+        """Test 5: Per-message derivation vs the cached service vs a cold-cache batch"""
+        try:
+            items = self.workload()
+            sample = items[:min(len(items), 20)]
+
+            uncached, cached, batch = [], [], []
+            for _ in range(self.trials):
+                started = time.perf_counter()
+                for user_id, email, plaintext in sample:
+                    encrypt_with_key(derive_user_key(user_id, email), plaintext)
+                uncached.append((time.perf_counter() - started) * 1000 / len(sample))
+
+                started = time.perf_counter()
+                for user_id, email, plaintext in items:
+                    self.service.encrypt(user_id, plaintext, email)
+                cached.append((time.perf_counter() - started) * 1000 / len(items))
+
+                self.service.keys.clear()
+                started = time.perf_counter()
+                encrypted = self.service.encrypt_batch(items)
+                batch.append((time.perf_counter() - started) * 1000 / len(items))
+
+            started = time.perf_counter()
+            self.service.decrypt_batch([(u, e, p) for (u, e, _), p in zip(items, encrypted)])
+            decrypt_rate = len(items) / (time.perf_counter() - started)
+
+            comparison = compare_samples(uncached, batch)
+            rates = {name: round(1000 / (sum(samples) / len(samples)))
+                     for name, samples in (('uncached', uncached), ('cached', cached), ('batch', batch))}
+            rates['batch_decrypt'] = round(decrypt_rate)
+            success = comparison['verdict'] == 'improvement'
+            self.log_test_result(
+                "Encryption - Throughput",
+                success,
+                f"{rates['uncached']} msg/s deriving per message, {rates['cached']} msg/s cached, "
+                f"{rates['batch']} msg/s batched from a cold cache ({self.users} users), "
+                f"{rates['batch_decrypt']} msg/s batch decrypt",
+                {'messages_per_second': rates, 'comparison': comparison, 'keys': self.service.keys.summary()}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Encryption - Throughput", False, f"Benchmark failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the encryption checks and benchmark"""
+        print("🚀 Starting Encryption Test")
+        print(f"   {self.messages} messages over {self.users} users, {self.trials} trials")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_wire_compatibility,
+            self.test_rejects_tampering,
+            self.test_key_cache,
+            self.test_reencrypt_on_email_change,
+            self.test_throughput
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Server-side encryption matches the client and keeps up in bulk!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = EncryptionTester(
+        messages=scenario_option(argv, 'messages', 2000),
+        users=scenario_option(argv, 'users', 50),
+        trials=scenario_option(argv, 'trials', 5),
+        workers=scenario_option(argv, 'workers', 0),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -12,16 +12,21 @@ from datetime import datetime
 from typing import Dict, List, Any, Optional
 import sys
 
-class EnterpriseCreationFrontendTester:
-    def __init__(self):
+from harness import TesterBase, depends_on, suite_options
+from harness.instrumentation import http_trace_config
+
+class EnterpriseCreationFrontendTester(TesterBase):
+    incremental_context = {'base_url': 'http://localhost:8080'}
+
+    def __init__(self, **options):
+        super().__init__(**options)
         self.session = None
-        self.test_results = []
         self.base_url = "http://localhost:8080"
         
     async def setup(self):
         """Initialize HTTP session"""
         try:
-            self.session = aiohttp.ClientSession()
+            self.session = aiohttp.ClientSession(trace_configs=[http_trace_config()])
             print("✅ HTTP session initialized successfully")
             return True
             
@@ -38,23 +43,7 @@ class EnterpriseCreationFrontendTester:
         except Exception as e:
             print(f"⚠️ Cleanup warning: {e}")
     
-    def log_test_result(self, test_name: str, success: bool, message: str, details: Dict = None):
-        """Log test result"""
-        result = {
-            'test': test_name,
-            'success': success,
-            'message': message,
-            'details': details or {},
-            'timestamp': datetime.now().isoformat()
-        }
-        self.test_results.append(result)
-        
-        status = "✅" if success else "❌"
-        print(f"{status} {test_name}: {message}")
-        
-        if details and not success:
-            print(f"   Details: {details}")
-    
+    @depends_on(files=('.env',))
     async def test_environment_variables_configuration(self):
         """Test 1: Verify VITE_SUPABASE_SERVICE_ROLE_KEY is accessible"""
         try:
@@ -131,6 +120,7 @@ class EnterpriseCreationFrontendTester:
             )
             return False
     
+    @depends_on(files=('server/index.ts',))
     async def test_api_health_endpoint(self):
         """Test 2: Test /health endpoint"""
         try:
@@ -185,6 +175,7 @@ class EnterpriseCreationFrontendTester:
             )
             return False
     
+    @depends_on(files=('client/lib/supabase.ts',))
     async def test_supabase_client_configuration(self):
         """Test 3: Test supabase client configuration in frontend code"""
         try:
@@ -249,6 +240,7 @@ class EnterpriseCreationFrontendTester:
             )
             return False
     
+    @depends_on(files=('client/pages/SuperAdmin.tsx',))
     async def test_superadmin_component_structure(self):
         """Test 4: Test SuperAdmin component has enterprise creation functionality"""
         try:
@@ -325,6 +317,7 @@ class EnterpriseCreationFrontendTester:
             )
             return False
     
+    @depends_on(files=('client/lib/supabase-types.ts',))
     async def test_database_schema_types(self):
         """Test 5: Test database schema types are properly defined"""
         try:
@@ -417,6 +410,7 @@ class EnterpriseCreationFrontendTester:
             )
             return False
     
+    @depends_on(files=('client/pages/SuperAdmin.tsx',))
     async def test_enterprise_creation_workflow_logic(self):
         """Test 6: Test enterprise creation workflow logic in SuperAdmin component"""
         try:
@@ -492,6 +486,7 @@ class EnterpriseCreationFrontendTester:
             )
             return False
     
+    @depends_on(files=('client/pages/SuperAdmin.tsx',))
     async def test_error_handling_and_validation(self):
         """Test 7: Test error handling and validation in enterprise creation"""
         try:
@@ -574,21 +569,7 @@ class EnterpriseCreationFrontendTester:
             self.test_error_handling_and_validation
         ]
         
-        passed = 0
-        failed = 0
-        
-        for test in tests:
-            try:
-                result = await test()
-                if result:
-                    passed += 1
-                else:
-                    failed += 1
-            except Exception as e:
-                print(f"❌ Test {test.__name__} crashed: {e}")
-                failed += 1
-            
-            print()  # Add spacing between tests
+        passed, failed, cached = await self.run_tests(tests)
         
         # Cleanup
         await self.cleanup()
@@ -598,7 +579,9 @@ class EnterpriseCreationFrontendTester:
         print(f"📊 TEST SUMMARY")
         print(f"✅ Passed: {passed}")
         print(f"❌ Failed: {failed}")
-        print(f"📈 Success Rate: {(passed / (passed + failed) * 100):.1f}%")
+        if cached:
+            print(f"⏭️ Cached: {cached}")
+        print(f"📈 Success Rate: {((passed + cached) / (passed + failed + cached) * 100):.1f}%")
         
         if failed == 0:
             print("🎉 All enterprise creation frontend tests passed!")
@@ -610,7 +593,7 @@ class EnterpriseCreationFrontendTester:
 
 async def main():
     """Main test runner"""
-    tester = EnterpriseCreationFrontendTester()
+    tester = EnterpriseCreationFrontendTester(**suite_options(sys.argv[1:]))
     success = await tester.run_all_tests()
     return 0 if success else 1
 
@@ -0,0 +1,52 @@
+-- MailoReply AI - Extension Template Bundles
+-- Content versions and indexes for services/template_bundles.py, which answers extension
+-- template polls from precomputed per-user bundles and only asks the database whether
+-- anything changed.
+-- Run after enhanced_template_management.sql. Safe to run multiple times.
+
+-- 1. CONTENT VERSION
+-- Nothing maintains templates.updated_at: owners edit their rows through RLS without
+-- touching it, and increment_template_usage moves it on every use. content_version is
+-- drawn from one sequence on insert and again whenever a field the extension sees
+-- changes, so the highest version among a user's visible templates moves on any edit,
+-- approval or new template, and never on a usage count.
+CREATE SEQUENCE IF NOT EXISTS public.template_content_version_seq;
+
+ALTER TABLE public.templates
+  ADD COLUMN IF NOT EXISTS content_version BIGINT NOT NULL
+  DEFAULT nextval('public.template_content_version_seq');
+
+CREATE OR REPLACE FUNCTION public.bump_template_content_version()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.content_version := nextval('public.template_content_version_seq');
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bump_template_content_version_trigger ON public.templates;
+CREATE TRIGGER bump_template_content_version_trigger
+  BEFORE UPDATE ON public.templates
+  FOR EACH ROW
+  WHEN ((OLD.user_id, OLD.company_id, OLD.title, OLD.content, OLD.subject, OLD.hotkey, OLD.visibility,
+         OLD.approved_at)
+        IS DISTINCT FROM
+        (NEW.user_id, NEW.company_id, NEW.title, NEW.content, NEW.subject, NEW.hotkey, NEW.visibility,
+         NEW.approved_at))
+  EXECUTE FUNCTION public.bump_template_content_version();
+
+-- 2. FRESHNESS CHECKS
+-- A poll past the bundle's check interval runs one aggregate (count, MAX(content_version))
+-- over exactly the rows get_templates_for_extension returns. These partial indexes cover
+-- each half of that set, so the check reads a handful of index entries instead of every
+-- template of the user or company. They replace the earlier indexes on updated_at.
+DROP INDEX IF EXISTS public.idx_templates_extension_private;
+DROP INDEX IF EXISTS public.idx_templates_extension_company;
+
+CREATE INDEX IF NOT EXISTS idx_templates_extension_private_version
+  ON public.templates (user_id, content_version)
+  WHERE visibility = 'private' AND hotkey IS NOT NULL AND hotkey <> '';
+
+CREATE INDEX IF NOT EXISTS idx_templates_extension_company_version
+  ON public.templates (company_id, content_version)
+  WHERE visibility = 'company' AND approved_at IS NOT NULL AND hotkey IS NOT NULL AND hotkey <> '';
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Generation Gateway Test
+Checks services.gateway.GenerationGateway against the n8n stand-in
+(services/n8n_standin.py), run in-process, so it needs no n8n and no LLM.
+
+Free users fire more concurrent requests than their daily limit allows, and exactly the
+limit must go through and be recorded. Cached quota decisions must agree with the
+can_user_generate RPC. A warm-cache gateway request must make no database round trips of
+its own. Its latency under concurrency is compared with the client's direct path: users
+lookup, can_user_generate, webhook, ai_generations insert and increment_user_usage.
+
+It seeds users and writes their generations, removed again at cleanup, so point this at a
+test database.
+
+Usage: python generation_gateway_test.py [--users=50] [--concurrency=50] [--trials=10] [--latency-ms=0]
+"""
+
+import asyncio
+import asyncpg
+from typing import List
+import sys
+
+from aiohttp import web
+
+from harness import TesterBase, compare_samples, measure, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import direct_generate, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.gateway import GenerationGateway, N8NClient, QuotaCache
+from services.ingest import GenerationIngestor
+from services.n8n_standin import create_app as create_standin
+
+REQUESTS = {
+    'reply': {'generationType': 'reply', 'source': 'website', 'language': 'English', 'tone': 'Professional',
+              'intent': 'Say Yes', 'originalMessage': 'Can we move the meeting to Thursday?', 'encrypted': False},
+    'email': {'generationType': 'email', 'source': 'extension', 'language': 'English', 'tone': 'Friendly',
+              'prompt': 'invite the team to the quarterly review', 'encrypted': False}
+}
+
+
+class GenerationGatewayTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 50, concurrency: int = 50, trials: int = 10, latency_ms: float = 0.0,
+                 **options):
+        super().__init__(**options)
+        self.users = users
+        self.concurrency = concurrency
+        self.trials = trials
+        self.latency_ms = latency_ms
+        self.db_pool = None
+        self.standin = None
+        self.n8n = None
+        self.ingestor = None
+        self.gateway = None
+        self.free_ids: List = []
+        self.unlimited_ids: List = []
+        self.other_ids: List = []
+
+    async def setup(self):
+        """Start the n8n stand-in, the gateway and its ingestor; seed users"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=10, connection_class=InstrumentedConnection
+            )
+            self.standin = web.AppRunner(create_standin(latency=self.latency_ms / 1000))
+            await self.standin.setup()
+            await web.TCPSite(self.standin, '127.0.0.1', 0).start()
+            port = self.standin.addresses[0][1]
+
+            self.n8n = N8NClient(f"http://127.0.0.1:{port}/webhook/reply", f"http://127.0.0.1:{port}/webhook/email")
+            await self.n8n.start()
+            self.ingestor = GenerationIngestor(self.db_pool, max_delay=0.05)
+            self.ingestor.start()
+            self.gateway = GenerationGateway(QuotaCache(self.db_pool, ttl=30.0), self.n8n, self.ingestor)
+
+            async with self.db_pool.acquire() as conn:
+                self.free_ids = await seed_users(conn, 10, role='free')
+                # Not short-circuited by the client, so the direct path pays for the RPC
+                self.unlimited_ids = await seed_users(conn, self.users, role='enterprise_user')
+                self.other_ids = await seed_users(conn, 5, role='pro')
+                self.other_ids += await seed_users(conn, 5, role='pro_plus')
+                await conn.execute("UPDATE public.users SET monthly_usage = monthly_limit WHERE id = $1",
+                                   self.other_ids[0])
+                await conn.execute("UPDATE public.users SET status = 'suspended' WHERE id = $1", self.other_ids[-1])
+            print(f"✅ Gateway initialized against n8n stand-in on :{port}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize gateway: {e}")
+            return False
+
+    async def cleanup(self):
+        """Stop the gateway and stand-in, remove seeded users (generations cascade) and close the pool"""
+        if self.gateway:
+            await self.gateway.drain()
+        if self.ingestor:
+            await self.ingestor.stop()
+        if self.n8n:
+            await self.n8n.close()
+        if self.standin:
+            await self.standin.cleanup()
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])",
+                                   self.free_ids + self.unlimited_ids + self.other_ids)
+            await self.db_pool.close()
+
+    async def test_quota_enforcement(self):
+        """Test 1: Concurrent requests from free users stop exactly at the daily limit"""
+        try:
+            per_user = 6
+            results = await asyncio.gather(*[
+                self.gateway.generate(user_id, REQUESTS['reply' if i % 2 else 'email'])
+                for user_id in self.free_ids for i in range(per_user)
+            ])
+            await self.gateway.drain()
+            allowed = sum(1 for status, _ in results if status == 200)
+            async with self.db_pool.acquire() as conn:
+                usage = await conn.fetch("""
+                    SELECT u.id, u.daily_usage, COUNT(g.id) AS generations
+                    FROM public.users u LEFT JOIN public.ai_generations g ON g.user_id = u.id
+                    WHERE u.id = ANY($1::uuid[])
+                    GROUP BY u.id, u.daily_usage
+                """, self.free_ids)
+            wrong = [dict(row) for row in usage if row['daily_usage'] != 3 or row['generations'] != 3]
+            details = {'requests': len(results), 'allowed': allowed, 'quota': self.gateway.quotas.stats}
+            if allowed != 3 * len(self.free_ids) or wrong:
+                details['wrong_users'] = [{k: str(v) for k, v in row.items()} for row in wrong[:3]]
+                self.log_test_result("Gateway - Quota Enforcement", False,
+                                     f"{allowed} of {len(results)} allowed; {len(wrong)} users with wrong usage",
+                                     details)
+                return False
+            self.log_test_result("Gateway - Quota Enforcement", True,
+                                 f"{allowed} of {len(results)} concurrent requests allowed (3 per free user); "
+                                 f"usage recorded exactly", details)
+            return True
+        except Exception as e:
+            self.log_test_result("Gateway - Quota Enforcement", False, f"Generation failed: {str(e)}")
+            return False
+
+    async def test_matches_rpc(self):
+        """Test 2: Freshly loaded quota decisions agree with can_user_generate"""
+        try:
+            user_ids = self.free_ids + self.unlimited_ids[:5] + self.other_ids
+            disagreements = []
+            async with self.db_pool.acquire() as conn:
+                for user_id in user_ids:
+                    self.gateway.quotas.invalidate(user_id)
+                    quota = await self.gateway.quotas.get(user_id)
+                    cached = quota is not None and quota.denial() is None
+                    rpc = await conn.fetchval("SELECT public.can_user_generate($1)", user_id)
+                    if cached != rpc:
+                        disagreements.append({'user_id': str(user_id), 'cached': cached, 'rpc': rpc,
+                                              'role': quota.role if quota else None})
+            if disagreements:
+                self.log_test_result("Gateway - Matches RPC", False,
+                                     f"{len(disagreements)} of {len(user_ids)} decisions differ", disagreements[:5])
+                return False
+            self.log_test_result("Gateway - Matches RPC", True,
+                                 f"All {len(user_ids)} decisions match can_user_generate "
+                                 f"(exhausted, suspended and unlimited users included)")
+            return True
+        except Exception as e:
+            self.log_test_result("Gateway - Matches RPC", False, f"Comparison failed: {str(e)}")
+            return False
+
+    async def test_round_trips(self):
+        """Test 3: A warm-cache gateway request makes no database round trips"""
+        try:
+            user_id = self.unlimited_ids[0]
+            await self.gateway.quotas.get(user_id)
+            with self.round_trip_budget('gateway generate', max_db=0) as gateway_trips:
+                status, _ = await self.gateway.generate(user_id, REQUESTS['reply'])
+            with self.round_trip_budget('direct generate') as direct_trips:
+                await direct_generate(self.db_pool, self.n8n, self.unlimited_ids[1], REQUESTS['reply'])
+            details = {'gateway': gateway_trips.summary(), 'direct': direct_trips.summary()}
+            self.log_test_result(
+                "Gateway - Round Trips",
+                status == 200,
+                f"gateway {gateway_trips.total('db')} DB + {gateway_trips.total('http')} HTTP; "
+                f"direct {direct_trips.total('db')} DB + {direct_trips.total('http')} HTTP",
+                details
+            )
+            return status == 200
+        except Exception as e:
+            self.log_test_result("Gateway - Round Trips", False, f"Round-trip check failed: {str(e)}")
+            return False
+
+    async def test_latency_under_concurrency(self):
+        """Test 4: Batch latency at the configured concurrency, direct path vs gateway"""
+        try:
+            users = [self.unlimited_ids[i % len(self.unlimited_ids)] for i in range(self.concurrency)]
+
+            async def direct():
+                await asyncio.gather(*[direct_generate(self.db_pool, self.n8n, u, REQUESTS['reply']) for u in users])
+
+            async def gateway():
+                await asyncio.gather(*[self.gateway.generate(u, REQUESTS['reply']) for u in users])
+
+            direct_ms = await measure(direct, trials=self.trials, calls_per_trial=1)
+            gateway_ms = await measure(gateway, trials=self.trials, calls_per_trial=1)
+            await self.gateway.drain()
+            comparison = compare_samples(direct_ms, gateway_ms)
+            self.log_test_result(
+                "Gateway - Latency",
+                comparison['verdict'] != 'regression',
+                f"{self.concurrency} concurrent requests: direct {comparison['baseline_median_ms']:.1f} ms, "
+                f"gateway {comparison['candidate_median_ms']:.1f} ms ({comparison['verdict']}, "
+                f"ratio {comparison['ratio']:.2f})",
+                comparison
+            )
+            return comparison['verdict'] != 'regression'
+        except Exception as e:
+            self.log_test_result("Gateway - Latency", False, f"Measurement failed: {str(e)}")
+            return False
+
+    async def test_usage_recorded(self):
+        """Test 5: Every gateway request left exactly one ai_generations row"""
+        try:
+            await self.gateway.drain()
+            stats = self.gateway.stats
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetchval(
+                    "SELECT COUNT(*) FROM public.ai_generations WHERE idempotency_key IS NOT NULL "
+                    "AND user_id = ANY($1::uuid[])", self.free_ids + self.unlimited_ids + self.other_ids)
+            expected = stats['generated'] + stats['failed']
+            details = {'gateway': stats, 'ingest': self.ingestor.stats, 'rows': rows}
+            if rows != expected or stats['record_failures']:
+                self.log_test_result("Gateway - Usage Recorded", False,
+                                     f"{rows} rows for {expected} forwarded requests", details)
+                return False
+            self.log_test_result("Gateway - Usage Recorded", True,
+                                 f"{rows} rows for {expected} forwarded requests in "
+                                 f"{self.ingestor.stats['batches']} batches", details)
+            return True
+        except Exception as e:
+            self.log_test_result("Gateway - Usage Recorded", False, f"Check failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the gateway checks"""
+        print("🚀 Starting Generation Gateway Test")
+        print(f"   {self.concurrency} concurrent requests, stand-in latency {self.latency_ms} ms")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_quota_enforcement,
+            self.test_matches_rpc,
+            self.test_round_trips,
+            self.test_latency_under_concurrency,
+            self.test_usage_recorded
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Generation gateway enforces quotas without the round trips!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = GenerationGatewayTester(
+        users=scenario_option(argv, 'users', 50),
+        concurrency=scenario_option(argv, 'concurrency', 50),
+        trials=scenario_option(argv, 'trials', 10),
+        latency_ms=scenario_option(argv, 'latency-ms', 0.0, float),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
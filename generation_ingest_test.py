@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Batched Generation Ingest Test
+Checks services.ingest.GenerationIngestor against the per-event path it replaces
+(INSERT into ai_generations + increment_user_usage / track_extension_usage per
+generation) and measures the cost of each.
+
+Both paths process the same seeded event mix for their own freshly seeded users; the
+resulting ai_generations rows, users.daily_usage / monthly_usage and templates.usage_count
+must match. Redelivering every event to the ingestor must leave all of them unchanged.
+A batch holding an event the database refuses must fail only that event.
+
+Requires ai_generations_ingest.sql.
+
+Usage: python generation_ingest_test.py [--users=200] [--events=5000] [--batch=500]
+"""
+
+import time
+import random
+import asyncio
+import asyncpg
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, depends_on, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.ingest import GenerationEvent, GenerationIngestor
+
+ROLE_MIX = [('free', 0.5), ('pro', 0.3), ('pro_plus', 0.2)]
+
+
+class GenerationIngestTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 200, events: int = 5000, batch: int = 500, seed: int = 3, **options):
+        super().__init__(**options)
+        self.users = users
+        self.events = events
+        self.batch = batch
+        self.seed = seed
+        self.db_pool = None
+        self.path_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Initialize the database connection pool"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=10, connection_class=InstrumentedConnection
+            )
+            print("✅ Database pool initialized")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Close the connection pool"""
+        if self.db_pool:
+            await self.db_pool.close()
+
+    async def seed_population(self):
+        """Users per role (plan order) and one private template per user"""
+        rng = random.Random(self.seed)
+        roles = rng.choices([r for r, _ in ROLE_MIX], [w for _, w in ROLE_MIX], k=self.users)
+        user_ids: List = [None] * self.users
+        async with self.db_pool.acquire() as conn:
+            for role in {r for r, _ in ROLE_MIX}:
+                positions = [i for i, r in enumerate(roles) if r == role]
+                for position, user_id in zip(positions, await seed_users(conn, len(positions), role=role)):
+                    user_ids[position] = user_id
+            template_ids = [row['id'] for row in await conn.fetch("""
+                INSERT INTO public.templates (user_id, title, content, visibility)
+                SELECT u, 'Bench Template', 'Hello {{name}}', 'private'
+                FROM unnest($1::uuid[]) u
+                RETURNING id
+            """, user_ids)]
+        return user_ids, template_ids
+
+    def plan(self, user_ids: List, template_ids: List) -> List[GenerationEvent]:
+        rng = random.Random(self.seed)
+        events = []
+        for _ in range(self.events):
+            index = rng.randrange(len(user_ids))
+            if rng.random() < 0.3:
+                events.append(GenerationEvent.extension_action(
+                    user_ids[index], 'template_insert', template_ids[index], rng.randint(50, 800)
+                ))
+            else:
+                events.append(GenerationEvent(
+                    user_id=user_ids[index],
+                    source=rng.choice(['website', 'extension']),
+                    generation_type=rng.choice(['reply', 'email']),
+                    language='English',
+                    tone=rng.choice(['Professional', 'Friendly']),
+                    input_length=rng.randint(20, 2000),
+                    output_length=rng.randint(100, 1500),
+                    success=rng.random() > 0.05
+                ))
+        return events
+
+    async def per_event(self, events: List[GenerationEvent]):
+        """What trackGeneration and track_extension_usage do today, one event at a time"""
+        async def write(event):
+            async with self.db_pool.acquire() as conn:
+                if not event.count_usage:
+                    await conn.execute("SELECT public.track_extension_usage($1, $2, $3, $4)",
+                                       event.user_id, event.generation_type, event.template_id,
+                                       event.output_length)
+                    return
+                await conn.execute("""
+                    INSERT INTO public.ai_generations (user_id, source, generation_type, language, tone,
+                        intent, input_length, output_length, encrypted, success, error_message, created_at)
+                    VALUES ($1, $2::generation_source, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                """, event.user_id, event.source, event.generation_type, event.language, event.tone,
+                    event.intent, event.input_length, event.output_length, event.encrypted, event.success,
+                    event.error_message, event.created_at)
+                if event.success:
+                    await conn.execute("SELECT public.increment_user_usage($1)", event.user_id)
+
+        semaphore = asyncio.Semaphore(10)
+
+        async def bounded(event):
+            async with semaphore:
+                await write(event)
+
+        await asyncio.gather(*(bounded(event) for event in events))
+
+    async def state(self, user_ids: List) -> Dict:
+        async with self.db_pool.acquire() as conn:
+            generations = await conn.fetchval(
+                "SELECT COUNT(*) FROM public.ai_generations WHERE user_id = ANY($1::uuid[])", user_ids)
+            usage = sorted(tuple(row) for row in await conn.fetch(
+                "SELECT daily_usage, monthly_usage FROM public.users WHERE id = ANY($1::uuid[])",
+                user_ids))
+            templates = sorted(row['usage_count'] for row in await conn.fetch(
+                "SELECT usage_count FROM public.templates WHERE user_id = ANY($1::uuid[])", user_ids))
+        return {'generations': generations, 'usage': usage, 'template_usage': templates}
+
+    def statement_count(self) -> int:
+        return sum(row['count'] for row in self.latency.summary(kinds=['db']))
+
+    async def run_path(self, path: str) -> Dict:
+        user_ids, template_ids = await self.seed_population()
+        events = self.plan(user_ids, template_ids)
+        try:
+            statements_before = self.statement_count()
+            started = time.perf_counter()
+            if path == 'per_event':
+                await self.per_event(events)
+            else:
+                ingestor = GenerationIngestor(self.db_pool, max_batch=self.batch, max_delay=0.2)
+                ingestor.start()
+                await ingestor.submit_many(events)
+            elapsed = time.perf_counter() - started
+            statements = self.statement_count() - statements_before
+
+            redelivered = None
+            if path == 'batched':
+                first = await self.state(user_ids)
+                await ingestor.submit_many(events)
+                await ingestor.stop()
+                redelivered = {'unchanged': await self.state(user_ids) == first, 'stats': ingestor.stats}
+            final = await self.state(user_ids)
+        finally:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", user_ids)
+
+        return {
+            'path': path,
+            'events': len(events),
+            'statements': statements,
+            'elapsed_s': round(elapsed, 3),
+            'events_per_s': round(len(events) / elapsed, 1),
+            'state': final,
+            'redelivery': redelivered
+        }
+
+    async def check_path(self, path: str, name: str) -> bool:
+        try:
+            result = await self.run_path(path)
+            self.path_results[path] = result
+            details = {k: v for k, v in result.items() if k != 'state'}
+            if result['redelivery'] is not None and not result['redelivery']['unchanged']:
+                self.log_test_result(name, False, "Redelivered events changed rows or counters", details)
+                return False
+            self.log_test_result(
+                name,
+                True,
+                f"{result['events']} events -> {result['statements']} statements in {result['elapsed_s']}s "
+                f"({result['events_per_s']}/s)",
+                details
+            )
+            return True
+        except Exception as e:
+            self.log_test_result(name, False, f"Ingest failed: {str(e)}")
+            return False
+
+    async def test_per_event_path(self):
+        """Test 1: Per-event INSERT + increment_user_usage / track_extension_usage"""
+        return await self.check_path('per_event', "Generation Ingest - Per Event")
+
+    @depends_on(files=('services/ingest.py', 'ai_generations_ingest.sql'),
+                tables=('ai_generations', 'users', 'templates'))
+    async def test_batched_path(self):
+        """Test 2: Batched ingest, then full redelivery of the same events"""
+        return await self.check_path('batched', "Generation Ingest - Batched + Redelivery")
+
+    async def test_paths_agree(self):
+        """Test 3: Both paths leave the same rows and counters"""
+        if len(self.path_results) < 2:
+            self.log_test_result("Ingest Path Agreement", False, "Both paths must complete first")
+            return False
+        reference = self.path_results['per_event']['state']
+        candidate = self.path_results['batched']['state']
+        differing = [key for key in reference if reference[key] != candidate[key]]
+        if differing:
+            self.log_test_result("Ingest Path Agreement", False, f"Paths differ in: {', '.join(differing)}")
+            return False
+        ratio = self.path_results['per_event']['statements'] / max(self.path_results['batched']['statements'], 1)
+        self.log_test_result(
+            "Ingest Path Agreement",
+            True,
+            f"Rows and counters match; batched path used x{ratio:.0f} fewer statements"
+        )
+        return True
+
+    @depends_on(files=('services/ingest.py',), tables=('ai_generations',))
+    async def test_poison_event_isolated(self):
+        """Test 4: One unwritable event in a batch fails alone; the rest commit"""
+        async with self.db_pool.acquire() as conn:
+            user_ids = await seed_users(conn, 10)
+        events = [
+            GenerationEvent(user_id=user_id, source='website', generation_type='reply', language='English',
+                            tone='Professional', success=False, error_message='timeout')
+            for user_id in user_ids
+        ]
+        # Postgres refuses NUL bytes in text
+        poison = len(events) // 2
+        events[poison].error_message = 'bad\x00byte'
+        ingestor = GenerationIngestor(self.db_pool, max_batch=len(events), max_delay=0.2)
+        ingestor.start()
+        try:
+            results = await ingestor.submit_many(events, return_exceptions=True)
+            await ingestor.stop()
+            async with self.db_pool.acquire() as conn:
+                written = await conn.fetchval(
+                    "SELECT COUNT(*) FROM public.ai_generations WHERE user_id = ANY($1::uuid[])", user_ids)
+        except Exception as e:
+            self.log_test_result("Ingest Poison Event", False, f"Ingest failed: {str(e)}")
+            return False
+        finally:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", user_ids)
+
+        failed = [index for index, result in enumerate(results) if isinstance(result, Exception)]
+        details = {'failed': failed, 'written': written, 'stats': ingestor.stats}
+        if failed != [poison] or written != len(events) - 1:
+            self.log_test_result("Ingest Poison Event", False,
+                                 f"Expected only event {poison} to fail and {len(events) - 1} rows, "
+                                 f"got failures {failed} and {written} rows", details)
+            return False
+        self.log_test_result(
+            "Ingest Poison Event",
+            True,
+            f"Only the bad event failed ({type(results[poison]).__name__}); {written} rows written after "
+            f"{ingestor.stats['split_batches']} splits and {ingestor.stats['retries']} retries",
+            details
+        )
+        return True
+
+    async def run_all_tests(self):
+        """Run the ingest comparison"""
+        print("🚀 Starting Batched Generation Ingest Test")
+        print(f"   {self.events} events from {self.users} users, batches of {self.batch}")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_per_event_path,
+            self.test_batched_path,
+            self.test_paths_agree,
+            self.test_poison_event_isolated
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Batched ingest matches the per-event path!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = GenerationIngestTester(
+        users=scenario_option(argv, 'users', 200),
+        events=scenario_option(argv, 'events', 5000),
+        batch=scenario_option(argv, 'batch', 500),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
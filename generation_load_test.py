@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Generation Load Test
+Drives generation requests end to end through the n8n stand-in
+(services/n8n_standin.py) at several concurrency levels. The stand-in uses a
+realistic latency distribution and error rate and can stream its responses.
+
+Each level runs twice over the same mixed users. The first run takes the client's
+direct path: users lookup, can_user_generate, webhook, ai_generations insert and
+increment_user_usage. The second goes through services.gateway.GenerationGateway.
+Free users get more requests than their daily limit, and pro users start two
+generations short of their monthly limit, so the quota RPCs decide real outcomes.
+Usage is reset before every run.
+
+Reported per run: throughput, p50/p95/p99 latency, the outcome breakdown, the
+stand-in's peak in-flight requests and any users pushed past their limit. The
+gateway must never overshoot a limit. The direct path's check-then-increment
+can, and its overshoot is reported. Upstream failures must match the configured
+rates, and every forwarded request must leave exactly one ai_generations row.
+
+It seeds users and writes their generations at load, removed again at cleanup, so point
+this at a test database.
+
+Usage: python generation_load_test.py [--users=10] [--requests=200] [--concurrency=20,100]
+       [--latency=lognormal:median=1.0,sigma=0.5,max=10] [--error-rate=0.03] [--failure-rate=0.02]
+       [--hang-rate=0] [--timeout=30] [--stream] [--seed=0]
+"""
+
+import asyncio
+import asyncpg
+import math
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+import sys
+
+from aiohttp import web
+
+from harness import Histogram, TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import direct_generate, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.gateway import GenerationGateway, N8NClient, QuotaCache
+from services.ingest import GenerationIngestor
+from services.n8n_standin import LatencyModel, create_app as create_standin
+
+REQUESTS = [
+    {'generationType': 'reply', 'source': 'extension', 'language': 'English', 'tone': 'Professional',
+     'intent': 'Say Yes', 'originalMessage': 'Can we move the meeting to Thursday?', 'encrypted': False},
+    {'generationType': 'email', 'source': 'website', 'language': 'English', 'tone': 'Friendly',
+     'prompt': 'invite the team to the quarterly review', 'encrypted': False},
+    {'generationType': 'reply', 'source': 'extension', 'language': 'English', 'tone': 'Apologetic',
+     'intent': 'Delay Reply', 'originalMessage': 'Any update on the invoice?', 'encrypted': False}
+]
+ROLES = ('free', 'pro', 'pro_plus', 'enterprise_user')
+
+OVERSHOOT_SQL = """
+    SELECT COUNT(*) FILTER (WHERE role = 'free' AND (daily_usage > daily_limit OR monthly_usage > monthly_limit)),
+           COUNT(*) FILTER (WHERE role = 'pro' AND monthly_usage > monthly_limit)
+    FROM public.users WHERE id = ANY($1::uuid[])
+"""
+
+
+class GenerationLoadTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 10, requests: int = 200, concurrency: List[int] = (20, 100),
+                 latency: str = 'lognormal:median=1.0,sigma=0.5,max=10', error_rate: float = 0.03,
+                 failure_rate: float = 0.02, hang_rate: float = 0.0, timeout: float = 30.0, stream: bool = False,
+                 seed: int = 0, **options):
+        super().__init__(**options)
+        self.users = users
+        self.requests = requests
+        self.concurrency = list(concurrency)
+        self.latency = LatencyModel.parse(latency)
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.timeout = timeout
+        self.stream = stream
+        self.seed = seed or None
+        self.db_pool = None
+        self.standin = None
+        self.standin_stats: Dict = {}
+        self.n8n = None
+        self.ingestor = None
+        self.user_ids: Dict[str, List] = {}
+        self.runs: Dict[str, Dict[int, Dict]] = {'direct': {}, 'gateway': {}}
+
+    @property
+    def all_user_ids(self) -> List:
+        return [user_id for ids in self.user_ids.values() for user_id in ids]
+
+    async def setup(self):
+        """Start the stand-in, the n8n client and the ingestor; seed users of every role"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=20, connection_class=InstrumentedConnection
+            )
+            app = create_standin(latency=self.latency, error_rate=self.error_rate, failure_rate=self.failure_rate,
+                                 hang_rate=self.hang_rate, hang=self.timeout + 1, stream=self.stream, seed=self.seed)
+            self.standin_stats = app['stats']
+            self.standin = web.AppRunner(app)
+            await self.standin.setup()
+            await web.TCPSite(self.standin, '127.0.0.1', 0).start()
+            port = self.standin.addresses[0][1]
+
+            self.n8n = N8NClient(f"http://127.0.0.1:{port}/webhook/reply", f"http://127.0.0.1:{port}/webhook/email",
+                                 timeout=self.timeout, max_connections=max(self.concurrency))
+            await self.n8n.start()
+            self.ingestor = GenerationIngestor(self.db_pool, max_delay=0.05)
+            self.ingestor.start()
+
+            async with self.db_pool.acquire() as conn:
+                for role in ROLES:
+                    self.user_ids[role] = await seed_users(conn, self.users, role=role)
+            print(f"✅ Stand-in on :{port} ({self.latency}, {'streaming' if self.stream else 'buffered'})")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize load test: {e}")
+            return False
+
+    async def cleanup(self):
+        """Stop the ingestor and stand-in, remove seeded users (generations cascade) and close the pool"""
+        if self.ingestor:
+            await self.ingestor.stop()
+        if self.n8n:
+            await self.n8n.close()
+        if self.standin:
+            await self.standin.cleanup()
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", self.all_user_ids)
+            await self.db_pool.close()
+
+    async def reset_usage(self):
+        """Zero everyone's usage, then put pro users two generations short of their monthly limit"""
+        async with self.db_pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE public.users
+                SET daily_usage = 0,
+                    monthly_usage = CASE WHEN role = 'pro' THEN GREATEST(monthly_limit - 2, 0) ELSE 0 END,
+                    last_daily_reset = CURRENT_DATE, last_monthly_reset = date_trunc('month', CURRENT_DATE)::date
+                WHERE id = ANY($1::uuid[])
+            """, self.all_user_ids)
+
+    async def direct_generate(self, user_id, request: Dict) -> Tuple[int, Dict]:
+        """The client's path, with the gateway's status codes for comparison"""
+        response = await direct_generate(self.db_pool, self.n8n, user_id, request)
+        if response['success']:
+            return 200, response
+        return (429 if response['error'] == 'Usage limit reached' else 502), response
+
+    async def run_level(self, path: str, concurrency: int) -> Dict:
+        """Send `requests` generations at `concurrency` through one path and summarize them"""
+        await self.reset_usage()
+        users = self.all_user_ids
+        if path == 'gateway':
+            gateway = GenerationGateway(QuotaCache(self.db_pool, ttl=30.0), self.n8n, self.ingestor)
+            generate = gateway.generate
+        else:
+            gateway = None
+            generate = self.direct_generate
+
+        histogram = Histogram()
+        statuses = Counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        self.standin_stats['max_in_flight'] = 0
+
+        async def one(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                status, _ = await generate(users[i % len(users)], REQUESTS[i % len(REQUESTS)])
+                histogram.record((time.perf_counter() - started) * 1000)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(self.requests)])
+        elapsed = time.perf_counter() - started
+        if gateway:
+            await gateway.drain()
+
+        async with self.db_pool.acquire() as conn:
+            free_over, pro_over = await conn.fetchrow(OVERSHOOT_SQL, users)
+        return {
+            'concurrency': concurrency,
+            'throughput_rps': round(self.requests / elapsed, 2),
+            'latency': histogram.summary(),
+            'statuses': dict(statuses),
+            'forwarded': statuses[200] + statuses[502],
+            'failed': statuses[502],
+            'standin_max_in_flight': self.standin_stats['max_in_flight'],
+            'overshoot': {'free': free_over, 'pro': pro_over}
+        }
+
+    async def run_path(self, path: str, label: str) -> bool:
+        try:
+            for concurrency in self.concurrency:
+                run = await self.run_level(path, concurrency)
+                self.runs[path][concurrency] = run
+                latency = run['latency']
+                print(f"   {path} @ {concurrency}: {run['throughput_rps']} req/s, p50 {latency['p50_ms']:.0f} ms, "
+                      f"p95 {latency['p95_ms']:.0f} ms, p99 {latency['p99_ms']:.0f} ms, {run['statuses']}")
+            self.log_test_result(label, True,
+                                 f"{len(self.concurrency)} levels × {self.requests} requests completed",
+                                 self.runs[path])
+            return True
+        except Exception as e:
+            self.log_test_result(label, False, f"Load run failed: {str(e)}")
+            return False
+
+    async def test_standin_connection(self):
+        """Test 1: Both webhooks answer testN8NConnection's ping"""
+        try:
+            for kind in ('reply', 'email'):
+                async with self.n8n.session.post(self.n8n.urls[kind], json={'test': True}) as response:
+                    data = await response.json(content_type=None)
+                    if response.status != 200 or not data.get('success'):
+                        self.log_test_result("Load - Stand-in Connection", False,
+                                             f"{kind} webhook answered {response.status}", data)
+                        return False
+            self.log_test_result("Load - Stand-in Connection", True, "Reply and email webhooks answer pings")
+            return True
+        except Exception as e:
+            self.log_test_result("Load - Stand-in Connection", False, f"Ping failed: {str(e)}")
+            return False
+
+    async def test_direct_path(self):
+        """Test 2: Each concurrency level through the client's direct path"""
+        return await self.run_path('direct', "Load - Direct Path")
+
+    async def test_gateway_path(self):
+        """Test 3: Each concurrency level through the generation gateway"""
+        return await self.run_path('gateway', "Load - Gateway Path")
+
+    async def test_quota_under_load(self):
+        """Test 4: The gateway never pushes a user past a limit; direct-path overshoot is reported"""
+        try:
+            gateway = {c: run['overshoot'] for c, run in self.runs['gateway'].items()}
+            direct = {c: run['overshoot'] for c, run in self.runs['direct'].items()}
+            over = sum(count for overshoot in gateway.values() for count in overshoot.values())
+            self.log_test_result(
+                "Load - Quota Under Load",
+                bool(gateway) and over == 0,
+                f"gateway overshoot {over} users; direct path overshoot by level {direct}",
+                {'gateway': gateway, 'direct': direct}
+            )
+            return bool(gateway) and over == 0
+        except Exception as e:
+            self.log_test_result("Load - Quota Under Load", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_failure_rate(self):
+        """Test 5: Upstream failures match the configured rates within binomial tolerance"""
+        try:
+            runs = [run for path in self.runs.values() for run in path.values()]
+            forwarded = sum(run['forwarded'] for run in runs)
+            failed = sum(run['failed'] for run in runs)
+            expected = self.error_rate + self.failure_rate + self.hang_rate
+            tolerance = 4 * math.sqrt(expected * (1 - expected) / forwarded) + 1 / forwarded if forwarded else 0
+            observed = failed / forwarded if forwarded else 0.0
+            success = forwarded > 0 and abs(observed - expected) <= tolerance
+            self.log_test_result(
+                "Load - Failure Rate",
+                success,
+                f"{failed} of {forwarded} forwarded requests failed ({observed:.3f}, "
+                f"expected {expected:.3f} ± {tolerance:.3f})",
+                {'standin': dict(self.standin_stats)}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Load - Failure Rate", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_usage_recorded(self):
+        """Test 6: Every forwarded request left exactly one ai_generations row on either path"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetchrow("""
+                    SELECT COUNT(*) FILTER (WHERE idempotency_key IS NULL) AS direct,
+                           COUNT(*) FILTER (WHERE idempotency_key IS NOT NULL) AS gateway
+                    FROM public.ai_generations WHERE user_id = ANY($1::uuid[])
+                """, self.all_user_ids)
+            expected = {path: sum(run['forwarded'] for run in runs.values()) for path, runs in self.runs.items()}
+            details = {'rows': dict(rows), 'expected': expected, 'ingest': self.ingestor.stats}
+            if dict(rows) != expected:
+                self.log_test_result("Load - Usage Recorded", False,
+                                     f"rows {dict(rows)} for forwarded {expected}", details)
+                return False
+            self.log_test_result("Load - Usage Recorded", True,
+                                 f"{rows['direct']} direct and {rows['gateway']} gateway rows, one per forwarded "
+                                 f"request", details)
+            return True
+        except Exception as e:
+            self.log_test_result("Load - Usage Recorded", False, f"Check failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the load scenario"""
+        print("🚀 Starting Generation Load Test")
+        print(f"   {self.requests} requests per level at concurrency {self.concurrency}, "
+              f"{len(ROLES) * self.users} users")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_standin_connection,
+            self.test_direct_path,
+            self.test_gateway_path,
+            self.test_quota_under_load,
+            self.test_failure_rate,
+            self.test_usage_recorded
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Generation holds up under load!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+def _levels(value: str) -> List[int]:
+    return [int(level) for level in value.split(',')]
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = GenerationLoadTester(
+        users=scenario_option(argv, 'users', 10),
+        requests=scenario_option(argv, 'requests', 200),
+        concurrency=scenario_option(argv, 'concurrency', [20, 100], _levels),
+        latency=scenario_option(argv, 'latency', 'lognormal:median=1.0,sigma=0.5,max=10', str),
+        error_rate=scenario_option(argv, 'error-rate', 0.03, float),
+        failure_rate=scenario_option(argv, 'failure-rate', 0.02, float),
+        hang_rate=scenario_option(argv, 'hang-rate', 0.0, float),
+        timeout=scenario_option(argv, 'timeout', 30.0, float),
+        stream='--stream' in argv,
+        seed=scenario_option(argv, 'seed', 0),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,61 @@
+"""
+Shared harness for the MailoReply AI backend test suites.
+"""
+
+from .base import TesterBase, scenario_option, suite_options
+from .baseline import BaselineStore, sql_revision
+from .incremental import IncrementalCache, SqlCatalog, depends_on
+from .instrumentation import (
+    Histogram,
+    InstrumentedConnection,
+    LatencyRecorder,
+    RoundTripBudgetExceeded,
+    RoundTripCounter,
+    fingerprint_sql,
+    http_trace_config,
+    url_template,
+)
+from .locks import LockSampler
+from .sinks import (
+    BufferedAsyncWriter,
+    JUnitXmlSink,
+    MemorySink,
+    MultiSink,
+    NdjsonSink,
+    ResultSink,
+    file_sinks,
+)
+from .statements import StatementStats
+from .stats import bootstrap_ratio_ci, compare_samples, measure, reject_outliers
+
+__all__ = [
+    'TesterBase',
+    'IncrementalCache',
+    'SqlCatalog',
+    'depends_on',
+    'suite_options',
+    'scenario_option',
+    'Histogram',
+    'InstrumentedConnection',
+    'LatencyRecorder',
+    'RoundTripBudgetExceeded',
+    'RoundTripCounter',
+    'fingerprint_sql',
+    'http_trace_config',
+    'url_template',
+    'LockSampler',
+    'StatementStats',
+    'BufferedAsyncWriter',
+    'JUnitXmlSink',
+    'MemorySink',
+    'MultiSink',
+    'NdjsonSink',
+    'ResultSink',
+    'file_sinks',
+    'BaselineStore',
+    'sql_revision',
+    'bootstrap_ratio_ci',
+    'compare_samples',
+    'measure',
+    'reject_outliers',
+]
@@ -0,0 +1,312 @@
+"""
+Shared plumbing for the backend test suites.
+
+Every suite keeps its own tests and summary output; TesterBase owns result
+logging and the sequential run loop so that cross-cutting behaviour (result
+sinks, incremental selection, latency instrumentation, round-trip budgets,
+lock sampling, pg_stat_statements deltas) works the same way in all of them.
+"""
+
+import inspect
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .incremental import IncrementalCache
+from .instrumentation import (
+    LatencyRecorder,
+    RoundTripBudgetExceeded,
+    RoundTripCounter,
+    current_recorder,
+    current_round_trips,
+    current_test,
+)
+from .locks import LockSampler
+from .statements import StatementStats, merge_statement_deltas, print_statement_deltas
+from .sinks import MemorySink, ResultSink, file_sinks
+
+
+def suite_options(argv: List[str]) -> Dict:
+    """Translate suite command-line flags into TesterBase keyword arguments"""
+    options = {
+        'incremental': '--incremental' in argv,
+        'results_dir': os.environ.get('HARNESS_RESULTS_DIR'),
+        'retries': 0,
+        'lock_sample_interval': None,
+        'statement_stats': '--pg-stat-statements' in argv
+    }
+    for arg in argv:
+        if arg.startswith('--results-dir='):
+            options['results_dir'] = arg.split('=', 1)[1]
+        elif arg.startswith('--retries='):
+            options['retries'] = int(arg.split('=', 1)[1])
+        elif arg == '--lock-sampler':
+            options['lock_sample_interval'] = 0.1
+        elif arg.startswith('--lock-sampler='):
+            options['lock_sample_interval'] = int(arg.split('=', 1)[1]) / 1000
+    return options
+
+
+def scenario_option(argv: List[str], name: str, default, cast: Callable = int):
+    """Value of a scenario-specific --name=value flag, or default"""
+    prefix = f"--{name}="
+    for arg in argv:
+        if arg.startswith(prefix):
+            return cast(arg[len(prefix):])
+    return default
+
+
+class TesterBase:
+    # Scenario scripts run themselves; keep pytest from collecting them
+    __test__ = False
+    # Namespace for cached and persisted results; defaults to the class name
+    suite_name: Optional[str] = None
+    # Extra values folded into every input digest (e.g. the target database)
+    incremental_context: Dict = {}
+    # Database for the harness's own connections (lock sampler, pg_stat_statements);
+    # suites that connect elsewhere than harness.config.db_config() set their own
+    db_options: Optional[Dict] = None
+
+    def __init__(self, incremental: bool = False, results_dir: Optional[str] = None,
+                 result_sink: Optional[ResultSink] = None, retries: int = 0,
+                 lock_sample_interval: Optional[float] = None, statement_stats: bool = False):
+        self.suite = self.suite_name or type(self).__name__
+        self.run_id = os.environ.get('HARNESS_RUN_ID') or uuid.uuid4().hex
+        self.host = socket.gethostname()
+        self.retries = retries
+
+        if result_sink is not None:
+            self.result_sink = result_sink
+        elif results_dir:
+            self.result_sink = file_sinks(results_dir, self.suite, self.run_id, self.host)
+        else:
+            self.result_sink = MemorySink()
+
+        self.incremental = None
+        if incremental:
+            self.incremental = IncrementalCache(self.suite, context=self.incremental_context)
+
+        self.latency = LatencyRecorder()
+        self.lock_sample_interval = lock_sample_interval
+        self.lock_sampler: Optional[LockSampler] = None
+        self.statement_stats = StatementStats(self.db_options) if statement_stats else None
+        self.statement_deltas: List[Dict] = []
+
+        self.current_test: Optional[str] = None
+        self.current_attempt = 1
+        self._test_started: Optional[float] = None
+        self._round_trips: List[Dict] = []
+        # Records held back until the attempt's server-side deltas are known
+        self._pending_records: Optional[List[Dict]] = None
+
+    @property
+    def test_results(self) -> List[Dict]:
+        """Records kept in memory; empty when results are streamed to files"""
+        return getattr(self.result_sink, 'records', [])
+
+    def _result_record(self, test_name: str, success: bool, message: str, details: Optional[Dict]) -> Dict:
+        duration_ms = None
+        if self._test_started is not None:
+            duration_ms = round((time.perf_counter() - self._test_started) * 1000, 3)
+        return {
+            'run_id': self.run_id,
+            'host': self.host,
+            'suite': self.suite,
+            'test_id': self.current_test,
+            'test': test_name,
+            'attempt': self.current_attempt,
+            'success': success,
+            'message': message,
+            'details': details or {},
+            'duration_ms': duration_ms,
+            'calls': self.latency.summary(self.current_test, kinds=['db', 'http']) if self.current_test else [],
+            'round_trips': list(self._round_trips),
+            'locks': self.lock_sampler.summary(self.current_test) if self.lock_sampler and self.current_test else None,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def _emit(self, record: Dict):
+        if self._pending_records is not None:
+            self._pending_records.append(record)
+        else:
+            self.result_sink.emit(record)
+
+    def log_test_result(self, test_name: str, success: bool, message: str, details: Dict = None):
+        """Log test result"""
+        self._emit(self._result_record(test_name, success, message, details))
+
+        status = "✅" if success else "❌"
+        print(f"{status} {test_name}: {message}")
+
+        if details and not success:
+            print(f"   Details: {details}")
+
+    def log_cached_result(self, test_name: str, entry: Dict):
+        """Log a test skipped because its inputs are unchanged since its last green run"""
+        record = self._result_record(
+            test_name,
+            True,
+            f"Inputs unchanged since {entry['passed_at']}",
+            {'digest': entry['digest']}
+        )
+        record['cached'] = True
+        self.result_sink.emit(record)
+
+        print(f"⏭️ {test_name}: cached (inputs unchanged since {entry['passed_at']})")
+
+    @contextmanager
+    def round_trip_budget(self, label: str, max_round_trips: Optional[int] = None, max_db: Optional[int] = None,
+                          max_http: Optional[int] = None, fail_on_repeats: bool = False):
+        """
+        Count DB and HTTP round trips made inside the block. Repeated identical
+        statements are reported as N+1 patterns; exceeding a budget (or
+        repeating a statement, with fail_on_repeats) raises
+        RoundTripBudgetExceeded when the block completes.
+        """
+        counter = RoundTripCounter(label, max_round_trips=max_round_trips, max_db=max_db,
+                                   max_http=max_http, fail_on_repeats=fail_on_repeats)
+        token = current_round_trips.set(current_round_trips.get() + (counter,))
+        try:
+            yield counter
+        finally:
+            current_round_trips.reset(token)
+            self._round_trips.append(counter.summary())
+
+        for row in counter.repeated():
+            print(f"🔂 N+1 in {label}: {row['count']}x {row['kind']} {row['statement'][:100]}")
+
+        violations = counter.violations()
+        if violations:
+            print(f"❌ Round-trip budget exceeded in {label}: {'; '.join(violations)}")
+            raise RoundTripBudgetExceeded(f"{label}: {'; '.join(violations)}")
+
+    async def _run_one(self, test: Callable) -> bool:
+        try:
+            result = test()
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            print(f"❌ Test {test.__name__} crashed: {e}")
+            self._emit(self._result_record(
+                test.__name__, False, f"Test crashed: {e}", {'exception': type(e).__name__}
+            ))
+            result = False
+        return bool(result)
+
+    async def _statement_snapshot(self):
+        if not self.statement_stats:
+            return None
+        try:
+            snapshot = await self.statement_stats.snapshot()
+        except Exception as e:
+            print(f"⚠️ pg_stat_statements snapshot failed: {e}")
+            return None
+        self._pending_records = []
+        return snapshot
+
+    async def _flush_with_statement_deltas(self, before):
+        """Attach the attempt's pg_stat_statements deltas to its records and emit them"""
+        if self._pending_records is None:
+            return
+        records, self._pending_records = self._pending_records, None
+        try:
+            deltas = StatementStats.diff(before, await self.statement_stats.snapshot())
+        except Exception as e:
+            print(f"⚠️ pg_stat_statements snapshot failed: {e}")
+            deltas = None
+        if deltas:
+            for delta in deltas:
+                delta['test'] = self.current_test
+            self.statement_deltas.extend(deltas)
+        for record in records:
+            record['statements'] = deltas
+            self.result_sink.emit(record)
+
+    async def run_tests(self, tests: List[Callable]) -> Tuple[int, int, int]:
+        """Run tests in sequence, returning (passed, failed, cached) counts"""
+        passed = 0
+        failed = 0
+        cached = 0
+        recorder_token = current_recorder.set(self.latency)
+
+        if self.lock_sample_interval:
+            sampler = LockSampler(self.lock_sample_interval, connect_options=self.db_options,
+                                  label=lambda: self.current_test)
+            try:
+                await sampler.start()
+                self.lock_sampler = sampler
+            except Exception as e:
+                print(f"⚠️ Lock sampler unavailable: {e}")
+
+        if self.statement_stats:
+            try:
+                await self.statement_stats.start()
+            except Exception as e:
+                print(f"⚠️ pg_stat_statements unavailable: {e}")
+                self.statement_stats = None
+
+        for test in tests:
+            self.current_test = test.__name__
+            self.current_attempt = 1
+            self._test_started = None
+            test_token = current_test.set(test.__name__)
+
+            digest = self.incremental.digest(test) if self.incremental else None
+            entry = self.incremental.lookup(test.__name__, digest) if self.incremental else None
+
+            if entry:
+                self.log_cached_result(test.__name__, entry)
+                cached += 1
+                current_test.reset(test_token)
+                print()
+                continue
+
+            while True:
+                self._test_started = time.perf_counter()
+                self._round_trips = []
+                snapshot = await self._statement_snapshot()
+                result = await self._run_one(test)
+                self.latency.record(
+                    'test', test.__name__, 'passed' if result else 'failed',
+                    (time.perf_counter() - self._test_started) * 1000
+                )
+                await self._flush_with_statement_deltas(snapshot)
+                if result or self.current_attempt > self.retries:
+                    break
+                self.current_attempt += 1
+                print(f"🔁 Retrying {test.__name__} (attempt {self.current_attempt})")
+
+            if result:
+                passed += 1
+            else:
+                failed += 1
+
+            if self.incremental:
+                self.incremental.record(test.__name__, digest, result)
+
+            current_test.reset(test_token)
+            print()  # Add spacing between tests
+
+        current_recorder.reset(recorder_token)
+        self.current_test = None
+        self._test_started = None
+        self.latency.print_summary()
+
+        if self.lock_sampler:
+            await self.lock_sampler.stop()
+            self.lock_sampler.print_summary()
+
+        if self.statement_stats:
+            await self.statement_stats.stop()
+            print_statement_deltas(merge_statement_deltas(self.statement_deltas))
+
+        if self.incremental:
+            self.incremental.save()
+
+        await self.result_sink.close()
+
+        return passed, failed, cached
@@ -0,0 +1,220 @@
+"""
+Benchmark baseline store and regression gate.
+
+Runs are kept in a local SQLite database, keyed by scenario, dataset scale and
+the git revision of the SQL files (suffixed with a content hash when the SQL
+has uncommitted changes). ``compare`` times the current tree and checks it
+against the most recent run from another revision:
+
+    python -m harness.baseline run get_company_users --scale 1000
+    python -m harness.baseline compare get_company_users --scale 1000
+    python -m harness.baseline list
+
+compare exits 1 when the slowdown is significant, 0 otherwise.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import socket
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .incremental import REPO_ROOT
+from .stats import compare_samples
+
+DB_PATH = REPO_ROOT / '.harness' / 'baselines.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS benchmark_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scenario TEXT NOT NULL,
+    scale INTEGER NOT NULL,
+    sql_revision TEXT NOT NULL,
+    host TEXT,
+    calls_per_trial INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_benchmark_runs_key
+    ON benchmark_runs (scenario, scale, sql_revision, id);
+CREATE TABLE IF NOT EXISTS benchmark_samples (
+    run_id INTEGER NOT NULL REFERENCES benchmark_runs(id) ON DELETE CASCADE,
+    trial INTEGER NOT NULL,
+    value_ms REAL NOT NULL,
+    PRIMARY KEY (run_id, trial)
+);
+"""
+
+
+def _git(root: Path, *args) -> str:
+    return subprocess.run(
+        ['git', *args], cwd=root, capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def sql_revision(root: Path = REPO_ROOT) -> str:
+    """Last commit touching *.sql, plus a content hash if the SQL is modified or untracked"""
+    try:
+        revision = _git(root, 'log', '-1', '--format=%h', '--', '*.sql')
+        dirty = _git(root, 'status', '--porcelain', '--', '*.sql')
+    except (OSError, subprocess.CalledProcessError):
+        revision, dirty = '', 'no git'
+
+    if revision and not dirty:
+        return revision
+
+    digest = hashlib.sha256()
+    for path in sorted(root.rglob('*.sql')):
+        if 'node_modules' in path.parts:
+            continue
+        digest.update(str(path.relative_to(root)).encode())
+        digest.update(path.read_bytes())
+    return f"{revision or 'untracked'}+{digest.hexdigest()[:10]}"
+
+
+class BaselineStore:
+    """SQLite store of benchmark runs and their per-trial samples"""
+
+    def __init__(self, path: Path = DB_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SCHEMA)
+
+    def record_run(self, scenario: str, scale: int, revision: str, samples: List[float],
+                   calls_per_trial: int, host: Optional[str] = None) -> int:
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO benchmark_runs (scenario, scale, sql_revision, host, calls_per_trial, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scenario, scale, revision, host or socket.gethostname(), calls_per_trial,
+                 datetime.now().isoformat())
+            )
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO benchmark_samples (run_id, trial, value_ms) VALUES (?, ?, ?)",
+                [(run_id, trial, value) for trial, value in enumerate(samples)]
+            )
+        return run_id
+
+    def latest_run(self, scenario: str, scale: int, revision: Optional[str] = None,
+                   exclude_revision: Optional[str] = None) -> Optional[Tuple[Dict, List[float]]]:
+        """Most recent run for (scenario, scale), optionally pinned to or excluding a revision"""
+        query = "SELECT * FROM benchmark_runs WHERE scenario = ? AND scale = ?"
+        params: list = [scenario, scale]
+        if revision is not None:
+            query += " AND sql_revision = ?"
+            params.append(revision)
+        if exclude_revision is not None:
+            query += " AND sql_revision != ?"
+            params.append(exclude_revision)
+        query += " ORDER BY id DESC LIMIT 1"
+
+        self.conn.row_factory = sqlite3.Row
+        row = self.conn.execute(query, params).fetchone()
+        self.conn.row_factory = None
+        if row is None:
+            return None
+        samples = [value for (value,) in self.conn.execute(
+            "SELECT value_ms FROM benchmark_samples WHERE run_id = ? ORDER BY trial", (row['id'],)
+        )]
+        return dict(row), samples
+
+    def runs(self) -> List[Tuple]:
+        return self.conn.execute("""
+            SELECT r.id, r.scenario, r.scale, r.sql_revision, r.created_at, COUNT(s.trial)
+            FROM benchmark_runs r LEFT JOIN benchmark_samples s ON s.run_id = r.id
+            GROUP BY r.id ORDER BY r.scenario, r.scale, r.id
+        """).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def _run_and_record(store: BaselineStore, args, revision: str) -> List[float]:
+    from .benchmarks import run_scenario
+
+    print(f"🔍 {args.scenario} @ scale {args.scale}: {args.trials} trials x {args.calls} calls (SQL {revision})")
+    samples = asyncio.run(run_scenario(
+        args.scenario, args.scale, trials=args.trials, warmup=args.warmup, calls_per_trial=args.calls
+    ))
+    run_id = store.record_run(args.scenario, args.scale, revision, samples, args.calls)
+    ordered = sorted(samples)
+    print(f"✅ Recorded run {run_id}: median {ordered[len(ordered) // 2]:.3f} ms/call, "
+          f"min {ordered[0]:.3f}, max {ordered[-1]:.3f}")
+    return samples
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m harness.baseline', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', type=Path, default=DB_PATH, help='baseline store location')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('run', 'compare'):
+        command = commands.add_parser(name)
+        command.add_argument('scenario')
+        command.add_argument('--scale', type=int, default=1000)
+        command.add_argument('--trials', type=int, default=30)
+        command.add_argument('--warmup', type=int, default=2)
+        command.add_argument('--calls', type=int, default=10, help='calls per trial')
+    compare = commands.choices['compare']
+    compare.add_argument('--baseline-rev', help='SQL revision to compare against (default: latest other revision)')
+    compare.add_argument('--threshold', type=float, default=0.05, help='relative slowdown tolerated (default 0.05)')
+    compare.add_argument('--confidence', type=float, default=0.95)
+    compare.add_argument('--no-run', action='store_true', help='compare the latest stored run instead of timing now')
+    commands.add_parser('list')
+
+    args = parser.parse_args(argv)
+    store = BaselineStore(args.db)
+    try:
+        if args.command == 'list':
+            for run_id, scenario, scale, revision, created_at, trials in store.runs():
+                print(f"{run_id:>5}  {scenario:<24} scale {scale:<8} SQL {revision:<22} {trials:>3} trials  {created_at}")
+            return 0
+
+        revision = sql_revision()
+        if args.command == 'run':
+            _run_and_record(store, args, revision)
+            return 0
+
+        baseline = store.latest_run(args.scenario, args.scale, revision=args.baseline_rev,
+                                    exclude_revision=None if args.baseline_rev else revision)
+        if baseline is None:
+            print(f"⚠️ No baseline for {args.scenario} @ scale {args.scale}; "
+                  f"record one with: python -m harness.baseline run {args.scenario} --scale {args.scale}")
+            return 0
+
+        if args.no_run:
+            candidate = store.latest_run(args.scenario, args.scale, revision=revision)
+            if candidate is None:
+                print(f"❌ No stored run for SQL {revision}")
+                return 2
+            candidate_samples = candidate[1]
+        else:
+            candidate_samples = _run_and_record(store, args, revision)
+
+        result = compare_samples(baseline[1], candidate_samples,
+                                 threshold=args.threshold, confidence=args.confidence)
+        print(f"📊 {args.scenario} @ scale {args.scale}: SQL {baseline[0]['sql_revision']} -> {revision}")
+        print(f"   median {result['baseline_median_ms']:.3f} ms -> {result['candidate_median_ms']:.3f} ms "
+              f"(x{result['ratio']:.3f}, {result['confidence']:.0%} CI x{result['ci_low']:.3f}..x{result['ci_high']:.3f})")
+        print(f"   outliers rejected: {result['baseline_outliers']} baseline, {result['candidate_outliers']} candidate")
+
+        if result['verdict'] == 'regression':
+            print(f"❌ Regression: slower by more than {result['threshold']:.0%} with {result['confidence']:.0%} confidence")
+            return 1
+        if result['verdict'] == 'improvement':
+            print("✅ Improvement")
+        else:
+            print("✅ No significant change")
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
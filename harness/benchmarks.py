@@ -0,0 +1,70 @@
+"""
+Benchmark scenarios for the baseline store.
+
+A scenario seeds its data at a given scale and returns the coroutine to time.
+Everything runs in one transaction that is rolled back afterwards, so
+scenarios can be pointed at a shared database without leaving rows behind.
+"""
+
+import itertools
+from typing import Awaitable, Callable, Dict, List
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import db_config
+from .fixtures import seed_company, seed_users
+from .stats import measure
+
+Scenario = Callable[..., Awaitable[Callable[[], Awaitable]]]
+
+SCENARIOS: Dict[str, Scenario] = {}
+
+
+def scenario(name: str):
+    """Register a scenario under `name`"""
+    def decorator(func: Scenario) -> Scenario:
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+@scenario('get_company_users')
+async def get_company_users_scenario(conn, scale: int):
+    """Manager listing a company of `scale` members with two devices each"""
+    company = await seed_company(conn, users=scale, devices_per_user=2)
+    manager_id = company['manager_id']
+
+    async def call():
+        await conn.fetch("SELECT * FROM public.get_company_users($1)", manager_id)
+    return call
+
+
+@scenario('can_user_generate')
+async def can_user_generate_scenario(conn, scale: int):
+    """Quota check for free users, rotating over a table of `scale` users"""
+    user_ids = await seed_users(conn, scale, role='free')
+    rotation = itertools.cycle(user_ids)
+
+    async def call():
+        await conn.fetchval("SELECT public.can_user_generate($1)", next(rotation))
+    return call
+
+
+async def run_scenario(name: str, scale: int, trials: int = 30, warmup: int = 2,
+                       calls_per_trial: int = 10) -> List[float]:
+    """Seed and time scenario `name` inside a rolled-back transaction"""
+    if name not in SCENARIOS:
+        raise KeyError(f"Unknown scenario {name!r} (known: {', '.join(sorted(SCENARIOS))})")
+
+    conn = await asyncpg.connect(**db_config())
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        call = await SCENARIOS[name](conn, scale)
+        return await measure(call, trials, warmup=warmup, calls_per_trial=calls_per_trial)
+    finally:
+        await transaction.rollback()
+        await conn.close()
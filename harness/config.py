@@ -0,0 +1,21 @@
+"""
+Database settings for harness scenarios and benchmarks.
+
+Read from the same variables as .env (DB_HOST, DB_PORT, DB_NAME, DB_USER and
+DB_PASSWORD or DB_SCHEMA_PASSWORD), defaulting to the project database the
+suites target.
+"""
+
+import os
+from typing import Dict
+
+
+def db_config() -> Dict:
+    """Keyword arguments for asyncpg.connect / asyncpg.create_pool"""
+    return {
+        'host': os.environ.get('DB_HOST', 'db.wacuqgyyctatwnbemkyx.supabase.co'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME', 'postgres'),
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'password': os.environ.get('DB_PASSWORD') or os.environ.get('DB_SCHEMA_PASSWORD')
+    }
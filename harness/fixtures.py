@@ -0,0 +1,88 @@
+"""
+Synthetic data for scenarios and benchmarks.
+
+Rows follow the shape the suites insert by hand (an enterprise company, an
+enterprise_manager, members with devices) but are generated set-based with
+generate_series so large scales seed in a single round trip. Scenarios usually
+seed inside a transaction they roll back, which leaves nothing to clean up.
+
+direct_generate replays the client's own generation path, for the suites that
+compare it with services/gateway.py.
+"""
+
+import uuid
+from typing import Dict, List
+
+
+async def seed_company(conn, users: int, max_users: int = None, devices_per_user: int = 1,
+                       role: str = 'enterprise_user') -> Dict:
+    """Create a company, its manager and `users` members with devices"""
+    tag = uuid.uuid4().hex[:8]
+    company_id = uuid.uuid4()
+    manager_id = uuid.uuid4()
+
+    await conn.execute("""
+        INSERT INTO companies (id, name, plan, max_users, current_users, status)
+        VALUES ($1, $2, 'enterprise', $3, $4, 'active')
+    """, company_id, f"Bench Corp {tag}", max_users if max_users is not None else users + 1, users + 1)
+
+    await conn.execute("""
+        INSERT INTO users (id, name, email, role, company_id, status)
+        VALUES ($1, $2, $3, 'enterprise_manager', $4, 'active')
+    """, manager_id, f"Bench Manager {tag}", f"manager-{tag}@bench.test", company_id)
+
+    member_ids = await seed_users(conn, users, role=role, company_id=company_id, tag=tag)
+
+    if devices_per_user:
+        await seed_devices(conn, member_ids, devices_per_user)
+
+    return {
+        'tag': tag,
+        'company_id': company_id,
+        'manager_id': manager_id,
+        'user_ids': member_ids
+    }
+
+
+async def seed_users(conn, count: int, role: str = 'free', company_id=None, tag: str = None) -> List[uuid.UUID]:
+    """Insert `count` users and return their ids"""
+    tag = tag or uuid.uuid4().hex[:8]
+    rows = await conn.fetch("""
+        INSERT INTO users (id, name, email, role, company_id, status)
+        SELECT gen_random_uuid(), 'Bench User ' || g, 'user-' || $1 || '-' || g || '@bench.test',
+               $2::user_role, $3, 'active'
+        FROM generate_series(1, $4) g
+        RETURNING id
+    """, tag, role, company_id, count)
+    return [row['id'] for row in rows]
+
+
+async def seed_devices(conn, user_ids: List[uuid.UUID], devices_per_user: int = 1):
+    """Register devices (fingerprints fp-1..fp-N) with last_active spread over a week"""
+    await conn.execute("""
+        INSERT INTO user_devices (user_id, device_fingerprint, device_name, last_active)
+        SELECT u, 'fp-' || d, 'Bench Device ' || d, NOW() - random() * INTERVAL '7 days'
+        FROM unnest($1::uuid[]) u
+        CROSS JOIN generate_series(1, $2) d
+    """, user_ids, devices_per_user)
+
+
+async def direct_generate(pool, n8n, user_id, request: Dict) -> Dict:
+    """The client's path: two checks before the webhook, two writes after it"""
+    async with pool.acquire() as conn:
+        role = await conn.fetchval("SELECT role::text FROM public.users WHERE id = $1", user_id)
+        if role not in ('superuser', 'pro_plus'):
+            if not await conn.fetchval("SELECT public.can_user_generate($1)", user_id):
+                return {'success': False, 'error': 'Usage limit reached'}
+    response = await n8n.generate(request)
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO public.ai_generations (user_id, source, generation_type, language, tone, intent,
+                                               input_length, encrypted, success, error_message)
+            VALUES ($1, $2::generation_source, $3, $4, $5, $6, $7, $8, $9, $10)
+        """, user_id, request['source'], request['generationType'], request['language'], request['tone'],
+            request.get('intent'), len(request.get('originalMessage') or request.get('prompt') or ''),
+            request['encrypted'], response['success'], response.get('error'))
+        if response['success']:
+            await conn.execute("SELECT public.increment_user_usage($1)", user_id)
+    return response
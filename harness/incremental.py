@@ -0,0 +1,245 @@
+"""
+Content-hash incremental test selection.
+
+Tests declare the repository files, database tables and RPC functions they
+exercise with ``@depends_on``. Tables and RPCs are resolved to the DDL
+statements that define them in the repo's *.sql files, so editing an unrelated
+function in the same file does not invalidate a test. When the digest of a
+test's inputs (plus its own source) matches the digest recorded at its last
+green run, the runner skips it and reports it as cached.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CACHE_PATH = REPO_ROOT / '.harness' / 'incremental.json'
+
+_NAME = r'(?:public\.)?"?(\w+)"?'
+_DOLLAR_TAG = re.compile(r'\$\w*\$')
+
+_FUNCTION_PATTERNS = [
+    re.compile(r'^CREATE\s+(?:OR\s+REPLACE\s+)?FUNCTION\s+' + _NAME, re.I),
+    re.compile(r'^DROP\s+FUNCTION\s+(?:IF\s+EXISTS\s+)?' + _NAME, re.I),
+    re.compile(r'^GRANT\s+.*?\bON\s+FUNCTION\s+' + _NAME, re.I | re.S),
+    re.compile(r'^COMMENT\s+ON\s+FUNCTION\s+' + _NAME, re.I),
+]
+
+_TABLE_PATTERNS = [
+    re.compile(r'^CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + _NAME, re.I),
+    re.compile(r'^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?' + _NAME, re.I),
+    re.compile(r'^DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?' + _NAME, re.I),
+    re.compile(r'^COMMENT\s+ON\s+TABLE\s+' + _NAME, re.I),
+    re.compile(r'^(?:CREATE|DROP)\s+(?:POLICY|TRIGGER)\s+.*?\bON\s+' + _NAME, re.I | re.S),
+]
+
+# Index DDL is also wrapped in DO blocks (see supabase_stripe_schema_compatible.sql)
+_INDEX_PATTERN = re.compile(r'\bINDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?\w*\s*ON\s+(?:ONLY\s+)?' + _NAME, re.I)
+_TRIGGER_FUNCTION = re.compile(r'\bEXECUTE\s+(?:FUNCTION|PROCEDURE)\s+' + _NAME, re.I)
+
+
+def depends_on(files: Iterable[str] = (), tables: Iterable[str] = (), rpcs: Iterable[str] = ()):
+    """Declare the inputs a test exercises so it can be selected incrementally"""
+    def decorator(func):
+        func.test_inputs = {
+            'files': tuple(files),
+            'tables': tuple(tables),
+            'rpcs': tuple(rpcs)
+        }
+        return func
+    return decorator
+
+
+def split_sql_statements(sql: str) -> List[str]:
+    """Split a SQL script on top-level semicolons, respecting quotes and $$ bodies"""
+    statements = []
+    buf = []
+    i = 0
+    n = len(sql)
+    dollar_tag = None
+    in_quote = False
+
+    while i < n:
+        ch = sql[i]
+        if dollar_tag:
+            if sql.startswith(dollar_tag, i):
+                buf.append(dollar_tag)
+                i += len(dollar_tag)
+                dollar_tag = None
+                continue
+        elif in_quote:
+            if ch == "'":
+                in_quote = False
+        elif ch == "'":
+            in_quote = True
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = n if end == -1 else end
+            buf.append(sql[i:end])
+            i = end
+            continue
+        elif ch == '$':
+            match = _DOLLAR_TAG.match(sql, i)
+            if match:
+                dollar_tag = match.group()
+                buf.append(dollar_tag)
+                i += len(dollar_tag)
+                continue
+        elif ch == ';':
+            statement = _strip_leading_comments(''.join(buf))
+            if statement:
+                statements.append(statement)
+            buf = []
+            i += 1
+            continue
+
+        buf.append(ch)
+        i += 1
+
+    statement = _strip_leading_comments(''.join(buf))
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def _strip_leading_comments(statement: str) -> str:
+    lines = statement.strip().splitlines()
+    while lines and (not lines[0].strip() or lines[0].strip().startswith('--')):
+        lines.pop(0)
+    return '\n'.join(lines).strip()
+
+
+class SqlCatalog:
+    """Index of the DDL statements in the repo's SQL files by table and function name"""
+
+    def __init__(self, root: Path = REPO_ROOT):
+        self.tables: Dict[str, List[str]] = {}
+        self.functions: Dict[str, List[str]] = {}
+        self.trigger_functions: Dict[str, set] = {}
+
+        for path in sorted(root.glob('*.sql')):
+            for statement in split_sql_statements(path.read_text()):
+                self._index(path.name, statement)
+
+    def _index(self, filename: str, statement: str):
+        tagged = f"-- {filename}\n{statement}"
+
+        for pattern in _FUNCTION_PATTERNS:
+            match = pattern.match(statement)
+            if match:
+                self.functions.setdefault(match.group(1).lower(), []).append(tagged)
+                return
+
+        table_names = set()
+        for pattern in _TABLE_PATTERNS:
+            match = pattern.match(statement)
+            if match:
+                table_names.add(match.group(1).lower())
+                break
+
+        if statement[:2].upper() == 'DO' or statement.upper().startswith('CREATE'):
+            table_names.update(m.group(1).lower() for m in _INDEX_PATTERN.finditer(statement))
+
+        for table in table_names:
+            self.tables.setdefault(table, []).append(tagged)
+            trigger = _TRIGGER_FUNCTION.search(statement)
+            if trigger and re.match(r'^CREATE\s+TRIGGER', statement, re.I):
+                self.trigger_functions.setdefault(table, set()).add(trigger.group(1).lower())
+
+    def table_statements(self, name: str) -> List[str]:
+        """DDL for a table, including the bodies of functions its triggers execute"""
+        name = name.lower()
+        statements = list(self.tables.get(name, []))
+        for function in sorted(self.trigger_functions.get(name, ())):
+            statements.extend(self.functions.get(function, []))
+        return statements
+
+    def function_statements(self, name: str) -> List[str]:
+        return list(self.functions.get(name.lower(), []))
+
+
+class IncrementalCache:
+    """Per-suite record of the input digest at each test's last green run"""
+
+    def __init__(self, suite: str, path: Path = CACHE_PATH, root: Path = REPO_ROOT,
+                 context: Optional[Dict] = None):
+        self.suite = suite
+        self.path = Path(path)
+        self.root = Path(root)
+        self.context = context or {}
+        self._catalog = None
+        self._entries = self._load().get(suite, {})
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def catalog(self) -> SqlCatalog:
+        if self._catalog is None:
+            self._catalog = SqlCatalog(self.root)
+        return self._catalog
+
+    def digest(self, test) -> Optional[str]:
+        """Hash of everything a test depends on, or None if it declares no inputs"""
+        inputs = getattr(test, 'test_inputs', None)
+        if inputs is None:
+            return None
+
+        h = hashlib.sha256()
+        h.update(inspect.getsource(test).encode())
+        h.update(json.dumps(self.context, sort_keys=True, default=str).encode())
+
+        for rel_path in sorted(set(inputs['files'])):
+            path = self.root / rel_path
+            h.update(f"\0file:{rel_path}\0".encode())
+            h.update(path.read_bytes() if path.exists() else b'<missing>')
+
+        for table in sorted(set(inputs['tables'])):
+            h.update(f"\0table:{table}\0".encode())
+            for statement in self.catalog.table_statements(table):
+                h.update(statement.encode())
+
+        for rpc in sorted(set(inputs['rpcs'])):
+            h.update(f"\0rpc:{rpc}\0".encode())
+            for statement in self.catalog.function_statements(rpc):
+                h.update(statement.encode())
+
+        return h.hexdigest()
+
+    def lookup(self, test_name: str, digest: Optional[str]) -> Optional[Dict]:
+        """Return the last green entry if its digest still matches"""
+        if digest is None:
+            return None
+        entry = self._entries.get(test_name)
+        if entry and entry.get('digest') == digest:
+            return entry
+        return None
+
+    def record(self, test_name: str, digest: Optional[str], success: bool):
+        if digest is not None and success:
+            self._entries[test_name] = {
+                'digest': digest,
+                'passed_at': datetime.now().isoformat()
+            }
+        else:
+            self._entries.pop(test_name, None)
+
+    def save(self):
+        """Merge this suite's entries into the cache file atomically"""
+        data = self._load()
+        data[self.suite] = self._entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,343 @@
+"""
+Per-test and per-call latency instrumentation.
+
+Database calls are timed by InstrumentedConnection, an asyncpg connection
+class passed to ``create_pool(connection_class=...)``; HTTP calls are timed by
+an aiohttp TraceConfig. Every sample is tagged with the running test (tracked
+in a context variable by TesterBase), a statement fingerprint or URL template,
+and a status, and lands in a log-bucketed histogram so long runs keep memory
+flat. The same hooks feed any active RoundTripCounter scopes.
+"""
+
+import hashlib
+import math
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    import asyncpg
+except ImportError:  # the simulated suite runs without database drivers
+    asyncpg = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+current_test: ContextVar[Optional[str]] = ContextVar('harness_current_test', default=None)
+current_recorder: ContextVar[Optional['LatencyRecorder']] = ContextVar('harness_latency_recorder', default=None)
+current_round_trips: ContextVar[Tuple['RoundTripCounter', ...]] = ContextVar('harness_round_trips', default=())
+
+_SQL_COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+_SQL_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_UUID = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
+_PATH_NUMBER = re.compile(r'(?<=/)\d+(?=/|$)')
+# Query parameters whose values are part of the request's shape, not its data
+_STRUCTURAL_PARAMS = {'select', 'order', 'grant_type', 'on_conflict', 'columns'}
+
+
+def fingerprint_sql(query: str) -> Tuple[str, str]:
+    """Normalize a statement (literals replaced, whitespace collapsed) and return (id, text)"""
+    text = _SQL_COMMENT.sub(' ', query)
+    text = _SQL_STRING.sub('?', text)
+    text = _SQL_NUMBER.sub('?', text)
+    text = _SQL_IN_LIST.sub('(?)', text)
+    text = _WHITESPACE.sub(' ', text).strip().lower()
+    return hashlib.sha1(text.encode()).hexdigest()[:12], text
+
+
+def url_template(method: str, url) -> str:
+    """Collapse ids and filter values out of a URL so calls group by endpoint"""
+    parts = urlsplit(str(url))
+    path = _PATH_NUMBER.sub('{n}', _UUID.sub('{id}', parts.path))
+
+    params = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        if key in _STRUCTURAL_PARAMS:
+            params.append(f"{key}={value}")
+        elif re.match(r'^[a-z]+\.', value):
+            # PostgREST filters (id=eq.<uuid>): keep the operator only
+            params.append(f"{key}={value.split('.', 1)[0]}.?")
+        else:
+            params.append(f"{key}=?")
+
+    template = f"{method.upper()} {parts.netloc}{path}"
+    if params:
+        template += '?' + '&'.join(params)
+    return template
+
+
+class Histogram:
+    """Log-bucketed latency histogram (~5% relative error) with exact count/sum/min/max"""
+
+    GROWTH = 1.05
+    FLOOR_MS = 0.01
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = math.inf
+        self.max_ms = 0.0
+        self.buckets: Dict[int, int] = {}
+
+    def record(self, value_ms: float):
+        self.count += 1
+        self.total_ms += value_ms
+        self.min_ms = min(self.min_ms, value_ms)
+        self.max_ms = max(self.max_ms, value_ms)
+        index = int(math.log(max(value_ms, self.FLOOR_MS) / self.FLOOR_MS, self.GROWTH))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: 'Histogram'):
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                upper = self.FLOOR_MS * self.GROWTH ** (index + 1)
+                return min(max(upper, self.min_ms), self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'min_ms': round(self.min_ms, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50), 3),
+            'p95_ms': round(self.percentile(95), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'max_ms': round(self.max_ms, 3)
+        }
+
+
+class LatencyRecorder:
+    """Histograms keyed by (test, kind, key, status)"""
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[Optional[str], str, str, str], Histogram] = {}
+        self.statements: Dict[str, str] = {}
+
+    def record(self, kind: str, key: str, status: str, duration_ms: float, test: Optional[str] = None):
+        if test is None:
+            test = current_test.get()
+        histogram_key = (test, kind, key, status)
+        histogram = self.histograms.get(histogram_key)
+        if histogram is None:
+            histogram = self.histograms[histogram_key] = Histogram()
+        histogram.record(duration_ms)
+
+    @contextmanager
+    def timed(self, kind: str, key: str):
+        """Time a block; the status is 'ok' or the exception's class name"""
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self.record(kind, key, status, (time.perf_counter() - started) * 1000)
+
+    def summary(self, test: Optional[str] = None, kinds: Optional[List[str]] = None) -> List[Dict]:
+        """Per-call histograms (optionally for one test), most expensive first"""
+        rows = []
+        for (row_test, kind, key, status), histogram in self.histograms.items():
+            if test is not None and row_test != test:
+                continue
+            if kinds is not None and kind not in kinds:
+                continue
+            row = {'test': row_test, 'kind': kind, 'key': key, 'status': status}
+            if kind == 'db':
+                row['statement'] = self.statements.get(key, '')
+            row.update(histogram.summary())
+            rows.append(row)
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+    def print_summary(self, limit: int = 10):
+        rows = self.summary(kinds=['db', 'http'])
+        if not rows:
+            return
+        print(f"⏱️ Slowest calls by total time (top {min(limit, len(rows))})")
+        for row in rows[:limit]:
+            label = row['statement'][:80] if row['kind'] == 'db' else row['key']
+            print(
+                f"   {row['total_ms']:>10.1f} ms  x{row['count']:<5} p95 {row['p95_ms']:>8.1f} ms  "
+                f"[{row['test']}] {row['kind']} {row['status']}: {label}"
+            )
+
+
+class RoundTripBudgetExceeded(AssertionError):
+    """A scoped block made more round trips than its budget allows"""
+
+
+class RoundTripCounter:
+    """
+    Round trips made inside one scoped block, by kind ('db' or 'http').
+
+    Each asyncpg call (executemany included) and each HTTP request is one
+    round trip. A statement fingerprint or URL template seen repeat_threshold
+    times or more is reported as an N+1 pattern.
+    """
+
+    def __init__(self, label: str, max_round_trips: Optional[int] = None, max_db: Optional[int] = None,
+                 max_http: Optional[int] = None, repeat_threshold: int = 2, fail_on_repeats: bool = False):
+        self.label = label
+        self.max_round_trips = max_round_trips
+        self.max_db = max_db
+        self.max_http = max_http
+        self.repeat_threshold = repeat_threshold
+        self.fail_on_repeats = fail_on_repeats
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.statements: Dict[str, str] = {}
+
+    def count(self, kind: str, key: str, text: Optional[str] = None):
+        self.counts[(kind, key)] = self.counts.get((kind, key), 0) + 1
+        if text is not None:
+            self.statements.setdefault(key, text)
+
+    def total(self, kind: Optional[str] = None) -> int:
+        return sum(n for (k, _), n in self.counts.items() if kind is None or k == kind)
+
+    def repeated(self) -> List[Dict]:
+        """Calls issued repeat_threshold times or more, most frequent first"""
+        rows = [
+            {'kind': kind, 'key': key, 'count': n, 'statement': self.statements.get(key, key)}
+            for (kind, key), n in self.counts.items() if n >= self.repeat_threshold
+        ]
+        rows.sort(key=lambda row: row['count'], reverse=True)
+        return rows
+
+    def violations(self) -> List[str]:
+        violations = []
+        for limit, kind, name in ((self.max_round_trips, None, 'round trips'),
+                                  (self.max_db, 'db', 'DB round trips'),
+                                  (self.max_http, 'http', 'HTTP round trips')):
+            if limit is not None and self.total(kind) > limit:
+                violations.append(f"{self.total(kind)} {name} (budget {limit})")
+        if self.fail_on_repeats:
+            for row in self.repeated():
+                violations.append(f"N+1: {row['count']}x {row['kind']} {row['statement'][:80]}")
+        return violations
+
+    def summary(self) -> Dict:
+        return {
+            'label': self.label,
+            'round_trips': self.total(),
+            'db': self.total('db'),
+            'http': self.total('http'),
+            'budget': {'total': self.max_round_trips, 'db': self.max_db, 'http': self.max_http},
+            'repeated': self.repeated(),
+            'violations': self.violations()
+        }
+
+
+def _count_round_trip(kind: str, key: str, text: Optional[str] = None):
+    for counter in current_round_trips.get():
+        counter.count(kind, key, text)
+
+
+def _record_statement(kind: str, query: str, started: float, status: str):
+    recorder = current_recorder.get()
+    counters = current_round_trips.get()
+    if recorder is None and not counters:
+        return
+    fingerprint, text = fingerprint_sql(query)
+    _count_round_trip(kind, fingerprint, text)
+    if recorder is None:
+        return
+    recorder.statements.setdefault(fingerprint, text)
+    recorder.record(kind, fingerprint, status, (time.perf_counter() - started) * 1000)
+
+
+if asyncpg is not None:
+
+    class InstrumentedConnection(asyncpg.Connection):
+        """asyncpg connection that times every statement into the active recorder"""
+
+        async def _timed(self, method, query, *args, **kwargs):
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                return await method(query, *args, **kwargs)
+            except BaseException as e:
+                status = type(e).__name__
+                raise
+            finally:
+                _record_statement('db', query, started, status)
+
+        async def execute(self, query, *args, **kwargs):
+            return await self._timed(super().execute, query, *args, **kwargs)
+
+        async def executemany(self, command, args, **kwargs):
+            return await self._timed(super().executemany, command, args, **kwargs)
+
+        async def fetch(self, query, *args, **kwargs):
+            return await self._timed(super().fetch, query, *args, **kwargs)
+
+        async def fetchval(self, query, *args, **kwargs):
+            return await self._timed(super().fetchval, query, *args, **kwargs)
+
+        async def fetchrow(self, query, *args, **kwargs):
+            return await self._timed(super().fetchrow, query, *args, **kwargs)
+
+        async def fetchmany(self, query, args, **kwargs):
+            return await self._timed(super().fetchmany, query, args, **kwargs)
+
+else:
+    InstrumentedConnection = None
+
+
+def http_trace_config():
+    """aiohttp TraceConfig that times every request (up to response headers) into the active recorder"""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        _count_round_trip('http', url_template(params.method, params.url))
+        recorder = current_recorder.get()
+        if recorder is not None:
+            recorder.record(
+                'http',
+                url_template(params.method, params.url),
+                str(params.response.status),
+                (time.perf_counter() - context.started) * 1000
+            )
+
+    async def on_request_exception(session, context, params):
+        _count_round_trip('http', url_template(params.method, params.url))
+        recorder = current_recorder.get()
+        if recorder is not None:
+            recorder.record(
+                'http',
+                url_template(params.method, params.url),
+                type(params.exception).__name__,
+                (time.perf_counter() - context.started) * 1000
+            )
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
@@ -0,0 +1,197 @@
+"""
+Background sampler for Postgres lock waits and wait events.
+
+LockSampler polls pg_stat_activity, pg_locks and pg_blocking_pids() on its own
+connection while tests or load scenarios run. Time a backend spends waiting on
+a heavyweight lock is attributed to the fingerprint of the statement it was
+running, the fingerprint of the statement that blocks it and the relation
+involved, so a stall reads as "accept_invitation waited 840 ms on
+public.companies behind invite_enterprise_user" rather than as a higher p99.
+Full blocking chains (root blocker first) are kept with their sample counts.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import db_config
+from .instrumentation import fingerprint_sql
+
+SAMPLE_QUERY = """
+SELECT a.pid,
+       a.state,
+       a.wait_event_type,
+       a.wait_event,
+       a.query,
+       pg_blocking_pids(a.pid) AS blocked_by,
+       (SELECT l.relation::regclass::text FROM pg_locks l
+         WHERE l.pid = a.pid AND l.relation IS NOT NULL AND (NOT l.granted OR l.locktype = 'tuple')
+         ORDER BY l.granted LIMIT 1) AS relation,
+       (SELECT l.locktype || ':' || l.mode FROM pg_locks l
+         WHERE l.pid = a.pid AND NOT l.granted LIMIT 1) AS waiting_for
+FROM pg_stat_activity a
+WHERE a.pid <> pg_backend_pid()
+  AND a.datname = current_database()
+  AND a.backend_type = 'client backend'
+  AND a.state <> 'idle'
+"""
+
+
+class LockSampler:
+    """Poll lock and wait-event state every `interval` seconds on a dedicated connection"""
+
+    def __init__(self, interval: float = 0.1, connect_options: Optional[Dict] = None,
+                 label: Optional[Callable[[], Optional[str]]] = None):
+        self.interval = interval
+        self.connect_options = connect_options or db_config()
+        self.label = label or (lambda: None)
+        self.samples = 0
+        self.statements: Dict[str, str] = {}
+        # (label, waiter fingerprint, blocker fingerprint, relation, waiting_for) -> ms blocked
+        self.blocked_ms: Dict[Tuple, float] = {}
+        # (label, wait_event_type, wait_event, fingerprint) -> samples
+        self.wait_events: Dict[Tuple, int] = {}
+        # (label, fingerprints root blocker -> waiter) -> samples
+        self.chains: Dict[Tuple, int] = {}
+        self._conn = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_sample: Optional[float] = None
+
+    async def __aenter__(self) -> 'LockSampler':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        self._conn = await asyncpg.connect(
+            **self.connect_options, server_settings={'application_name': 'harness-lock-sampler'}
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _run(self):
+        while True:
+            try:
+                rows = await self._conn.fetch(SAMPLE_QUERY)
+            except (asyncpg.PostgresError, OSError) as e:
+                print(f"⚠️ Lock sampler stopped: {e}")
+                return
+            self._ingest(rows, time.perf_counter())
+            await asyncio.sleep(self.interval)
+
+    def _fingerprint(self, query: Optional[str]) -> str:
+        if not query:
+            return '-'
+        fingerprint, text = fingerprint_sql(query)
+        self.statements.setdefault(fingerprint, text)
+        return fingerprint
+
+    def _ingest(self, rows, now: float):
+        # Credit each waiting backend with the time since the previous sample
+        elapsed_ms = (now - self._last_sample) * 1000 if self._last_sample is not None else self.interval * 1000
+        self._last_sample = now
+        self.samples += 1
+        label = self.label()
+
+        backends = {row['pid']: row for row in rows}
+        fingerprints = {pid: self._fingerprint(row['query']) for pid, row in backends.items()}
+
+        for pid, row in backends.items():
+            if row['wait_event_type']:
+                key = (label, row['wait_event_type'], row['wait_event'], fingerprints[pid])
+                self.wait_events[key] = self.wait_events.get(key, 0) + 1
+
+            blocked_by = row['blocked_by'] or []
+            for blocker in blocked_by:
+                key = (label, fingerprints[pid], fingerprints.get(blocker, '-'), row['relation'], row['waiting_for'])
+                self.blocked_ms[key] = self.blocked_ms.get(key, 0.0) + elapsed_ms / len(blocked_by)
+
+            # Chains end at backends nobody waits on
+            if blocked_by and not any(pid in (other['blocked_by'] or []) for other in rows):
+                chain = self._chain(pid, backends, fingerprints)
+                self.chains[(label, chain)] = self.chains.get((label, chain), 0) + 1
+
+    def _chain(self, pid: int, backends: Dict, fingerprints: Dict) -> Tuple[str, ...]:
+        """Fingerprints from the root blocker down to `pid`, following the first blocker"""
+        chain = [fingerprints[pid]]
+        seen = {pid}
+        current = backends[pid]
+        while current['blocked_by']:
+            blocker = current['blocked_by'][0]
+            if blocker in seen:
+                chain.append('(deadlock)')
+                break
+            seen.add(blocker)
+            chain.append(fingerprints.get(blocker, '-'))
+            if blocker not in backends:
+                break
+            current = backends[blocker]
+        return tuple(reversed(chain))
+
+    def summary(self, label: Optional[str] = None) -> Dict:
+        """Blocked time, wait events and chains, optionally for one label (test)"""
+        def keep(key_label):
+            return label is None or key_label == label
+
+        blocked = [
+            {
+                'waiter': waiter,
+                'waiter_statement': self.statements.get(waiter, ''),
+                'blocker': blocker,
+                'blocker_statement': self.statements.get(blocker, ''),
+                'relation': relation,
+                'waiting_for': waiting_for,
+                'blocked_ms': round(ms, 1)
+            }
+            for (key_label, waiter, blocker, relation, waiting_for), ms in self.blocked_ms.items() if keep(key_label)
+        ]
+        blocked.sort(key=lambda row: row['blocked_ms'], reverse=True)
+
+        waits = [
+            {'wait_event_type': event_type, 'wait_event': event, 'fingerprint': fingerprint,
+             'statement': self.statements.get(fingerprint, ''), 'samples': count}
+            for (key_label, event_type, event, fingerprint), count in self.wait_events.items() if keep(key_label)
+        ]
+        waits.sort(key=lambda row: row['samples'], reverse=True)
+
+        chains = [
+            {'chain': list(chain), 'samples': count}
+            for (key_label, chain), count in self.chains.items() if keep(key_label)
+        ]
+        chains.sort(key=lambda row: row['samples'], reverse=True)
+
+        return {'samples': self.samples, 'blocked': blocked, 'wait_events': waits, 'chains': chains}
+
+    def print_summary(self, limit: int = 5):
+        summary = self.summary()
+        if not summary['blocked'] and not summary['wait_events']:
+            return
+        print(f"🔒 Lock waits ({summary['samples']} samples every {self.interval * 1000:.0f} ms)")
+        for row in summary['blocked'][:limit]:
+            print(
+                f"   {row['blocked_ms']:>10.1f} ms  {row['waiter_statement'][:50]} "
+                f"waiting on {row['relation'] or row['waiting_for'] or '?'} behind {row['blocker_statement'][:50]}"
+            )
+        for row in summary['chains'][:limit]:
+            chain = ' -> '.join(self.statements.get(fp, fp)[:40] for fp in row['chain'])
+            print(f"   chain x{row['samples']}: {chain}")
+        for row in summary['wait_events'][:limit]:
+            print(f"   {row['samples']:>6} samples  {row['wait_event_type']}/{row['wait_event']}: {row['statement'][:60]}")
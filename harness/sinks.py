@@ -0,0 +1,232 @@
+"""
+Streaming result sinks for the backend test suites.
+
+Results used to live in per-tester Python lists until the process exited.
+Sinks receive each result as a structured record the moment it is logged and
+persist it through a buffered writer that flushes from a background task, so
+long load runs keep memory flat and a crash loses at most one flush interval.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape, quoteattr
+
+
+class BufferedAsyncWriter:
+    """Append lines to a file in batches from a background asyncio task"""
+
+    def __init__(self, path: Path, max_pending: int = 10000, batch_size: int = 1000):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._max_pending = max_pending
+        self._overflow: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+
+    def _ensure_started(self):
+        if self._task is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._queue = asyncio.Queue(maxsize=self._max_pending)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def write(self, line: str):
+        """Queue a line, waiting when the writer is behind (backpressure)"""
+        self._ensure_started()
+        await self._queue.put(line)
+
+    def write_nowait(self, line: str):
+        """Queue a line from synchronous code without blocking the event loop"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            # Only synchronous callers land here and they log one line per
+            # test, so the overflow stays small; it goes out with the next batch.
+            self._overflow.append(line)
+
+    async def _run(self):
+        while True:
+            line = await self._queue.get()
+            if line is None:
+                return
+            batch = self._overflow + [line]
+            self._overflow = []
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    line = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if line is None:
+                    stop = True
+                    break
+                batch.append(line)
+            await asyncio.to_thread(self._write_batch, batch)
+            if stop:
+                return
+
+    def _write_batch(self, lines: List[str]):
+        self._file.write(''.join(lines))
+        self._file.flush()
+
+    async def close(self):
+        """Drain pending lines and close the file"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        if self._overflow:
+            self._write_batch(self._overflow)
+            self._overflow = []
+        self._file.close()
+        self._task = None
+
+
+class ResultSink:
+    """Destination for structured test results"""
+
+    def emit(self, record: Dict):
+        """Accept a record from synchronous code (e.g. log_test_result)"""
+        raise NotImplementedError
+
+    async def write(self, record: Dict):
+        """Accept a record with backpressure; used by high-volume load runs"""
+        self.emit(record)
+
+    async def close(self):
+        pass
+
+
+class MemorySink(ResultSink):
+    """Keep records in a list; the default when no results directory is set"""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+
+    def emit(self, record: Dict):
+        self.records.append(record)
+
+
+class NdjsonSink(ResultSink):
+    """One JSON object per line"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._writer = BufferedAsyncWriter(self.path)
+
+    @staticmethod
+    def _encode(record: Dict) -> str:
+        return json.dumps(record, default=str, ensure_ascii=False) + '\n'
+
+    def emit(self, record: Dict):
+        self._writer.write_nowait(self._encode(record))
+
+    async def write(self, record: Dict):
+        await self._writer.write(self._encode(record))
+
+    async def close(self):
+        await self._writer.close()
+
+
+class JUnitXmlSink(ResultSink):
+    """
+    JUnit XML report. <testcase> elements are streamed to a side file and the
+    <testsuite> wrapper, whose attributes need the final counts, is written
+    around them on close.
+    """
+
+    def __init__(self, path: Path, suite: str, run_id: str, host: str):
+        self.path = Path(path)
+        self.suite = suite
+        self.run_id = run_id
+        self.host = host
+        self.tests = 0
+        self.failures = 0
+        self.skipped = 0
+        self.duration_ms = 0.0
+        self._cases_path = self.path.with_suffix(self.path.suffix + '.cases')
+        self._writer = BufferedAsyncWriter(self._cases_path)
+
+    def _encode(self, record: Dict) -> str:
+        self.tests += 1
+        duration_ms = record.get('duration_ms') or 0.0
+        self.duration_ms += duration_ms
+
+        attrs = (
+            f"classname={quoteattr(record.get('suite', self.suite))} "
+            f"name={quoteattr(str(record['test']))} "
+            f"time=\"{duration_ms / 1000:.3f}\""
+        )
+        body = (
+            f"<properties><property name=\"attempt\" value=\"{record.get('attempt', 1)}\"/>"
+            f"<property name=\"test_id\" value={quoteattr(str(record.get('test_id') or ''))}/></properties>"
+        )
+        if record.get('cached'):
+            self.skipped += 1
+            body += f"<skipped message={quoteattr(record['message'])}/>"
+        elif not record['success']:
+            self.failures += 1
+            details = json.dumps(record.get('details') or {}, default=str, ensure_ascii=False)
+            body += f"<failure message={quoteattr(record['message'])}>{escape(details)}</failure>"
+        return f"  <testcase {attrs}>{body}</testcase>\n"
+
+    def emit(self, record: Dict):
+        self._writer.write_nowait(self._encode(record))
+
+    async def write(self, record: Dict):
+        await self._writer.write(self._encode(record))
+
+    async def close(self):
+        await self._writer.close()
+        await asyncio.to_thread(self._assemble)
+
+    def _assemble(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as out:
+            out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            out.write(
+                f"<testsuite name={quoteattr(self.suite)} tests=\"{self.tests}\" "
+                f"failures=\"{self.failures}\" skipped=\"{self.skipped}\" errors=\"0\" "
+                f"time=\"{self.duration_ms / 1000:.3f}\" hostname={quoteattr(self.host)} "
+                f"id={quoteattr(self.run_id)}>\n"
+            )
+            if self._cases_path.exists():
+                with open(self._cases_path, 'r', encoding='utf-8') as cases:
+                    shutil.copyfileobj(cases, out)
+            out.write('</testsuite>\n')
+        if self._cases_path.exists():
+            os.remove(self._cases_path)
+
+
+class MultiSink(ResultSink):
+    """Fan records out to several sinks"""
+
+    def __init__(self, sinks: List[ResultSink]):
+        self.sinks = sinks
+
+    def emit(self, record: Dict):
+        for sink in self.sinks:
+            sink.emit(record)
+
+    async def write(self, record: Dict):
+        for sink in self.sinks:
+            await sink.write(record)
+
+    async def close(self):
+        for sink in self.sinks:
+            await sink.close()
+
+
+def file_sinks(results_dir: str, suite: str, run_id: str, host: str) -> MultiSink:
+    """NDJSON plus JUnit XML sinks for one suite run under results_dir"""
+    base = Path(results_dir) / f"{suite}-{run_id}"
+    return MultiSink([
+        NdjsonSink(base.with_suffix('.ndjson')),
+        JUnitXmlSink(base.with_suffix('.xml'), suite, run_id, host)
+    ])
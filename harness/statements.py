@@ -0,0 +1,126 @@
+"""
+Server-side cost attribution from pg_stat_statements.
+
+StatementStats snapshots pg_stat_statements on a dedicated connection and
+diffs two snapshots into per-statement deltas (calls, total and mean time,
+rows, shared block hits and reads, temp blocks). Statements executed inside
+plpgsql functions such as bulk_invite_enterprise_users only appear when the
+server runs with pg_stat_statements.track = 'all'; a warning is printed
+otherwise.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import db_config
+
+COUNTERS = ('calls', 'total_ms', 'rows', 'shared_blks_hit', 'shared_blks_read',
+            'temp_blks_read', 'temp_blks_written')
+
+Snapshot = Dict[Tuple, Dict]
+
+
+class StatementStats:
+    """Snapshot and diff pg_stat_statements for the current database"""
+
+    def __init__(self, connect_options: Optional[Dict] = None):
+        self.connect_options = connect_options or db_config()
+        self._conn = None
+        self._query: Optional[str] = None
+
+    async def start(self):
+        self._conn = await asyncpg.connect(
+            **self.connect_options, server_settings={'application_name': 'harness-statement-stats'}
+        )
+        columns = {row['attname'] for row in await self._conn.fetch(
+            "SELECT attname FROM pg_attribute WHERE attrelid = 'pg_stat_statements'::regclass AND attnum > 0"
+        )}
+        # total_time was split into plan/exec time in Postgres 13; toplevel arrived in 14
+        total = 'total_exec_time' if 'total_exec_time' in columns else 'total_time'
+        toplevel = 'toplevel' if 'toplevel' in columns else 'true'
+        self._query = f"""
+            SELECT userid, queryid, {toplevel} AS toplevel, query, calls, {total} AS total_ms, rows,
+                   shared_blks_hit, shared_blks_read, temp_blks_read, temp_blks_written
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+              AND query NOT LIKE '%pg_stat_statements%'
+        """
+
+        track = await self._conn.fetchval("SELECT current_setting('pg_stat_statements.track', true)")
+        if track != 'all':
+            print(f"⚠️ pg_stat_statements.track is {track!r}; statements inside RPCs are not broken out")
+
+    async def stop(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def snapshot(self) -> Snapshot:
+        rows = await self._conn.fetch(self._query)
+        return {(row['userid'], row['queryid'], row['toplevel']): dict(row) for row in rows}
+
+    @staticmethod
+    def diff(before: Snapshot, after: Snapshot) -> List[Dict]:
+        """Per-statement deltas between two snapshots, most expensive first"""
+        deltas = []
+        for key, row in after.items():
+            previous = before.get(key)
+            delta = {name: row[name] - (previous[name] if previous else 0) for name in COUNTERS}
+            if delta['calls'] <= 0:
+                continue
+            delta['total_ms'] = round(delta['total_ms'], 3)
+            delta['mean_ms'] = round(delta['total_ms'] / delta['calls'], 3)
+            delta['queryid'] = row['queryid']
+            delta['toplevel'] = row['toplevel']
+            delta['query'] = row['query']
+            deltas.append(delta)
+        deltas.sort(key=lambda delta: delta['total_ms'], reverse=True)
+        return deltas
+
+    @asynccontextmanager
+    async def capture(self):
+        """Collect deltas for a block: ``async with stats.capture() as deltas:``"""
+        deltas: List[Dict] = []
+        before = await self.snapshot()
+        try:
+            yield deltas
+        finally:
+            deltas.extend(self.diff(before, await self.snapshot()))
+
+
+def merge_statement_deltas(deltas: List[Dict]) -> List[Dict]:
+    """Deltas of several captures summed per statement, most expensive first"""
+    merged: Dict[Tuple, Dict] = {}
+    for delta in deltas:
+        key = (delta['queryid'], delta['toplevel'])
+        total = merged.get(key)
+        if total is None:
+            merged[key] = total = {name: 0 for name in COUNTERS}
+            total.update(queryid=delta['queryid'], toplevel=delta['toplevel'], query=delta['query'], tests=[])
+        for name in COUNTERS:
+            total[name] += delta[name]
+        if delta.get('test') and delta['test'] not in total['tests']:
+            total['tests'].append(delta['test'])
+    for total in merged.values():
+        total['total_ms'] = round(total['total_ms'], 3)
+        total['mean_ms'] = round(total['total_ms'] / total['calls'], 3)
+    return sorted(merged.values(), key=lambda total: total['total_ms'], reverse=True)
+
+
+def print_statement_deltas(deltas: List[Dict], limit: int = 10):
+    if not deltas:
+        return
+    print(f"🗄️ Server-side statement cost (top {min(limit, len(deltas))} by total time)")
+    for delta in deltas[:limit]:
+        nested = '' if delta['toplevel'] else '  (nested)'
+        query = ' '.join(delta['query'].split())[:80]
+        print(
+            f"   {delta['total_ms']:>10.1f} ms  x{delta['calls']:<5} mean {delta['mean_ms']:>8.2f} ms  "
+            f"rows {delta['rows']:<6} hit/read {delta['shared_blks_hit']}/{delta['shared_blks_read']}  "
+            f"{query}{nested}"
+        )
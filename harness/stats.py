@@ -0,0 +1,87 @@
+"""
+Statistics for benchmark trials: timing, outlier rejection and bootstrap
+confidence intervals. Pure Python so the gate runs anywhere the suites do.
+"""
+
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+
+async def measure(call: Callable[[], Awaitable], trials: int, warmup: int = 2,
+                  calls_per_trial: int = 10) -> List[float]:
+    """Run `call` in repeated trials and return the mean ms per call of each trial"""
+    for _ in range(warmup * calls_per_trial):
+        await call()
+
+    samples = []
+    for _ in range(trials):
+        started = time.perf_counter()
+        for _ in range(calls_per_trial):
+            await call()
+        samples.append((time.perf_counter() - started) * 1000 / calls_per_trial)
+    return samples
+
+
+def reject_outliers(values: Sequence[float], threshold: float = 3.5) -> Tuple[List[float], List[float]]:
+    """Split values by modified z-score (median/MAD based) into (kept, rejected)"""
+    if len(values) < 3:
+        return list(values), []
+    med = statistics.median(values)
+    mad = statistics.median(abs(v - med) for v in values)
+    if mad == 0:
+        return list(values), []
+    kept, rejected = [], []
+    for value in values:
+        (rejected if 0.6745 * abs(value - med) / mad > threshold else kept).append(value)
+    return kept, rejected
+
+
+def bootstrap_ratio_ci(baseline: Sequence[float], candidate: Sequence[float], iterations: int = 5000,
+                       confidence: float = 0.95, seed: int = 0) -> Tuple[float, float, float]:
+    """Median ratio candidate/baseline with a percentile bootstrap confidence interval"""
+    rng = random.Random(seed)
+    point = statistics.median(candidate) / statistics.median(baseline)
+    ratios = []
+    for _ in range(iterations):
+        b = statistics.median(rng.choices(baseline, k=len(baseline)))
+        c = statistics.median(rng.choices(candidate, k=len(candidate)))
+        ratios.append(c / b)
+    ratios.sort()
+    tail = (1 - confidence) / 2
+    low = ratios[int(tail * (iterations - 1))]
+    high = ratios[int((1 - tail) * (iterations - 1))]
+    return point, low, high
+
+
+def compare_samples(baseline: Sequence[float], candidate: Sequence[float], threshold: float = 0.05,
+                    confidence: float = 0.95) -> Dict:
+    """
+    Decide whether candidate is slower than baseline. A regression needs the
+    whole confidence interval of the median ratio above 1 + threshold, so
+    noise alone cannot fail the gate.
+    """
+    baseline_kept, baseline_rejected = reject_outliers(baseline)
+    candidate_kept, candidate_rejected = reject_outliers(candidate)
+    ratio, low, high = bootstrap_ratio_ci(baseline_kept, candidate_kept, confidence=confidence)
+
+    if low > 1 + threshold:
+        verdict = 'regression'
+    elif high < 1 - threshold:
+        verdict = 'improvement'
+    else:
+        verdict = 'unchanged'
+
+    return {
+        'verdict': verdict,
+        'ratio': ratio,
+        'ci_low': low,
+        'ci_high': high,
+        'confidence': confidence,
+        'threshold': threshold,
+        'baseline_median_ms': statistics.median(baseline_kept),
+        'candidate_median_ms': statistics.median(candidate_kept),
+        'baseline_outliers': len(baseline_rejected),
+        'candidate_outliers': len(candidate_rejected)
+    }
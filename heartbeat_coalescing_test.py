@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Device Heartbeat Write-Coalescing Test
+Compares per-ping updates of user_devices.last_active (what updateDeviceActivity in
+client/lib/enhanced-usage-tracking.ts does) with services.heartbeat.HeartbeatCoalescer.
+
+A simulated period of activity pings is generated up front: every device pings every
+--ping-interval seconds, with jitter, for --minutes. Both modes replay it on their own
+freshly seeded devices, as fast as the database allows; the coalescer flushes whenever
+the simulated clock crosses a flush boundary. For each mode the test reports statements,
+row versions written (n_tup_upd / n_tup_hot_upd on user_devices), WAL generated and
+client-side DB time. Both modes must end with the same last_active for every device.
+
+WAL is measured cluster-wide, so run it on a quiet database.
+
+Usage: python heartbeat_coalescing_test.py [--devices=1000] [--minutes=10] [--ping-interval=30]
+       [--flush-interval=5] [--concurrency=20]
+"""
+
+import time
+import random
+import asyncio
+import asyncpg
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+import sys
+
+from harness import TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_devices, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.heartbeat import HeartbeatCoalescer
+
+PER_PING_SQL = """
+UPDATE public.user_devices
+SET last_active = $3
+WHERE user_id = $1 AND device_fingerprint = $2
+"""
+
+TABLE_STATS_SQL = """
+SELECT n_tup_upd, n_tup_hot_upd, pg_current_wal_lsn() AS lsn
+FROM pg_stat_user_tables
+WHERE relid = 'public.user_devices'::regclass
+"""
+
+
+class HeartbeatCoalescingTester(TesterBase):
+    def __init__(self, devices: int = 1000, minutes: float = 10, ping_interval: float = 30,
+                 flush_interval: float = 5, concurrency: int = 20, seed: int = 11, **options):
+        super().__init__(**options)
+        self.devices = devices
+        self.minutes = minutes
+        self.ping_interval = ping_interval
+        self.flush_interval = flush_interval
+        self.concurrency = concurrency
+        self.seed = seed
+        self.db_pool = None
+        self.mode_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Initialize the database connection pool"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(),
+                min_size=2,
+                max_size=self.concurrency,
+                connection_class=InstrumentedConnection
+            )
+            print("✅ Database pool initialized")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Close the connection pool"""
+        if self.db_pool:
+            await self.db_pool.close()
+
+    def plan(self) -> List[Tuple[float, int]]:
+        """(simulated second, device index) for every ping, in time order"""
+        rng = random.Random(self.seed)
+        pings = []
+        duration = self.minutes * 60
+        for device in range(self.devices):
+            at = rng.uniform(0, self.ping_interval)
+            while at < duration:
+                pings.append((at, device))
+                at += self.ping_interval * rng.uniform(0.8, 1.2)
+        pings.sort()
+        return pings
+
+    async def table_stats(self) -> Dict:
+        async with self.db_pool.acquire() as conn:
+            # Table counters reach the stats system shortly after commit
+            await asyncio.sleep(1.0)
+            await conn.execute("SELECT pg_stat_clear_snapshot()")
+            return dict(await conn.fetchrow(TABLE_STATS_SQL))
+
+    async def replay(self, mode: str, pings: List[Tuple[float, int]], keys: List[Tuple], epoch: datetime):
+        if mode == 'per_ping':
+            # Each device has a fixed writer, so its pings commit in the order they were sent
+            queues = [asyncio.Queue(maxsize=4) for _ in range(self.concurrency)]
+
+            async def writer(queue: asyncio.Queue):
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        return
+                    await self.db_pool.execute(PER_PING_SQL, *item)
+
+            writers = [asyncio.create_task(writer(queue)) for queue in queues]
+            for offset, device in pings:
+                await queues[device % self.concurrency].put((*keys[device], epoch + timedelta(seconds=offset)))
+            for queue in queues:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+            return {}
+
+        coalescer = HeartbeatCoalescer(self.db_pool, flush_interval=self.flush_interval)
+        next_flush = self.flush_interval
+        for offset, device in pings:
+            while offset >= next_flush:
+                await coalescer.flush()
+                next_flush += self.flush_interval
+            user_id, fingerprint = keys[device]
+            coalescer.ping(user_id, fingerprint, epoch + timedelta(seconds=offset))
+        await coalescer.stop()
+        return coalescer.stats
+
+    async def run_mode(self, mode: str) -> Dict:
+        pings = self.plan()
+        # The simulated period ends now; the coalescer refuses pings from the future
+        epoch = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(minutes=self.minutes)
+
+        async with self.db_pool.acquire() as conn:
+            user_ids = await seed_users(conn, self.devices, role='pro')
+            await seed_devices(conn, user_ids, devices_per_user=1)
+            await conn.execute(
+                "UPDATE public.user_devices SET last_active = $2 WHERE user_id = ANY($1::uuid[])",
+                user_ids, epoch - timedelta(days=1)
+            )
+        keys = [(user_id, 'fp-1') for user_id in user_ids]
+
+        try:
+            before = await self.table_stats()
+            statements_before = self.db_statement_count()
+            started = time.perf_counter()
+            coalescer_stats = await self.replay(mode, pings, keys, epoch)
+            elapsed = time.perf_counter() - started
+            statements = self.db_statement_count() - statements_before
+            after = await self.table_stats()
+
+            async with self.db_pool.acquire() as conn:
+                wal_bytes = await conn.fetchval("SELECT pg_wal_lsn_diff($1::pg_lsn, $2::pg_lsn)",
+                                                str(after['lsn']), str(before['lsn']))
+                final = {row['user_id']: row['last_active'] for row in await conn.fetch(
+                    "SELECT user_id, last_active FROM public.user_devices WHERE user_id = ANY($1::uuid[])",
+                    user_ids
+                )}
+        finally:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", user_ids)
+
+        expected: Dict = {}
+        for offset, device in pings:
+            expected[user_ids[device]] = epoch + timedelta(seconds=offset)
+        stale = sum(1 for user_id, at in expected.items() if final.get(user_id) != at)
+
+        return {
+            'mode': mode,
+            'pings': len(pings),
+            'statements': statements,
+            'rows_updated': after['n_tup_upd'] - before['n_tup_upd'],
+            'hot_updates': after['n_tup_hot_upd'] - before['n_tup_hot_upd'],
+            'wal_bytes': int(wal_bytes),
+            'elapsed_s': round(elapsed, 3),
+            'stale_devices': stale,
+            'coalescer': coalescer_stats
+        }
+
+    def db_statement_count(self) -> int:
+        return sum(row['count'] for row in self.latency.summary(kinds=['db']))
+
+    async def check_mode(self, mode: str, name: str) -> bool:
+        try:
+            result = await self.run_mode(mode)
+            self.mode_results[mode] = result
+            if result['stale_devices']:
+                self.log_test_result(
+                    name,
+                    False,
+                    f"{result['stale_devices']} devices did not end with their latest ping",
+                    result
+                )
+                return False
+            self.log_test_result(
+                name,
+                True,
+                f"{result['pings']} pings -> {result['statements']} statements, "
+                f"{result['rows_updated']} row updates, {result['wal_bytes'] / 1024:.0f} KiB WAL "
+                f"in {result['elapsed_s']}s",
+                result
+            )
+            return True
+        except Exception as e:
+            self.log_test_result(name, False, f"Heartbeat replay failed: {str(e)}")
+            return False
+
+    async def test_per_ping_updates(self):
+        """Test 1: One UPDATE per ping, as updateDeviceActivity does"""
+        return await self.check_mode('per_ping', "Heartbeats - Per-Ping Updates")
+
+    async def test_coalesced_updates(self):
+        """Test 2: Pings coalesced per device and flushed in batches"""
+        return await self.check_mode('coalesced', "Heartbeats - Coalesced Flushes")
+
+    def print_comparison(self):
+        if len(self.mode_results) < 2:
+            return
+        per_ping = self.mode_results['per_ping']
+        coalesced = self.mode_results['coalesced']
+        print("📊 Per-ping vs coalesced")
+        for key in ('statements', 'rows_updated', 'hot_updates', 'wal_bytes', 'elapsed_s'):
+            ratio = per_ping[key] / coalesced[key] if coalesced[key] else float('inf')
+            print(f"   {key:<14} {per_ping[key]:>12} {coalesced[key]:>12}   x{ratio:.1f}")
+
+    async def run_all_tests(self):
+        """Run both heartbeat modes"""
+        print("🚀 Starting Device Heartbeat Write-Coalescing Test")
+        print(f"   {self.devices} devices pinging every {self.ping_interval}s for {self.minutes} min, "
+              f"flush every {self.flush_interval}s")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_per_ping_updates,
+            self.test_coalesced_updates
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        self.print_comparison()
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Both heartbeat modes left every device with its latest ping!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = HeartbeatCoalescingTester(
+        devices=scenario_option(argv, 'devices', 1000),
+        minutes=scenario_option(argv, 'minutes', 10.0, float),
+        ping_interval=scenario_option(argv, 'ping-interval', 30.0, float),
+        flush_interval=scenario_option(argv, 'flush-interval', 5.0, float),
+        concurrency=scenario_option(argv, 'concurrency', 20),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Invitation Expiry Test
+Checks services.invitation_expiry against cleanup_expired_invitations() on a seeded
+invitations table.
+
+The company has a long invitation history (accepted, cancelled and expired rows), some
+pending invitations that are still valid, and `due` overdue pending ones. The chunked
+job must expire exactly the overdue ones, read them through the partial index instead of
+scanning the history, resume an interrupted run from its checkpoint, and skip a row an
+application transaction holds instead of waiting on it. While expiry runs, a manager
+keeps resending overdue invitations: behind the single UPDATE a resend waits for the
+whole statement, behind the chunked job for one chunk at most.
+
+Usage: python invitation_expiry_test.py [--invitations=50000] [--due=20000] [--chunk=500] [--resenders=4]
+"""
+
+import json
+import time
+import asyncio
+import asyncpg
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, LockSampler, compare_samples, measure, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company
+from harness.instrumentation import Histogram, InstrumentedConnection
+from services.invitation_expiry import InvitationExpiryJob
+
+INVITATION_RELATIONS = ('user_invitations', 'public.user_invitations')
+
+# What the chunk reads, without the locking
+DUE_SQL = """
+SELECT id FROM public.user_invitations
+WHERE status = 'pending' AND expires_at < NOW()
+ORDER BY expires_at, id
+LIMIT $1
+"""
+
+FULL_SCAN_SETTINGS = ("SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off; "
+                      "SET LOCAL enable_indexonlyscan = off")
+
+
+class InvitationExpiryTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, invitations: int = 50000, due: int = 20000, chunk: int = 500, resenders: int = 4,
+                 **options):
+        super().__init__(**options)
+        self.invitations = invitations
+        self.due = due
+        self.chunk = chunk
+        self.resenders = resenders
+        self.db_pool = None
+        self.company = None
+        self.mode_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Seed a company with a long invitation history and overdue pending invitations"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(),
+                min_size=2,
+                max_size=self.resenders + 4,
+                connection_class=InstrumentedConnection
+            )
+            async with self.db_pool.acquire() as conn:
+                self.company = await seed_company(conn, users=1, max_users=self.invitations + 10,
+                                                  devices_per_user=0)
+                history = max(0, self.invitations - self.due - self.invitations // 20)
+                await conn.execute("""
+                    INSERT INTO public.user_invitations (email, name, company_id, invited_by, status, expires_at,
+                                                         created_at)
+                    SELECT 'hist-' || $1 || '-' || g || '@bench.test', 'History ' || g, $2, $3,
+                           (ARRAY['accepted', 'cancelled', 'expired'])[1 + g % 3],
+                           NOW() - (g % 365) * INTERVAL '1 day', NOW() - (g % 365 + 7) * INTERVAL '1 day'
+                    FROM generate_series(1, $4) g
+                """, self.company['tag'], self.company['company_id'], self.company['manager_id'], history)
+                await conn.execute("""
+                    INSERT INTO public.user_invitations (email, name, company_id, invited_by, status, expires_at)
+                    SELECT 'valid-' || $1 || '-' || g || '@bench.test', 'Valid ' || g, $2, $3, 'pending',
+                           NOW() + (1 + g % 7) * INTERVAL '1 day'
+                    FROM generate_series(1, $4) g
+                """, self.company['tag'], self.company['company_id'], self.company['manager_id'],
+                    self.invitations // 20)
+                await conn.execute("""
+                    INSERT INTO public.user_invitations (email, name, company_id, invited_by, status, created_at)
+                    SELECT 'due-' || $1 || '-' || g || '@bench.test', 'Due ' || g, $2, $3, 'pending',
+                           NOW() - INTERVAL '30 days' + g * INTERVAL '1 second'
+                    FROM generate_series(1, $4) g
+                """, self.company['tag'], self.company['company_id'], self.company['manager_id'], self.due)
+                await self.reset_due(conn)
+                await conn.execute("ANALYZE public.user_invitations")
+                # A run left over from an aborted earlier test would be resumed otherwise
+                await conn.execute(
+                    "UPDATE public.maintenance_checkpoints SET cutoff = NULL WHERE name = 'invitation_expiry'")
+            print(f"✅ Seeded {self.invitations} invitations, {self.due} of them overdue and pending")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to seed invitations: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove the company (invitations cascade) and close the pool"""
+        if self.db_pool:
+            if self.company:
+                async with self.db_pool.acquire() as conn:
+                    await conn.execute("DELETE FROM public.users WHERE company_id = $1", self.company['company_id'])
+                    await conn.execute("DELETE FROM public.companies WHERE id = $1", self.company['company_id'])
+            await self.db_pool.close()
+
+    async def reset_due(self, conn):
+        """Put the overdue invitations back as seeded: pending, expired a week after creation"""
+        await conn.execute("""
+            UPDATE public.user_invitations
+            SET status = 'pending', expires_at = created_at + INTERVAL '7 days'
+            WHERE company_id = $1 AND email LIKE 'due-%'
+        """, self.company['company_id'])
+
+    async def status_counts(self, conn) -> Dict[str, int]:
+        rows = await conn.fetch("""
+            SELECT split_part(email, '-', 1) || ':' || status AS key, COUNT(*) AS n
+            FROM public.user_invitations
+            WHERE company_id = $1
+            GROUP BY 1
+        """, self.company['company_id'])
+        return {row['key']: row['n'] for row in rows}
+
+    async def checkpoint(self, conn):
+        return await conn.fetchrow(
+            "SELECT cutoff, processed, chunks FROM public.maintenance_checkpoints WHERE name = 'invitation_expiry'")
+
+    async def test_partial_index(self):
+        """Test 1: The chunk's read uses the partial index and beats the full scan"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                async def plan(force_full_scan: bool) -> Dict:
+                    async with conn.transaction():
+                        if force_full_scan:
+                            await conn.execute(FULL_SCAN_SETTINGS)
+                        explain = await conn.fetchval(
+                            f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {DUE_SQL}", self.chunk)
+                    explain = json.loads(explain) if isinstance(explain, str) else explain
+                    return explain[0]
+
+                async def run(force_full_scan: bool):
+                    async with conn.transaction():
+                        if force_full_scan:
+                            await conn.execute(FULL_SCAN_SETTINGS)
+                        await conn.fetch(DUE_SQL, self.chunk)
+
+                indexed_plan, full_plan = await plan(False), await plan(True)
+                full_ms = await measure(lambda: run(True), trials=10, calls_per_trial=3)
+                indexed_ms = await measure(lambda: run(False), trials=10, calls_per_trial=3)
+
+            def buffers(explain):
+                return explain['Plan'].get('Shared Hit Blocks', 0) + explain['Plan'].get('Shared Read Blocks', 0)
+
+            uses_index = 'idx_user_invitations_pending_expiry' in json.dumps(indexed_plan)
+            comparison = compare_samples(full_ms, indexed_ms)
+            details = {
+                'full_scan_buffers': buffers(full_plan),
+                'indexed_buffers': buffers(indexed_plan),
+                'full_scan_median_ms': round(comparison['baseline_median_ms'], 2),
+                'indexed_median_ms': round(comparison['candidate_median_ms'], 2),
+                'verdict': comparison['verdict']
+            }
+            success = uses_index and details['indexed_buffers'] <= details['full_scan_buffers'] \
+                and comparison['verdict'] != 'regression'
+            self.log_test_result(
+                "Invitation Expiry - Partial Index",
+                success,
+                f"{'partial index' if uses_index else 'NO partial index'}: {details['indexed_buffers']} buffers, "
+                f"{details['indexed_median_ms']:.2f} ms vs full scan {details['full_scan_buffers']} buffers, "
+                f"{details['full_scan_median_ms']:.2f} ms ({comparison['verdict']})",
+                details
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Invitation Expiry - Partial Index", False, f"Measurement failed: {str(e)}")
+            return False
+
+    async def test_expires_overdue_only(self):
+        """Test 2: The job expires exactly the overdue pending invitations"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                await self.reset_due(conn)
+                before = await self.status_counts(conn)
+            job = InvitationExpiryJob(self.db_pool, chunk_size=self.chunk)
+            result = await job.run()
+            async with self.db_pool.acquire() as conn:
+                after = await self.status_counts(conn)
+
+            expected = dict(before)
+            expected['due:expired'] = expected.get('due:expired', 0) + expected.pop('due:pending', 0)
+            success = result['finished'] and after == expected and result['rows'] >= self.due
+            self.log_test_result(
+                "Invitation Expiry - Overdue Only",
+                success,
+                f"{after.get('due:expired', 0)} of {self.due} overdue expired, "
+                f"{after.get('valid:pending', 0)} valid still pending; {result['rows']} rows in "
+                f"{result['chunks']} chunks, {result['rows_per_s']} rows/s, chunk p50 {result['chunk_ms']['p50']} ms, "
+                f"p95 {result['chunk_ms']['p95']} ms, max {result['chunk_ms']['max']} ms",
+                {'result': result, 'before': before, 'after': after}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Invitation Expiry - Overdue Only", False, f"Expiry failed: {str(e)}")
+            return False
+
+    async def test_resume(self):
+        """Test 3: An interrupted run resumes from its checkpoint with the same cutoff"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                await self.reset_due(conn)
+            first = await InvitationExpiryJob(self.db_pool, chunk_size=self.chunk).run(max_chunks=2)
+            async with self.db_pool.acquire() as conn:
+                interrupted = await self.checkpoint(conn)
+            second = await InvitationExpiryJob(self.db_pool, chunk_size=self.chunk).run()
+            async with self.db_pool.acquire() as conn:
+                done = await self.checkpoint(conn)
+                counts = await self.status_counts(conn)
+
+            success = (not first['finished'] and interrupted['cutoff'] is not None
+                       and interrupted['processed'] == first['rows'] and second['resumed'] and second['finished']
+                       and done['cutoff'] is None and counts.get('due:pending', 0) == 0
+                       and done['processed'] == first['rows'] + second['rows'])
+            self.log_test_result(
+                "Invitation Expiry - Resume",
+                success,
+                f"stopped after {first['rows']} rows (checkpoint {interrupted['processed']}), resumed for "
+                f"{second['rows']} more; {counts.get('due:pending', 0)} overdue left",
+                {'first': first, 'second': second}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Invitation Expiry - Resume", False, f"Resume failed: {str(e)}")
+            return False
+
+    async def test_skip_locked(self):
+        """Test 4: A row held by another transaction is skipped, not waited on, and expired next run"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                await self.reset_due(conn)
+            async with self.db_pool.acquire() as holder:
+                transaction = holder.transaction()
+                await transaction.start()
+                try:
+                    held = await holder.fetchval("""
+                        SELECT id FROM public.user_invitations
+                        WHERE company_id = $1 AND email LIKE 'due-%'
+                        ORDER BY expires_at, id LIMIT 1
+                        FOR UPDATE
+                    """, self.company['company_id'])
+                    job = InvitationExpiryJob(self.db_pool, chunk_size=self.chunk)
+                    first = await asyncio.wait_for(job.run(), timeout=60)
+                finally:
+                    await transaction.rollback()
+            async with self.db_pool.acquire() as conn:
+                still_pending = await conn.fetchval(
+                    "SELECT status = 'pending' FROM public.user_invitations WHERE id = $1", held)
+            second = await job.run()
+
+            success = first['finished'] and still_pending and second['rows'] >= 1
+            self.log_test_result(
+                "Invitation Expiry - Skip Locked",
+                success,
+                f"first run finished with the held row {'still pending' if still_pending else 'expired'}; "
+                f"next run expired {second['rows']}",
+                {'first': first, 'second': second}
+            )
+            return success
+        except asyncio.TimeoutError:
+            self.log_test_result("Invitation Expiry - Skip Locked", False, "Job waited on the held row")
+            return False
+        except Exception as e:
+            self.log_test_result("Invitation Expiry - Skip Locked", False, f"Check failed: {str(e)}")
+            return False
+
+    async def resends_during(self, mode: str, expire) -> Dict:
+        """Resend overdue invitations from `resenders` workers while `expire` runs"""
+        async with self.db_pool.acquire() as conn:
+            await self.reset_due(conn)
+            ids = [row['id'] for row in await conn.fetch("""
+                SELECT id FROM public.user_invitations
+                WHERE company_id = $1 AND email LIKE 'due-%'
+                ORDER BY random()
+            """, self.company['company_id'])]
+        latency = Histogram()
+        done = asyncio.Event()
+
+        async def resender(worker: int):
+            async with self.db_pool.acquire() as conn:
+                for invitation_id in ids[worker::self.resenders]:
+                    if done.is_set():
+                        return
+                    started = time.perf_counter()
+                    await conn.fetchval("SELECT public.resend_invitation($1, $2)",
+                                        invitation_id, self.company['manager_id'])
+                    latency.record((time.perf_counter() - started) * 1000)
+
+        async with LockSampler(0.01, label=lambda: mode) as sampler:
+            workers = [asyncio.create_task(resender(i)) for i in range(self.resenders)]
+            await asyncio.sleep(0.2)
+            started = time.perf_counter()
+            expired = await expire()
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*workers)
+
+        locks = sampler.summary(mode)
+        result = {
+            'mode': mode,
+            'expired': expired,
+            'expiry_s': round(elapsed, 3),
+            'resends': latency.summary(),
+            'blocked_ms': round(sum(row['blocked_ms'] for row in locks['blocked']
+                                    if row['relation'] in INVITATION_RELATIONS), 1)
+        }
+        self.mode_results[mode] = result
+        return result
+
+    async def test_resend_stall(self):
+        """Test 5: Resends wait for the whole single UPDATE, but at most one chunk of the job"""
+        try:
+            async def single():
+                async with self.db_pool.acquire() as conn:
+                    return await conn.fetchval("SELECT public.cleanup_expired_invitations()")
+
+            job = InvitationExpiryJob(self.db_pool, chunk_size=self.chunk)
+            chunk_ms: List[float] = []
+
+            async def chunked():
+                result = await job.run()
+                chunk_ms.append(result['chunk_ms']['max'])
+                return result['rows']
+
+            function = await self.resends_during('function', single)
+            chunks = await self.resends_during('chunked', chunked)
+
+            # A resend can queue behind one chunk, plus scheduling noise
+            bound_ms = chunk_ms[0] + 50
+            success = chunks['resends']['max_ms'] <= bound_ms
+            self.log_test_result(
+                "Invitation Expiry - Resend Stall",
+                success,
+                f"resend max {function['resends']['max_ms']:.0f} ms behind cleanup_expired_invitations() "
+                f"({function['blocked_ms']:.0f} ms blocked), {chunks['resends']['max_ms']:.0f} ms behind the "
+                f"job ({chunks['blocked_ms']:.0f} ms blocked; bound {bound_ms:.0f} ms)",
+                {'function': function, 'chunked': chunks}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Invitation Expiry - Resend Stall", False, f"Measurement failed: {str(e)}")
+            return False
+
+    def print_comparison(self):
+        if not self.mode_results:
+            return
+        print("📊 Resends during expiry")
+        print(f"   {'mode':<9} {'expired':>8} {'expiry s':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+              f"{'blocked ms':>11}")
+        for mode, result in self.mode_results.items():
+            resends = result['resends']
+            print(
+                f"   {mode:<9} {result['expired']:>8} {result['expiry_s']:>9.3f} {resends['p50_ms']:>8.1f} "
+                f"{resends['p95_ms']:>8.1f} {resends['max_ms']:>8.1f} {result['blocked_ms']:>11.0f}"
+            )
+
+    async def run_all_tests(self):
+        """Run the invitation expiry checks"""
+        print("🚀 Starting Invitation Expiry Test")
+        print(f"   {self.invitations} invitations, {self.due} overdue, chunks of {self.chunk}, "
+              f"{self.resenders} resenders")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_partial_index,
+            self.test_expires_overdue_only,
+            self.test_resume,
+            self.test_skip_locked,
+            self.test_resend_stall
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        self.print_comparison()
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Invitations expire in chunks without stalling managers!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = InvitationExpiryTester(
+        invitations=scenario_option(argv, 'invitations', 50000),
+        due=scenario_option(argv, 'due', 20000),
+        chunk=scenario_option(argv, 'chunk', 500),
+        resenders=scenario_option(argv, 'resenders', 4),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
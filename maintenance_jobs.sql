@@ -0,0 +1,38 @@
+-- MailoReply AI - Maintenance Jobs
+-- Checkpoints and indexes for the chunked maintenance jobs in services/ (invitation expiry,
+-- usage resets).
+-- Run after enterprise_invitation_system.sql and complete_user_limits_update.sql. Safe to run
+-- multiple times.
+
+-- 1. MAINTENANCE CHECKPOINTS
+-- One row per job. A run fixes its cutoff when it starts and moves the cursor after every
+-- committed chunk, so a run that is interrupted resumes where it stopped, against the same
+-- cutoff. cutoff is NULL between runs. The row is locked for the duration of each chunk,
+-- which also keeps two copies of a job from working the same range.
+CREATE TABLE IF NOT EXISTS public.maintenance_checkpoints (
+  name TEXT PRIMARY KEY,
+  cutoff TIMESTAMP WITH TIME ZONE,
+  cursor_at TIMESTAMP WITH TIME ZONE,
+  cursor_id UUID,
+  processed BIGINT NOT NULL DEFAULT 0,
+  chunks INTEGER NOT NULL DEFAULT 0,
+  started_at TIMESTAMP WITH TIME ZONE,
+  finished_at TIMESTAMP WITH TIME ZONE,
+  updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE public.maintenance_checkpoints ENABLE ROW LEVEL SECURITY;
+
+INSERT INTO public.maintenance_checkpoints (name)
+VALUES ('invitation_expiry'), ('usage_reset')
+ON CONFLICT (name) DO NOTHING;
+
+-- 2. PENDING INVITATION EXPIRY
+-- Pending invitations are a small, moving slice of user_invitations; accepted, cancelled and
+-- expired rows pile up forever. The partial index holds only the pending ones, in the order
+-- the expiry job walks them, and an expired row leaves it. cleanup_expired_invitations()
+-- also uses it instead of scanning the table.
+CREATE INDEX IF NOT EXISTS idx_user_invitations_pending_expiry
+  ON public.user_invitations (expires_at, id)
+  WHERE status = 'pending';
+
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Parquet Export Test
+Checks services.export.ParquetExporter: a full export followed by incremental runs must
+write every exported row exactly once, incremental runs must read only rows past the
+watermark (including late events whose created_at lies in an older month), and Python-side
+memory must stay bounded by the batch size rather than the table size.
+
+Generations and devices are seeded for fresh users; payment_history is exported too when
+the Stripe schema is installed. Files go to a temporary directory that is removed
+afterwards unless --keep is given.
+
+Exports whole tables, so point it at a test database. Requires pyarrow.
+
+Usage: python parquet_export_test.py [--users=100] [--events=100000] [--batch=5000] [--keep]
+"""
+
+import os
+import random
+import shutil
+import asyncio
+import asyncpg
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+import sys
+
+try:
+    import pyarrow.dataset as ds
+except ImportError:
+    ds = None
+
+from harness import TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_devices, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.export import EXPORTS, ParquetExporter
+
+
+class ParquetExportTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 100, events: int = 100000, batch: int = 5000, keep: bool = False,
+                 seed: int = 13, **options):
+        super().__init__(**options)
+        self.users = users
+        self.events = events
+        self.batch = batch
+        self.keep = keep
+        self.seed = seed
+        self.db_pool = None
+        self.user_ids: List = []
+        self.out_dir = None
+        self.tables: List[str] = []
+        self.exported: Dict[str, int] = {}
+
+    async def setup(self):
+        """Initialize the database connection pool, seed rows and pick the tables to export"""
+        try:
+            if ds is None:
+                raise RuntimeError("pyarrow is not installed")
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=1, max_size=3, connection_class=InstrumentedConnection
+            )
+            async with self.db_pool.acquire() as conn:
+                self.user_ids = await seed_users(conn, self.users, role='pro')
+                await seed_devices(conn, self.user_ids, devices_per_user=2)
+                await self.write_generations(conn, self.events, max_age=timedelta(days=90))
+                self.tables = [name for name in EXPORTS
+                               if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", f"public.{name}")]
+            self.out_dir = tempfile.mkdtemp(prefix='parquet-export-')
+            print(f"✅ Database pool initialized, exporting {', '.join(self.tables)} to {self.out_dir}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove seeded users (rows cascade), the export directory, and close the pool"""
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", self.user_ids)
+            await self.db_pool.close()
+        if self.out_dir and not self.keep:
+            shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    async def write_generations(self, conn, count: int, max_age: timedelta):
+        rng = random.Random(self.seed + count)
+        now = datetime.now(timezone.utc)
+        rows = [(
+            rng.choice(self.user_ids), rng.choice(['website', 'extension']), rng.choice(['reply', 'email']),
+            'English', 'Professional', rng.randint(20, 2000), rng.randint(100, 1500), True,
+            now - timedelta(seconds=rng.uniform(0, max_age.total_seconds()))
+        ) for _ in range(count)]
+        await conn.copy_records_to_table(
+            'ai_generations', schema_name='public', records=rows,
+            columns=['user_id', 'source', 'generation_type', 'language', 'tone',
+                     'input_length', 'output_length', 'success', 'created_at']
+        )
+
+    async def run_export(self, full: bool = False) -> Dict[str, Dict]:
+        async with self.db_pool.acquire() as conn:
+            exporter = ParquetExporter(conn, self.out_dir, batch_rows=self.batch, settle=0)
+            for name in self.tables:
+                await exporter.export_table(name, full=full)
+        for name, stats in exporter.stats.items():
+            self.exported[name] = self.exported.get(name, 0) + stats['rows']
+        return exporter.stats
+
+    async def test_full_export(self):
+        """Test 1: First run exports every row; Python memory stays bounded by the batch"""
+        try:
+            tracemalloc.start()
+            stats = await self.run_export(full=True)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            # What one batch of records costs, scaled up to the whole table
+            async with self.db_pool.acquire() as conn:
+                tracemalloc.start()
+                sample = await conn.fetch("SELECT * FROM public.ai_generations LIMIT $1", self.batch)
+                per_row, _ = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            per_row /= max(len(sample), 1)
+            whole_table = per_row * stats['ai_generations']['rows']
+
+            details = {'stats': stats, 'peak_mb': round(peak / 2**20, 1),
+                       'whole_table_estimate_mb': round(whole_table / 2**20, 1)}
+            if stats['ai_generations']['rows'] >= 10 * self.batch and peak > 0.25 * whole_table:
+                self.log_test_result("Export - Full", False,
+                                     "Peak memory grows with the table rather than the batch", details)
+                return False
+            self.log_test_result(
+                "Export - Full",
+                True,
+                ", ".join(f"{name} {s['rows']} rows/{s['files']} files" for name, s in stats.items())
+                + f"; peak {details['peak_mb']} MiB (table ~{details['whole_table_estimate_mb']} MiB)",
+                details
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Export - Full", False, f"Export failed: {str(e)}")
+            return False
+
+    async def test_incremental_export(self):
+        """Test 2: Incremental run reads only new rows, late events included"""
+        try:
+            fresh, late = 2000, 500
+            async with self.db_pool.acquire() as conn:
+                await self.write_generations(conn, fresh, max_age=timedelta(minutes=5))
+                # created_at two months back: older partition, but new to the export
+                await self.write_generations(conn, late, max_age=timedelta(days=70))
+            stats = await self.run_export()
+            rows = stats['ai_generations']['rows']
+            if rows != fresh + late:
+                self.log_test_result("Export - Incremental", False,
+                                     f"Exported {rows} generations, expected {fresh + late}", stats)
+                return False
+            self.log_test_result("Export - Incremental", True,
+                                 f"{rows} new generations in {stats['ai_generations']['files']} files", stats)
+            return True
+        except Exception as e:
+            self.log_test_result("Export - Incremental", False, f"Export failed: {str(e)}")
+            return False
+
+    async def test_files_match_tables(self):
+        """Test 3: The Parquet files hold each exported row exactly once"""
+        try:
+            mismatched = {}
+            for name in self.tables:
+                directory = os.path.join(self.out_dir, name)
+                if not os.path.isdir(directory):
+                    continue
+                ids = ds.dataset(directory, format='parquet', partitioning='hive').to_table(columns=['id'])['id']
+                unique = len(set(ids.to_pylist()))
+                if len(ids) != self.exported[name] or unique != len(ids):
+                    mismatched[name] = {'rows': len(ids), 'unique': unique, 'exported': self.exported[name]}
+            if mismatched:
+                self.log_test_result("Export - Files", False, "Files disagree with exported rows", mismatched)
+                return False
+            self.log_test_result("Export - Files", True, "Every exported row appears exactly once",
+                                 {'exported': self.exported})
+            return True
+        except Exception as e:
+            self.log_test_result("Export - Files", False, f"Reading files failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the export checks"""
+        print("🚀 Starting Parquet Export Test")
+        print(f"   {self.events} generations from {self.users} users, batches of {self.batch} rows")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_full_export,
+            self.test_incremental_export,
+            self.test_files_match_tables
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Parquet export is complete and incremental!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = ParquetExportTester(
+        users=scenario_option(argv, 'users', 100),
+        events=scenario_option(argv, 'events', 100000),
+        batch=scenario_option(argv, 'batch', 5000),
+        keep='--keep' in argv,
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Response Cache Test
+Checks services.response_cache.ResponseCache wired into services.gateway.GenerationGateway,
+with the n8n stand-in run in-process and answering after --latency-ms.
+
+Repeated and trivially reworded requests must be answered from the cache with the same
+content. Tenants (companies, or individual users) must never share entries. Encrypted
+requests must always reach n8n. A cache hit must be recorded without consuming a credit.
+The cache must stay within its global and per-tenant bounds and honour its TTL. Finally a
+workload with repeated requests is run with and without the cache to show the effect on
+latency and upstream calls.
+
+Usage: python response_cache_test.py [--latency-ms=500] [--requests=400] [--distinct=100] [--concurrency=20]
+"""
+
+import time
+import random
+import asyncio
+import asyncpg
+from typing import Dict, List
+import sys
+
+from aiohttp import web
+
+from harness import TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.gateway import GenerationGateway, N8NClient, QuotaCache
+from services.ingest import GenerationIngestor
+from services.n8n_standin import create_app as create_standin
+from services.response_cache import ResponseCache
+
+REPLY = {'generationType': 'reply', 'source': 'extension', 'language': 'English', 'tone': 'Professional',
+         'intent': 'Say Yes', 'originalMessage': 'Could you send the signed contract by Friday?', 'encrypted': False}
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ResponseCacheTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, latency_ms: float = 500.0, requests: int = 400, distinct: int = 100, concurrency: int = 20,
+                 seed: int = 23, **options):
+        super().__init__(**options)
+        self.latency_ms = latency_ms
+        self.requests = requests
+        self.distinct = distinct
+        self.concurrency = concurrency
+        self.seed = seed
+        self.db_pool = None
+        self.standin = None
+        self.n8n = None
+        self.ingestor = None
+        self.companies: List[Dict] = []
+        self.user_ids: List = []
+        self.free_id = None
+
+    async def setup(self):
+        """Start the n8n stand-in and ingestor; seed two companies and individual users"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=10, connection_class=InstrumentedConnection
+            )
+            self.standin = web.AppRunner(create_standin(latency=self.latency_ms / 1000))
+            await self.standin.setup()
+            await web.TCPSite(self.standin, '127.0.0.1', 0).start()
+            port = self.standin.addresses[0][1]
+            self.n8n = N8NClient(f"http://127.0.0.1:{port}/webhook/reply", f"http://127.0.0.1:{port}/webhook/email")
+            await self.n8n.start()
+            self.ingestor = GenerationIngestor(self.db_pool, max_delay=0.05)
+            self.ingestor.start()
+
+            async with self.db_pool.acquire() as conn:
+                for _ in range(2):
+                    self.companies.append(await seed_company(conn, users=3, devices_per_user=0))
+                self.user_ids = await seed_users(conn, 20, role='pro_plus')
+                self.free_id = (await seed_users(conn, 1, role='free'))[0]
+            print(f"✅ Gateway initialized against n8n stand-in on :{port} ({self.latency_ms} ms)")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize gateway: {e}")
+            return False
+
+    async def cleanup(self):
+        """Stop the stand-in and ingestor, remove seeded users and companies, close the pool"""
+        if self.ingestor:
+            await self.ingestor.stop()
+        if self.n8n:
+            await self.n8n.close()
+        if self.standin:
+            await self.standin.cleanup()
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])",
+                                   self.user_ids + ([self.free_id] if self.free_id else []))
+                for company in self.companies:
+                    await conn.execute("DELETE FROM public.users WHERE company_id = $1", company['company_id'])
+                    await conn.execute("DELETE FROM public.companies WHERE id = $1", company['company_id'])
+            await self.db_pool.close()
+
+    def gateway(self, cache: ResponseCache = None) -> GenerationGateway:
+        return GenerationGateway(QuotaCache(self.db_pool), self.n8n, self.ingestor, cache=cache)
+
+    def upstream_calls(self) -> int:
+        stats = self.standin.app['stats']
+        return stats['reply'] + stats['email']
+
+    async def test_repeat_hits(self):
+        """Test 1: A repeated or reworded request is served from the cache"""
+        try:
+            gateway = self.gateway(ResponseCache())
+            user_id = self.user_ids[0]
+            before = self.upstream_calls()
+            _, first = await gateway.generate(user_id, REPLY)
+            _, repeat = await gateway.generate(user_id, REPLY)
+            reworded = {**REPLY, 'tone': ' professional', 'originalMessage': '  Could you send the signed\n'
+                                                                                 'contract   by Friday? '}
+            _, variant = await gateway.generate(user_id, reworded)
+            _, other_tone = await gateway.generate(user_id, {**REPLY, 'tone': 'Friendly'})
+            upstream = self.upstream_calls() - before
+
+            details = {'upstream_calls': upstream, 'cache': gateway.cache.summary()}
+            ok = (repeat.get('cached') and variant.get('cached') and not other_tone.get('cached')
+                  and repeat['content'] == first['content'] == variant['content'] and upstream == 2)
+            self.log_test_result("Cache - Repeat Hits", bool(ok),
+                                 f"4 requests, {upstream} reached n8n; repeat and reworded request hit, "
+                                 f"other tone missed" if ok else "Cache answered the wrong requests", details)
+            return bool(ok)
+        except Exception as e:
+            self.log_test_result("Cache - Repeat Hits", False, f"Generation failed: {str(e)}")
+            return False
+
+    async def test_tenant_isolation(self):
+        """Test 2: Entries are shared within a company and never across tenants"""
+        try:
+            gateway = self.gateway(ResponseCache())
+            first, second = self.companies
+            outcomes = {}
+            for label, user_id in (('company A member 1', first['user_ids'][0]),
+                                   ('company A member 2', first['user_ids'][1]),
+                                   ('company B member', second['user_ids'][0]),
+                                   ('individual 1', self.user_ids[1]),
+                                   ('individual 2', self.user_ids[2])):
+                _, response = await gateway.generate(user_id, REPLY)
+                outcomes[label] = bool(response.get('cached'))
+            expected = {'company A member 1': False, 'company A member 2': True, 'company B member': False,
+                        'individual 1': False, 'individual 2': False}
+            self.log_test_result("Cache - Tenant Isolation", outcomes == expected,
+                                 "Hits only within the same company" if outcomes == expected
+                                 else "Cache crossed a tenant boundary", {'cached': outcomes})
+            return outcomes == expected
+        except Exception as e:
+            self.log_test_result("Cache - Tenant Isolation", False, f"Generation failed: {str(e)}")
+            return False
+
+    async def test_encrypted_bypass(self):
+        """Test 3: Encrypted requests always reach n8n and are never stored"""
+        try:
+            gateway = self.gateway(ResponseCache())
+            before = self.upstream_calls()
+            for _ in range(3):
+                await gateway.generate(self.user_ids[3], {**REPLY, 'encrypted': True})
+            upstream = self.upstream_calls() - before
+            summary = gateway.cache.summary()
+            ok = upstream == 3 and summary['entries'] == 0 and summary['bypassed'] == 3
+            self.log_test_result("Cache - Encrypted Bypass", ok,
+                                 f"{upstream} of 3 encrypted requests reached n8n, {summary['entries']} stored",
+                                 summary)
+            return ok
+        except Exception as e:
+            self.log_test_result("Cache - Encrypted Bypass", False, f"Generation failed: {str(e)}")
+            return False
+
+    async def test_hits_do_not_consume_credits(self):
+        """Test 4: Hits are recorded as generations but leave the usage counters alone"""
+        try:
+            gateway = self.gateway(ResponseCache())
+            results = [await gateway.generate(self.free_id, REPLY) for _ in range(3)]
+            await gateway.drain()
+            async with self.db_pool.acquire() as conn:
+                usage = await conn.fetchrow("""
+                    SELECT u.daily_usage, (SELECT COUNT(*) FROM public.ai_generations g WHERE g.user_id = u.id) AS rows
+                    FROM public.users u WHERE u.id = $1
+                """, self.free_id)
+            details = {'statuses': [status for status, _ in results], **dict(usage)}
+            ok = all(status == 200 for status, _ in results) and usage['daily_usage'] == 1 and usage['rows'] == 3
+            self.log_test_result("Cache - Credits", ok,
+                                 f"3 identical requests: daily_usage {usage['daily_usage']}, "
+                                 f"{usage['rows']} generation rows", details)
+            return ok
+        except Exception as e:
+            self.log_test_result("Cache - Credits", False, f"Generation failed: {str(e)}")
+            return False
+
+    async def test_bounds_and_ttl(self):
+        """Test 5: Global and per-tenant bounds hold; entries expire after the TTL"""
+        try:
+            cache = ResponseCache(max_entries=50, max_per_tenant=10, ttl=0.2)
+            response = {'success': True, 'content': 'ok'}
+            for tenant in range(10):
+                for i in range(20):
+                    cache.put(tenant, {**REPLY, 'originalMessage': f"message {i}"}, response)
+            per_tenant = max(len(keys) for keys in cache.tenants.values())
+            newest_hit = cache.get(9, {**REPLY, 'originalMessage': 'message 19'}) is not None
+            oldest_gone = cache.get(0, {**REPLY, 'originalMessage': 'message 19'}) is None
+            await asyncio.sleep(0.25)
+            expired = cache.get(9, {**REPLY, 'originalMessage': 'message 18'}) is None
+            summary = cache.summary()
+            ok = len(cache.entries) <= 50 and per_tenant <= 10 and newest_hit and oldest_gone and expired
+            self.log_test_result("Cache - Bounds", ok,
+                                 f"{summary['entries']} entries (max 50), at most {per_tenant} per tenant (max 10), "
+                                 f"TTL expiry {'works' if expired else 'failed'}", summary)
+            return ok
+        except Exception as e:
+            self.log_test_result("Cache - Bounds", False, f"Bounds check failed: {str(e)}")
+            return False
+
+    async def run_workload(self, gateway: GenerationGateway) -> Dict:
+        rng = random.Random(self.seed)
+        # Zipf-like popularity: a few messages are regenerated often
+        weights = [1 / (rank + 1) for rank in range(self.distinct)]
+        picks = rng.choices(range(self.distinct), weights=weights, k=self.requests)
+        limiter = asyncio.Semaphore(self.concurrency)
+        latencies = []
+        before = self.upstream_calls()
+
+        async def one(pick: int):
+            async with limiter:
+                started = time.perf_counter()
+                await gateway.generate(self.user_ids[4 + pick % 4],
+                                       {**REPLY, 'originalMessage': f"Message number {pick}"})
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*[one(pick) for pick in picks])
+        await gateway.drain()
+        return {'p50_ms': round(percentile(latencies, 0.5), 1), 'p95_ms': round(percentile(latencies, 0.95), 1),
+                'upstream_calls': self.upstream_calls() - before}
+
+    async def test_workload(self):
+        """Test 6: Repeated-request workload with and without the cache"""
+        try:
+            without = await self.run_workload(self.gateway())
+            cache = ResponseCache()
+            with_cache = await self.run_workload(self.gateway(cache))
+            details = {'without_cache': without, 'with_cache': with_cache, 'cache': cache.summary()}
+            ok = with_cache['upstream_calls'] < without['upstream_calls'] and with_cache['p50_ms'] <= without['p50_ms']
+            self.log_test_result(
+                "Cache - Workload",
+                ok,
+                f"hit rate {cache.summary()['hit_rate']:.0%}: upstream {without['upstream_calls']} -> "
+                f"{with_cache['upstream_calls']}, p50 {without['p50_ms']} -> {with_cache['p50_ms']} ms, "
+                f"p95 {without['p95_ms']} -> {with_cache['p95_ms']} ms",
+                details
+            )
+            return ok
+        except Exception as e:
+            self.log_test_result("Cache - Workload", False, f"Workload failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the response cache checks"""
+        print("🚀 Starting Response Cache Test")
+        print(f"   {self.requests} requests over {self.distinct} messages, n8n latency {self.latency_ms} ms")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_repeat_hits,
+            self.test_tenant_isolation,
+            self.test_encrypted_bypass,
+            self.test_hits_do_not_consume_credits,
+            self.test_bounds_and_ttl,
+            self.test_workload
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Response cache is correct and isolated!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = ResponseCacheTester(
+        latency_ms=scenario_option(argv, 'latency-ms', 500.0, float),
+        requests=scenario_option(argv, 'requests', 400),
+        distinct=scenario_option(argv, 'distinct', 100),
+        concurrency=scenario_option(argv, 'concurrency', 20),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
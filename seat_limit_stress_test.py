@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Seat-Limit Concurrency Stress Test
+Fires a burst of concurrent invite_enterprise_user + accept_invitation calls at one
+company with only a few free seats, and counts over-admissions.
+
+invite_enterprise_user and accept_invitation read companies.current_users, compare it
+with max_users and only then insert/increment, without locking the company row. Each
+mode below runs the same burst against a freshly seeded company:
+
+  current   - the RPCs exactly as deployed
+  advisory  - accept_invitation serialized per company by pg_advisory_xact_lock
+  row_lock  - accept_invitation serialized by SELECT ... FOR UPDATE on the company row
+
+Usage: python seat_limit_stress_test.py [--burst=200] [--seats=10] [--concurrency=50]
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import asyncpg
+from typing import Dict
+import sys
+
+from harness import TesterBase, LockSampler, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company
+from harness.instrumentation import Histogram, InstrumentedConnection
+
+# Members already in the company before the burst
+EXISTING_MEMBERS = 40
+
+SERIALIZE = {
+    'current': None,
+    'advisory': "SELECT pg_advisory_xact_lock(hashtextextended($1::uuid::text, 0))",
+    'row_lock': "SELECT 1 FROM public.companies WHERE id = $1 FOR UPDATE"
+}
+
+
+class SeatLimitStressTester(TesterBase):
+    def __init__(self, burst: int = 200, seats: int = 10, concurrency: int = 50, **options):
+        super().__init__(**options)
+        self.burst = burst
+        self.seats = seats
+        self.concurrency = concurrency
+        self.db_pool = None
+        self.mode_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Initialize the database connection pool"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(),
+                min_size=self.concurrency,
+                max_size=self.concurrency,
+                connection_class=InstrumentedConnection
+            )
+            print(f"✅ Database pool initialized ({self.concurrency} connections)")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Close the connection pool"""
+        if self.db_pool:
+            await self.db_pool.close()
+
+    async def seed(self) -> Dict:
+        async with self.db_pool.acquire() as conn:
+            return await seed_company(
+                conn,
+                users=EXISTING_MEMBERS,
+                max_users=EXISTING_MEMBERS + 1 + self.seats,
+                devices_per_user=0
+            )
+
+    async def remove(self, company: Dict):
+        async with self.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM public.users WHERE company_id = $1", company['company_id'])
+            await conn.execute("DELETE FROM public.companies WHERE id = $1", company['company_id'])
+
+    async def invite_and_accept(self, company: Dict, index: int, mode: str, start: asyncio.Event) -> str:
+        email = f"burst-{company['tag']}-{index}@bench.test"
+        await start.wait()
+
+        async with self.db_pool.acquire() as conn:
+            invite = json.loads(await conn.fetchval(
+                "SELECT public.invite_enterprise_user($1, $2, 'enterprise_user', $3)",
+                email, f"Burst User {index}", company['manager_id']
+            ))
+            if not invite.get('success'):
+                return 'invite_rejected'
+
+            async with conn.transaction():
+                if SERIALIZE[mode]:
+                    await conn.execute(SERIALIZE[mode], company['company_id'])
+                accepted = json.loads(await conn.fetchval(
+                    "SELECT public.accept_invitation($1::uuid, $2)",
+                    invite['invitation_token'], uuid.uuid4()
+                ))
+            return 'accepted' if accepted.get('success') else 'accept_rejected'
+
+    async def run_burst(self, mode: str) -> Dict:
+        company = await self.seed()
+        start = asyncio.Event()
+        latency = Histogram()
+
+        async def worker(index):
+            started = time.perf_counter()
+            try:
+                return await self.invite_and_accept(company, index, mode, start)
+            except asyncpg.PostgresError as e:
+                return f"error:{type(e).__name__}"
+            finally:
+                latency.record((time.perf_counter() - started) * 1000)
+
+        try:
+            async with LockSampler(0.02, label=lambda: mode) as sampler:
+                tasks = [asyncio.create_task(worker(i)) for i in range(self.burst)]
+                await asyncio.sleep(0)
+                started = time.perf_counter()
+                start.set()
+                outcomes = await asyncio.gather(*tasks)
+                elapsed = time.perf_counter() - started
+
+            async with self.db_pool.acquire() as conn:
+                final = await conn.fetchrow("""
+                    SELECT c.current_users, c.max_users,
+                           (SELECT COUNT(*) FROM public.users u WHERE u.company_id = c.id) AS members
+                    FROM public.companies c WHERE c.id = $1
+                """, company['company_id'])
+        finally:
+            await self.remove(company)
+
+        counts: Dict[str, int] = {}
+        for outcome in outcomes:
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+        locks = sampler.summary(mode)
+        return {
+            'mode': mode,
+            'outcomes': counts,
+            'accepted': counts.get('accepted', 0),
+            'free_seats': self.seats,
+            'over_admissions': max(0, counts.get('accepted', 0) - self.seats),
+            'current_users': final['current_users'],
+            'max_users': final['max_users'],
+            'members': final['members'],
+            'elapsed_s': round(elapsed, 3),
+            'throughput_ops': round(self.burst / elapsed, 1),
+            'latency': latency.summary(),
+            'blocked_ms': round(sum(row['blocked_ms'] for row in locks['blocked']), 1),
+            'top_blocking': locks['blocked'][:3]
+        }
+
+    async def check_mode(self, mode: str, name: str, must_hold: bool) -> bool:
+        result = await self.run_burst(mode)
+        self.mode_results[mode] = result
+        over = result['over_admissions']
+        errors = sum(count for outcome, count in result['outcomes'].items() if outcome.startswith('error:'))
+
+        message = (
+            f"{result['accepted']} accepted for {self.seats} free seats "
+            f"({over} over-admitted), {result['throughput_ops']} ops/s, "
+            f"p95 {result['latency']['p95_ms']:.1f} ms, {result['blocked_ms']:.0f} ms blocked on locks"
+        )
+        if errors:
+            # A burst that errored out never exercised the seat check
+            message = f"{errors} attempts failed with database errors; " + message
+        elif result['accepted'] < self.seats:
+            message = f"only {result['accepted']} of {self.seats} free seats filled; " + message
+        elif over and not must_hold:
+            message = "⚠️ " + message
+        success = errors == 0 and result['accepted'] >= self.seats and (over == 0 or not must_hold)
+        self.log_test_result(name, success, message, result)
+        return success
+
+    async def test_current_seat_enforcement(self):
+        """Test 1: Burst against the RPCs as deployed (over-admissions reported, not failed)"""
+        return await self.check_mode('current', "Seat Limit - Current RPCs", must_hold=False)
+
+    async def test_advisory_lock_seat_enforcement(self):
+        """Test 2: Burst with accept_invitation serialized by a per-company advisory lock"""
+        return await self.check_mode('advisory', "Seat Limit - Advisory Lock", must_hold=True)
+
+    async def test_row_lock_seat_enforcement(self):
+        """Test 3: Burst with accept_invitation serialized by locking the company row"""
+        return await self.check_mode('row_lock', "Seat Limit - Company Row Lock", must_hold=True)
+
+    def print_comparison(self):
+        if not self.mode_results:
+            return
+        baseline = self.mode_results.get('current')
+        print("📊 Seat enforcement cost")
+        print(f"   {'mode':<10} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'blocked ms':>11} {'over':>5}")
+        for mode, result in self.mode_results.items():
+            relative = ''
+            if baseline and mode != 'current':
+                relative = f"  ({result['throughput_ops'] / baseline['throughput_ops']:.0%} of current)"
+            print(
+                f"   {mode:<10} {result['throughput_ops']:>8.1f} {result['latency']['p50_ms']:>8.1f} "
+                f"{result['latency']['p95_ms']:>8.1f} {result['latency']['p99_ms']:>8.1f} "
+                f"{result['blocked_ms']:>11.0f} {result['over_admissions']:>5}{relative}"
+            )
+
+    async def run_all_tests(self):
+        """Run the burst once per enforcement mode"""
+        print("🚀 Starting Seat-Limit Concurrency Stress Test")
+        print(f"   {self.burst} concurrent invite+accept, {self.seats} free seats, "
+              f"{self.concurrency} connections")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_current_seat_enforcement,
+            self.test_advisory_lock_seat_enforcement,
+            self.test_row_lock_seat_enforcement
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        self.print_comparison()
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Serialized variants enforced the seat limit under burst load!")
+        else:
+            print("⚠️ Seat limit was exceeded. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = SeatLimitStressTester(
+        burst=scenario_option(argv, 'burst', 200),
+        seats=scenario_option(argv, 'seats', 10),
+        concurrency=scenario_option(argv, 'concurrency', 50),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,4 @@
+"""
+Python runtime services for MailoReply AI (ingest workers and maintenance jobs)
+that sit next to the Supabase database.
+"""
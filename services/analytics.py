@@ -0,0 +1,408 @@
+"""
+Offline usage analytics over exported ai_generations rows.
+
+export_generations streams ai_generations out with a binary COPY and decodes it
+straight into columnar NumPy arrays, so reports run on the worker rather than as
+long aggregate queries on the database that serves users (point
+ANALYTICS_DATABASE_URL at a read replica to keep the scan off the primary too).
+
+Every exported column is fixed width and non-null, which makes each COPY row
+the same size and lets a whole chunk be decoded with one np.frombuffer:
+
+- source and the user's role are enums, sent as their position in the enum;
+- generation_type, language and tone are free text, sent as hashtext() and
+  mapped back to labels afterwards (from the usage rollups of the export
+  window, then one lookup over the exported rows for any code still unknown;
+  two labels sharing a code are an error rather than silently merged);
+- a missing company is the nil UUID and a missing length is -1.
+
+GenerationFrame then offers grouped counts and sums, per-group percentiles and
+category mix over day/week/month buckets, all as vectorized NumPy operations.
+
+Run ``python -m services.analytics [--since=YYYY-MM-DD] [--until=YYYY-MM-DD]``
+for the standard report.
+"""
+
+import asyncio
+import os
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options
+
+NIL_UUID = uuid.UUID(int=0)
+PG_EPOCH_US = 946_684_800 * 1_000_000  # 2000-01-01, the binary COPY timestamp origin
+
+# (name, select expression, big-endian NumPy dtype of the binary value)
+COLUMNS = [
+    ('created_at', "g.created_at", '>i8'),
+    ('user_id', "g.user_id", 'V16'),
+    ('company_id', f"COALESCE(g.company_id, '{NIL_UUID}'::uuid)", 'V16'),
+    ('role', "COALESCE(array_position(enum_range(NULL::user_role), u.role), 0)::int2", '>i2'),
+    ('source', "array_position(enum_range(NULL::generation_source), g.source)::int2", '>i2'),
+    ('generation_type', "hashtext(g.generation_type)", '>i4'),
+    ('language', "hashtext(g.language)", '>i4'),
+    ('tone', "hashtext(g.tone)", '>i4'),
+    ('input_length', "COALESCE(g.input_length, -1)", '>i4'),
+    ('output_length', "COALESCE(g.output_length, -1)", '>i4'),
+    ('success', "g.success", '?')
+]
+
+ENUM_COLUMNS = {'role': 'user_role', 'source': 'generation_source'}
+HASHED_COLUMNS = ('generation_type', 'language', 'tone')
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+
+def row_dtype():
+    """One binary COPY tuple: field count, then (length, value) per column"""
+    fields = [('field_count', '>i2')]
+    for name, _, dtype in COLUMNS:
+        fields.append((f'{name}_length', '>i4'))
+        fields.append((name, dtype))
+    return np.dtype(fields)
+
+
+@dataclass
+class Categorical:
+    """Dense integer codes plus the label of each code"""
+    codes: 'np.ndarray'
+    labels: List
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def from_values(cls, values: 'np.ndarray', label=lambda value: value) -> 'Categorical':
+        unique, inverse = np.unique(values, return_inverse=True)
+        return cls(inverse.astype(np.int32), [label(value) for value in unique])
+
+
+def _uuid_label(value) -> uuid.UUID:
+    return uuid.UUID(bytes=value.tobytes())
+
+
+class GenerationFrame:
+    """Columnar ai_generations rows with vectorized grouping"""
+
+    def __init__(self, columns: Dict[str, 'np.ndarray'], labels: Dict[str, Dict[int, str]]):
+        self.created_at = (columns['created_at'].astype(np.int64) + PG_EPOCH_US).astype('datetime64[us]')
+        self.success = columns['success'].astype(bool)
+        self.input_length = columns['input_length'].astype(np.int32)
+        self.output_length = columns['output_length'].astype(np.int32)
+        self.categories: Dict[str, Categorical] = {
+            'user': Categorical.from_values(columns['user_id'], _uuid_label),
+            'company': Categorical.from_values(columns['company_id'], _uuid_label)
+        }
+        for name, mapping in labels.items():
+            self.categories[name] = Categorical.from_values(
+                columns[name].astype(np.int64), lambda code, mapping=mapping: mapping.get(int(code), f'#{code}')
+            )
+
+    def __len__(self):
+        return len(self.created_at)
+
+    def bucket(self, period: str) -> Categorical:
+        """created_at bucketed by 'day', 'week' (starting Monday) or 'month', UTC"""
+        days = self.created_at.astype('datetime64[D]')
+        if period == 'day':
+            values = days
+        elif period == 'week':
+            ordinal = days.astype(np.int64)
+            # 1970-01-01 was a Thursday
+            values = (ordinal - (ordinal + 3) % 7).astype('datetime64[D]')
+        elif period == 'month':
+            values = self.created_at.astype('datetime64[M]')
+        else:
+            raise ValueError(f"Unknown period {period!r}")
+        return Categorical.from_values(values, lambda value: str(value))
+
+    def category(self, name: str) -> Categorical:
+        if name in ('day', 'week', 'month'):
+            return self.bucket(name)
+        return self.categories[name]
+
+    def mask(self, name: str, label) -> 'np.ndarray':
+        """Rows whose `name` category is `label`"""
+        key = self.category(name)
+        if label not in key.labels:
+            return np.zeros(len(self), bool)
+        return key.codes == key.labels.index(label)
+
+    def _group(self, by: Sequence[str], where: Optional['np.ndarray']):
+        """Flat group index per row, the key categoricals and the shape of the key space"""
+        keys = [self.category(name) for name in by]
+        shape = tuple(max(len(key.labels), 1) for key in keys)
+        index = np.ravel_multi_index([key.codes for key in keys], shape) if keys else np.zeros(len(self), np.int64)
+        if where is not None:
+            index = index[where]
+        return index, keys, shape
+
+    def aggregate(self, by: Sequence[str], value: Optional[str] = None, how: str = 'count',
+                  where: Optional['np.ndarray'] = None) -> Dict[Tuple, float]:
+        """{(label, ...): count | sum | mean of `value`} for every non-empty group"""
+        index, keys, shape = self._group(by, where)
+        size = int(np.prod(shape))
+        counts = np.bincount(index, minlength=size)
+        if how == 'count':
+            result = counts
+        else:
+            values = getattr(self, value)
+            if where is not None:
+                values = values[where]
+            # Lengths are -1 where the row had none; leave those out
+            present = values >= 0
+            sums = np.bincount(index, weights=np.where(present, values, 0).astype(np.float64), minlength=size)
+            if how == 'sum':
+                result = sums
+            elif how == 'mean':
+                present_counts = np.bincount(index, weights=present, minlength=size)
+                result = np.divide(sums, present_counts, out=np.zeros(size), where=present_counts > 0)
+            else:
+                raise ValueError(f"Unknown aggregate {how!r}")
+
+        groups = {}
+        for flat in np.flatnonzero(counts):
+            codes = np.unravel_index(flat, shape)
+            groups[tuple(key.labels[code] for key, code in zip(keys, codes))] = result[flat].item()
+        return groups
+
+    def top(self, by: str, n: int = 10, where: Optional['np.ndarray'] = None) -> List[Tuple]:
+        """The n largest groups of `by` by row count"""
+        key = self.category(by)
+        codes = key.codes if where is None else key.codes[where]
+        counts = np.bincount(codes, minlength=len(key.labels))
+        order = np.argsort(counts)[::-1][:n]
+        return [(key.labels[code], int(counts[code])) for code in order if counts[code] > 0]
+
+    def percentiles(self, per: Sequence[str], across: str, q: Sequence[float] = (50, 90, 99),
+                    where: Optional['np.ndarray'] = None) -> Dict:
+        """
+        Percentiles of the row count per `per` group (e.g. generations per user and
+        month), split by `across` (e.g. role). Groups with no rows do not count.
+        """
+        index, _, shape = self._group(per, where)
+        size = int(np.prod(shape))
+        counts = np.bincount(index, minlength=size)
+        across_key = self.category(across)
+        across_codes = across_key.codes if where is None else across_key.codes[where]
+        # `across` is assumed constant within a group; take any row's value
+        group_across = np.full(size, -1, np.int64)
+        group_across[index] = across_codes
+
+        result = {}
+        for code, label in enumerate(across_key.labels):
+            values = counts[(group_across == code) & (counts > 0)]
+            if len(values):
+                result[label] = {
+                    'groups': int(len(values)),
+                    **{f'p{p:g}': float(v) for p, v in zip(q, np.percentile(values, q))}
+                }
+        return result
+
+    def mix(self, column: str, period: str, where: Optional['np.ndarray'] = None) -> Tuple[List, List, 'np.ndarray']:
+        """(bucket labels, category labels, share matrix) of `column` within each `period` bucket"""
+        buckets = self.bucket(period)
+        key = self.category(column)
+        width = len(key.labels)
+        index = buckets.codes.astype(np.int64) * width + key.codes
+        if where is not None:
+            index = index[where]
+        counts = np.bincount(index, minlength=len(buckets.labels) * width).reshape(len(buckets.labels), width)
+        totals = counts.sum(axis=1, keepdims=True)
+        shares = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+        return buckets.labels, key.labels, shares
+
+
+class CopyDecoder:
+    """Incremental decoder for a binary COPY stream of COLUMNS"""
+
+    def __init__(self):
+        self.dtype = row_dtype()
+        self.buffer = bytearray()
+        self.header_done = False
+        self.chunks: List['np.ndarray'] = []
+        self.rows = 0
+
+    async def feed(self, data: bytes):
+        self.buffer += data
+        if not self.header_done:
+            if len(self.buffer) < 19:
+                return
+            if bytes(self.buffer[:11]) != COPY_SIGNATURE:
+                raise ValueError("Not a binary COPY stream")
+            extension = int.from_bytes(self.buffer[15:19], 'big')
+            if len(self.buffer) < 19 + extension:
+                return
+            del self.buffer[:19 + extension]
+            self.header_done = True
+
+        complete = len(self.buffer) // self.dtype.itemsize
+        if not complete:
+            return
+        end = complete * self.dtype.itemsize
+        chunk = np.frombuffer(bytes(self.buffer[:end]), dtype=self.dtype)
+        del self.buffer[:end]
+        self._check(chunk)
+        self.chunks.append(chunk)
+        self.rows += complete
+
+    def _check(self, chunk: 'np.ndarray'):
+        if (chunk['field_count'] != len(COLUMNS)).any():
+            raise ValueError("Unexpected field count in COPY stream")
+        for name, _, dtype in COLUMNS:
+            if (chunk[f'{name}_length'] != np.dtype(dtype).itemsize).any():
+                raise ValueError(f"Column {name} is not fixed width (NULL in the export?)")
+
+    def finish(self) -> Dict[str, 'np.ndarray']:
+        # What remains is the file trailer: a field count of -1
+        if bytes(self.buffer) != b'\xff\xff':
+            raise ValueError(f"Truncated COPY stream ({len(self.buffer)} trailing bytes)")
+        rows = np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=self.dtype)
+        return {name: np.ascontiguousarray(rows[name]) for name, _, _ in COLUMNS}
+
+
+def _export_conditions(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       user_ids: Optional[Sequence[uuid.UUID]] = None) -> List[str]:
+    # COPY takes no bind parameters; every inlined value is a parsed date or UUID
+    conditions = ["g.created_at IS NOT NULL"]
+    if since:
+        conditions.append(f"g.created_at >= '{since.isoformat()}'::timestamptz")
+    if until:
+        conditions.append(f"g.created_at < '{until.isoformat()}'::timestamptz")
+    if user_ids is not None:
+        ids = ','.join(str(uuid.UUID(str(user_id))) for user_id in user_ids)
+        conditions.append(f"g.user_id = ANY('{{{ids}}}'::uuid[])")
+    return conditions
+
+
+def export_query(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 user_ids: Optional[Sequence[uuid.UUID]] = None) -> str:
+    select = ',\n       '.join(expression for _, expression, _ in COLUMNS)
+    return (f"SELECT {select}\nFROM public.ai_generations g\n"
+            f"LEFT JOIN public.users u ON u.id = g.user_id\n"
+            f"WHERE {' AND '.join(_export_conditions(since, until, user_ids))}")
+
+
+async def _hash_labels(conn, column: str, codes: 'np.ndarray', since: Optional[datetime] = None,
+                       until: Optional[datetime] = None,
+                       user_ids: Optional[Sequence[uuid.UUID]] = None) -> Dict[int, str]:
+    """Map hashtext() codes back to the text they came from, within the export's rows"""
+    wanted = {int(code) for code in np.unique(codes)}
+    found: Dict[int, set] = {}
+
+    # Rollup days are UTC dates, so the day bounds cover the export window
+    conditions = []
+    if since:
+        conditions.append(f"r.day >= '{since.astimezone(timezone.utc).date().isoformat()}'::date")
+    if until:
+        conditions.append(f"r.day <= '{until.astimezone(timezone.utc).date().isoformat()}'::date")
+    if user_ids is not None:
+        ids = ','.join(str(uuid.UUID(str(user_id))) for user_id in user_ids)
+        conditions.append(f"r.user_id = ANY('{{{ids}}}'::uuid[])")
+    try:
+        rows = await conn.fetch(
+            f"SELECT DISTINCT r.{column} AS label, hashtext(r.{column}) AS code FROM public.usage_daily_user r"
+            + (f" WHERE {' AND '.join(conditions)}" if conditions else ""))
+        for row in rows:
+            if row['code'] in wanted:
+                found.setdefault(row['code'], set()).add(row['label'])
+    except asyncpg.UndefinedTableError:
+        pass
+
+    # Not rolled up yet: one pass over the exported rows for every code still unknown
+    missing = sorted(wanted - found.keys())
+    if missing:
+        rows = await conn.fetch(
+            f"SELECT DISTINCT g.{column} AS label, hashtext(g.{column}) AS code FROM public.ai_generations g "
+            f"WHERE {' AND '.join(_export_conditions(since, until, user_ids))} "
+            f"AND hashtext(g.{column}) = ANY($1::int[])", missing)
+        for row in rows:
+            found.setdefault(row['code'], set()).add(row['label'])
+
+    collisions = {code: sorted(values) for code, values in found.items() if len(values) > 1}
+    if collisions:
+        raise ValueError(f"hashtext() collision in {column}, cannot tell apart: "
+                         + '; '.join(' / '.join(values) for values in collisions.values()))
+    return {code: values.pop() for code, values in found.items()}
+
+
+async def export_generations(conn, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                             user_ids: Optional[Sequence[uuid.UUID]] = None) -> GenerationFrame:
+    """Stream matching ai_generations rows into a GenerationFrame"""
+    decoder = CopyDecoder()
+    await conn.copy_from_query(export_query(since, until, user_ids), output=decoder.feed, format='binary')
+    columns = decoder.finish()
+
+    labels: Dict[str, Dict[int, str]] = {}
+    for name, enum_type in ENUM_COLUMNS.items():
+        values = await conn.fetchval(f"SELECT enum_range(NULL::{enum_type})::text[]")
+        labels[name] = {position: value for position, value in enumerate(values, 1)}
+        labels[name][0] = 'none'
+    for name in HASHED_COLUMNS:
+        labels[name] = await _hash_labels(conn, name, columns[name], since, until, user_ids)
+    return GenerationFrame(columns, labels)
+
+
+def print_report(frame: GenerationFrame):
+    successful = frame.success
+    print(f"📊 {len(frame)} generations ({int(successful.sum())} successful)")
+
+    print("🏢 Top companies by successful generations")
+    for company_id, count in frame.top('company', n=10, where=successful & ~frame.mask('company', NIL_UUID)):
+        print(f"   {company_id}  {count}")
+
+    print("👥 Successful generations per user and month, by role")
+    for role, stats in frame.percentiles(('user', 'month'), across='role', where=successful).items():
+        print(f"   {role:<20} users-months {stats['groups']:>7}  p50 {stats['p50']:>7.0f}  "
+              f"p90 {stats['p90']:>7.0f}  p99 {stats['p99']:>7.0f}")
+
+    for column in ('language', 'tone'):
+        months, labels, shares = frame.mix(column, 'month')
+        print(f"🗣️ {column.capitalize()} mix by month")
+        print("   " + " " * 10 + "".join(f"{str(label)[:12]:>13}" for label in labels))
+        for month, row in zip(months, shares):
+            print(f"   {month:<10}" + "".join(f"{share:>12.1%} " for share in row))
+
+
+def _date_option(argv: List[str], name: str) -> Optional[datetime]:
+    for arg in argv:
+        if arg.startswith(f'--{name}='):
+            return datetime.combine(date.fromisoformat(arg.split('=', 1)[1]), datetime.min.time(), timezone.utc)
+    return None
+
+
+async def main(argv: List[str]) -> int:
+    options = ({'dsn': os.environ['ANALYTICS_DATABASE_URL']} if os.environ.get('ANALYTICS_DATABASE_URL')
+               else database_options())
+    conn = await asyncpg.connect(**options)
+    try:
+        started = time.perf_counter()
+        frame = await export_generations(conn, since=_date_option(argv, 'since'), until=_date_option(argv, 'until'))
+        print(f"✅ Exported {len(frame)} generations in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"❌ Export failed: {e}")
+        return 1
+    finally:
+        await conn.close()
+
+    print_report(frame)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,421 @@
+"""
+Per-company daily usage sketches: distinct active users and generations per
+user, without GROUP BYs over ai_generations at read time.
+
+company_usage_sketches (company_usage_sketches.sql) holds, for each company
+and UTC day, a HyperLogLog of the users who generated and a t-digest of how
+many generations each of them made (services/sketches.py). Both merge, so a
+month of distinct users or p95 generations per user-day is a merge of at most
+31 small rows, and sketches built on other shards merge the same way.
+
+The job follows ai_generations by ingested_at like services/rollups.py, with
+its own watermark in usage_rollup_state. Days that can still receive rows are
+"open" and kept in memory as exact per-user counters; each refresh rewrites
+the sketches of the open days it touched, in the same transaction that moves
+the watermark. A day closes once the watermark is `grace` seconds past its
+end and is dropped from memory. Rows that arrive later still (offline
+extension events) are merged into the stored sketch: they count towards
+generations and distinct users, and are tallied in late_generations, but a
+per-user count cannot be amended inside a t-digest, so they leave user_counts
+as it was.
+
+Open days are rebuilt from raw rows below the watermark at start-up, after a
+failed refresh, and whenever another process has moved the watermark, so the
+in-memory state never has to survive a restart.
+
+The usage endpoint applies the check of get_company_usage_sketch: only the
+company's managers and superusers may read it, and anyone else gets a 403.
+Like the gateway, it trusts the userId it is given and belongs behind the
+app server, which checks the session first.
+
+Run with ``python -m services.company_sketches`` (refresh every
+SKETCH_INTERVAL_SECONDS and serve GET /companies/{id}/usage?userId=...&days=30
+on SKETCH_PORT), ``--once`` for a single catch-up, or ``--rebuild[=YYYY-MM-DD]``
+to rebuild stored sketches from that day (default: the oldest generation).
+"""
+
+import asyncio
+import sys
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from .config import database_options, env_float, env_int
+from .sketches import HyperLogLog, TDigest
+
+STATE_NAME = 'company_sketches'
+PRECISION = 12
+COMPRESSION = 100
+
+# The access rule of get_company_usage_sketch
+CAN_VIEW_USAGE_SQL = """
+SELECT EXISTS (
+  SELECT 1 FROM public.users
+  WHERE id = $1
+    AND ((role = 'enterprise_manager' AND company_id = $2) OR role = 'superuser')
+)
+"""
+ACCESS_DENIED = 'Access denied: only company managers can view company usage'
+
+LOCK_STATE_SQL = """
+SELECT watermark, LEAST(NOW() - make_interval(secs => $2), watermark + make_interval(secs => $3)) AS upper
+FROM public.usage_rollup_state
+WHERE name = $1
+FOR UPDATE
+"""
+
+# {rows} selects the raw rows; its parameters start at $1
+GROUPED_SQL = """
+SELECT company_id, (created_at AT TIME ZONE 'UTC')::date AS day, user_id, COUNT(*) AS generations
+FROM public.ai_generations
+WHERE company_id IS NOT NULL AND {rows}
+GROUP BY 1, 2, 3
+"""
+
+WINDOW_SQL = GROUPED_SQL.format(rows="ingested_at >= $1 AND ingested_at < $2")
+
+# Days from $1 on, as of watermark $2
+SINCE_SQL = GROUPED_SQL.format(rows="""
+    created_at >= $1::date::timestamp AT TIME ZONE 'UTC'
+    AND (ingested_at IS NULL OR ingested_at < $2)
+""")
+
+# Days [$1, $2) as of watermark $3
+RANGE_SQL = GROUPED_SQL.format(rows="""
+    created_at >= $1::date::timestamp AT TIME ZONE 'UTC'
+    AND created_at < $2::date::timestamp AT TIME ZONE 'UTC'
+    AND (ingested_at IS NULL OR ingested_at < $3)
+""")
+
+UPSERT_SQL = """
+INSERT INTO public.company_usage_sketches AS s
+  (company_id, day, generations, distinct_users, user_counts, distinct_users_estimate,
+   p50_per_user, p95_per_user, late_generations, updated_at)
+VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, NOW())
+ON CONFLICT (company_id, day) DO UPDATE SET
+  generations = EXCLUDED.generations,
+  distinct_users = EXCLUDED.distinct_users,
+  user_counts = EXCLUDED.user_counts,
+  distinct_users_estimate = EXCLUDED.distinct_users_estimate,
+  p50_per_user = EXCLUDED.p50_per_user,
+  p95_per_user = EXCLUDED.p95_per_user,
+  late_generations = EXCLUDED.late_generations,
+  updated_at = NOW()
+"""
+
+
+def first_open_day(at: datetime, grace: float) -> date:
+    """Oldest UTC day that can still take rows ingested at or after `at`"""
+    return (at - timedelta(seconds=grace)).astimezone(timezone.utc).date()
+
+
+class CompanyDay:
+    """Exact per-user generation counts for one company and day"""
+
+    def __init__(self):
+        self.users: Counter = Counter()
+
+    def add(self, user_id: uuid.UUID, generations: int = 1):
+        self.users[user_id] += generations
+
+    def sketches(self) -> Tuple[HyperLogLog, TDigest]:
+        distinct = HyperLogLog(PRECISION)
+        counts = TDigest(COMPRESSION)
+        for user_id, generations in self.users.items():
+            distinct.add(user_id)
+            counts.add(generations)
+        return distinct, counts
+
+
+def sketch_row(company_id, day: date, generations: int, distinct: HyperLogLog, counts: TDigest,
+               late: int = 0) -> Tuple:
+    return (company_id, day, generations, distinct.to_bytes(), counts.to_bytes(), len(distinct),
+            counts.quantile(0.5), counts.quantile(0.95), late)
+
+
+def day_row(company_id, day: date, state: CompanyDay) -> Tuple:
+    distinct, counts = state.sketches()
+    return sketch_row(company_id, day, sum(state.users.values()), distinct, counts)
+
+
+def group(rows: Iterable) -> Dict[Tuple, CompanyDay]:
+    days: Dict[Tuple, CompanyDay] = {}
+    for row in rows:
+        days.setdefault((row['company_id'], row['day']), CompanyDay()).add(row['user_id'], row['generations'])
+    return days
+
+
+class CompanySketchJob:
+    """Keep company_usage_sketches current from newly ingested ai_generations rows"""
+
+    def __init__(self, pool, grace: float = 7200.0, settle: float = 60.0, max_window: float = 3600.0):
+        self.pool = pool
+        self.grace = grace
+        self.settle = settle
+        self.max_window = max_window
+        self.open_days: Dict[Tuple, CompanyDay] = {}
+        # Watermark the open days reflect; None until loaded
+        self.watermark: Optional[datetime] = None
+        self.stats = {'refreshes': 0, 'generations': 0, 'sketches_written': 0, 'late_generations': 0,
+                      'closed_days': 0, 'reloads': 0, 'rebuilt_days': 0}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def _lock_state(self, conn):
+        state = await conn.fetchrow(LOCK_STATE_SQL, STATE_NAME, self.settle, self.max_window)
+        if state is None:
+            raise RuntimeError("usage_rollup_state has no company_sketches row; run company_usage_sketches.sql")
+        return state
+
+    async def _load(self, conn, watermark: datetime):
+        """Rebuild the open days from raw rows below the watermark"""
+        rows = await conn.fetch(SINCE_SQL, first_open_day(watermark, self.grace), watermark)
+        self.open_days = group(rows)
+        self.watermark = watermark
+        self.stats['reloads'] += 1
+
+    async def _merge_late(self, conn, key: Tuple, late: CompanyDay) -> Tuple:
+        stored = await conn.fetchrow(
+            "SELECT generations, distinct_users, user_counts, late_generations FROM public.company_usage_sketches "
+            "WHERE company_id = $1 AND day = $2 FOR UPDATE", *key)
+        distinct = HyperLogLog.from_bytes(stored['distinct_users']) if stored else HyperLogLog(PRECISION)
+        counts = TDigest.from_bytes(stored['user_counts']) if stored else TDigest(COMPRESSION)
+        distinct.update(late.users)
+        generations = sum(late.users.values())
+        return sketch_row(*key, (stored['generations'] if stored else 0) + generations, distinct, counts,
+                          (stored['late_generations'] if stored else 0) + generations)
+
+    async def refresh(self) -> Dict:
+        """Apply at most one window; returns counts, with 'caught_up' once the watermark is current"""
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    state = await self._lock_state(conn)
+                    if self.watermark != state['watermark']:
+                        await self._load(conn, state['watermark'])
+                    if state['upper'] <= state['watermark']:
+                        return {'generations': 0, 'sketches': 0, 'late_generations': 0, 'caught_up': True}
+
+                    open_from = first_open_day(state['upper'], self.grace)
+                    touched = set()
+                    late_days: Dict[Tuple, CompanyDay] = {}
+                    generations = 0
+                    for row in await conn.fetch(WINDOW_SQL, state['watermark'], state['upper']):
+                        key = (row['company_id'], row['day'])
+                        days = self.open_days if row['day'] >= open_from else late_days
+                        days.setdefault(key, CompanyDay()).add(row['user_id'], row['generations'])
+                        generations += row['generations']
+                        if days is self.open_days:
+                            touched.add(key)
+
+                    rows = [day_row(*key, self.open_days[key]) for key in touched]
+                    for key, late in late_days.items():
+                        rows.append(await self._merge_late(conn, key, late))
+                    if rows:
+                        await conn.executemany(UPSERT_SQL, rows)
+                    await conn.execute(
+                        "UPDATE public.usage_rollup_state SET watermark = $2, updated_at = NOW() WHERE name = $1",
+                        STATE_NAME, state['upper']
+                    )
+            except BaseException:
+                # Open days may hold rows from the rolled-back window
+                self.watermark = None
+                raise
+
+        self.watermark = state['upper']
+        closed = [key for key in self.open_days if key[1] < open_from]
+        for key in closed:
+            del self.open_days[key]
+
+        late_generations = sum(sum(late.users.values()) for late in late_days.values())
+        self.stats['refreshes'] += 1
+        self.stats['generations'] += generations
+        self.stats['sketches_written'] += len(rows)
+        self.stats['late_generations'] += late_generations
+        self.stats['closed_days'] += len(closed)
+        return {
+            'generations': generations,
+            'sketches': len(rows),
+            'late_generations': late_generations,
+            'caught_up': state['upper'] - state['watermark'] < timedelta(seconds=self.max_window)
+        }
+
+    async def catch_up(self) -> Dict:
+        """Refresh window after window until the watermark is current"""
+        total = {'generations': 0, 'sketches': 0, 'late_generations': 0}
+        while True:
+            applied = await self.refresh()
+            for key in total:
+                total[key] += applied[key]
+            if applied['caught_up']:
+                return total
+
+    async def rebuild(self, start: Optional[date] = None, end: Optional[date] = None, chunk_days: int = 7) -> int:
+        """Recompute stored sketches for days [start, end) from raw rows, one chunk per transaction"""
+        async with self.pool.acquire() as conn:
+            if start is None:
+                start = await conn.fetchval(
+                    "SELECT (MIN(created_at) AT TIME ZONE 'UTC')::date FROM public.ai_generations "
+                    "WHERE company_id IS NOT NULL")
+            if end is None:
+                end = await conn.fetchval("SELECT (NOW() AT TIME ZONE 'UTC')::date + 1")
+            if start is None:
+                return 0
+
+            day = start
+            while day < end:
+                chunk_end = min(day + timedelta(days=chunk_days), end)
+                async with conn.transaction():
+                    state = await self._lock_state(conn)
+                    days = group(await conn.fetch(RANGE_SQL, day, chunk_end, state['watermark']))
+                    await conn.execute(
+                        "DELETE FROM public.company_usage_sketches WHERE day >= $1 AND day < $2", day, chunk_end)
+                    if days:
+                        await conn.executemany(UPSERT_SQL, [day_row(*key, value) for key, value in days.items()])
+                print(f"   rebuilt {day} .. {chunk_end - timedelta(days=1)}: {len(days)} company days")
+                self.stats['rebuilt_days'] += (chunk_end - day).days
+                day = chunk_end
+        return self.stats['rebuilt_days']
+
+    def start(self, interval: float):
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def _run(self, interval: float):
+        while not self._stopping.is_set():
+            try:
+                applied = await self.catch_up()
+                if applied['generations']:
+                    print(f"✅ Sketched {applied['generations']} generations into {applied['sketches']} "
+                          f"company days ({applied['late_generations']} late)")
+            except Exception as e:
+                print(f"⚠️ Sketch refresh failed, retrying in {interval}s: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            await self._task
+
+
+async def company_summary(conn, company_id: uuid.UUID, start: date, end: date) -> Dict:
+    """Merge a company's sketches for days [start, end)
+
+    distinct_users counts each user once over the whole range; the percentiles
+    are of generations per active user-day.
+    """
+    rows = await conn.fetch(
+        "SELECT day, generations, distinct_users, user_counts, distinct_users_estimate, p50_per_user, "
+        "p95_per_user, late_generations FROM public.company_usage_sketches "
+        "WHERE company_id = $1 AND day >= $2 AND day < $3 ORDER BY day",
+        company_id, start, end
+    )
+    distinct = HyperLogLog(PRECISION)
+    counts = TDigest(COMPRESSION)
+    for row in rows:
+        distinct.merge(HyperLogLog.from_bytes(row['distinct_users']))
+        counts.merge(TDigest.from_bytes(row['user_counts']))
+    return {
+        'company_id': str(company_id),
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'generations': sum(row['generations'] for row in rows),
+        'late_generations': sum(row['late_generations'] for row in rows),
+        'distinct_users': len(distinct),
+        'p50_per_user_day': counts.quantile(0.5),
+        'p95_per_user_day': counts.quantile(0.95),
+        'days': [{
+            'day': row['day'].isoformat(),
+            'generations': row['generations'],
+            'distinct_users': row['distinct_users_estimate'],
+            'p50_per_user': row['p50_per_user'],
+            'p95_per_user': row['p95_per_user']
+        } for row in rows]
+    }
+
+
+def create_app(pool, job: CompanySketchJob) -> 'web.Application':
+    async def usage(request):
+        try:
+            company_id = uuid.UUID(request.match_info['company_id'])
+            user_id = uuid.UUID(request.query['userId'])
+            days = int(request.query.get('days', 30))
+        except (KeyError, ValueError) as e:
+            return web.json_response({'success': False, 'error': f"Invalid request: {e}"}, status=400)
+        end = datetime.now(timezone.utc).date() + timedelta(days=1)
+        async with pool.acquire() as conn:
+            if not await conn.fetchval(CAN_VIEW_USAGE_SQL, user_id, company_id):
+                return web.json_response({'success': False, 'error': ACCESS_DENIED}, status=403)
+            summary = await company_summary(conn, company_id, end - timedelta(days=days), end)
+        return web.json_response({'success': True, **summary})
+
+    async def stats(request):
+        return web.json_response({**job.stats, 'open_days': len(job.open_days)})
+
+    app = web.Application()
+    app.router.add_get('/companies/{company_id}/usage', usage)
+    app.router.add_get('/sketches/stats', stats)
+    return app
+
+
+def rebuild_start(argv: List[str]) -> Optional[date]:
+    for arg in argv:
+        if arg.startswith('--rebuild='):
+            return date.fromisoformat(arg.split('=', 1)[1])
+    return None
+
+
+async def main(argv: List[str]) -> int:
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=3)
+    job = CompanySketchJob(
+        pool,
+        grace=env_float('SKETCH_GRACE_SECONDS', 7200.0),
+        settle=env_float('SKETCH_SETTLE_SECONDS', 60.0),
+        max_window=env_float('SKETCH_MAX_WINDOW_SECONDS', 3600.0)
+    )
+    runner = None
+    try:
+        if any(arg == '--rebuild' or arg.startswith('--rebuild=') for arg in argv):
+            days = await job.rebuild(rebuild_start(argv))
+            print(f"✅ Rebuilt {days} days of company sketches")
+        elif '--once' in argv:
+            applied = await job.catch_up()
+            print(f"✅ Sketched {applied['generations']} generations")
+        else:
+            interval = env_int('SKETCH_INTERVAL_SECONDS', 60)
+            job.start(interval)
+            runner = web.AppRunner(create_app(pool, job))
+            await runner.setup()
+            port = env_int('SKETCH_PORT', 8092)
+            await web.TCPSite(runner, '0.0.0.0', port).start()
+            print(f"✅ Company sketches refreshing every {interval}s, listening on :{port}")
+            await asyncio.Event().wait()
+    except Exception as e:
+        print(f"❌ Company sketches failed: {e}")
+        return 1
+    finally:
+        if runner:
+            await runner.cleanup()
+        await job.stop()
+        await pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
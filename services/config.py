@@ -0,0 +1,35 @@
+"""
+Service settings from the environment.
+
+The database is taken from DATABASE_URL when set, otherwise from the same
+DB_* variables as .env (DB_HOST, DB_PORT, DB_NAME, DB_USER and DB_PASSWORD or
+DB_SCHEMA_PASSWORD).
+"""
+
+import os
+from typing import Dict
+
+
+def database_options() -> Dict:
+    """Keyword arguments for asyncpg.connect / asyncpg.create_pool"""
+    if os.environ.get('DATABASE_URL'):
+        return {'dsn': os.environ['DATABASE_URL']}
+    return {
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'port': int(os.environ.get('DB_PORT', 5432)),
+        'database': os.environ.get('DB_NAME', 'postgres'),
+        'user': os.environ.get('DB_USER', 'postgres'),
+        'password': os.environ.get('DB_PASSWORD') or os.environ.get('DB_SCHEMA_PASSWORD')
+    }
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
@@ -0,0 +1,239 @@
+"""
+Server-side counterpart of client/lib/enhanced-encryption.ts.
+
+The wire format is the client's. A key is derived per user with PBKDF2-SHA256
+over ``mailoreply-user-<id>-<email or 'unknown'>``, salted with
+``mailoreply-salt-<id>-v2``, at 100000 iterations. A message is AES-256-GCM
+with a random 96-bit IV and a 128-bit tag, sent as
+``'v2:' + base64(iv || ciphertext || tag)``. Anything encryptMessage produces
+decrypts here, and the other way round. Unprefixed legacy payloads are
+accepted on decrypt, as the client accepts them.
+
+Deriving a key takes 100000 HMAC rounds, so it costs milliseconds where
+the AES itself costs microseconds. KeyCache keeps derived keys in a bounded
+LRU, and concurrent requests for the same user derive once.
+EncryptionService.encrypt_batch / decrypt_batch / reencrypt_batch first
+derive every distinct user's key once, then run the messages in chunks on a
+thread pool. hashlib and OpenSSL release the GIL, so both steps use every
+core. reencrypt_batch covers an email change, which changes the key.
+
+The cache holds raw key material in process memory. Size it for the working
+set, and call forget() when a user's email changes or they are deleted.
+
+The ``cryptography`` package is optional for the rest of services/ and only
+needed here.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+    InvalidTag = None
+
+PREFIX = 'v2:'
+ITERATIONS = 100000
+KEY_LENGTH = 32
+IV_LENGTH = 12
+TAG_LENGTH = 16
+
+UserRef = Tuple[str, Optional[str]]
+
+
+class DecryptionError(ValueError):
+    """Corrupted payload or wrong key; the client's 'Failed to decrypt message'"""
+
+
+def _require_cryptography():
+    if AESGCM is None:
+        raise RuntimeError("cryptography is required for services.encryption")
+
+
+def derive_user_key(user_id, email: Optional[str] = None) -> bytes:
+    """deriveUserKey: the raw 256-bit AES key for a user"""
+    material = f"mailoreply-user-{user_id}-{email or 'unknown'}".encode()
+    salt = f"mailoreply-salt-{user_id}-v2".encode()
+    return hashlib.pbkdf2_hmac('sha256', material, salt, ITERATIONS, KEY_LENGTH)
+
+
+def encrypt_with_key(key: bytes, plaintext: str, iv: Optional[bytes] = None) -> str:
+    _require_cryptography()
+    iv = iv or os.urandom(IV_LENGTH)
+    sealed = AESGCM(key).encrypt(iv, plaintext.encode(), None)
+    return PREFIX + base64.b64encode(iv + sealed).decode('ascii')
+
+
+def decrypt_with_key(key: bytes, data: str) -> str:
+    _require_cryptography()
+    if data.startswith(PREFIX):
+        data = data[len(PREFIX):]
+    try:
+        combined = base64.b64decode(data, validate=True)
+        if len(combined) < IV_LENGTH + TAG_LENGTH:
+            raise ValueError("payload too short")
+        return AESGCM(key).decrypt(combined[:IV_LENGTH], combined[IV_LENGTH:], None).decode()
+    except (InvalidTag, binascii.Error, ValueError) as e:
+        raise DecryptionError("Failed to decrypt message - data may be corrupted or key mismatch") from e
+
+
+def is_encrypted(text: str) -> bool:
+    """isEncrypted: a v2 payload, or legacy base64 longer than 20 characters"""
+    body = text[len(PREFIX):] if text.startswith(PREFIX) else text
+    try:
+        valid = base64.b64encode(base64.b64decode(body, validate=True)).decode('ascii') == body
+    except (binascii.Error, ValueError):
+        return False
+    return valid and (text.startswith(PREFIX) or len(text) > 20)
+
+
+class KeyCache:
+    """Bounded LRU of derived user keys; concurrent misses for one user derive once"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.keys: 'OrderedDict[UserRef, bytes]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'derivations': 0, 'evicted': 0}
+        self._lock = threading.Lock()
+        self._deriving: Dict[UserRef, Future] = {}
+
+    def get(self, user_id, email: Optional[str] = None) -> bytes:
+        ref = (str(user_id), email or None)
+        with self._lock:
+            key = self.keys.get(ref)
+            if key is not None:
+                self.keys.move_to_end(ref)
+                self.stats['hits'] += 1
+                return key
+            self.stats['misses'] += 1
+            pending = self._deriving.get(ref)
+            if pending is None:
+                pending = self._deriving[ref] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return pending.result()
+
+        try:
+            key = derive_user_key(*ref)
+        except BaseException as e:
+            with self._lock:
+                del self._deriving[ref]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            del self._deriving[ref]
+            self.stats['derivations'] += 1
+            self.keys[ref] = key
+            while len(self.keys) > self.max_entries:
+                self.keys.popitem(last=False)
+                self.stats['evicted'] += 1
+        pending.set_result(key)
+        return key
+
+    def forget(self, user_id):
+        """Drop every cached key of a user (email change, deletion, logout)"""
+        with self._lock:
+            for ref in [ref for ref in self.keys if ref[0] == str(user_id)]:
+                del self.keys[ref]
+
+    def clear(self):
+        with self._lock:
+            self.keys.clear()
+
+    def summary(self) -> Dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {**self.stats, 'entries': len(self.keys),
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None}
+
+
+class EncryptionService:
+    """Per-message and batch encrypt/decrypt over a KeyCache and a thread pool"""
+
+    def __init__(self, keys: Optional[KeyCache] = None, workers: Optional[int] = None, chunk_size: int = 256):
+        _require_cryptography()
+        self.keys = keys or KeyCache()
+        self.chunk_size = chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix='crypto')
+        self.stats = {'encrypted': 0, 'decrypted': 0, 'failures': 0, 'batches': 0}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def encrypt(self, user_id, plaintext: str, email: Optional[str] = None) -> str:
+        self.stats['encrypted'] += 1
+        return encrypt_with_key(self.keys.get(user_id, email), plaintext)
+
+    def decrypt(self, user_id, data: str, email: Optional[str] = None) -> str:
+        self.stats['decrypted'] += 1
+        try:
+            return decrypt_with_key(self.keys.get(user_id, email), data)
+        except DecryptionError:
+            self.stats['failures'] += 1
+            raise
+
+    def _warm(self, refs: Iterable[UserRef]):
+        """Derive the distinct keys of a batch in parallel before any message needs one"""
+        list(self.executor.map(lambda ref: self.keys.get(*ref), set(refs)))
+
+    def _chunked(self, work, items: Sequence) -> List:
+        chunks = [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        results = []
+        for chunk_result in self.executor.map(lambda chunk: [work(*item) for item in chunk], chunks):
+            results.extend(chunk_result)
+        self.stats['batches'] += 1
+        return results
+
+    def encrypt_batch(self, items: Sequence[Tuple[str, Optional[str], str]]) -> List[str]:
+        """(user_id, email, plaintext) triples to v2 payloads, in order"""
+        self._warm((str(user_id), email or None) for user_id, email, _ in items)
+
+        def work(user_id, email, plaintext):
+            return encrypt_with_key(self.keys.get(user_id, email), plaintext)
+
+        results = self._chunked(work, items)
+        self.stats['encrypted'] += len(results)
+        return results
+
+    def decrypt_batch(self, items: Sequence[Tuple[str, Optional[str], str]]) -> List[Optional[str]]:
+        """(user_id, email, payload) triples to plaintexts; None where a payload does not decrypt"""
+        self._warm((str(user_id), email or None) for user_id, email, _ in items)
+
+        def work(user_id, email, data):
+            try:
+                return decrypt_with_key(self.keys.get(user_id, email), data)
+            except DecryptionError:
+                return None
+
+        results = self._chunked(work, items)
+        self.stats['decrypted'] += len(results)
+        self.stats['failures'] += results.count(None)
+        return results
+
+    def reencrypt_batch(self, items: Sequence[Tuple[str, Optional[str], Optional[str], str]]) -> List[Optional[str]]:
+        """(user_id, old_email, new_email, payload) to payloads under the new key; None where decrypt fails"""
+        self._warm(ref for user_id, old, new, _ in items
+                   for ref in ((str(user_id), old or None), (str(user_id), new or None)))
+
+        def work(user_id, old_email, new_email, data):
+            try:
+                plaintext = decrypt_with_key(self.keys.get(user_id, old_email), data)
+            except DecryptionError:
+                return None
+            return encrypt_with_key(self.keys.get(user_id, new_email), plaintext)
+
+        results = self._chunked(work, items)
+        failures = results.count(None)
+        self.stats['decrypted'] += len(results)
+        self.stats['encrypted'] += len(results) - failures
+        self.stats['failures'] += failures
+        return results
@@ -0,0 +1,267 @@
+"""
+Parquet export of generation, device and payment history for the data team.
+
+Each table is read through a server-side cursor in a read-only snapshot, a
+bounded number of rows at a time, turned into Arrow record batches and written
+to Parquet files partitioned by month of created_at:
+
+    <out>/<table>/month=YYYY-MM/part-<run>.parquet
+
+Only one batch is held in memory, plus one open writer per month touched, so
+memory stays flat however large the table is. Files are written under a
+temporary name and renamed once the whole table has been exported; only then
+does the table's watermark in <out>/_watermarks.json move forward. An
+interrupted run leaves no visible files and the next run repeats it.
+
+Incremental runs read rows at or after the watermark and before now minus
+EXPORT_SETTLE_SECONDS. ai_generations is tracked by ingested_at rather than
+created_at, because batched and offline events keep their original
+created_at and would fall behind a created_at watermark (see
+services/rollups.py); its rows from before ingested_at existed go out with the
+first full export.
+
+pyarrow is optional for the rest of services/ and only needed here. Point
+EXPORT_DATABASE_URL at a read replica to keep the scan off the primary.
+
+Run with ``python -m services.export [--out=DIR] [--tables=a,b] [--full]``.
+``--full`` ignores the watermark and writes a complete new copy next to the
+existing files, so clear the table's directory first.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int, env_str
+
+WATERMARK_FILE = '_watermarks.json'
+
+
+@dataclass
+class ExportTable:
+    name: str
+    # (column, select expression, Arrow type name)
+    columns: Sequence[Tuple[str, str, str]]
+    watermark_column: str = 'created_at'
+
+
+EXPORTS = {
+    'ai_generations': ExportTable('ai_generations', [
+        ('id', 'id', 'uuid'),
+        ('user_id', 'user_id', 'uuid'),
+        ('company_id', 'company_id', 'uuid'),
+        ('source', 'source::text', 'string'),
+        ('generation_type', 'generation_type', 'string'),
+        ('language', 'language', 'string'),
+        ('tone', 'tone', 'string'),
+        ('intent', 'intent', 'string'),
+        ('input_length', 'input_length', 'int32'),
+        ('output_length', 'output_length', 'int32'),
+        ('encrypted', 'encrypted', 'bool'),
+        ('success', 'success', 'bool'),
+        ('error_message', 'error_message', 'string'),
+        ('created_at', 'created_at', 'timestamp'),
+        ('ingested_at', 'ingested_at', 'timestamp')
+    ], watermark_column='ingested_at'),
+    'user_devices': ExportTable('user_devices', [
+        ('id', 'id', 'uuid'),
+        ('user_id', 'user_id', 'uuid'),
+        ('device_fingerprint', 'device_fingerprint', 'string'),
+        ('device_name', 'device_name', 'string'),
+        ('last_active', 'last_active', 'timestamp'),
+        ('created_at', 'created_at', 'timestamp')
+    ]),
+    'payment_history': ExportTable('payment_history', [
+        ('id', 'id', 'uuid'),
+        ('user_id', 'user_id', 'uuid'),
+        ('subscription_id', 'subscription_id', 'uuid'),
+        ('stripe_invoice_id', 'stripe_invoice_id', 'string'),
+        ('stripe_payment_intent_id', 'stripe_payment_intent_id', 'string'),
+        ('amount', 'amount', 'int32'),
+        ('currency', 'currency', 'string'),
+        ('status', 'status', 'string'),
+        ('description', 'description', 'string'),
+        ('receipt_url', 'receipt_url', 'string'),
+        ('created_at', 'created_at', 'timestamp')
+    ])
+}
+
+
+def arrow_type(name: str):
+    return {
+        'uuid': pa.string(),
+        'string': pa.string(),
+        'int32': pa.int32(),
+        'int64': pa.int64(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('us', tz='UTC')
+    }[name]
+
+
+def arrow_schema(table: ExportTable):
+    return pa.schema([pa.field(column, arrow_type(kind)) for column, _, kind in table.columns])
+
+
+def month_partition(created_at: Optional[datetime]) -> str:
+    return f"month={created_at.astimezone(timezone.utc):%Y-%m}" if created_at else 'month=unknown'
+
+
+class ParquetExporter:
+    """Stream tables into month-partitioned Parquet files with per-table watermarks"""
+
+    def __init__(self, conn, out_dir: str, batch_rows: int = 50000, settle: float = 60.0,
+                 compression: str = 'zstd'):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for Parquet export (pip install pyarrow)")
+        self.conn = conn
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.batch_rows = batch_rows
+        self.settle = settle
+        self.compression = compression
+        self.run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.stats: Dict[str, Dict] = {}
+
+    # Watermarks
+
+    def _watermark_path(self) -> str:
+        return os.path.join(self.out_dir, WATERMARK_FILE)
+
+    def watermarks(self) -> Dict[str, datetime]:
+        try:
+            with open(self._watermark_path()) as f:
+                return {name: datetime.fromisoformat(value) for name, value in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+
+    def _save_watermark(self, name: str, value: datetime):
+        marks = {key: mark.isoformat() for key, mark in self.watermarks().items()}
+        marks[name] = value.isoformat()
+        temporary = self._watermark_path() + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(marks, f, indent=2, sort_keys=True)
+        os.replace(temporary, self._watermark_path())
+
+    # Export
+
+    def _query(self, table: ExportTable, since: Optional[datetime]) -> str:
+        select = ', '.join(f"{expression} AS {column}" for column, expression, _ in table.columns)
+        mark = table.watermark_column
+        if since is None:
+            condition = f"({mark} IS NULL OR {mark} < $1)"
+        else:
+            condition = f"{mark} >= $2 AND {mark} < $1"
+        return f"SELECT {select} FROM public.{table.name} WHERE {condition}"
+
+    def _record_batch(self, table: ExportTable, schema, rows: List) -> 'pa.RecordBatch':
+        arrays = []
+        for index, (column, _, kind) in enumerate(table.columns):
+            values = [row[index] for row in rows]
+            if kind == 'uuid':
+                values = [str(value) if value is not None else None for value in values]
+            arrays.append(pa.array(values, type=schema.field(column).type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    async def export_table(self, name: str, full: bool = False) -> Dict:
+        table = EXPORTS[name]
+        schema = arrow_schema(table)
+        since = None if full else self.watermarks().get(name)
+        upper = await self.conn.fetchval("SELECT NOW() - make_interval(secs => $1)", self.settle)
+
+        writers: Dict[str, Tuple[str, str, 'pq.ParquetWriter']] = {}
+        stats = {'rows': 0, 'batches': 0, 'files': 0, 'since': since.isoformat() if since else None,
+                 'until': upper.isoformat()}
+        args = (upper,) if since is None else (upper, since)
+        partition_index = [column for column, _, _ in table.columns].index('created_at')
+
+        try:
+            async with self.conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await self.conn.cursor(self._query(table, since), *args, prefetch=self.batch_rows)
+                while True:
+                    rows = await cursor.fetch(self.batch_rows)
+                    if not rows:
+                        break
+                    by_partition: Dict[str, List] = {}
+                    for row in rows:
+                        by_partition.setdefault(month_partition(row[partition_index]), []).append(row)
+                    for partition, partition_rows in by_partition.items():
+                        if partition not in writers:
+                            directory = os.path.join(self.out_dir, name, partition)
+                            os.makedirs(directory, exist_ok=True)
+                            final = os.path.join(directory, f"part-{self.run_id}.parquet")
+                            temporary = final + '.tmp'
+                            writers[partition] = (temporary, final, pq.ParquetWriter(
+                                temporary, schema, compression=self.compression))
+                        writers[partition][2].write_batch(self._record_batch(table, schema, partition_rows))
+                    stats['rows'] += len(rows)
+                    stats['batches'] += 1
+        except BaseException:
+            for temporary, _, writer in writers.values():
+                writer.close()
+                os.remove(temporary)
+            raise
+
+        for temporary, final, writer in writers.values():
+            writer.close()
+            os.replace(temporary, final)
+        stats['files'] = len(writers)
+        self._save_watermark(name, upper)
+        self.stats[name] = stats
+        return stats
+
+
+def _option(argv: List[str], name: str) -> Optional[str]:
+    for arg in argv:
+        if arg.startswith(f'--{name}='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+async def main(argv: List[str]) -> int:
+    options = ({'dsn': os.environ['EXPORT_DATABASE_URL']} if os.environ.get('EXPORT_DATABASE_URL')
+               else database_options())
+    tables = (_option(argv, 'tables') or ','.join(EXPORTS)).split(',')
+    unknown = [name for name in tables if name not in EXPORTS]
+    if unknown:
+        print(f"❌ Unknown tables: {', '.join(unknown)} (known: {', '.join(EXPORTS)})")
+        return 1
+
+    conn = await asyncpg.connect(**options)
+    try:
+        exporter = ParquetExporter(
+            conn,
+            out_dir=_option(argv, 'out') or env_str('EXPORT_DIR', 'exports'),
+            batch_rows=env_int('EXPORT_BATCH_ROWS', 50000),
+            settle=env_float('EXPORT_SETTLE_SECONDS', 60.0)
+        )
+        for name in tables:
+            stats = await exporter.export_table(name, full='--full' in argv)
+            print(f"✅ {name}: {stats['rows']} rows in {stats['files']} files "
+                  f"({stats['since'] or 'full'} .. {stats['until']})")
+    except Exception as e:
+        print(f"❌ Export failed: {e}")
+        return 1
+    finally:
+        await conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,441 @@
+"""
+Generation gateway in front of the n8n reply and email webhooks.
+
+The website path today makes two database round trips before every
+generation (the users lookup and the can_user_generate RPC in
+client/lib/usage-tracking.ts) and two more after it (the ai_generations
+insert and increment_user_usage). The gateway answers the quota check from
+QuotaCache, an in-memory copy of each user's limits and counters (the users
+fields AuthenticationTester.test_user_profile_retrieval reads) that is
+reloaded after `ttl` seconds. It forwards the request to n8n over one pooled
+HTTP session, and hands the usage record to a GenerationIngestor
+(services/ingest.py) without waiting for the write. A request with a warm
+cache touches the database not at all on its own path.
+
+Quota rules are those of can_user_generate: free users (and unknown roles)
+are held to their daily and monthly limits, pro users to the monthly one, and
+everyone else is unlimited. A generation reserves its credit before n8n is
+called, so concurrent requests cannot overspend, and a failed generation
+gives it back. Credits still on the ingest queue are added to the counters
+whenever an entry is reloaded. Separate gateway processes only see each
+other's usage after a reload, so across N processes a user can overspend by
+at most what N - 1 of them allow within one ttl. An entry also records the
+UTC day and month it was loaded in and is reloaded once either rolls over, so
+the daily and monthly resets take effect at midnight, not up to a ttl later.
+
+With CACHE_INVALIDATION=1 the gateway also listens for the invalidations of
+cache_invalidation.sql (services/invalidation.py) and drops a user's quota as
+soon as their role, status or limits change. That covers role and limit
+changes only. Counters are not watched, so a reset by usage_reset.py or an
+admin, and other processes' usage, are still seen only after a reload.
+GATEWAY_QUOTA_TTL_SECONDS therefore bounds both counter staleness and the
+cross-process overspend, and should stay short.
+
+With GATEWAY_RESPONSE_CACHE_ENTRIES set, identical unencrypted requests from
+the same tenant are answered from services/response_cache.py. A user must
+still be within quota to get a cached answer. The hit is recorded like any
+other generation, but it does not consume a credit, since nothing was
+generated.
+
+The gateway trusts the userId in the request body, like the ingest service.
+It belongs behind the app server, which checks the session first.
+
+Run with ``python -m services.gateway``. It serves POST /generate with a
+GenerationRequest body plus userId, and GET /gateway/stats.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+    web = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int, env_str
+from .ingest import GenerationEvent, GenerationIngestor
+from .invalidation import InvalidationBus, LoadGuard
+from .response_cache import ResponseCache
+
+UNLIMITED_ROLES = {'pro_plus', 'enterprise_user', 'enterprise_manager', 'superuser'}
+
+# Counters as increment_user_usage would leave them after the pending resets
+QUOTA_SQL = """
+SELECT role::text AS role, status::text AS status, company_id, daily_limit, monthly_limit,
+       CASE WHEN last_daily_reset < CURRENT_DATE THEN 0 ELSE daily_usage END AS daily_usage,
+       CASE WHEN last_monthly_reset < DATE_TRUNC('month', CURRENT_DATE) THEN 0 ELSE monthly_usage END AS monthly_usage
+FROM public.users
+WHERE id = $1
+"""
+
+
+@dataclass
+class Quota:
+    """One user's limits and counters as of loaded_at, plus credits reserved since"""
+
+    role: str
+    status: str
+    company_id: Optional[uuid.UUID]
+    daily_limit: int
+    monthly_limit: int
+    daily_usage: int
+    monthly_usage: int
+    loaded_at: float
+    day: date
+    month: date
+    reserved: int = 0
+
+    def current(self) -> bool:
+        """Whether the counters still belong to the UTC day and month they were loaded in"""
+        return (self.day, self.month) == utc_period()
+
+    def denial(self) -> Optional[str]:
+        """Why can_user_generate would say no, or None"""
+        if self.status != 'active':
+            return 'Account is not active'
+        if self.role in UNLIMITED_ROLES:
+            return None
+        if self.role == 'pro':
+            if self.monthly_usage + self.reserved >= self.monthly_limit:
+                return 'Monthly limit reached'
+            return None
+        daily_limit, monthly_limit = (self.daily_limit, self.monthly_limit) if self.role == 'free' else (3, 30)
+        if self.daily_usage + self.reserved >= daily_limit:
+            return 'Daily limit reached'
+        if self.monthly_usage + self.reserved >= monthly_limit:
+            return 'Monthly limit reached'
+        return None
+
+
+def utc_period() -> Tuple[date, date]:
+    """Today's UTC date and the first day of its month, the periods the usage resets follow"""
+    today = datetime.now(timezone.utc).date()
+    return today, today.replace(day=1)
+
+
+class QuotaCache:
+    """TTL-bounded, size-bounded cache of user quotas with local reservations"""
+
+    def __init__(self, pool, ttl: float = 30.0, max_entries: int = 100000):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[uuid.UUID, Quota]' = OrderedDict()
+        # Reserved credits whose usage record has not been committed yet
+        self.pending: Dict[uuid.UUID, int] = {}
+        self._loading: Dict[uuid.UUID, asyncio.Future] = {}
+        self._guard = LoadGuard()
+        self.stats = {'hits': 0, 'loads': 0, 'denied': 0, 'evictions': 0, 'stale_loads': 0}
+
+    async def _load(self, user_id: uuid.UUID) -> Optional[Quota]:
+        token = self._guard.begin()
+        try:
+            # Taken before the read, so a load straddling midnight is reloaded once more
+            day, month = utc_period()
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(QUOTA_SQL, user_id)
+            self.stats['loads'] += 1
+            if row is None:
+                return None
+            quota = Quota(**dict(row), loaded_at=time.monotonic(), day=day, month=month,
+                          reserved=self.pending.get(user_id, 0))
+            if not self._guard.current(token, user_id):
+                # Invalidated while we read; the row may predate the change, so serve it once only
+                self.stats['stale_loads'] += 1
+                return quota
+            self.entries[user_id] = quota
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            return quota
+        finally:
+            self._guard.end()
+
+    def _load_done(self, user_id: uuid.UUID, loading: asyncio.Future):
+        # invalidate() may have detached it, and a newer load taken its place
+        if self._loading.get(user_id) is loading:
+            del self._loading[user_id]
+
+    async def get(self, user_id: uuid.UUID) -> Optional[Quota]:
+        quota = self.entries.get(user_id)
+        if quota is not None and time.monotonic() - quota.loaded_at < self.ttl and quota.current():
+            self.entries.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return quota
+
+        # One load per user at a time; concurrent requests wait for it
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = loading
+            loading.add_done_callback(lambda done: self._load_done(user_id, done))
+        return await asyncio.shield(loading)
+
+    async def check(self, user_id: uuid.UUID) -> Tuple[Optional[Quota], Optional[str]]:
+        """The user's quota and the denial reason, if any, without taking a credit"""
+        quota = await self.get(user_id)
+        reason = 'User not found' if quota is None else quota.denial()
+        if reason:
+            self.stats['denied'] += 1
+        return quota, reason
+
+    async def reserve(self, user_id: uuid.UUID) -> Optional[str]:
+        """Take one credit; returns the denial reason instead if there is none"""
+        quota, reason = await self.check(user_id)
+        if reason:
+            return reason
+        quota.reserved += 1
+        self.pending[user_id] = self.pending.get(user_id, 0) + 1
+        return None
+
+    def settle(self, user_id: uuid.UUID, used: bool):
+        """The reserved credit's record was committed (used) or the generation failed (not used)"""
+        remaining = self.pending.get(user_id, 0) - 1
+        if remaining > 0:
+            self.pending[user_id] = remaining
+        else:
+            self.pending.pop(user_id, None)
+        if not used and user_id in self.entries:
+            self.entries[user_id].reserved -= 1
+
+    def invalidate(self, user_id: uuid.UUID):
+        """Drop a user's entry, e.g. after a role or limit change; a load under way is not cached"""
+        self.entries.pop(user_id, None)
+        self._loading.pop(user_id, None)
+        self._guard.invalidate(user_id)
+
+    def invalidate_all(self):
+        """Drop every entry; credits still pending are kept and reapplied on reload"""
+        self.entries.clear()
+        self._loading.clear()
+        self._guard.invalidate_all()
+
+
+class N8NClient:
+    """The reply and email webhooks over one pooled HTTP session"""
+
+    def __init__(self, reply_url: str, email_url: str, token: Optional[str] = None, timeout: float = 60.0,
+                 max_connections: int = 100):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the generation gateway")
+        self.urls = {'reply': reply_url, 'email': email_url}
+        self.token = token
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.session: Optional['aiohttp.ClientSession'] = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    def payload(self, request: Dict) -> Dict:
+        """The body generateAIReply / generateAIEmail would post; encrypted text arrives already encrypted"""
+        if request['generationType'] == 'reply':
+            payload = {'originalMessage': request.get('originalMessage'), 'intent': request.get('intent')}
+        else:
+            payload = {'prompt': request.get('prompt')}
+        payload.update(language=request['language'], tone=request['tone'],
+                       encrypted=bool(request.get('encrypted')), token=self.token)
+        return payload
+
+    async def generate(self, request: Dict) -> Dict:
+        """A GenerationResponse; failures come back as success False with an error"""
+        kind = request['generationType']
+        try:
+            async with self.session.post(self.urls[kind], json=self.payload(request)) as response:
+                if response.status >= 400:
+                    raise RuntimeError(f"N8N request failed: {response.status} {response.reason}")
+                data = await response.json(content_type=None)
+            if not data.get('success'):
+                raise RuntimeError(data.get('error') or 'AI generation failed')
+            result = {'success': True, 'content': data.get('content') or ''}
+            if kind == 'email':
+                result['subject'] = data.get('subject') or ''
+            return result
+        except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, ValueError) as e:
+            return {'success': False, 'error': str(e) or f"Failed to generate {kind}"}
+
+
+class GenerationGateway:
+    """Quota check from cache, n8n call, usage recorded in the background"""
+
+    def __init__(self, quotas: QuotaCache, n8n: N8NClient, ingestor: GenerationIngestor,
+                 cache: Optional[ResponseCache] = None):
+        self.quotas = quotas
+        self.n8n = n8n
+        self.ingestor = ingestor
+        self.cache = cache
+        self.stats = {'requests': 0, 'generated': 0, 'failed': 0, 'denied': 0, 'cache_hits': 0,
+                      'record_failures': 0}
+        self._recording: Set[asyncio.Task] = set()
+
+    async def _record(self, user_id: uuid.UUID, event: GenerationEvent, reserved: bool = True):
+        try:
+            await self.ingestor.submit(event)
+        except Exception as e:
+            self.stats['record_failures'] += 1
+            print(f"⚠️ Could not record generation for {user_id}: {e}")
+        finally:
+            if reserved:
+                self.quotas.settle(user_id, event.success)
+
+    def _hand_off(self, user_id: uuid.UUID, request: Dict, response: Dict, reserved: bool = True):
+        text = request.get('originalMessage') if request['generationType'] == 'reply' else request.get('prompt')
+        event = GenerationEvent(
+            user_id=user_id,
+            source=request.get('source') or 'website',
+            generation_type=request['generationType'],
+            language=request['language'],
+            tone=request['tone'],
+            intent=request.get('intent'),
+            input_length=len(text or ''),
+            output_length=len(response.get('content') or ''),
+            encrypted=bool(request.get('encrypted')),
+            success=response['success'],
+            error_message=response.get('error'),
+            count_usage=reserved
+        )
+        task = asyncio.create_task(self._record(user_id, event, reserved))
+        self._recording.add(task)
+        task.add_done_callback(self._recording.discard)
+
+    async def generate(self, user_id: uuid.UUID, request: Dict) -> Tuple[int, Dict]:
+        """(HTTP status, GenerationResponse) for one request"""
+        self.stats['requests'] += 1
+        tenant = None
+        if self.cache is not None:
+            quota, reason = await self.quotas.check(user_id)
+            if reason:
+                self.stats['denied'] += 1
+                return 429, {'success': False, 'error': reason}
+            tenant = quota.company_id or user_id
+            cached = self.cache.get(tenant, request)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                self._hand_off(user_id, request, cached, reserved=False)
+                return 200, {**cached, 'cached': True}
+
+        reason = await self.quotas.reserve(user_id)
+        if reason:
+            self.stats['denied'] += 1
+            return 429, {'success': False, 'error': reason}
+
+        response = await self.n8n.generate(request)
+        self.stats['generated' if response['success'] else 'failed'] += 1
+        if self.cache is not None:
+            self.cache.put(tenant, request, response)
+        self._hand_off(user_id, request, response)
+        return (200 if response['success'] else 502), response
+
+    async def drain(self):
+        """Wait for every usage record handed off so far"""
+        if self._recording:
+            await asyncio.gather(*self._recording, return_exceptions=True)
+
+
+def _parse_request(payload: Dict) -> Tuple[uuid.UUID, Dict]:
+    user_id = uuid.UUID(str(payload['userId']))
+    if payload.get('generationType') not in ('reply', 'email'):
+        raise ValueError(f"Unknown generationType {payload.get('generationType')!r}")
+    if payload.get('source', 'website') not in ('website', 'extension'):
+        raise ValueError(f"Unknown source {payload.get('source')!r}")
+    for key in ('language', 'tone'):
+        if not payload.get(key):
+            raise ValueError(f"{key} is required")
+    return user_id, payload
+
+
+def create_app(gateway: GenerationGateway) -> 'web.Application':
+    async def generate(request):
+        try:
+            user_id, body = _parse_request(await request.json())
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            return web.json_response({'success': False, 'error': f"Invalid generation request: {e}"}, status=400)
+        status, response = await gateway.generate(user_id, body)
+        return web.json_response(response, status=status)
+
+    async def stats(request):
+        return web.json_response({
+            **gateway.stats,
+            'quota': gateway.quotas.stats,
+            'cached_users': len(gateway.quotas.entries),
+            'response_cache': gateway.cache.summary() if gateway.cache else None
+        })
+
+    app = web.Application()
+    app.router.add_post('/generate', generate)
+    app.router.add_get('/gateway/stats', stats)
+    return app
+
+
+async def serve():
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=env_int('GATEWAY_DB_POOL', 5))
+    ingestor = GenerationIngestor(pool, max_delay=env_float('INGEST_MAX_DELAY_SECONDS', 1.0))
+    ingestor.start()
+    n8n = N8NClient(
+        env_str('N8N_REPLY_WEBHOOK_URL', 'http://localhost:5678/webhook/reply'),
+        env_str('N8N_EMAIL_WEBHOOK_URL', 'http://localhost:5678/webhook/email'),
+        token=env_str('N8N_WEBHOOK_TOKEN', '') or None,
+        timeout=env_float('N8N_TIMEOUT_SECONDS', 60.0),
+        max_connections=env_int('N8N_MAX_CONNECTIONS', 100)
+    )
+    await n8n.start()
+    cache = None
+    if env_int('GATEWAY_RESPONSE_CACHE_ENTRIES', 0) > 0:
+        cache = ResponseCache(
+            max_entries=env_int('GATEWAY_RESPONSE_CACHE_ENTRIES', 0),
+            max_per_tenant=env_int('GATEWAY_RESPONSE_CACHE_PER_TENANT', 1000),
+            ttl=env_float('GATEWAY_RESPONSE_CACHE_TTL_SECONDS', 600.0)
+        )
+    gateway = GenerationGateway(QuotaCache(pool, ttl=env_float('GATEWAY_QUOTA_TTL_SECONDS', 30.0)), n8n, ingestor,
+                                cache=cache)
+    bus = None
+    if env_int('CACHE_INVALIDATION', 0) == 1:
+        bus = InvalidationBus()
+        bus.subscribe('user', gateway.quotas.invalidate)
+        bus.on_resync(gateway.quotas.invalidate_all)
+        bus.start()
+
+    runner = web.AppRunner(create_app(gateway))
+    await runner.setup()
+    port = env_int('GATEWAY_PORT', 8093)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"✅ Generation gateway listening on :{port}, quotas cached for {gateway.quotas.ttl}s, "
+          f"response cache {'on' if cache else 'off'}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if bus:
+            await bus.stop()
+        await gateway.drain()
+        await ingestor.stop()
+        await n8n.close()
+        await pool.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,198 @@
+"""
+Device heartbeat ingest with write coalescing.
+
+updateDeviceActivity (client/lib/enhanced-usage-tracking.ts) updates
+user_devices.last_active on every activity ping. This service accepts the
+pings instead and keeps only the newest timestamp per (user, device) in
+memory. Every few seconds it writes them all with one set-based UPDATE, so each
+active device costs one row version per flush interval rather than one per
+ping. get_company_users only reads MAX(last_active), which tolerates the delay.
+
+A failed flush puts its rows back into the pending map, and newer pings win
+when the two are merged, so a database outage delays heartbeats but does not
+lose them. A ping dated more than MAX_CLOCK_SKEW (services/ingest.py) ahead
+is refused: rows only move forward, so a client clock days ahead would
+otherwise pin last_active until that time.
+
+The service trusts the user and device ids it is given, like the ingest
+service. It belongs behind the app server, which checks the session first.
+
+Run standalone with ``python -m services.heartbeat``. It serves
+POST /heartbeat with a ping object or a list of them:
+{"user_id": ..., "device_fingerprint": ..., "at": ISO-8601 (optional)}.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from .config import database_options, env_float, env_int
+from .ingest import MAX_CLOCK_SKEW
+
+# Rows only move forward in time, so a late or replayed batch cannot roll
+# last_active back, and unchanged rows are not rewritten
+FLUSH_SQL = """
+UPDATE public.user_devices d
+SET last_active = v.last_active
+FROM unnest($1::uuid[], $2::text[], $3::timestamptz[]) AS v(user_id, device_fingerprint, last_active)
+WHERE d.user_id = v.user_id
+  AND d.device_fingerprint = v.device_fingerprint
+  AND (d.last_active IS NULL OR d.last_active < v.last_active)
+"""
+
+DeviceKey = Tuple[uuid.UUID, str]
+
+
+class HeartbeatCoalescer:
+    """Coalesce device pings in memory and flush them in batches"""
+
+    def __init__(self, pool, flush_interval: float = 5.0, max_batch: int = 5000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.pending: Dict[DeviceKey, datetime] = {}
+        self.stats = {'pings': 0, 'flushes': 0, 'statements': 0, 'rows_sent': 0, 'rows_updated': 0, 'errors': 0}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def ping(self, user_id, device_fingerprint: str, at: Optional[datetime] = None):
+        """Record activity; only the newest timestamp per device is kept. Raises ValueError for a future `at`"""
+        key = (user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id)), device_fingerprint)
+        at = _check_ping_time(at) if at else datetime.now(timezone.utc)
+        self.stats['pings'] += 1
+        previous = self.pending.get(key)
+        if previous is None or at > previous:
+            self.pending[key] = at
+
+    async def flush(self) -> int:
+        """Write all pending heartbeats; returns the number of rows updated"""
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            # Sorted so concurrent flushers lock rows in the same order
+            rows = sorted(batch.items())
+            written = 0
+            updated = 0
+            try:
+                while written < len(rows):
+                    chunk = rows[written:written + self.max_batch]
+                    status = await self.pool.execute(
+                        FLUSH_SQL,
+                        [user_id for (user_id, _), _ in chunk],
+                        [fingerprint for (_, fingerprint), _ in chunk],
+                        [at for _, at in chunk]
+                    )
+                    written += len(chunk)
+                    updated += int(status.split()[-1])
+                    self.stats['statements'] += 1
+                    self.stats['rows_sent'] += len(chunk)
+            except Exception:
+                self.stats['errors'] += 1
+                self._requeue(rows[written:])
+                raise
+            finally:
+                self.stats['rows_updated'] += updated
+            self.stats['flushes'] += 1
+            return updated
+
+    def _requeue(self, rows: List[Tuple[DeviceKey, datetime]]):
+        for key, at in rows:
+            newer = self.pending.get(key)
+            if newer is None or at > newer:
+                self.pending[key] = at
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Heartbeat flush failed, {len(self.pending)} devices pending: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def _check_ping_time(at: datetime) -> datetime:
+    if at > datetime.now(timezone.utc) + MAX_CLOCK_SKEW:
+        raise ValueError(f"at {at.isoformat()} is too far in the future")
+    return at
+
+
+def _parse_ping(payload: Dict) -> Tuple[uuid.UUID, str, Optional[datetime]]:
+    at = payload.get('at')
+    if at:
+        at = datetime.fromisoformat(at.replace('Z', '+00:00'))
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        at = _check_ping_time(at)
+    return uuid.UUID(payload['user_id']), str(payload['device_fingerprint']), at
+
+
+def create_app(coalescer: HeartbeatCoalescer) -> 'web.Application':
+    async def heartbeat(request):
+        try:
+            payload = await request.json()
+            pings = [_parse_ping(p) for p in (payload if isinstance(payload, list) else [payload])]
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            return web.json_response({'success': False, 'error': f"Invalid heartbeat: {e}"}, status=400)
+        for user_id, fingerprint, at in pings:
+            coalescer.ping(user_id, fingerprint, at)
+        return web.json_response({'success': True, 'accepted': len(pings)}, status=202)
+
+    async def stats(request):
+        return web.json_response({**coalescer.stats, 'pending': len(coalescer.pending)})
+
+    app = web.Application()
+    app.router.add_post('/heartbeat', heartbeat)
+    app.router.add_get('/heartbeat/stats', stats)
+    return app
+
+
+async def serve():
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=2)
+    coalescer = HeartbeatCoalescer(pool, flush_interval=env_float('HEARTBEAT_FLUSH_SECONDS', 5.0))
+    coalescer.start()
+
+    runner = web.AppRunner(create_app(coalescer))
+    await runner.setup()
+    port = env_int('HEARTBEAT_PORT', 8090)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"✅ Heartbeat service listening on :{port}, flushing every {coalescer.flush_interval}s")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await coalescer.stop()
+        await pool.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,397 @@
+"""
+Batched ingestion of AI generation events.
+
+Today every generation costs an INSERT into ai_generations plus a separate
+increment_user_usage or track_extension_usage call, and increment_user_usage
+first calls reset_user_usage for the user. GenerationIngestor puts events from the
+website and extension paths on a bounded queue. A batch is cut at max_batch
+events or max_delay seconds, whichever comes first, and written in one
+transaction:
+
+  1. binary COPY of the batch into a session temp table;
+  2. one statement that inserts the new rows into ai_generations, then applies
+     one aggregated usage UPDATE per user and one usage_count UPDATE per
+     template, counting only rows that were actually inserted.
+
+Delivery is at least once. submit() resolves only after its batch commits,
+and callers retry on failure with the same idempotency_key (and the event's
+original created_at). The partial unique index from ai_generations_ingest.sql
+turns redelivered events into no-ops, so usage counters are never incremented
+twice.
+
+Only lost connections, serialization failures, deadlocks and the like are
+retried. Any other error means some event in the batch cannot be written, so
+the batch is split in halves until the offending events are alone, and only
+their submitters see the error. Events dated more than MAX_CLOCK_SKEW ahead or
+MAX_EVENT_AGE back are refused up front; they would fall outside the
+partitions services/partitions.py keeps, and that error would repeat on every
+redelivery.
+
+Run standalone with ``python -m services.ingest``. It serves POST /generations
+with an event object or a list of them.
+"""
+
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from .config import database_options, env_float, env_int
+
+# created_at bounds for incoming events; offline extension events arrive late, but not this late
+MAX_CLOCK_SKEW = timedelta(hours=1)
+MAX_EVENT_AGE = timedelta(days=30)
+
+# Connection exceptions (08), serialization failure, deadlock, too many connections, shutdown
+TRANSIENT_SQLSTATES = ('08', '40001', '40P01', '53300', '57P01', '57P02', '57P03')
+
+def is_transient(error: BaseException) -> bool:
+    """Whether writing the same batch again can succeed"""
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return True
+    sqlstate = getattr(error, 'sqlstate', None) or ''
+    return sqlstate.startswith(TRANSIENT_SQLSTATES)
+
+
+STAGING_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS ai_generations_staging (
+  idempotency_key UUID NOT NULL,
+  user_id UUID NOT NULL,
+  source TEXT NOT NULL,
+  generation_type TEXT NOT NULL,
+  language TEXT NOT NULL,
+  tone TEXT NOT NULL,
+  intent TEXT,
+  input_length INTEGER,
+  output_length INTEGER,
+  encrypted BOOLEAN NOT NULL,
+  success BOOLEAN NOT NULL,
+  error_message TEXT,
+  template_id UUID,
+  count_usage BOOLEAN NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL
+) ON COMMIT DELETE ROWS
+"""
+
+# Usage rules follow increment_user_usage: free (and unknown) roles count daily
+# and monthly, pro counts monthly only, unlimited roles only touch updated_at.
+# Stale daily/monthly windows are reset inline for the affected users, as
+# reset_user_usage would, without a call per user.
+APPLY_BATCH_SQL = """
+WITH inserted AS (
+  INSERT INTO public.ai_generations (
+    idempotency_key, user_id, company_id, source, generation_type, language, tone, intent,
+    input_length, output_length, encrypted, success, error_message, created_at
+  )
+  SELECT s.idempotency_key, s.user_id, u.company_id, s.source::generation_source, s.generation_type,
+         s.language, s.tone, s.intent, s.input_length, s.output_length, s.encrypted, s.success,
+         s.error_message, s.created_at
+  FROM ai_generations_staging s
+  JOIN public.users u ON u.id = s.user_id
+  ON CONFLICT (idempotency_key, created_at) WHERE idempotency_key IS NOT NULL DO NOTHING
+  RETURNING idempotency_key
+),
+fresh AS (
+  SELECT s.* FROM ai_generations_staging s JOIN inserted i USING (idempotency_key)
+),
+usage AS (
+  UPDATE public.users u
+  SET
+    daily_usage = CASE WHEN u.last_daily_reset < CURRENT_DATE THEN 0 ELSE u.daily_usage END
+      + CASE WHEN u.role IN ('pro', 'pro_plus', 'enterprise_user', 'enterprise_manager', 'superuser')
+             THEN 0 ELSE f.n END,
+    monthly_usage = CASE WHEN u.last_monthly_reset < DATE_TRUNC('month', CURRENT_DATE) THEN 0 ELSE u.monthly_usage END
+      + CASE WHEN u.role IN ('pro_plus', 'enterprise_user', 'enterprise_manager', 'superuser')
+             THEN 0 ELSE f.n END,
+    last_daily_reset = GREATEST(u.last_daily_reset, CURRENT_DATE),
+    last_monthly_reset = GREATEST(u.last_monthly_reset, DATE_TRUNC('month', CURRENT_DATE)::DATE),
+    updated_at = NOW()
+  FROM (
+    SELECT user_id, COUNT(*) AS n FROM fresh WHERE count_usage AND success GROUP BY user_id
+  ) f
+  WHERE u.id = f.user_id
+  RETURNING u.id
+),
+template_usage AS (
+  UPDATE public.templates t
+  SET usage_count = t.usage_count + f.n, updated_at = NOW()
+  FROM (
+    SELECT template_id, COUNT(*) AS n FROM fresh WHERE template_id IS NOT NULL GROUP BY template_id
+  ) f
+  WHERE t.id = f.template_id
+  RETURNING t.id
+)
+SELECT
+  (SELECT COUNT(*) FROM inserted) AS inserted,
+  (SELECT COUNT(*) FROM usage) AS users_updated,
+  (SELECT COUNT(*) FROM template_usage) AS templates_updated,
+  (SELECT COUNT(*) FROM ai_generations_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM public.users u WHERE u.id = s.user_id)) AS unknown_users
+"""
+
+
+@dataclass
+class GenerationEvent:
+    """One generation, as trackGeneration / track_extension_usage would record it"""
+
+    user_id: uuid.UUID
+    source: str
+    generation_type: str
+    language: str
+    tone: str
+    idempotency_key: uuid.UUID = field(default_factory=uuid.uuid4)
+    intent: Optional[str] = None
+    input_length: Optional[int] = None
+    output_length: Optional[int] = None
+    encrypted: bool = False
+    success: bool = True
+    error_message: Optional[str] = None
+    template_id: Optional[uuid.UUID] = None
+    # trackGeneration increments usage for successful generations;
+    # track_extension_usage only logs the action
+    count_usage: bool = True
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def extension_action(cls, user_id, action_type: str, template_id=None, content_length: Optional[int] = None,
+                         idempotency_key=None) -> 'GenerationEvent':
+        """Event equivalent to track_extension_usage(user_id, action_type, template_id, content_length)"""
+        return cls(
+            user_id=user_id,
+            source='extension',
+            generation_type=action_type,
+            language='English',
+            tone='Professional',
+            idempotency_key=idempotency_key or uuid.uuid4(),
+            input_length=0,
+            output_length=content_length or 0,
+            template_id=template_id,
+            count_usage=False
+        )
+
+    @classmethod
+    def from_payload(cls, payload: Dict) -> 'GenerationEvent':
+        known = {f.name for f in fields(cls)}
+        values = {key: value for key, value in payload.items() if key in known}
+        for key in ('user_id', 'idempotency_key', 'template_id'):
+            if values.get(key) is not None:
+                values[key] = uuid.UUID(str(values[key]))
+        # Both are needed for a redelivery to collide with the original row
+        for key in ('idempotency_key', 'created_at'):
+            if key not in values:
+                raise ValueError(f"{key} is required")
+        if isinstance(values.get('created_at'), str):
+            values['created_at'] = datetime.fromisoformat(values['created_at'].replace('Z', '+00:00'))
+        if not isinstance(values['created_at'], datetime):
+            raise ValueError(f"Invalid created_at {values['created_at']!r}")
+        if values['created_at'].tzinfo is None:
+            values['created_at'] = values['created_at'].replace(tzinfo=timezone.utc)
+        # Refused rather than clamped: a redelivery must carry the same created_at to collide
+        now = datetime.now(timezone.utc)
+        if not now - MAX_EVENT_AGE <= values['created_at'] <= now + MAX_CLOCK_SKEW:
+            raise ValueError(f"created_at {values['created_at'].isoformat()} is outside the accepted window")
+        if values.get('source') not in ('website', 'extension'):
+            raise ValueError(f"Unknown source {values.get('source')!r}")
+        return cls(**values)
+
+    def record(self) -> tuple:
+        created_at = self.created_at if self.created_at.tzinfo else self.created_at.replace(tzinfo=timezone.utc)
+        return (
+            self.idempotency_key, self.user_id, self.source, self.generation_type, self.language, self.tone,
+            self.intent, self.input_length, self.output_length, self.encrypted, self.success,
+            self.error_message, self.template_id, self.count_usage and self.success, created_at
+        )
+
+
+STAGING_COLUMNS = [
+    'idempotency_key', 'user_id', 'source', 'generation_type', 'language', 'tone', 'intent',
+    'input_length', 'output_length', 'encrypted', 'success', 'error_message', 'template_id',
+    'count_usage', 'created_at'
+]
+
+
+class GenerationIngestor:
+    """Bounded queue of generation events written in size/time-cut batches"""
+
+    def __init__(self, pool, max_batch: int = 500, max_delay: float = 1.0, queue_size: int = 10000,
+                 max_attempts: int = 5):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = {'events': 0, 'batches': 0, 'inserted': 0, 'duplicates': 0, 'unknown_users': 0,
+                      'users_updated': 0, 'templates_updated': 0, 'retries': 0, 'failed_batches': 0,
+                      'split_batches': 0, 'rejected_events': 0}
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, event: GenerationEvent) -> None:
+        """Enqueue an event and wait until its batch is committed"""
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((event, done))
+        await done
+
+    async def submit_many(self, events: List[GenerationEvent], return_exceptions: bool = False) -> List:
+        """Enqueue events and wait for them all; with return_exceptions, one result or error per event"""
+        futures = []
+        for event in events:
+            done = asyncio.get_running_loop().create_future()
+            await self.queue.put((event, done))
+            futures.append(done)
+        return await asyncio.gather(*futures, return_exceptions=return_exceptions)
+
+    async def _next_batch(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def write_batch(self, events: List[GenerationEvent]) -> Dict:
+        # Redeliveries within one batch collapse to their first occurrence
+        unique = list({event.idempotency_key: event for event in reversed(events)}.values())
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(STAGING_DDL)
+                await conn.copy_records_to_table(
+                    'ai_generations_staging', records=[event.record() for event in unique], columns=STAGING_COLUMNS
+                )
+                result = dict(await conn.fetchrow(APPLY_BATCH_SQL))
+        result['duplicates'] = len(events) - result['inserted'] - result['unknown_users']
+        return result
+
+    async def _write(self, batch: list):
+        """Write (event, future) pairs, retrying transient errors and splitting around bad events"""
+        events = [event for event, _ in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = await self.write_batch(events)
+                break
+            except Exception as e:
+                if is_transient(e) and attempt < self.max_attempts:
+                    self.stats['retries'] += 1
+                    await asyncio.sleep(min(0.1 * 2 ** attempt, 5.0))
+                    continue
+                if not is_transient(e) and len(batch) > 1:
+                    # One bad event rolls back the whole batch; find it by halves
+                    self.stats['split_batches'] += 1
+                    middle = len(batch) // 2
+                    await self._write(batch[:middle])
+                    await self._write(batch[middle:])
+                    return
+                if is_transient(e):
+                    self.stats['failed_batches'] += 1
+                else:
+                    self.stats['rejected_events'] += 1
+                for _, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+                return
+
+        self.stats['events'] += len(events)
+        self.stats['batches'] += 1
+        for key in ('inserted', 'duplicates', 'unknown_users', 'users_updated', 'templates_updated'):
+            self.stats[key] += result[key]
+        for _, done in batch:
+            if not done.done():
+                done.set_result(None)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Drain the queue, then stop the writer"""
+        await self.queue.join()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def create_app(ingestor: GenerationIngestor) -> 'web.Application':
+    async def generations(request):
+        try:
+            payload = await request.json()
+            events = [GenerationEvent.from_payload(p) for p in (payload if isinstance(payload, list) else [payload])]
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            return web.json_response({'success': False, 'error': f"Invalid generation event: {e}"}, status=400)
+        results = await ingestor.submit_many(events, return_exceptions=True)
+        errors = [(index, e) for index, e in enumerate(results) if isinstance(e, Exception)]
+        if any(is_transient(e) for _, e in errors):
+            # Not all written; the caller retries with the same idempotency keys
+            return web.json_response({'success': False, 'error': str(errors[0][1])}, status=503)
+        if errors:
+            # The rest were written; retrying these would fail the same way
+            return web.json_response({
+                'success': False,
+                'accepted': len(events) - len(errors),
+                'rejected': [{'index': index, 'error': str(e)} for index, e in errors]
+            }, status=422)
+        return web.json_response({'success': True, 'accepted': len(events)})
+
+    async def stats(request):
+        return web.json_response({**ingestor.stats, 'queued': ingestor.queue.qsize()})
+
+    app = web.Application()
+    app.router.add_post('/generations', generations)
+    app.router.add_get('/generations/stats', stats)
+    return app
+
+
+async def serve():
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=4)
+    ingestor = GenerationIngestor(
+        pool,
+        max_batch=env_int('INGEST_MAX_BATCH', 500),
+        max_delay=env_float('INGEST_MAX_DELAY_SECONDS', 1.0),
+        queue_size=env_int('INGEST_QUEUE_SIZE', 10000)
+    )
+    ingestor.start()
+
+    runner = web.AppRunner(create_app(ingestor))
+    await runner.setup()
+    port = env_int('INGEST_PORT', 8091)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"✅ Generation ingest listening on :{port} (batches of {ingestor.max_batch} / {ingestor.max_delay}s)")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await ingestor.stop()
+        await pool.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,255 @@
+"""
+Cache invalidation bus over Postgres LISTEN/NOTIFY.
+
+The triggers in cache_invalidation.sql announce committed changes to users,
+user_settings and templates as ``<kind>:<uuid>`` payloads on the
+cache_invalidation channel. InvalidationBus holds one dedicated connection
+listening there and passes each id to the handlers subscribed for its kind
+(QuotaCache.invalidate for ``user``, TemplateBundleCache.invalidate_company
+for ``company_templates``, and so on). Caches can then keep entries until
+they are told otherwise, instead of rereading them every few seconds.
+
+Notifications are gathered for `coalesce` seconds and deduplicated before
+they are dispatched. If a burst holds more than `burst` distinct ids (a
+migration rewriting every user, say), the resync handlers run instead of the
+per-id ones, and those drop whole caches.
+
+A notification sent while the bus was disconnected is lost, so nothing can
+be trusted across a gap. Whenever the connection is (re)established, the bus
+LISTENs first and then runs the resync handlers, which closes the gap. A
+keepalive query every `keepalive` seconds notices a silently dead connection.
+Reconnects back off exponentially up to `max_backoff`.
+
+An invalidation can also land while a cache is reading the row it is about
+to drop; storing that read would bring the old value back. Caches take a
+LoadGuard token before each load and only store the result if nothing it
+covers was invalidated in the meantime.
+
+LISTEN needs a session-mode connection. Behind a transaction-mode pooler,
+point INVALIDATION_DATABASE_URL at the database directly.
+
+Run standalone with ``python -m services.invalidation`` to print what
+arrives.
+"""
+
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int
+
+CHANNEL = 'cache_invalidation'
+KINDS = ('user', 'settings', 'user_templates', 'company_templates')
+
+Handler = Callable[[uuid.UUID], None]
+
+
+def listener_options() -> Dict:
+    """Connection for LISTEN: INVALIDATION_DATABASE_URL if set, else the service database"""
+    if os.environ.get('INVALIDATION_DATABASE_URL'):
+        return {'dsn': os.environ['INVALIDATION_DATABASE_URL']}
+    return database_options()
+
+
+def parse_payload(payload: str) -> Optional[Tuple[str, uuid.UUID]]:
+    kind, _, value = payload.partition(':')
+    if kind not in KINDS:
+        return None
+    try:
+        return kind, uuid.UUID(value)
+    except ValueError:
+        return None
+
+
+class LoadGuard:
+    """Invalidation counters for the loads a cache has in flight"""
+
+    def __init__(self):
+        self.sequence = 0
+        self.in_flight = 0
+        self.reset_at = 0
+        # key -> sequence of its last invalidation, kept only while loads are in flight
+        self.invalidated: Dict[Hashable, int] = {}
+
+    def begin(self) -> int:
+        """Token for one load; pass it to current() and call end() when the load is over"""
+        self.in_flight += 1
+        return self.sequence
+
+    def end(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self.invalidated.clear()
+
+    def invalidate(self, key: Hashable):
+        if self.in_flight:
+            self.sequence += 1
+            self.invalidated[key] = self.sequence
+
+    def invalidate_all(self):
+        if self.in_flight:
+            self.sequence += 1
+            self.reset_at = self.sequence
+
+    def current(self, token: int, *keys: Hashable) -> bool:
+        """Whether none of `keys`, and not everything, was invalidated since the load took `token`"""
+        return self.reset_at <= token and all(self.invalidated.get(key, 0) <= token for key in keys)
+
+
+class InvalidationBus:
+    """One LISTEN connection fanning invalidations out to in-process caches"""
+
+    def __init__(self, connect_options: Optional[Dict] = None, channel: str = CHANNEL, coalesce: float = 0.05,
+                 burst: int = 1000, keepalive: float = 15.0, max_backoff: float = 30.0):
+        self.connect_options = connect_options if connect_options is not None else listener_options()
+        self.channel = channel
+        self.coalesce = coalesce
+        self.burst = burst
+        self.keepalive = keepalive
+        self.max_backoff = max_backoff
+        self.handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self.resync_handlers: List[Callable[[], None]] = []
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.connected = asyncio.Event()
+        self.stats = {'notifications': 0, 'ignored': 0, 'dispatched': 0, 'handler_errors': 0, 'connects': 0,
+                      'disconnects': 0, 'resyncs': 0, 'bursts': 0}
+        self._conn = None
+        self._lost: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def subscribe(self, kind: str, handler: Handler):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown invalidation kind {kind!r} (known: {', '.join(KINDS)})")
+        self.handlers[kind].append(handler)
+
+    def on_resync(self, handler: Callable[[], None]):
+        """Called after every (re)connect and for oversized bursts; should drop the whole cache"""
+        self.resync_handlers.append(handler)
+
+    def _notified(self, conn, pid, channel, payload):
+        self.stats['notifications'] += 1
+        parsed = parse_payload(payload)
+        if parsed is None:
+            self.stats['ignored'] += 1
+            return
+        self.queue.put_nowait(parsed)
+
+    def _call(self, handler, *args):
+        try:
+            handler(*args)
+        except Exception as e:
+            self.stats['handler_errors'] += 1
+            print(f"⚠️ Invalidation handler {getattr(handler, '__qualname__', handler)} failed: {e}")
+
+    def resync(self):
+        self.stats['resyncs'] += 1
+        for handler in self.resync_handlers:
+            self._call(handler)
+
+    def dispatch(self, events: Set[Tuple[str, uuid.UUID]]):
+        if len(events) > self.burst:
+            self.stats['bursts'] += 1
+            self.resync()
+            return
+        for kind, key in events:
+            for handler in self.handlers.get(kind, ()):
+                self._call(handler, key)
+            self.stats['dispatched'] += 1
+
+    async def _dispatch_loop(self):
+        while True:
+            events = {await self.queue.get()}
+            if self.coalesce:
+                await asyncio.sleep(self.coalesce)
+            while not self.queue.empty():
+                events.add(self.queue.get_nowait())
+            self.dispatch(events)
+
+    async def _connect(self):
+        conn = await asyncpg.connect(**self.connect_options)
+        lost = asyncio.Event()
+        conn.add_termination_listener(lambda _: lost.set())
+        await conn.add_listener(self.channel, self._notified)
+        self._conn, self._lost = conn, lost
+        self.stats['connects'] += 1
+        self.connected.set()
+        # Anything announced before LISTEN took effect was missed
+        self.resync()
+
+    async def _listen_loop(self):
+        backoff = 0.5
+        while True:
+            try:
+                await self._connect()
+                backoff = 0.5
+                while not self._lost.is_set():
+                    try:
+                        await asyncio.wait_for(self._lost.wait(), self.keepalive)
+                    except asyncio.TimeoutError:
+                        await asyncio.wait_for(self._conn.fetchval("SELECT 1"), self.keepalive)
+                raise ConnectionError("listener connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.connected.clear()
+                self.stats['disconnects'] += 1
+                print(f"⚠️ Invalidation listener lost ({e}); reconnecting in {backoff:.1f}s")
+                await self._close_connection()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _close_connection(self):
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await asyncio.wait_for(conn.close(), 5.0)
+            except Exception:
+                conn.terminate()
+
+    def backend_pid(self) -> Optional[int]:
+        """Server process of the listener connection, if connected"""
+        return self._conn.get_server_pid() if self._conn is not None else None
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._listen_loop()), asyncio.create_task(self._dispatch_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self.connected.clear()
+        await self._close_connection()
+
+
+async def serve():
+    bus = InvalidationBus(coalesce=env_float('INVALIDATION_COALESCE_SECONDS', 0.05),
+                          burst=env_int('INVALIDATION_BURST', 1000))
+    for kind in KINDS:
+        bus.subscribe(kind, lambda key, kind=kind: print(f"🔄 {kind} {key}"))
+    bus.on_resync(lambda: print("🔄 resync"))
+    bus.start()
+    await bus.connected.wait()
+    print(f"✅ Listening on {bus.channel}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await bus.stop()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,100 @@
+"""
+Chunked expiry of pending enterprise invitations.
+
+cleanup_expired_invitations() marks every overdue pending invitation in one
+UPDATE, and nothing schedules it. When it does run after a long gap, it
+scans user_invitations and holds the lock on every row it expires until the
+end. resend_invitation, cancel_invitation and accept_invitation on those
+rows wait for it, and so does a re-invite of the same email, whose INSERT
+has to check the (email, company_id) key.
+
+InvitationExpiryJob does the same UPDATE in chunks (services/maintenance.py):
+the oldest `chunk_size` overdue invitations at a time, found through the
+partial index from maintenance_jobs.sql and locked with SKIP LOCKED. An
+invitation that a manager is resending or cancelling at that moment is
+skipped, and the next run picks it up if it is still overdue. The result is
+what cleanup_expired_invitations() leaves behind: status 'expired', nothing
+else changed.
+
+Run with ``python -m services.invitation_expiry`` (every
+INVITATION_EXPIRY_INTERVAL_SECONDS) or ``--once`` for a single run.
+"""
+
+import asyncio
+import sys
+from typing import List, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int
+from .maintenance import ChunkedJob, Cursor
+
+# Walks idx_user_invitations_pending_expiry from the cursor
+EXPIRE_CHUNK_SQL = """
+WITH due AS (
+  SELECT id
+  FROM public.user_invitations
+  WHERE status = 'pending'
+    AND expires_at < $1
+    AND (expires_at, id) > (COALESCE($2::timestamptz, '-infinity'),
+                            COALESCE($3::uuid, '00000000-0000-0000-0000-000000000000'))
+  ORDER BY expires_at, id
+  LIMIT $4
+  FOR UPDATE SKIP LOCKED
+)
+UPDATE public.user_invitations i
+SET status = 'expired'
+FROM due
+WHERE i.id = due.id
+RETURNING i.id, i.expires_at
+"""
+
+
+class InvitationExpiryJob(ChunkedJob):
+    """Mark overdue pending invitations expired, chunk by chunk"""
+
+    name = 'invitation_expiry'
+
+    async def process(self, conn, state) -> Tuple[int, Cursor]:
+        rows = await conn.fetch(EXPIRE_CHUNK_SQL, state['cutoff'], state['cursor_at'], state['cursor_id'],
+                                self.chunk_size)
+        if not rows:
+            return 0, (state['cursor_at'], state['cursor_id'])
+        return len(rows), max((row['expires_at'], row['id']) for row in rows)
+
+
+async def main(argv: List[str]) -> int:
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=1)
+    job = InvitationExpiryJob(
+        pool,
+        chunk_size=env_int('INVITATION_EXPIRY_CHUNK', 500),
+        pause=env_float('INVITATION_EXPIRY_PAUSE_SECONDS', 0.05),
+        progress_every=env_int('INVITATION_EXPIRY_PROGRESS_CHUNKS', 20)
+    )
+    try:
+        if '--once' in argv:
+            result = await job.run()
+            print(f"✅ Expired {result['rows']} invitations in {result['chunks']} chunks "
+                  f"({result['chunk_ms']['p95']} ms p95 per chunk{', resumed' if result['resumed'] else ''})")
+        else:
+            interval = env_int('INVITATION_EXPIRY_INTERVAL_SECONDS', 300)
+            job.start(interval)
+            print(f"✅ Invitation expiry running every {interval}s")
+            await asyncio.Event().wait()
+    except Exception as e:
+        print(f"❌ Invitation expiry failed: {e}")
+        return 1
+    finally:
+        await job.stop()
+        await pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
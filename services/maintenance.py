@@ -0,0 +1,189 @@
+"""
+Chunked, resumable maintenance jobs.
+
+A job that rewrites every matching row in one statement holds every one of
+those row locks until it commits. ChunkedJob instead works through the rows
+in keyset order, `chunk_size` per transaction, throttled by a `pause` after
+every chunk and a `max_rate` in rows per second. Each chunk locks its rows
+with FOR UPDATE SKIP LOCKED, so it never waits on an application
+transaction; a skipped row is left for the next run.
+
+Progress is kept in public.maintenance_checkpoints (maintenance_jobs.sql).
+A run fixes its cutoff when it starts. Each chunk locks the job's row, does
+its work and moves the cursor in the same transaction, so a crash loses at
+most one uncommitted chunk and the next run resumes after the cursor with
+the same cutoff. Two copies of a job take turns chunk by chunk instead of
+overlapping.
+
+Subclasses set `name` and implement `process(conn, state)`; see
+services/invitation_expiry.py and services/usage_reset.py.
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+STATE_SQL = """
+SELECT name, cutoff, cursor_at, cursor_id, processed, chunks, started_at
+FROM public.maintenance_checkpoints
+WHERE name = $1
+FOR UPDATE
+"""
+
+BEGIN_RUN_SQL = """
+UPDATE public.maintenance_checkpoints
+SET cutoff = $2, cursor_at = NULL, cursor_id = NULL, processed = 0, chunks = 0, started_at = NOW(),
+    finished_at = NULL, updated_at = NOW()
+WHERE name = $1
+RETURNING name, cutoff, cursor_at, cursor_id, processed, chunks, started_at
+"""
+
+ADVANCE_SQL = """
+UPDATE public.maintenance_checkpoints
+SET cursor_at = $2, cursor_id = $3, processed = processed + $4, chunks = chunks + 1, updated_at = NOW()
+WHERE name = $1
+"""
+
+FINISH_SQL = """
+UPDATE public.maintenance_checkpoints
+SET cutoff = NULL, finished_at = NOW(), updated_at = NOW()
+WHERE name = $1
+"""
+
+# (cursor_at, cursor_id) of the last row a chunk handled
+Cursor = Tuple[Optional[datetime], Optional[uuid.UUID]]
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class ChunkedJob:
+    """Keyset-ordered chunks against a cutoff, checkpointed after every chunk"""
+
+    name = ''
+
+    def __init__(self, pool, chunk_size: int = 500, pause: float = 0.0, max_rate: float = 0.0,
+                 progress_every: int = 0):
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_rate = max_rate
+        self.progress_every = progress_every
+        self.stats = {'runs': 0, 'resumed_runs': 0, 'chunks': 0, 'rows': 0, 'errors': 0}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def cutoff(self, conn) -> datetime:
+        """The bound a new run works towards; rows past it are left for the next run"""
+        return await conn.fetchval("SELECT NOW()")
+
+    async def process(self, conn, state) -> Tuple[int, Cursor]:
+        """Handle up to chunk_size rows after the state's cursor; returns (rows, new cursor)"""
+        raise NotImplementedError
+
+    def fraction_done(self, cursor: Cursor) -> Optional[float]:
+        """Estimated share of the run behind `cursor`, if the job can tell"""
+        return None
+
+    async def due(self) -> bool:
+        """Whether the scheduled loop should start a run now"""
+        return True
+
+    async def _chunk(self) -> Tuple[int, Cursor, bool, bool]:
+        """One chunk in one transaction; returns (rows, cursor, resumed, finished)"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                state = await conn.fetchrow(STATE_SQL, self.name)
+                if state is None:
+                    raise RuntimeError(f"maintenance_checkpoints has no {self.name} row; run maintenance_jobs.sql")
+                resumed = state['cutoff'] is not None
+                if not resumed:
+                    state = await conn.fetchrow(BEGIN_RUN_SQL, self.name, await self.cutoff(conn))
+                rows, cursor = await self.process(conn, state)
+                if rows == 0:
+                    await conn.execute(FINISH_SQL, self.name)
+                    return 0, cursor, resumed, True
+                await conn.execute(ADVANCE_SQL, self.name, cursor[0], cursor[1], rows)
+                return rows, cursor, resumed, False
+
+    async def run(self, max_chunks: Optional[int] = None) -> Dict:
+        """Work chunk by chunk until no rows are left before the cutoff, `max_chunks` or stop()"""
+        chunk_ms: List[float] = []
+        rows_total = 0
+        resumed = False
+        finished = False
+        started = time.perf_counter()
+        while not self._stopping.is_set() and (max_chunks is None or len(chunk_ms) < max_chunks):
+            chunk_started = time.perf_counter()
+            try:
+                rows, cursor, chunk_resumed, finished = await self._chunk()
+            except Exception:
+                self.stats['errors'] += 1
+                raise
+            if not chunk_ms:
+                resumed = chunk_resumed
+            if finished:
+                break
+            chunk_ms.append((time.perf_counter() - chunk_started) * 1000)
+            rows_total += rows
+            self.stats['chunks'] += 1
+            self.stats['rows'] += rows
+            if self.progress_every and len(chunk_ms) % self.progress_every == 0:
+                fraction = self.fraction_done(cursor)
+                print(f"   {self.name}: {rows_total} rows in {len(chunk_ms)} chunks, "
+                      f"{_percentile(sorted(chunk_ms), 0.95):.1f} ms p95 per chunk"
+                      + (f", ~{fraction:.0%} done" if fraction is not None else ''))
+            delay = self.pause
+            if self.max_rate:
+                # Sleep off whatever the run is ahead of max_rate
+                delay = max(delay, rows_total / self.max_rate - (time.perf_counter() - started))
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        self.stats['runs'] += 1
+        if resumed:
+            self.stats['resumed_runs'] += 1
+        elapsed = time.perf_counter() - started
+        timings = sorted(chunk_ms)
+        return {
+            'rows': rows_total,
+            'chunks': len(chunk_ms),
+            'finished': finished,
+            'resumed': resumed,
+            'elapsed_s': round(elapsed, 3),
+            'rows_per_s': round(rows_total / elapsed, 1) if elapsed else 0.0,
+            'chunk_ms': {
+                'p50': round(_percentile(timings, 0.5), 2),
+                'p95': round(_percentile(timings, 0.95), 2),
+                'max': round(timings[-1], 2) if timings else 0.0
+            }
+        }
+
+    def start(self, interval: float):
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def _run(self, interval: float):
+        while not self._stopping.is_set():
+            try:
+                if await self.due():
+                    result = await self.run()
+                    if result['rows']:
+                        print(f"✅ {self.name}: {result['rows']} rows in {result['chunks']} chunks "
+                              f"({result['chunk_ms']['p95']} ms p95 per chunk)")
+            except Exception as e:
+                print(f"⚠️ {self.name} failed, retrying in {interval}s: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """Stop after the current chunk; an unfinished run resumes from its checkpoint"""
+        self._stopping.set()
+        if self._task:
+            await self._task
@@ -0,0 +1,239 @@
+"""
+Local stand-in for the n8n reply and email webhooks.
+
+Answers the payloads client/lib/n8n-service.ts sends with the same canned
+replies as its generateMockReply / generateMockEmail, so the generation
+gateway and its load scenarios can run without n8n or an LLM behind it.
+``{"test": true}`` pings (testN8NConnection) get an immediate success. When
+N8N_WEBHOOK_TOKEN is set, requests must carry it.
+
+Each generation waits for a delay drawn from a LatencyModel, a spec string
+such as ``lognormal:median=1.8,sigma=0.6``, ``fixed:ms=200``,
+``uniform:low=0.5,high=3``, or ``exponential:mean=1.5`` (seconds unless
+stated). LLM latency is heavy-tailed, and log-normal is the usual fit. A
+`max` parameter caps any distribution. Requests then fail in one of three
+ways:
+
+  error_rate    HTTP 500, as when the workflow errors out;
+  failure_rate  HTTP 200 with ``success: false``, as when the model call fails;
+  hang_rate     no answer for `hang` seconds, so client timeouts are exercised.
+
+With stream=True the response is sent chunked, the way n8n's streaming
+responses arrive. Headers come after first_byte of the delay, and the body
+follows in `chunks` pieces spread over the rest. Time to headers and time to
+the full body then differ, as they do in front of a streaming model.
+
+Run with ``python -m services.n8n_standin`` and point the gateway at
+http://localhost:<N8N_STANDIN_PORT>/webhook/reply and /webhook/email.
+Settings: N8N_STANDIN_LATENCY, N8N_STANDIN_ERROR_RATE,
+N8N_STANDIN_FAILURE_RATE, N8N_STANDIN_HANG_RATE, N8N_STANDIN_STREAM,
+N8N_STANDIN_CHUNKS and N8N_STANDIN_SEED.
+"""
+
+import asyncio
+import json
+import math
+import random
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from .config import env_float, env_int, env_str
+
+MOCK_REPLIES = {
+    'Say Yes': "Thank you for your message. Yes, I can help you with that. I'll get back to you shortly with more details.",
+    'Say No': "Thank you for reaching out. Unfortunately, I won't be able to assist with this particular request at this time.",
+    'Ask for More Info': "Thank you for your email. Could you please provide more details about your requirements? This will help me give you a more accurate response.",
+    'Delay Reply': "Thank you for your message. I'm currently reviewing your request and will get back to you within 24 hours with a comprehensive response.",
+    'Follow Up': "Following up on our previous conversation, I wanted to check if you need any additional information or if there's anything else I can help you with.",
+    'Confirm Something': "Thank you for your email. I can confirm that everything looks good on our end and we can proceed as discussed.",
+    'Decline Politely': "Thank you for thinking of us. While we appreciate the opportunity, we won't be able to move forward with this at this time.",
+    'Request Action': "Thank you for your message. Could you please take the following action to help us move forward with your request?",
+    'Thank Sender': "Thank you so much for your email and for taking the time to reach out. Your message is greatly appreciated.",
+    'Acknowledge Message': "Thank you for your message. I have received it and wanted to acknowledge that I'm reviewing the details."
+}
+
+
+def mock_reply(payload: Dict) -> Dict:
+    reply = MOCK_REPLIES.get(payload.get('intent'), MOCK_REPLIES['Acknowledge Message'])
+    tone = payload.get('tone')
+    if tone == 'Friendly':
+        reply = f"Hi there! {reply} Have a great day! 😊"
+    elif tone == 'Professional':
+        reply = f"Dear Sender,\n\n{reply}\n\nBest regards,\n[Your Name]"
+    elif tone == 'Urgent':
+        reply = f"URGENT: {reply}"
+    elif tone == 'Apologetic':
+        reply = f"I apologize for any inconvenience. {reply}"
+    return {'success': True, 'content': reply}
+
+
+def mock_email(payload: Dict) -> Dict:
+    prompt = payload.get('prompt') or 'general inquiry'
+    subject = f"Re: {prompt[:1].upper()}{prompt[1:50]}"
+    content = (f'Thank you for your interest. Based on your request about "{prompt}", I wanted to provide you '
+               f'with some helpful information.\n\nThis is a comprehensive response that addresses your inquiry. '
+               f'Please let me know if you need any additional details or clarification.\n\nBest regards,\n[Your Name]')
+    tone = payload.get('tone')
+    if tone == 'Friendly':
+        subject = f"😊 {subject}"
+        content = f"Hi there!\n\n{content}\n\nHave a wonderful day!"
+    elif tone == 'Professional':
+        content = f"Dear Recipient,\n\n{content}\n\nSincerely,\n[Your Name]"
+    elif tone == 'Urgent':
+        subject = f"URGENT: {subject}"
+        content = f"URGENT RESPONSE REQUIRED\n\n{content}"
+    return {'success': True, 'content': content, 'subject': subject}
+
+
+@dataclass
+class LatencyModel:
+    """Delay distribution in seconds, parsed from 'kind:key=value,...'"""
+
+    kind: str = 'fixed'
+    params: Dict[str, float] = field(default_factory=dict)
+
+    KINDS = {
+        'fixed': {'ms'},
+        'uniform': {'low', 'high'},
+        'exponential': {'mean'},
+        'lognormal': {'median', 'sigma'}
+    }
+
+    @classmethod
+    def parse(cls, spec: Union[str, float, 'LatencyModel', None]) -> 'LatencyModel':
+        if isinstance(spec, LatencyModel):
+            return spec
+        if spec is None or isinstance(spec, (int, float)):
+            return cls('fixed', {'ms': float(spec or 0) * 1000})
+        kind, _, body = spec.partition(':')
+        if kind not in cls.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind!r} (known: {', '.join(cls.KINDS)})")
+        params = {}
+        for item in filter(None, body.split(',')):
+            key, _, value = item.partition('=')
+            params[key.strip()] = float(value)
+        missing = cls.KINDS[kind] - params.keys()
+        if missing:
+            raise ValueError(f"{kind} latency needs {', '.join(sorted(missing))}")
+        return cls(kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == 'fixed':
+            delay = p['ms'] / 1000
+        elif self.kind == 'uniform':
+            delay = rng.uniform(p['low'], p['high'])
+        elif self.kind == 'exponential':
+            delay = rng.expovariate(1 / p['mean'])
+        else:
+            delay = rng.lognormvariate(math.log(p['median']), p['sigma'])
+        return min(delay, p.get('max', math.inf))
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(f'{k}={v:g}' for k, v in self.params.items())}"
+
+
+def create_app(latency: Union[str, float, LatencyModel, None] = None, error_rate: float = 0.0,
+               failure_rate: float = 0.0, hang_rate: float = 0.0, hang: float = 120.0, stream: bool = False,
+               chunks: int = 8, first_byte: float = 0.2, token: Optional[str] = None,
+               seed: Optional[int] = None) -> 'web.Application':
+    model = LatencyModel.parse(latency)
+    rng = random.Random(seed)
+    stats = {'reply': 0, 'email': 0, 'pings': 0, 'rejected': 0, 'errors': 0, 'failures': 0, 'hangs': 0,
+             'in_flight': 0, 'max_in_flight': 0, 'delay_s': 0.0}
+
+    async def respond(request, body: Dict, delay: float):
+        if not stream:
+            await asyncio.sleep(delay)
+            return web.json_response(body)
+        await asyncio.sleep(delay * first_byte)
+        response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        data = json.dumps(body).encode()
+        size = math.ceil(len(data) / chunks)
+        for start in range(0, len(data), size):
+            await asyncio.sleep(delay * (1 - first_byte) / chunks)
+            await response.write(data[start:start + size])
+        await response.write_eof()
+        return response
+
+    def webhook(kind: str, generate):
+        async def handler(request):
+            try:
+                payload = await request.json()
+            except ValueError:
+                return web.json_response({'success': False, 'error': 'Invalid JSON'}, status=400)
+            if token and payload.get('token') != token:
+                stats['rejected'] += 1
+                return web.json_response({'success': False, 'error': 'Invalid token'}, status=401)
+            if payload.get('test'):
+                stats['pings'] += 1
+                return web.json_response({'success': True})
+
+            stats[kind] += 1
+            stats['in_flight'] += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+            try:
+                roll = rng.random()
+                if roll < hang_rate:
+                    stats['hangs'] += 1
+                    await asyncio.sleep(hang)
+                    return web.json_response({'success': False, 'error': 'Workflow timed out'}, status=504)
+                delay = model.sample(rng)
+                stats['delay_s'] += delay
+                if roll < hang_rate + error_rate:
+                    stats['errors'] += 1
+                    await asyncio.sleep(delay)
+                    return web.json_response({'message': 'Error in workflow'}, status=500)
+                if roll < hang_rate + error_rate + failure_rate:
+                    stats['failures'] += 1
+                    return await respond(request, {'success': False, 'error': 'AI generation failed'}, delay)
+                return await respond(request, generate(payload), delay)
+            finally:
+                stats['in_flight'] -= 1
+        return handler
+
+    async def get_stats(request):
+        return web.json_response({**stats, 'latency': str(model)})
+
+    app = web.Application()
+    app['stats'] = stats
+    app.router.add_post('/webhook/reply', webhook('reply', mock_reply))
+    app.router.add_post('/webhook/email', webhook('email', mock_email))
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+async def serve():
+    latency = LatencyModel.parse(env_str('N8N_STANDIN_LATENCY', 'fixed:ms=0'))
+    runner = web.AppRunner(create_app(
+        latency=latency,
+        error_rate=env_float('N8N_STANDIN_ERROR_RATE', 0.0),
+        failure_rate=env_float('N8N_STANDIN_FAILURE_RATE', 0.0),
+        hang_rate=env_float('N8N_STANDIN_HANG_RATE', 0.0),
+        stream=env_int('N8N_STANDIN_STREAM', 0) == 1,
+        chunks=env_int('N8N_STANDIN_CHUNKS', 8),
+        token=env_str('N8N_WEBHOOK_TOKEN', '') or None,
+        seed=env_int('N8N_STANDIN_SEED', 0) or None
+    ))
+    await runner.setup()
+    port = env_int('N8N_STANDIN_PORT', 5678)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"✅ n8n stand-in listening on :{port} ({latency})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,202 @@
+"""
+Partition maintenance for the monthly-partitioned ai_generations table.
+
+ai_generations_partitioning.sql splits ai_generations by created_at into one
+partition per calendar month (UTC), named ai_generations_pYYYYMM. This job
+keeps that layout healthy and is meant to run daily from cron:
+
+- partitions for the current month and the next PARTITION_MONTHS_AHEAD months
+  are created ahead of time, so inserts never hit a missing range;
+- partitions that end before the retention window (PARTITION_RETAIN_MONTHS
+  full months, default 13 so a year-over-year month is always online) are
+  detached and moved to the PARTITION_ARCHIVE_SCHEMA schema, or dropped when
+  PARTITION_DROP=1.
+
+Detaching uses DETACH PARTITION ... CONCURRENTLY (PostgreSQL 14+), so inserts
+and dashboard reads on the parent are not blocked. Only one run works at a time;
+a second one finds the advisory lock taken and exits.
+
+Run with ``python -m services.partitions [--dry-run]``.
+"""
+
+import asyncio
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_int, env_str
+
+PARTITIONS_SQL = """
+SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = $1::regclass
+ORDER BY c.relname
+"""
+
+BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    lower: Optional[datetime]  # None for MINVALUE
+    upper: Optional[datetime]  # None for MAXVALUE
+
+
+def month_start(at: datetime) -> datetime:
+    at = at.astimezone(timezone.utc)
+    return datetime(at.year, at.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(at: datetime, months: int) -> datetime:
+    index = at.year * 12 + at.month - 1 + months
+    return at.replace(year=index // 12, month=index % 12 + 1)
+
+
+def parse_bound(value: str) -> Optional[datetime]:
+    """One side of a range bound as printed by pg_get_expr with TimeZone=UTC"""
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    value = value.strip("'")
+    # '2025-02-01 00:00:00+00' -> fromisoformat wants +00:00 on older Pythons
+    if re.search(r"[+-]\d\d$", value):
+        value += ':00'
+    return datetime.fromisoformat(value)
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class PartitionMaintainer:
+    """Create upcoming monthly partitions and retire expired ones"""
+
+    def __init__(self, conn, table: str = 'ai_generations', schema: str = 'public', months_ahead: int = 3,
+                 retain_months: int = 13, archive_schema: str = 'archive', drop: bool = False,
+                 concurrently: bool = True, dry_run: bool = False):
+        self.conn = conn
+        self.table = table
+        self.schema = schema
+        self.months_ahead = months_ahead
+        self.retain_months = retain_months
+        self.archive_schema = archive_schema
+        self.drop = drop
+        self.concurrently = concurrently
+        self.dry_run = dry_run
+        self.stats = {'created': [], 'detached': [], 'archived': [], 'dropped': []}
+
+    @property
+    def parent(self) -> str:
+        return f"{quote_ident(self.schema)}.{quote_ident(self.table)}"
+
+    def partition_name(self, start: datetime) -> str:
+        return f"{self.table}_p{start:%Y%m}"
+
+    async def partitions(self) -> List[Partition]:
+        partitions = []
+        for row in await self.conn.fetch(PARTITIONS_SQL, f"{self.schema}.{self.table}"):
+            match = BOUND_PATTERN.search(row['bound'])
+            if not match:
+                # DEFAULT partition; it covers nothing we manage
+                continue
+            partitions.append(Partition(row['name'], parse_bound(match.group(1)), parse_bound(match.group(2))))
+        return partitions
+
+    async def _execute(self, sql: str):
+        print(f"   {'[dry run] ' if self.dry_run else ''}{sql}")
+        if not self.dry_run:
+            await self.conn.execute(sql)
+
+    async def create_upcoming(self, partitions: List[Partition], now: datetime):
+        """One partition per month from the current one to months_ahead out, unless already covered"""
+        for offset in range(self.months_ahead + 1):
+            start = add_months(month_start(now), offset)
+            end = add_months(start, 1)
+            covered = any(
+                (p.lower is None or p.lower <= start) and (p.upper is None or p.upper >= end)
+                for p in partitions
+            )
+            if covered:
+                continue
+            overlapping = [
+                p.name for p in partitions
+                if (p.lower is None or p.lower < end) and (p.upper is None or p.upper > start)
+            ]
+            if overlapping:
+                print(f"⚠️ {start:%Y-%m} is partly covered by {', '.join(overlapping)}; not creating it")
+                continue
+            name = self.partition_name(start)
+            await self._execute(
+                f"CREATE TABLE IF NOT EXISTS {quote_ident(self.schema)}.{quote_ident(name)} "
+                f"PARTITION OF {self.parent} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+            self.stats['created'].append(name)
+
+    async def retire_expired(self, partitions: List[Partition], now: datetime):
+        """Detach partitions entirely older than the retention window, then archive or drop them"""
+        cutoff = add_months(month_start(now), -self.retain_months)
+        expired = [p for p in partitions if p.upper is not None and p.upper <= cutoff]
+        for partition in expired:
+            qualified = f"{quote_ident(self.schema)}.{quote_ident(partition.name)}"
+            await self._execute(
+                f"ALTER TABLE {self.parent} DETACH PARTITION {qualified}"
+                f"{' CONCURRENTLY' if self.concurrently else ''}"
+            )
+            self.stats['detached'].append(partition.name)
+            if self.drop:
+                await self._execute(f"DROP TABLE {qualified}")
+                self.stats['dropped'].append(partition.name)
+            else:
+                await self._execute(f"CREATE SCHEMA IF NOT EXISTS {quote_ident(self.archive_schema)}")
+                await self._execute(f"ALTER TABLE {qualified} SET SCHEMA {quote_ident(self.archive_schema)}")
+                self.stats['archived'].append(partition.name)
+
+    async def run(self, now: Optional[datetime] = None) -> Dict:
+        """One maintenance pass; returns the names touched per action"""
+        now = now or datetime.now(timezone.utc)
+        # Bounds are printed in the session time zone; month boundaries are UTC
+        await self.conn.execute("SET TIME ZONE 'UTC'")
+        lock_key = f"partitions:{self.schema}.{self.table}"
+        if not await self.conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", lock_key):
+            print(f"⚠️ Another partition maintenance run holds the lock for {self.table}; skipping")
+            return self.stats
+        try:
+            await self.create_upcoming(await self.partitions(), now)
+            await self.retire_expired(await self.partitions(), now)
+        finally:
+            await self.conn.execute("SELECT pg_advisory_unlock(hashtext($1))", lock_key)
+        return self.stats
+
+
+async def main(argv: List[str]) -> int:
+    conn = await asyncpg.connect(**database_options())
+    try:
+        maintainer = PartitionMaintainer(
+            conn,
+            months_ahead=env_int('PARTITION_MONTHS_AHEAD', 3),
+            retain_months=env_int('PARTITION_RETAIN_MONTHS', 13),
+            archive_schema=env_str('PARTITION_ARCHIVE_SCHEMA', 'archive'),
+            drop=env_int('PARTITION_DROP', 0) == 1,
+            dry_run='--dry-run' in argv
+        )
+        stats = await maintainer.run()
+    except Exception as e:
+        print(f"❌ Partition maintenance failed: {e}")
+        return 1
+    finally:
+        await conn.close()
+
+    print(f"✅ Partitions for {maintainer.table}: "
+          + ', '.join(f"{action} {len(names)}" for action, names in stats.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,124 @@
+"""
+Exact-match cache of AI generation responses.
+
+Regenerating a reply with the same message, tone and language is common in the
+extension, and every regeneration is a multi-second n8n call. ResponseCache
+keys a successful GenerationResponse by a SHA-256 of the normalized request
+(text with whitespace collapsed and Unicode normalized; generation_type,
+language, tone and intent case-folded) under the requesting tenant: the
+company for enterprise users, otherwise the user. Tenants never see each
+other's entries, and no tenant can hold more than max_per_tenant of them, so
+one busy company cannot evict everyone else.
+
+Entries leave on TTL expiry, on per-tenant overflow (that tenant's least
+recently used), or on global overflow (least recently used overall).
+Encrypted requests are never cached: their text is ciphertext that the cache
+must not keep, and it differs on every request anyway.
+
+The cache is opt-in. The gateway only uses it when
+GATEWAY_RESPONSE_CACHE_ENTRIES is above zero.
+"""
+
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: Optional[str]) -> str:
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+def _normalize_option(value: Optional[str]) -> str:
+    return (value or '').strip().casefold()
+
+
+def request_key(request: Dict) -> str:
+    """Digest of the fields that determine a generation's output"""
+    text = request.get('originalMessage') if request.get('generationType') == 'reply' else request.get('prompt')
+    fields = [
+        normalize_text(text),
+        _normalize_option(request.get('generationType')),
+        _normalize_option(request.get('language')),
+        _normalize_option(request.get('tone')),
+        _normalize_option(request.get('intent'))
+    ]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode()).hexdigest()
+
+
+class ResponseCache:
+    """Per-tenant LRU + TTL cache of successful generation responses"""
+
+    def __init__(self, max_entries: int = 10000, max_per_tenant: int = 1000, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.max_per_tenant = max_per_tenant
+        self.ttl = ttl
+        # (tenant, key) -> (stored_at, response), least recently used first
+        self.entries: 'OrderedDict[Tuple[Hashable, str], Tuple[float, Dict]]' = OrderedDict()
+        self.tenants: Dict[Hashable, 'OrderedDict[str, None]'] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0, 'expired': 0,
+                      'evicted': 0, 'tenant_evicted': 0}
+
+    @staticmethod
+    def cacheable(request: Dict) -> bool:
+        return not request.get('encrypted')
+
+    def _remove(self, tenant: Hashable, key: str):
+        self.entries.pop((tenant, key), None)
+        keys = self.tenants.get(tenant)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self.tenants[tenant]
+
+    def get(self, tenant: Hashable, request: Dict) -> Optional[Dict]:
+        if not self.cacheable(request):
+            self.stats['bypassed'] += 1
+            return None
+        key = request_key(request)
+        entry = self.entries.get((tenant, key))
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        stored_at, response = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            self._remove(tenant, key)
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return None
+        self.entries.move_to_end((tenant, key))
+        self.tenants[tenant].move_to_end(key)
+        self.stats['hits'] += 1
+        return dict(response)
+
+    def put(self, tenant: Hashable, request: Dict, response: Dict):
+        if not self.cacheable(request) or not response.get('success'):
+            return
+        key = request_key(request)
+        self._remove(tenant, key)
+        self.entries[(tenant, key)] = (time.monotonic(), dict(response))
+        keys = self.tenants.setdefault(tenant, OrderedDict())
+        keys[key] = None
+        self.stats['stores'] += 1
+
+        if len(keys) > self.max_per_tenant:
+            self._remove(tenant, next(iter(keys)))
+            self.stats['tenant_evicted'] += 1
+        while len(self.entries) > self.max_entries:
+            oldest_tenant, oldest_key = next(iter(self.entries))
+            self._remove(oldest_tenant, oldest_key)
+            self.stats['evicted'] += 1
+
+    def invalidate_tenant(self, tenant: Hashable):
+        for key in list(self.tenants.get(tenant, ())):
+            self._remove(tenant, key)
+
+    def summary(self) -> Dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {**self.stats, 'entries': len(self.entries), 'tenants': len(self.tenants),
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None}
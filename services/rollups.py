@@ -0,0 +1,231 @@
+"""
+Incremental daily usage rollups for ai_generations.
+
+usage_daily_user and usage_daily_company (ai_generations_rollups.sql) hold
+per-day generation counts by source, generation_type, language and tone. Each
+refresh takes the rows ingested since the stored watermark, aggregates them,
+adds them onto the rollups and moves the watermark, all in one transaction, so
+every row is counted exactly once even if the job crashes or two copies run.
+
+The window stops `settle` seconds before now: ingested_at is the inserting
+transaction's start time, so a row only becomes visible once that transaction
+commits. Writers to ai_generations must commit within that margin, which the
+ingest service and the per-event path do by a wide one.
+
+``--rebuild`` recomputes rollup days from raw rows instead (the initial backfill,
+or a repair after the verification harness finds drift). It holds the watermark
+lock and only counts rows below it, so it can run next to the refresh loop.
+
+Run with ``python -m services.rollups`` (refresh every ROLLUP_INTERVAL_SECONDS),
+``--once`` for a single refresh, or ``--rebuild[=YYYY-MM-DD]`` to rebuild from
+that day (default: the oldest generation).
+"""
+
+import asyncio
+import sys
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int
+
+STATE_NAME = 'ai_generations'
+
+LOCK_STATE_SQL = """
+SELECT watermark, LEAST(NOW() - make_interval(secs => $2), watermark + make_interval(secs => $3)) AS upper
+FROM public.usage_rollup_state
+WHERE name = $1
+FOR UPDATE
+"""
+
+# {rows} selects the raw rows to aggregate; its parameters start at $1
+APPLY_SQL = """
+WITH fresh AS (
+  SELECT user_id, company_id, (created_at AT TIME ZONE 'UTC')::date AS day, source, generation_type,
+         language, tone, success, COALESCE(input_length, 0) AS input_length,
+         COALESCE(output_length, 0) AS output_length
+  FROM public.ai_generations
+  WHERE {rows}
+),
+user_rows AS (
+  INSERT INTO public.usage_daily_user AS r
+    (user_id, day, source, generation_type, language, tone, generations, successful, input_chars, output_chars)
+  SELECT user_id, day, source, generation_type, language, tone,
+         COUNT(*), COUNT(*) FILTER (WHERE success), SUM(input_length), SUM(output_length)
+  FROM fresh
+  GROUP BY user_id, day, source, generation_type, language, tone
+  ON CONFLICT (user_id, day, source, generation_type, language, tone) DO UPDATE SET
+    generations = r.generations + EXCLUDED.generations,
+    successful = r.successful + EXCLUDED.successful,
+    input_chars = r.input_chars + EXCLUDED.input_chars,
+    output_chars = r.output_chars + EXCLUDED.output_chars
+  RETURNING 1
+),
+company_rows AS (
+  INSERT INTO public.usage_daily_company AS r
+    (company_id, day, source, generation_type, language, tone, generations, successful, input_chars, output_chars)
+  SELECT company_id, day, source, generation_type, language, tone,
+         COUNT(*), COUNT(*) FILTER (WHERE success), SUM(input_length), SUM(output_length)
+  FROM fresh
+  WHERE company_id IS NOT NULL
+  GROUP BY company_id, day, source, generation_type, language, tone
+  ON CONFLICT (company_id, day, source, generation_type, language, tone) DO UPDATE SET
+    generations = r.generations + EXCLUDED.generations,
+    successful = r.successful + EXCLUDED.successful,
+    input_chars = r.input_chars + EXCLUDED.input_chars,
+    output_chars = r.output_chars + EXCLUDED.output_chars
+  RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM fresh) AS generations,
+       (SELECT COUNT(*) FROM user_rows) AS user_rows,
+       (SELECT COUNT(*) FROM company_rows) AS company_rows
+"""
+
+REFRESH_SQL = APPLY_SQL.format(rows="ingested_at >= $1 AND ingested_at < $2")
+
+# Days [$1, $2) as of watermark $3; later rows are left to the refresh
+REBUILD_SQL = APPLY_SQL.format(rows="""
+    created_at >= $1::date::timestamp AT TIME ZONE 'UTC'
+    AND created_at < $2::date::timestamp AT TIME ZONE 'UTC'
+    AND (ingested_at IS NULL OR ingested_at < $3)
+""")
+
+
+class UsageRollupJob:
+    """Fold newly ingested ai_generations rows into the daily rollups"""
+
+    def __init__(self, pool, settle: float = 60.0, max_window: float = 3600.0):
+        self.pool = pool
+        self.settle = settle
+        self.max_window = max_window
+        self.stats = {'refreshes': 0, 'generations': 0, 'user_rows': 0, 'company_rows': 0, 'rebuilt_days': 0}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def _lock_state(self, conn):
+        state = await conn.fetchrow(LOCK_STATE_SQL, STATE_NAME, self.settle, self.max_window)
+        if state is None:
+            raise RuntimeError("usage_rollup_state has no ai_generations row; run ai_generations_rollups.sql")
+        return state
+
+    async def refresh(self) -> Dict:
+        """Apply at most one window; returns counts, with 'caught_up' once the watermark is current"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                state = await self._lock_state(conn)
+                if state['upper'] <= state['watermark']:
+                    return {'generations': 0, 'user_rows': 0, 'company_rows': 0, 'caught_up': True}
+                applied = dict(await conn.fetchrow(REFRESH_SQL, state['watermark'], state['upper']))
+                await conn.execute(
+                    "UPDATE public.usage_rollup_state SET watermark = $2, updated_at = NOW() WHERE name = $1",
+                    STATE_NAME, state['upper']
+                )
+
+        self.stats['refreshes'] += 1
+        for key in ('generations', 'user_rows', 'company_rows'):
+            self.stats[key] += applied[key]
+        applied['caught_up'] = state['upper'] - state['watermark'] < timedelta(seconds=self.max_window)
+        return applied
+
+    async def catch_up(self) -> Dict:
+        """Refresh window after window until the watermark is current"""
+        total = {'generations': 0, 'user_rows': 0, 'company_rows': 0}
+        while True:
+            applied = await self.refresh()
+            for key in total:
+                total[key] += applied[key]
+            if applied['caught_up']:
+                return total
+
+    async def rebuild(self, start: Optional[date] = None, end: Optional[date] = None, chunk_days: int = 31) -> int:
+        """Recompute rollup days [start, end) from raw rows, one chunk per transaction"""
+        async with self.pool.acquire() as conn:
+            if start is None:
+                start = await conn.fetchval(
+                    "SELECT (MIN(created_at) AT TIME ZONE 'UTC')::date FROM public.ai_generations")
+            if end is None:
+                end = await conn.fetchval("SELECT (NOW() AT TIME ZONE 'UTC')::date + 1")
+            if start is None:
+                return 0
+
+            day = start
+            while day < end:
+                chunk_end = min(day + timedelta(days=chunk_days), end)
+                async with conn.transaction():
+                    state = await self._lock_state(conn)
+                    for table in ('usage_daily_user', 'usage_daily_company'):
+                        await conn.execute(
+                            f"DELETE FROM public.{table} WHERE day >= $1 AND day < $2", day, chunk_end)
+                    applied = await conn.fetchrow(REBUILD_SQL, day, chunk_end, state['watermark'])
+                print(f"   rebuilt {day} .. {chunk_end - timedelta(days=1)}: {applied['generations']} generations")
+                self.stats['rebuilt_days'] += (chunk_end - day).days
+                day = chunk_end
+        return self.stats['rebuilt_days']
+
+    def start(self, interval: float):
+        self._task = asyncio.create_task(self._run(interval))
+
+    async def _run(self, interval: float):
+        while not self._stopping.is_set():
+            try:
+                applied = await self.catch_up()
+                if applied['generations']:
+                    print(f"✅ Rolled up {applied['generations']} generations "
+                          f"({applied['user_rows']} user rows, {applied['company_rows']} company rows)")
+            except Exception as e:
+                print(f"⚠️ Rollup refresh failed, retrying in {interval}s: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            await self._task
+
+
+def rebuild_start(argv: List[str]) -> Optional[date]:
+    for arg in argv:
+        if arg.startswith('--rebuild='):
+            return date.fromisoformat(arg.split('=', 1)[1])
+    return None
+
+
+async def main(argv: List[str]) -> int:
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=1)
+    job = UsageRollupJob(
+        pool,
+        settle=env_float('ROLLUP_SETTLE_SECONDS', 60.0),
+        max_window=env_float('ROLLUP_MAX_WINDOW_SECONDS', 3600.0)
+    )
+    try:
+        if any(arg == '--rebuild' or arg.startswith('--rebuild=') for arg in argv):
+            days = await job.rebuild(rebuild_start(argv))
+            print(f"✅ Rebuilt {days} days of usage rollups")
+        elif '--once' in argv:
+            applied = await job.catch_up()
+            print(f"✅ Rolled up {applied['generations']} generations")
+        else:
+            interval = env_int('ROLLUP_INTERVAL_SECONDS', 60)
+            job.start(interval)
+            print(f"✅ Usage rollups refreshing every {interval}s")
+            await asyncio.Event().wait()
+    except Exception as e:
+        print(f"❌ Usage rollups failed: {e}")
+        return 1
+    finally:
+        await job.stop()
+        await pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
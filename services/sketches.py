@@ -0,0 +1,189 @@
+"""
+Mergeable streaming sketches: HyperLogLog for distinct counts and t-digest
+for quantiles.
+
+Both answer from a fixed amount of state however many values they have seen,
+merge losslessly with another sketch of the same parameters (other days,
+other shards), and serialize to a few kilobytes.
+
+HyperLogLog at the default precision 12 keeps 4096 one-byte registers with a
+standard error of 1.04 / sqrt(4096), about 1.6%. Values are hashed with
+BLAKE2b, so sketches built in different processes agree.
+
+TDigest is the merging variant with the arcsine scale function: centroids are
+small near the tails and large in the middle, so extreme quantiles such as
+p95 and p99 stay accurate. compression bounds the number of centroids (about
+2x compression after a merge).
+"""
+
+import hashlib
+import math
+import struct
+import uuid
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+
+def _value_bytes(value) -> bytes:
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2**precision bytes"""
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError("register count does not match precision")
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(_value_bytes(value), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        rest = (hashed << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = min(64 - rest.bit_length() + 1, 64 - self.precision + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """Union in place"""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self) -> float:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        raw = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate while most registers are empty
+            return self.size * math.log(self.size / zeros)
+        return raw
+
+    def __len__(self):
+        return round(self.estimate())
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        return cls(data[0], zlib.decompress(data[1:]))
+
+
+class TDigest:
+    """Approximate quantiles from a bounded set of weighted centroids"""
+
+    HEADER = struct.Struct('<dIdd')  # compression, centroids, min, max
+    CENTROID = struct.Struct('<dd')  # mean, weight
+
+    def __init__(self, compression: float = 100):
+        self.compression = compression
+        self.centroids: List[Tuple[float, float]] = []
+        self.buffer: List[Tuple[float, float]] = []
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def total(self) -> float:
+        return sum(weight for _, weight in self.centroids) + sum(weight for _, weight in self.buffer)
+
+    def add(self, value: float, weight: float = 1.0):
+        self.buffer.append((float(value), float(weight)))
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) >= 5 * self.compression:
+            self.compress()
+
+    def update(self, values: Iterable[float]):
+        for value in values:
+            self.add(value)
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def compress(self):
+        """Fold the buffer into the centroids"""
+        if not self.buffer:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        total = sum(weight for _, weight in points)
+
+        merged = []
+        mean, weight = points[0]
+        done = 0.0
+        for next_mean, next_weight in points[1:]:
+            # A centroid may span at most one unit of k
+            if self._k((done + weight + next_weight) / total) - self._k(done / total) <= 1:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged.append((mean, weight))
+                done += weight
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def merge(self, other: 'TDigest') -> 'TDigest':
+        """Absorb another digest in place"""
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        self.compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        total = sum(weight for _, weight in self.centroids)
+        target = q * total
+        # Interpolate between centroid centers; the ends run out to min and max
+        cumulative = 0.0
+        previous_center, previous_mean = 0.0, self.min
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                if center == previous_center:
+                    return mean
+                share = (target - previous_center) / (center - previous_center)
+                return previous_mean + share * (mean - previous_mean)
+            previous_center, previous_mean = center, mean
+            cumulative += weight
+        if total == previous_center:
+            return self.max
+        share = (target - previous_center) / (total - previous_center)
+        return previous_mean + min(share, 1.0) * (self.max - previous_mean)
+
+    def to_bytes(self) -> bytes:
+        self.compress()
+        body = self.HEADER.pack(self.compression, len(self.centroids), self.min, self.max)
+        body += b''.join(self.CENTROID.pack(mean, weight) for mean, weight in self.centroids)
+        return zlib.compress(body)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'TDigest':
+        body = zlib.decompress(data)
+        compression, count, low, high = cls.HEADER.unpack_from(body)
+        digest = cls(compression)
+        digest.min, digest.max = low, high
+        digest.centroids = [cls.CENTROID.unpack_from(body, cls.HEADER.size + i * cls.CENTROID.size)
+                            for i in range(count)]
+        return digest
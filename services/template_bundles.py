@@ -0,0 +1,318 @@
+"""
+Precomputed extension template bundles with versioned delta sync.
+
+Every active extension polls get_templates_for_extension, which unions the
+user's private hotkey templates with their company's approved ones, sorts by
+hotkey, and sends every content body, changed or not. This service keeps one
+Bundle per user: a compact hotkey index (``[hotkey, id, title, source]`` in
+the RPC's order) plus each template's content.
+
+Each template's fields are hashed, and the bundle's version is a hash over
+those. A poll sends the version it holds. If nothing changed it gets a 304. If
+its version is one of the last `history` versions, it gets the full index and
+only the templates that changed, plus the ids that were removed. Otherwise it
+gets the whole bundle.
+
+Checking for changes does not read the templates. Within `check_interval` of
+the last check, a poll is answered from memory. After that, one aggregate over
+the same rows (count, MAX(content_version), and the user's company) is
+compared with the stamp the bundle was built from. The contents are reread
+only when the stamp moved. content_version is maintained by a trigger in
+extension_template_bundles.sql; updated_at is not used, since owner edits
+through RLS leave it alone and usage counts move it. Approving, rejecting or
+editing a company template moves the stamp of every member. An edit that
+writes back identical fields rebuilds to the same version, which then stays
+put, and so do the extensions' copies.
+
+Run extension_template_bundles.sql first for the content versions and the
+partial indexes behind the check. With CACHE_INVALIDATION=1 the service listens for the invalidations of
+cache_invalidation.sql (services/invalidation.py). A bundle is then checked
+as soon as one of its templates changes, so BUNDLE_CHECK_INTERVAL_SECONDS can
+be minutes rather than seconds. Like the gateway, the service trusts the userId it is given and belongs
+behind the app server.
+
+Run with ``python -m services.template_bundles``. It serves
+GET /extension/templates?userId=...&since=<version> (If-None-Match works too)
+and GET /extension/templates/stats.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int
+from .invalidation import InvalidationBus, LoadGuard
+
+# The rows get_templates_for_extension returns; {columns} picks what is read from them
+_EXTENSION_ROWS = """
+    SELECT {columns}, 'private' AS source
+    FROM public.templates t, target
+    WHERE t.user_id = target.id AND t.visibility = 'private' AND t.hotkey IS NOT NULL AND t.hotkey <> ''
+    UNION ALL
+    SELECT {columns}, 'company' AS source
+    FROM public.templates t, target
+    WHERE target.company_id IS NOT NULL AND t.company_id = target.company_id AND t.visibility = 'company'
+      AND t.approved_at IS NOT NULL AND t.hotkey IS NOT NULL AND t.hotkey <> ''
+"""
+
+# Aggregated without reading any contents
+STAMP_SQL = f"""
+WITH target AS (SELECT id, company_id FROM public.users WHERE id = $1),
+visible AS ({_EXTENSION_ROWS.format(columns='t.content_version')})
+SELECT (SELECT company_id FROM target) AS company_id, EXISTS (SELECT 1 FROM target) AS found,
+       COUNT(*) AS templates, MAX(content_version) AS content_version
+FROM visible
+"""
+
+TEMPLATES_SQL = f"""
+WITH target AS (SELECT id, company_id FROM public.users WHERE id = $1)
+SELECT * FROM ({_EXTENSION_ROWS.format(columns='t.id, t.title, t.content, t.subject, t.hotkey')}) visible
+ORDER BY hotkey, id
+"""
+
+
+def template_hash(row: Dict) -> str:
+    fields = [row['title'], row['content'], row['subject'], row['hotkey'], row['source']]
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+@dataclass
+class Bundle:
+    """One user's extension templates as of `stamp`, and the id -> hash maps of earlier versions"""
+
+    version: str
+    stamp: Tuple
+    company_id: Optional[uuid.UUID]
+    index: List[List]
+    templates: Dict[str, Dict]
+    hashes: Dict[str, str]
+    checked_at: float
+    previous: 'OrderedDict[str, Dict[str, str]]' = field(default_factory=OrderedDict)
+
+    @classmethod
+    def build(cls, rows, stamp: Tuple, company_id) -> 'Bundle':
+        index, templates, hashes = [], {}, {}
+        for row in rows:
+            row = dict(row)
+            template_id = str(row['id'])
+            index.append([row['hotkey'], template_id, row['title'], row['source']])
+            templates[template_id] = {key: row[key] for key in ('title', 'subject', 'content', 'hotkey', 'source')}
+            hashes[template_id] = template_hash(row)
+        digest = hashlib.sha256(''.join(f"{k}:{hashes[k]};" for k in sorted(hashes)).encode()).hexdigest()[:16]
+        return cls(digest, stamp, company_id, index, templates, hashes, time.monotonic())
+
+    def full(self) -> Dict:
+        return {'version': self.version, 'full': True, 'index': self.index, 'templates': self.templates,
+                'removed': []}
+
+    def delta(self, since: str) -> Optional[Dict]:
+        """Changes since an earlier version, or None if that version is no longer kept"""
+        base = self.previous.get(since)
+        if base is None:
+            return None
+        return {
+            'version': self.version,
+            'since': since,
+            'full': False,
+            'index': self.index,
+            'templates': {k: t for k, t in self.templates.items() if base.get(k) != self.hashes[k]},
+            'removed': [k for k in base if k not in self.hashes]
+        }
+
+
+class TemplateBundleCache:
+    """Per-user bundles, checked against the database at most once per check_interval"""
+
+    def __init__(self, pool, check_interval: float = 5.0, history: int = 8, max_users: int = 50000):
+        self.pool = pool
+        self.check_interval = check_interval
+        self.history = history
+        self.max_users = max_users
+        self.entries: 'OrderedDict[uuid.UUID, Bundle]' = OrderedDict()
+        self._refreshing: Dict[uuid.UUID, asyncio.Future] = {}
+        self._guard = LoadGuard()
+        self.stats = {'hits': 0, 'checks': 0, 'rebuilds': 0, 'unchanged_rebuilds': 0, 'not_modified': 0,
+                      'deltas': 0, 'full': 0, 'evictions': 0, 'stale_refreshes': 0}
+
+    async def _refresh(self, user_id: uuid.UUID, current: Optional[Bundle]) -> Optional[Bundle]:
+        token = self._guard.begin()
+        try:
+            return await self._refresh_guarded(user_id, current, token)
+        finally:
+            self._guard.end()
+
+    async def _refresh_guarded(self, user_id: uuid.UUID, current: Optional[Bundle], token: int) -> Optional[Bundle]:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                row = await conn.fetchrow(STAMP_SQL, user_id)
+                self.stats['checks'] += 1
+                if not row['found']:
+                    self.entries.pop(user_id, None)
+                    return None
+                stamp = (row['company_id'], row['templates'], row['content_version'])
+                if current is not None and current.stamp == stamp:
+                    if self._guard.current(token, ('user', user_id), ('company', row['company_id'])):
+                        current.checked_at = time.monotonic()
+                    return current
+                rows = await conn.fetch(TEMPLATES_SQL, user_id)
+
+        self.stats['rebuilds'] += 1
+        bundle = Bundle.build(rows, stamp, row['company_id'])
+        if not self._guard.current(token, ('user', user_id), ('company', row['company_id'])):
+            # Invalidated while we read; answer this poll, but leave the entry due for a check
+            self.stats['stale_refreshes'] += 1
+            return bundle
+        if current is not None and bundle.version == current.version:
+            # The edit wrote back what the extension already has
+            self.stats['unchanged_rebuilds'] += 1
+            current.stamp, current.company_id, current.checked_at = stamp, bundle.company_id, bundle.checked_at
+            return current
+        if current is not None:
+            bundle.previous = current.previous
+            bundle.previous[current.version] = current.hashes
+            bundle.previous.pop(bundle.version, None)
+            while len(bundle.previous) > self.history:
+                bundle.previous.popitem(last=False)
+
+        self.entries[user_id] = bundle
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_users:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+        return bundle
+
+    def _refresh_done(self, user_id: uuid.UUID, refreshing: asyncio.Future):
+        # An invalidation may have detached it, and a newer refresh taken its place
+        if self._refreshing.get(user_id) is refreshing:
+            del self._refreshing[user_id]
+
+    async def get(self, user_id: uuid.UUID) -> Optional[Bundle]:
+        bundle = self.entries.get(user_id)
+        if bundle is not None and time.monotonic() - bundle.checked_at < self.check_interval:
+            self.entries.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return bundle
+
+        refreshing = self._refreshing.get(user_id)
+        if refreshing is None:
+            refreshing = asyncio.ensure_future(self._refresh(user_id, bundle))
+            self._refreshing[user_id] = refreshing
+            refreshing.add_done_callback(lambda done: self._refresh_done(user_id, done))
+        return await asyncio.shield(refreshing)
+
+    async def sync(self, user_id: uuid.UUID, since: Optional[str] = None) -> Tuple[int, Optional[Dict]]:
+        """(304, version only) if `since` is current, else (200, delta or full bundle); (404, None) if no user"""
+        bundle = await self.get(user_id)
+        if bundle is None:
+            return 404, None
+        if since == bundle.version:
+            self.stats['not_modified'] += 1
+            return 304, {'version': bundle.version}
+        payload = bundle.delta(since) if since else None
+        if payload is None:
+            self.stats['full'] += 1
+            return 200, bundle.full()
+        self.stats['deltas'] += 1
+        return 200, payload
+
+    def invalidate(self, user_id: uuid.UUID):
+        """Check the user's bundle on the next poll, keeping its history for deltas"""
+        bundle = self.entries.get(user_id)
+        if bundle is not None:
+            bundle.checked_at = float('-inf')
+        self._refreshing.pop(user_id, None)
+        self._guard.invalidate(('user', user_id))
+
+    def invalidate_company(self, company_id: uuid.UUID):
+        for user_id, bundle in self.entries.items():
+            if bundle.company_id == company_id:
+                bundle.checked_at = float('-inf')
+                self._refreshing.pop(user_id, None)
+        self._guard.invalidate(('company', company_id))
+
+    def invalidate_all(self):
+        for bundle in self.entries.values():
+            bundle.checked_at = float('-inf')
+        self._refreshing.clear()
+        self._guard.invalidate_all()
+
+
+def create_app(bundles: TemplateBundleCache) -> 'web.Application':
+    async def templates(request):
+        try:
+            user_id = uuid.UUID(request.query['userId'])
+        except (KeyError, ValueError) as e:
+            return web.json_response({'success': False, 'error': f"Invalid userId: {e}"}, status=400)
+        since = request.query.get('since') or request.headers.get('If-None-Match', '').strip('W/"') or None
+        status, payload = await bundles.sync(user_id, since)
+        if status == 404:
+            return web.json_response({'success': False, 'error': 'User not found'}, status=404)
+        version = payload['version']
+        headers = {'ETag': f'"{version}"', 'Cache-Control': 'private, no-cache'}
+        if status == 304:
+            return web.Response(status=304, headers=headers)
+        response = web.json_response(payload, headers=headers)
+        response.enable_compression()
+        return response
+
+    async def stats(request):
+        return web.json_response({**bundles.stats, 'cached_users': len(bundles.entries)})
+
+    app = web.Application()
+    app.router.add_get('/extension/templates', templates)
+    app.router.add_get('/extension/templates/stats', stats)
+    return app
+
+
+async def serve():
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=env_int('BUNDLE_DB_POOL', 5))
+    bundles = TemplateBundleCache(
+        pool,
+        check_interval=env_float('BUNDLE_CHECK_INTERVAL_SECONDS', 5.0),
+        history=env_int('BUNDLE_HISTORY', 8),
+        max_users=env_int('BUNDLE_MAX_USERS', 50000)
+    )
+    bus = None
+    if env_int('CACHE_INVALIDATION', 0) == 1:
+        bus = InvalidationBus()
+        bus.subscribe('user', bundles.invalidate)
+        bus.subscribe('user_templates', bundles.invalidate)
+        bus.subscribe('company_templates', bundles.invalidate_company)
+        bus.on_resync(bundles.invalidate_all)
+        bus.start()
+
+    runner = web.AppRunner(create_app(bundles))
+    await runner.setup()
+    port = env_int('BUNDLE_PORT', 8094)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"✅ Template bundles listening on :{port}, checked every {bundles.check_interval}s")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if bus:
+            await bus.stop()
+        await pool.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,357 @@
+"""
+Batched template usage counting.
+
+Every hotkey expansion and template copy calls increment_template_usage,
+which looks up the template and the user's company, checks that the user may
+use the template, and then UPDATEs templates.usage_count. A popular company
+template becomes a hot row that every member of the company updates, and
+each of those transactions waits on the one before it.
+
+This service answers the permission check from TemplateAccessCache, an
+in-memory copy of each template's owner, company and visibility and of each
+user's company, and returns the same denials the RPC raises. Allowed uses
+are merged per template in memory. Every `flush_interval` seconds they are
+written with one set-based UPDATE that adds each template's count, so a hot
+template takes one row lock per flush instead of one per use. The UPDATE
+only adds to usage_count and leaves updated_at alone, so a count is not
+mistaken for an edit by anything that watches the row.
+
+A failed flush adds its counts back to the pending ones, so a database outage
+delays the counts but does not lose them. Counts for a template deleted in
+the meantime are dropped by the UPDATE.
+
+Access entries are reloaded after `ttl` seconds. With CACHE_INVALIDATION=1 the
+service also listens for the invalidations of cache_invalidation.sql
+(services/invalidation.py): a change to a user's templates or to a company's
+templates drops their entries, and a change to a user drops their company.
+
+Run with ``python -m services.template_usage``. It serves
+POST /templates/usage with {"template_id": ..., "user_id": ...} or a list of
+them, and GET /templates/usage/stats.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from .config import database_options, env_float, env_int
+from .invalidation import InvalidationBus, LoadGuard
+
+# What increment_template_usage reads before its UPDATE, in one round trip
+ACCESS_SQL = """
+SELECT t.id IS NOT NULL AS template_found, t.user_id AS owner_id, t.company_id, t.visibility,
+       u.id IS NOT NULL AS user_found, u.company_id AS user_company_id
+FROM (SELECT 1) one
+LEFT JOIN public.templates t ON t.id = $1
+LEFT JOIN public.users u ON u.id = $2
+"""
+
+# Ids are unique within a batch, so every row is matched once
+FLUSH_SQL = """
+UPDATE public.templates t
+SET usage_count = t.usage_count + v.uses
+FROM unnest($1::uuid[], $2::int[]) AS v(id, uses)
+WHERE t.id = v.id
+"""
+
+TEMPLATE_NOT_FOUND = 'Template not found'
+PRIVATE_DENIED = 'Access denied: cannot use private templates of other users'
+COMPANY_DENIED = 'Access denied: cannot use company templates from other companies'
+
+
+@dataclass
+class TemplateAccess:
+    """Who may use one template, as of loaded_at"""
+
+    owner_id: uuid.UUID
+    company_id: Optional[uuid.UUID]
+    visibility: str
+    loaded_at: float
+
+    def denial(self, user_id: uuid.UUID, user_company_id: Optional[uuid.UUID]) -> Optional[str]:
+        """Why increment_template_usage would raise, or None"""
+        if self.visibility == 'private' and self.owner_id != user_id:
+            return PRIVATE_DENIED
+        # The RPC compares with !=, which lets NULL companies through; so does this
+        if (self.visibility == 'company' and user_company_id is not None and self.company_id is not None
+                and user_company_id != self.company_id):
+            return COMPANY_DENIED
+        return None
+
+
+class TemplateAccessCache:
+    """TTL-bounded, size-bounded copy of template visibility and user companies"""
+
+    def __init__(self, pool, ttl: float = 300.0, max_entries: int = 100000):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.templates: 'OrderedDict[uuid.UUID, TemplateAccess]' = OrderedDict()
+        # user id -> (company id, loaded_at)
+        self.users: 'OrderedDict[uuid.UUID, Tuple[Optional[uuid.UUID], float]]' = OrderedDict()
+        self._loading: Dict[Tuple[uuid.UUID, uuid.UUID], asyncio.Future] = {}
+        self._guard = LoadGuard()
+        self.stats = {'hits': 0, 'loads': 0, 'denied': 0, 'evictions': 0, 'stale_loads': 0}
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl
+
+    def _store(self, entries: OrderedDict, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    async def _load(self, template_id: uuid.UUID, user_id: uuid.UUID) -> Tuple[Optional[TemplateAccess], Optional[Tuple]]:
+        token = self._guard.begin()
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(ACCESS_SQL, template_id, user_id)
+            self.stats['loads'] += 1
+            now = time.monotonic()
+            access = user = None
+            if row['template_found']:
+                access = TemplateAccess(row['owner_id'], row['company_id'], row['visibility'], now)
+                # Stored only if neither its owner's nor its company's templates were invalidated meanwhile
+                if self._guard.current(token, ('owner', access.owner_id), ('company', access.company_id)):
+                    self._store(self.templates, template_id, access)
+                else:
+                    self.stats['stale_loads'] += 1
+            # A user who does not exist yet is not remembered, they may be created any moment
+            if row['user_found']:
+                user = (row['user_company_id'], now)
+                if self._guard.current(token, ('user', user_id)):
+                    self._store(self.users, user_id, user)
+                else:
+                    self.stats['stale_loads'] += 1
+            return access, user
+        finally:
+            self._guard.end()
+
+    def _load_done(self, key: Tuple[uuid.UUID, uuid.UUID], loading: asyncio.Future):
+        # An invalidation may have detached it, and a newer load taken its place
+        if self._loading.get(key) is loading:
+            del self._loading[key]
+
+    async def check(self, template_id: uuid.UUID, user_id: uuid.UUID) -> Optional[str]:
+        """The denial increment_template_usage would raise for this use, or None"""
+        access = self.templates.get(template_id)
+        user = self.users.get(user_id)
+        if access is not None and self._fresh(access.loaded_at) and user is not None and self._fresh(user[1]):
+            self.templates.move_to_end(template_id)
+            self.users.move_to_end(user_id)
+            self.stats['hits'] += 1
+        else:
+            key = (template_id, user_id)
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load(template_id, user_id))
+                self._loading[key] = loading
+                loading.add_done_callback(lambda done: self._load_done(key, done))
+            access, user = await asyncio.shield(loading)
+
+        reason = TEMPLATE_NOT_FOUND if access is None else access.denial(user_id, user[0] if user else None)
+        if reason:
+            self.stats['denied'] += 1
+        return reason
+
+    def invalidate_user(self, user_id: uuid.UUID):
+        """Drop a user's company, e.g. after they joined or left one"""
+        self.users.pop(user_id, None)
+        for key in [key for key in self._loading if key[1] == user_id]:
+            del self._loading[key]
+        self._guard.invalidate(('user', user_id))
+
+    def invalidate_owner(self, user_id: uuid.UUID):
+        """Drop every template owned by the user"""
+        for template_id in [k for k, access in self.templates.items() if access.owner_id == user_id]:
+            del self.templates[template_id]
+        # Which loads read this owner's templates is only known once they finish
+        self._loading.clear()
+        self._guard.invalidate(('owner', user_id))
+
+    def invalidate_company(self, company_id: uuid.UUID):
+        """Drop every template of the company"""
+        for template_id in [k for k, access in self.templates.items() if access.company_id == company_id]:
+            del self.templates[template_id]
+        self._loading.clear()
+        self._guard.invalidate(('company', company_id))
+
+    def invalidate_all(self):
+        self.templates.clear()
+        self.users.clear()
+        self._loading.clear()
+        self._guard.invalidate_all()
+
+
+class TemplateUsageAggregator:
+    """Check template uses against the access cache, merge them and flush them in batches"""
+
+    def __init__(self, pool, access: TemplateAccessCache, flush_interval: float = 2.0, max_batch: int = 5000):
+        self.pool = pool
+        self.access = access
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.pending: Dict[uuid.UUID, int] = {}
+        self.stats = {'uses': 0, 'denied': 0, 'flushes': 0, 'statements': 0, 'templates_sent': 0,
+                      'rows_updated': 0, 'errors': 0}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, template_id, user_id, uses: int = 1) -> Optional[str]:
+        """Count `uses` of a template by a user; returns the denial instead if the RPC would refuse"""
+        template_id = template_id if isinstance(template_id, uuid.UUID) else uuid.UUID(str(template_id))
+        user_id = user_id if isinstance(user_id, uuid.UUID) else uuid.UUID(str(user_id))
+        reason = await self.access.check(template_id, user_id)
+        if reason:
+            self.stats['denied'] += 1
+            return reason
+        self.stats['uses'] += uses
+        self.pending[template_id] = self.pending.get(template_id, 0) + uses
+        return None
+
+    async def flush(self) -> int:
+        """Write all pending counts; returns the number of templates updated"""
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            # Sorted so concurrent flushers, and other processes, lock rows in the same order
+            rows = sorted(batch.items())
+            written = 0
+            updated = 0
+            try:
+                while written < len(rows):
+                    chunk = rows[written:written + self.max_batch]
+                    status = await self.pool.execute(
+                        FLUSH_SQL,
+                        [template_id for template_id, _ in chunk],
+                        [uses for _, uses in chunk]
+                    )
+                    written += len(chunk)
+                    updated += int(status.split()[-1])
+                    self.stats['statements'] += 1
+                    self.stats['templates_sent'] += len(chunk)
+            except Exception:
+                self.stats['errors'] += 1
+                self._requeue(rows[written:])
+                raise
+            finally:
+                self.stats['rows_updated'] += updated
+            self.stats['flushes'] += 1
+            return updated
+
+    def _requeue(self, rows: List[Tuple[uuid.UUID, int]]):
+        for template_id, uses in rows:
+            self.pending[template_id] = self.pending.get(template_id, 0) + uses
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Template usage flush failed, {len(self.pending)} templates pending: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def _parse_use(payload: Dict) -> Tuple[uuid.UUID, uuid.UUID]:
+    return uuid.UUID(payload['template_id']), uuid.UUID(payload['user_id'])
+
+
+def create_app(aggregator: TemplateUsageAggregator) -> 'web.Application':
+    async def usage(request):
+        try:
+            payload = await request.json()
+            uses = [_parse_use(u) for u in (payload if isinstance(payload, list) else [payload])]
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            return web.json_response({'success': False, 'error': f"Invalid template usage: {e}"}, status=400)
+        denied = []
+        for template_id, user_id in uses:
+            reason = await aggregator.record(template_id, user_id)
+            if reason:
+                denied.append({'template_id': str(template_id), 'error': reason})
+        if not isinstance(payload, list) and denied:
+            status = 404 if denied[0]['error'] == TEMPLATE_NOT_FOUND else 403
+            return web.json_response({'success': False, 'error': denied[0]['error']}, status=status)
+        return web.json_response({'success': True, 'accepted': len(uses) - len(denied), 'denied': denied},
+                                 status=202)
+
+    async def stats(request):
+        return web.json_response({
+            **aggregator.stats,
+            'pending': len(aggregator.pending),
+            'access': aggregator.access.stats,
+            'cached_templates': len(aggregator.access.templates),
+            'cached_users': len(aggregator.access.users)
+        })
+
+    app = web.Application()
+    app.router.add_post('/templates/usage', usage)
+    app.router.add_get('/templates/usage/stats', stats)
+    return app
+
+
+async def serve():
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=env_int('TEMPLATE_USAGE_DB_POOL', 3))
+    access = TemplateAccessCache(pool, ttl=env_float('TEMPLATE_ACCESS_TTL_SECONDS', 300.0))
+    aggregator = TemplateUsageAggregator(pool, access,
+                                         flush_interval=env_float('TEMPLATE_USAGE_FLUSH_SECONDS', 2.0))
+    aggregator.start()
+    bus = None
+    if env_int('CACHE_INVALIDATION', 0) == 1:
+        bus = InvalidationBus()
+        bus.subscribe('user', access.invalidate_user)
+        bus.subscribe('user_templates', access.invalidate_owner)
+        bus.subscribe('company_templates', access.invalidate_company)
+        bus.on_resync(access.invalidate_all)
+        bus.start()
+
+    runner = web.AppRunner(create_app(aggregator))
+    await runner.setup()
+    port = env_int('TEMPLATE_USAGE_PORT', 8095)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"✅ Template usage service listening on :{port}, flushing every {aggregator.flush_interval}s")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if bus:
+            await bus.stop()
+        await aggregator.stop()
+        await pool.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,132 @@
+"""
+Chunked daily and monthly usage resets.
+
+reset_daily_usage() and reset_monthly_usage() each rewrite every stale row
+of public.users in one statement. can_user_generate and increment_user_usage
+used to call both, so after midnight UTC the first generation request reset
+the whole table while every other user's request queued behind its row
+locks. Those functions now only reset their own user (reset_user_usage in
+complete_user_limits_update.sql). UsageResetJob resets everyone else in the
+background.
+
+A run starts the day it began on (and that day's month) for every user, in
+primary-key order, `chunk_size` users per transaction
+(services/maintenance.py). Each chunk skips users whose row a generation
+holds at that moment; that generation resets its own user anyway. The job
+sets the same values as the two functions, and it leaves a user alone if
+their own request got there first, so it is safe to run alongside generation
+traffic. Throttle it with USAGE_RESET_PAUSE_SECONDS between chunks or with
+USAGE_RESET_MAX_RATE in rows per second. Progress is estimated from the
+cursor, since user ids are random UUIDs.
+
+The scheduled loop checks every USAGE_RESET_INTERVAL_SECONDS and starts a
+run once a day, after midnight, or resumes an unfinished one.
+
+Run with ``python -m services.usage_reset`` or ``--once`` for a single run.
+"""
+
+import asyncio
+import sys
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from .config import database_options, env_float, env_int
+from .maintenance import ChunkedJob, Cursor
+
+# $1 is the run's cutoff, midnight of the day being started
+RESET_CHUNK_SQL = """
+WITH target AS (
+  SELECT $1::timestamptz::date AS day, DATE_TRUNC('month', $1::timestamptz::date)::date AS month
+),
+stale AS (
+  SELECT u.id
+  FROM public.users u, target
+  WHERE u.id > COALESCE($2::uuid, '00000000-0000-0000-0000-000000000000')
+    AND (u.last_daily_reset < target.day OR u.last_monthly_reset < target.month)
+  ORDER BY u.id
+  LIMIT $3
+  FOR UPDATE OF u SKIP LOCKED
+)
+UPDATE public.users u
+SET
+  daily_usage = CASE WHEN u.last_daily_reset < target.day THEN 0 ELSE u.daily_usage END,
+  monthly_usage = CASE WHEN u.last_monthly_reset < target.month THEN 0 ELSE u.monthly_usage END,
+  last_daily_reset = GREATEST(u.last_daily_reset, target.day),
+  last_monthly_reset = GREATEST(u.last_monthly_reset, target.month)
+FROM stale, target
+WHERE u.id = stale.id
+RETURNING u.id
+"""
+
+# A run is due when one is unfinished or none has started today
+DUE_SQL = """
+SELECT cutoff IS NOT NULL OR started_at IS NULL OR started_at < CURRENT_DATE::timestamptz
+FROM public.maintenance_checkpoints
+WHERE name = $1
+"""
+
+
+class UsageResetJob(ChunkedJob):
+    """Start the new day and month for every user, chunk by chunk"""
+
+    name = 'usage_reset'
+
+    async def cutoff(self, conn) -> datetime:
+        return await conn.fetchval("SELECT CURRENT_DATE::timestamptz")
+
+    async def process(self, conn, state) -> Tuple[int, Cursor]:
+        rows = await conn.fetch(RESET_CHUNK_SQL, state['cutoff'], state['cursor_id'], self.chunk_size)
+        if not rows:
+            return 0, (None, state['cursor_id'])
+        return len(rows), (None, max(row['id'] for row in rows))
+
+    def fraction_done(self, cursor: Cursor) -> Optional[float]:
+        _, cursor_id = cursor
+        return cursor_id.int / 2 ** 128 if isinstance(cursor_id, uuid.UUID) else None
+
+    async def due(self) -> bool:
+        async with self.pool.acquire() as conn:
+            due = await conn.fetchval(DUE_SQL, self.name)
+        return due is not False
+
+
+async def main(argv: List[str]) -> int:
+    pool = await asyncpg.create_pool(**database_options(), min_size=1, max_size=1)
+    job = UsageResetJob(
+        pool,
+        chunk_size=env_int('USAGE_RESET_CHUNK', 1000),
+        pause=env_float('USAGE_RESET_PAUSE_SECONDS', 0.05),
+        max_rate=env_float('USAGE_RESET_MAX_RATE', 0.0),
+        progress_every=env_int('USAGE_RESET_PROGRESS_CHUNKS', 50)
+    )
+    try:
+        if '--once' in argv:
+            result = await job.run()
+            print(f"✅ Reset usage for {result['rows']} users in {result['chunks']} chunks "
+                  f"({result['rows_per_s']} rows/s, {result['chunk_ms']['p95']} ms p95 per chunk"
+                  f"{', resumed' if result['resumed'] else ''})")
+        else:
+            interval = env_int('USAGE_RESET_INTERVAL_SECONDS', 60)
+            job.start(interval)
+            print(f"✅ Usage resets checked every {interval}s")
+            await asyncio.Event().wait()
+    except Exception as e:
+        print(f"❌ Usage reset failed: {e}")
+        return 1
+    finally:
+        await job.stop()
+        await pool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Template Bundles Test
+Checks services.template_bundles against get_templates_for_extension on a seeded company.
+
+Each member has private hotkey templates. The company has approved templates and a
+pending one. There are also templates the extension must never see: no hotkey,
+pending approval, or another company's. A bundle must hold exactly the RPC's rows in
+its hotkey order. Polls with the current version get 304s. A usage count must not
+move the stamp or trigger a rebuild. An edit, an approval and a deletion must
+arrive as a delta, and that delta applied to the old copy must equal the full new
+bundle. An approval must reach every member. At steady state, polling must cost a
+fraction of the RPC's round trips and bytes.
+
+Usage: python template_bundles_test.py [--members=5] [--templates=20] [--polls=200]
+"""
+
+import asyncio
+import asyncpg
+import json
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company
+from harness.instrumentation import InstrumentedConnection
+from services.template_bundles import TemplateBundleCache
+
+
+def apply_delta(copy: Dict, delta: Dict) -> Dict:
+    """What the extension does with a sync response"""
+    if delta['full']:
+        return {'version': delta['version'], 'index': delta['index'], 'templates': dict(delta['templates'])}
+    templates = {k: t for k, t in copy['templates'].items() if k not in delta['removed']}
+    templates.update(delta['templates'])
+    return {'version': delta['version'], 'index': delta['index'], 'templates': templates}
+
+
+class TemplateBundlesTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, members: int = 5, templates: int = 20, polls: int = 200, **options):
+        super().__init__(**options)
+        self.members = members
+        self.templates = templates
+        self.polls = polls
+        self.db_pool = None
+        self.company = None
+        self.other_company = None
+        self.pending_id = None
+        self.bundles = None
+
+    async def setup(self):
+        """Seed two companies and their templates"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=10, connection_class=InstrumentedConnection
+            )
+            async with self.db_pool.acquire() as conn:
+                self.company = await seed_company(conn, users=self.members, devices_per_user=0)
+                self.other_company = await seed_company(conn, users=1, devices_per_user=0)
+                company_id = self.company['company_id']
+                manager_id = self.company['manager_id']
+
+                for user_id in self.company['user_ids']:
+                    await conn.execute("""
+                        INSERT INTO public.templates (user_id, title, content, hotkey, visibility)
+                        SELECT $1, 'Private ' || g, 'Private body ' || g || repeat(' lorem ipsum', 40),
+                               'p' || lpad(g::text, 3, '0'), 'private'
+                        FROM generate_series(1, $2) g
+                    """, user_id, self.templates)
+                    await conn.execute("""
+                        INSERT INTO public.templates (user_id, title, content, hotkey, visibility)
+                        VALUES ($1, 'No hotkey', 'Never in the extension', NULL, 'private')
+                    """, user_id)
+                await conn.execute("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, subject, hotkey, visibility,
+                                                  approved_by, approved_at)
+                    SELECT $1, $2, 'Company ' || g, 'Company body ' || g || repeat(' dolor sit', 40),
+                           'Subject ' || g, 'c' || lpad(g::text, 3, '0'), 'company', $1, NOW()
+                    FROM generate_series(1, $3) g
+                """, manager_id, company_id, self.templates)
+                self.pending_id = await conn.fetchval("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, hotkey, visibility)
+                    VALUES ($1, $2, 'Awaiting approval', 'Pending body', 'zz-pending', 'pending_approval')
+                    RETURNING id
+                """, self.company['user_ids'][0], company_id)
+                await conn.execute("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, hotkey, visibility,
+                                                  approved_by, approved_at)
+                    VALUES ($1, $2, 'Other company', 'Not ours', 'c001', 'company', $1, NOW())
+                """, self.other_company['manager_id'], self.other_company['company_id'])
+
+            self.bundles = TemplateBundleCache(self.db_pool, check_interval=0.0)
+            print(f"✅ Seeded {self.members} members with {self.templates} private and {self.templates} "
+                  f"company templates")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to seed templates: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove both companies and their users (templates cascade) and close the pool"""
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                for company in (self.company, self.other_company):
+                    if company:
+                        await conn.execute("DELETE FROM public.users WHERE company_id = $1", company['company_id'])
+                        await conn.execute("DELETE FROM public.companies WHERE id = $1", company['company_id'])
+            await self.db_pool.close()
+
+    async def rpc_rows(self, user_id) -> List[Dict]:
+        async with self.db_pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM public.get_templates_for_extension($1)", user_id)
+        return [dict(row) for row in rows]
+
+    async def test_matches_rpc(self):
+        """Test 1: A bundle holds exactly the RPC's rows, indexed in hotkey order"""
+        try:
+            mismatches = []
+            for user_id in self.company['user_ids']:
+                status, bundle = await self.bundles.sync(user_id)
+                expected = {(str(r['id']), r['title'], r['content'], r['subject'], r['hotkey'], r['source'])
+                            for r in await self.rpc_rows(user_id)}
+                actual = {(k, t['title'], t['content'], t['subject'], t['hotkey'], t['source'])
+                          for k, t in bundle['templates'].items()}
+                hotkeys = [entry[0] for entry in bundle['index']]
+                if status != 200 or expected != actual or hotkeys != sorted(hotkeys) or \
+                        len(bundle['index']) != len(actual):
+                    mismatches.append({'user_id': str(user_id), 'missing': len(expected - actual),
+                                       'extra': len(actual - expected)})
+            if mismatches:
+                self.log_test_result("Bundles - Match RPC", False,
+                                     f"{len(mismatches)} of {self.members} bundles differ", mismatches[:3])
+                return False
+            self.log_test_result("Bundles - Match RPC", True,
+                                 f"{self.members} bundles match get_templates_for_extension "
+                                 f"({2 * self.templates} templates each, excluded rows stay out)")
+            return True
+        except Exception as e:
+            self.log_test_result("Bundles - Match RPC", False, f"Comparison failed: {str(e)}")
+            return False
+
+    async def test_not_modified(self):
+        """Test 2: The current version gets a 304, also after a usage count, without a rebuild"""
+        try:
+            user_id = self.company['user_ids'][0]
+            _, bundle = await self.bundles.sync(user_id)
+            first, _ = await self.bundles.sync(user_id, bundle['version'])
+
+            template_id = bundle['index'][0][1]
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("SELECT public.increment_template_usage($1::uuid, $2)", template_id, user_id)
+            rebuilds_before = self.bundles.stats['rebuilds']
+            after_use, payload = await self.bundles.sync(user_id, bundle['version'])
+            rebuilt = self.bundles.stats['rebuilds'] - rebuilds_before
+
+            success = first == 304 and after_use == 304 and rebuilt == 0
+            self.log_test_result("Bundles - Not Modified", success,
+                                 "304 before and after a template use, stamp unchanged"
+                                 if success else f"statuses {first}/{after_use}, {rebuilt} rebuilds",
+                                 self.bundles.stats)
+            return success
+        except Exception as e:
+            self.log_test_result("Bundles - Not Modified", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_delta_sync(self):
+        """Test 3: An edit, an approval and a deletion arrive as a delta that rebuilds the full bundle"""
+        try:
+            user_id = self.company['user_ids'][0]
+            _, full = await self.bundles.sync(user_id)
+            old_copy = apply_delta({}, full)
+            private = [entry[1] for entry in full['index'] if entry[3] == 'private']
+
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("UPDATE public.templates SET content = content || ' (edited)' "
+                                   "WHERE id = $1", private[0])
+                await conn.execute("DELETE FROM public.templates WHERE id = $1", private[1])
+                await conn.execute("SELECT public.approve_template($1, $2)", self.pending_id,
+                                   self.company['manager_id'])
+
+            status, delta = await self.bundles.sync(user_id, full['version'])
+            _, new_full = await self.bundles.sync(user_id)
+            patched = apply_delta(old_copy, delta)
+            expected_changed = {private[0], str(self.pending_id)}
+            success = (status == 200 and not delta['full'] and set(delta['templates']) == expected_changed
+                       and delta['removed'] == [private[1]]
+                       and patched['templates'] == new_full['templates'] and patched['index'] == new_full['index'])
+            sizes = {'full_bytes': len(json.dumps(new_full)), 'delta_bytes': len(json.dumps(delta))}
+            self.log_test_result("Bundles - Delta Sync", success,
+                                 f"delta of {len(delta['templates'])} templates + {len(delta['removed'])} removal, "
+                                 f"{sizes['delta_bytes']} of {sizes['full_bytes']} bytes" if success
+                                 else "Delta does not rebuild the new bundle",
+                                 {**sizes, 'changed': sorted(delta['templates']), 'removed': delta['removed']})
+            return success
+        except Exception as e:
+            self.log_test_result("Bundles - Delta Sync", False, f"Delta sync failed: {str(e)}")
+            return False
+
+    async def test_approval_reaches_members(self):
+        """Test 4: Every member's bundle carries the newly approved company template"""
+        try:
+            missing = []
+            for user_id in self.company['user_ids']:
+                _, bundle = await self.bundles.sync(user_id)
+                if str(self.pending_id) not in bundle['templates']:
+                    missing.append(str(user_id))
+            status, stale = await self.bundles.sync(self.company['user_ids'][1], 'not-a-kept-version')
+            success = not missing and status == 200 and stale['full']
+            self.log_test_result("Bundles - Approval Reaches Members", success,
+                                 f"All {self.members} members see the approved template; unknown versions get "
+                                 f"the full bundle" if success else f"{len(missing)} members missing it",
+                                 {'missing': missing[:5]})
+            return success
+        except Exception as e:
+            self.log_test_result("Bundles - Approval Reaches Members", False, f"Check failed: {str(e)}")
+            return False
+
+    async def test_polling_cost(self):
+        """Test 5: Steady-state polls vs the RPC, in round trips and bytes"""
+        try:
+            users = self.company['user_ids']
+            bundles = TemplateBundleCache(self.db_pool, check_interval=5.0)
+            versions = {}
+            for user_id in users:
+                _, bundle = await bundles.sync(user_id)
+                versions[user_id] = bundle['version']
+
+            with self.round_trip_budget('rpc polls') as rpc_trips:
+                rpc_bytes = 0
+                for i in range(self.polls):
+                    rows = await self.rpc_rows(users[i % len(users)])
+                    rpc_bytes += len(json.dumps(rows, default=str))
+            with self.round_trip_budget('bundle polls', max_db=0) as bundle_trips:
+                statuses = [(await bundles.sync(users[i % len(users)], versions[users[i % len(users)]]))[0]
+                            for i in range(self.polls)]
+
+            success = all(status == 304 for status in statuses)
+            self.log_test_result(
+                "Bundles - Polling Cost",
+                success,
+                f"{self.polls} polls: RPC {rpc_trips.total('db')} DB round trips and {rpc_bytes} bytes; "
+                f"bundles {bundle_trips.total('db')} DB round trips and {statuses.count(304)} 304s",
+                {'rpc': rpc_trips.summary(), 'bundles': bundle_trips.summary(), 'stats': bundles.stats}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Bundles - Polling Cost", False, f"Measurement failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the template bundle checks"""
+        print("🚀 Starting Template Bundles Test")
+        print(f"   {self.members} members, {self.templates} templates per source, {self.polls} polls")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_matches_rpc,
+            self.test_not_modified,
+            self.test_delta_sync,
+            self.test_approval_reaches_members,
+            self.test_polling_cost
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Extension polls are served from versioned bundles!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = TemplateBundlesTester(
+        members=scenario_option(argv, 'members', 5),
+        templates=scenario_option(argv, 'templates', 20),
+        polls=scenario_option(argv, 'polls', 200),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Template Usage Aggregation Test
+Compares increment_template_usage with services.template_usage on hot company templates.
+
+A seeded company shares a few approved templates that every member expands at once, the
+way a popular snippet is used across a team. The same burst of uses runs twice: once as
+one increment_template_usage call per use, and once through TemplateUsageAggregator,
+which checks each use against its access cache and flushes merged counts. Both must
+leave exactly `uses` more on the usage counters. The aggregator must refuse the same
+uses the RPC refuses, pick up a visibility change once it is invalidated, and spend far
+less time blocked on templates row locks.
+
+Usage: python template_usage_test.py [--members=50] [--hot=3] [--uses=2000] [--concurrency=20]
+"""
+
+import time
+import asyncio
+import asyncpg
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, LockSampler, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company
+from harness.instrumentation import Histogram, InstrumentedConnection
+from services.template_usage import PRIVATE_DENIED, TemplateAccessCache, TemplateUsageAggregator
+
+TEMPLATE_RELATIONS = ('templates', 'public.templates')
+
+
+class TemplateUsageTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, members: int = 50, hot: int = 3, uses: int = 2000, concurrency: int = 20, **options):
+        super().__init__(**options)
+        self.members = members
+        self.hot = hot
+        self.uses = uses
+        self.concurrency = concurrency
+        self.db_pool = None
+        self.company = None
+        self.other_company = None
+        self.hot_ids: List = []
+        self.private_id = None
+        self.other_id = None
+        self.mode_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Seed a company with hot templates, a private one and another company's"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(),
+                min_size=self.concurrency,
+                max_size=self.concurrency + 2,
+                connection_class=InstrumentedConnection
+            )
+            async with self.db_pool.acquire() as conn:
+                self.company = await seed_company(conn, users=self.members, devices_per_user=0)
+                self.other_company = await seed_company(conn, users=1, devices_per_user=0)
+                manager_id = self.company['manager_id']
+                rows = await conn.fetch("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, hotkey, visibility,
+                                                  approved_by, approved_at)
+                    SELECT $1, $2, 'Hot ' || g, 'Hot body ' || g, 'hot' || g, 'company', $1, NOW()
+                    FROM generate_series(1, $3) g
+                    RETURNING id
+                """, manager_id, self.company['company_id'], self.hot)
+                self.hot_ids = [row['id'] for row in rows]
+                self.private_id = await conn.fetchval("""
+                    INSERT INTO public.templates (user_id, title, content, hotkey, visibility)
+                    VALUES ($1, 'Mine', 'Private body', 'mine', 'private')
+                    RETURNING id
+                """, self.company['user_ids'][0])
+                self.other_id = await conn.fetchval("""
+                    INSERT INTO public.templates (user_id, company_id, title, content, hotkey, visibility,
+                                                  approved_by, approved_at)
+                    VALUES ($1, $2, 'Theirs', 'Not ours', 'theirs', 'company', $1, NOW())
+                    RETURNING id
+                """, self.other_company['manager_id'], self.other_company['company_id'])
+            print(f"✅ Seeded {self.members} members sharing {self.hot} hot templates "
+                  f"({self.concurrency} connections)")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to seed templates: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove both companies and their users (templates cascade) and close the pool"""
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                for company in (self.company, self.other_company):
+                    if company:
+                        await conn.execute("DELETE FROM public.users WHERE company_id = $1", company['company_id'])
+                        await conn.execute("DELETE FROM public.companies WHERE id = $1", company['company_id'])
+            await self.db_pool.close()
+
+    async def usage_total(self) -> int:
+        async with self.db_pool.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT COALESCE(SUM(usage_count), 0) FROM public.templates WHERE id = ANY($1::uuid[])", self.hot_ids
+            )
+
+    async def rpc_outcome(self, template_id, user_id) -> str:
+        """What increment_template_usage says, without keeping its count"""
+        async with self.db_pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                await conn.fetchval("SELECT public.increment_template_usage($1::uuid, $2)", template_id, user_id)
+                return 'allowed'
+            except asyncpg.RaiseError as e:
+                return str(e)
+            finally:
+                await transaction.rollback()
+
+    def burst(self):
+        """(template, user) pairs, every member cycling through the hot templates"""
+        users = self.company['user_ids']
+        return [(self.hot_ids[i % len(self.hot_ids)], users[i % len(users)]) for i in range(self.uses)]
+
+    async def run_burst(self, mode: str, use, start=None, finish=None) -> Dict:
+        before = await self.usage_total()
+        pairs = self.burst()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latency = Histogram()
+        errors: List[str] = []
+
+        async def worker(template_id, user_id):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    reason = await use(template_id, user_id)
+                    if reason:
+                        errors.append(reason)
+                except asyncpg.PostgresError as e:
+                    errors.append(type(e).__name__)
+                finally:
+                    latency.record((time.perf_counter() - started) * 1000)
+
+        with self.round_trip_budget(mode) as trips:
+            async with LockSampler(0.02, label=lambda: mode) as sampler:
+                if start is not None:
+                    start()
+                started = time.perf_counter()
+                await asyncio.gather(*(worker(t, u) for t, u in pairs))
+                elapsed = time.perf_counter() - started
+                # The aggregator's last flush is measured too
+                if finish is not None:
+                    await finish()
+
+        locks = sampler.summary(mode)
+        result = {
+            'mode': mode,
+            'uses': len(pairs),
+            'counted': await self.usage_total() - before,
+            'errors': len(errors),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_ops': round(len(pairs) / elapsed, 1),
+            'latency': latency.summary(),
+            'db_round_trips': trips.total('db'),
+            'blocked_ms': round(sum(row['blocked_ms'] for row in locks['blocked']
+                                    if row['relation'] in TEMPLATE_RELATIONS), 1),
+            'top_blocking': locks['blocked'][:3]
+        }
+        self.mode_results[mode] = result
+        return result
+
+    async def test_permission_parity(self):
+        """Test 1: The access cache refuses exactly what increment_template_usage refuses"""
+        try:
+            member, outsider = self.company['user_ids'][0], self.company['user_ids'][1]
+            cases = [
+                ('own private', self.private_id, member),
+                ("another member's private", self.private_id, outsider),
+                ('company template', self.hot_ids[0], outsider),
+                ("another company's template", self.other_id, member),
+                ('missing template', '00000000-0000-0000-0000-000000000000', member)
+            ]
+            aggregator = TemplateUsageAggregator(self.db_pool, TemplateAccessCache(self.db_pool))
+            mismatches = []
+            for label, template_id, user_id in cases:
+                expected = await self.rpc_outcome(template_id, user_id)
+                actual = await aggregator.record(template_id, user_id) or 'allowed'
+                if expected != actual:
+                    mismatches.append({'case': label, 'rpc': expected, 'aggregator': actual})
+
+            success = not mismatches
+            self.log_test_result(
+                "Template Usage - Permission Parity",
+                success,
+                f"{len(cases) - len(mismatches)} of {len(cases)} cases match the RPC "
+                f"({aggregator.stats['denied']} refused)",
+                mismatches or None
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Template Usage - Permission Parity", False, f"Comparison failed: {str(e)}")
+            return False
+
+    async def test_rpc_contention(self):
+        """Test 2: One increment_template_usage per use (reference; contention reported, not failed)"""
+        try:
+            async def use(template_id, user_id):
+                async with self.db_pool.acquire() as conn:
+                    await conn.fetchval("SELECT public.increment_template_usage($1::uuid, $2)", template_id, user_id)
+
+            result = await self.run_burst('rpc', use)
+            success = result['counted'] == self.uses and result['errors'] == 0
+            self.log_test_result(
+                "Template Usage - RPC Per Use",
+                success,
+                f"{result['counted']} of {self.uses} uses counted, {result['throughput_ops']} ops/s, "
+                f"p95 {result['latency']['p95_ms']:.1f} ms, {result['db_round_trips']} DB round trips, "
+                f"{result['blocked_ms']:.0f} ms blocked on templates rows",
+                result
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Template Usage - RPC Per Use", False, f"Burst failed: {str(e)}")
+            return False
+
+    async def test_aggregated_contention(self):
+        """Test 3: The same burst through the aggregator counts exactly and barely waits on row locks"""
+        try:
+            aggregator = TemplateUsageAggregator(self.db_pool, TemplateAccessCache(self.db_pool),
+                                                 flush_interval=0.2)
+            result = await self.run_burst('aggregated', aggregator.record, start=aggregator.start,
+                                          finish=aggregator.stop)
+            result['stats'] = dict(aggregator.stats)
+
+            rpc = self.mode_results.get('rpc')
+            exact = result['counted'] == self.uses and result['errors'] == 0
+            quieter = rpc is None or result['blocked_ms'] <= rpc['blocked_ms']
+            success = exact and quieter
+            self.log_test_result(
+                "Template Usage - Aggregated",
+                success,
+                f"{result['counted']} of {self.uses} uses counted in {aggregator.stats['statements']} UPDATEs, "
+                f"{result['throughput_ops']} ops/s, {result['db_round_trips']} DB round trips, "
+                f"{result['blocked_ms']:.0f} ms blocked on templates rows"
+                + (f" (RPC: {rpc['blocked_ms']:.0f} ms)" if rpc else ''),
+                result
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Template Usage - Aggregated", False, f"Burst failed: {str(e)}")
+            return False
+
+    async def test_visibility_change(self):
+        """Test 4: Making a hot template private denies members once the owner's entries are invalidated"""
+        try:
+            access = TemplateAccessCache(self.db_pool, ttl=3600)
+            member = self.company['user_ids'][1]
+            template_id = self.hot_ids[0]
+            before = await access.check(template_id, member)
+
+            async with self.db_pool.acquire() as conn:
+                owner = await conn.fetchval(
+                    "UPDATE public.templates SET visibility = 'private' WHERE id = $1 RETURNING user_id", template_id
+                )
+            stale = await access.check(template_id, member)
+            # What the invalidation bus does with user_templates:<owner>
+            access.invalidate_owner(owner)
+            after = await access.check(template_id, member)
+
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("UPDATE public.templates SET visibility = 'company' WHERE id = $1", template_id)
+
+            success = before is None and stale is None and after == PRIVATE_DENIED
+            self.log_test_result(
+                "Template Usage - Visibility Change",
+                success,
+                f"allowed before, {'still allowed' if stale is None else stale!r} until invalidated, "
+                f"then {after!r}",
+                {'stats': access.stats}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Template Usage - Visibility Change", False, f"Check failed: {str(e)}")
+            return False
+
+    def print_comparison(self):
+        if not self.mode_results:
+            return
+        print("📊 Hot template contention")
+        print(f"   {'mode':<11} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'DB trips':>9} {'blocked ms':>11}")
+        for mode, result in self.mode_results.items():
+            print(
+                f"   {mode:<11} {result['throughput_ops']:>9.1f} {result['latency']['p50_ms']:>8.1f} "
+                f"{result['latency']['p95_ms']:>8.1f} {result['db_round_trips']:>9} {result['blocked_ms']:>11.0f}"
+            )
+
+    async def run_all_tests(self):
+        """Run the template usage checks"""
+        print("🚀 Starting Template Usage Aggregation Test")
+        print(f"   {self.uses} uses of {self.hot} hot templates by {self.members} members, "
+              f"{self.concurrency} at a time")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_permission_parity,
+            self.test_rpc_contention,
+            self.test_aggregated_contention,
+            self.test_visibility_change
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        self.print_comparison()
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Template usage is counted in batches without queueing on hot rows!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = TemplateUsageTester(
+        members=scenario_option(argv, 'members', 50),
+        hot=scenario_option(argv, 'hot', 3),
+        uses=scenario_option(argv, 'uses', 2000),
+        concurrency=scenario_option(argv, 'concurrency', 20),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
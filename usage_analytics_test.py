@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Usage Analytics Engine Test
+Checks services.analytics (binary COPY export into NumPy columns) against the same
+reports written as SQL, and measures export throughput.
+
+Users of several roles, some in a seeded company, get generations spread over the last
+few months with a mix of sources, languages and tones. The export is limited to them, and
+top companies, (role, source) counts, mean output length, per-role percentiles of
+monthly generations per user and the language mix by month must equal the SQL answers.
+
+Requires numpy.
+
+Usage: python usage_analytics_test.py [--users=200] [--events=50000] [--months=4]
+"""
+
+import time
+import random
+import asyncio
+import asyncpg
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+import sys
+
+from harness import TesterBase, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.analytics import NIL_UUID, export_generations
+
+ROLE_MIX = [('free', 0.5), ('pro', 0.3), ('pro_plus', 0.2)]
+LANGUAGES = ['English', 'Spanish', 'French', 'German', 'Portuguese']
+TONES = ['Professional', 'Friendly', 'Concise']
+
+SQL_TOP_COMPANIES = """
+SELECT company_id, COUNT(*) FROM public.ai_generations
+WHERE user_id = ANY($1::uuid[]) AND success AND company_id IS NOT NULL
+GROUP BY company_id ORDER BY 2 DESC LIMIT 10
+"""
+
+SQL_ROLE_SOURCE = """
+SELECT u.role::text, g.source::text, COUNT(*)
+FROM public.ai_generations g JOIN public.users u ON u.id = g.user_id
+WHERE g.user_id = ANY($1::uuid[])
+GROUP BY 1, 2
+"""
+
+SQL_OUTPUT_MEAN = """
+SELECT source::text, AVG(output_length)::float8 FROM public.ai_generations
+WHERE user_id = ANY($1::uuid[]) GROUP BY 1
+"""
+
+SQL_ROLE_PERCENTILES = """
+SELECT role::text, COUNT(*) AS groups,
+       percentile_cont(0.5) WITHIN GROUP (ORDER BY n) AS p50,
+       percentile_cont(0.9) WITHIN GROUP (ORDER BY n) AS p90,
+       percentile_cont(0.99) WITHIN GROUP (ORDER BY n) AS p99
+FROM (
+  SELECT u.role, g.user_id, DATE_TRUNC('month', g.created_at AT TIME ZONE 'UTC'), COUNT(*) AS n
+  FROM public.ai_generations g JOIN public.users u ON u.id = g.user_id
+  WHERE g.user_id = ANY($1::uuid[]) AND g.success
+  GROUP BY 1, 2, 3
+) per_user_month
+GROUP BY 1
+"""
+
+SQL_LANGUAGE_MIX = """
+SELECT to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM') AS month, language, COUNT(*)
+FROM public.ai_generations
+WHERE user_id = ANY($1::uuid[])
+GROUP BY 1, 2
+"""
+
+
+class UsageAnalyticsTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 200, events: int = 50000, months: int = 4, seed: int = 9, **options):
+        super().__init__(**options)
+        self.users = users
+        self.events = events
+        self.months = months
+        self.seed = seed
+        self.db_pool = None
+        self.company = None
+        self.user_ids: List = []
+        self.frame = None
+
+    async def setup(self):
+        """Initialize the database connection pool and seed users with generations"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=1, max_size=3, connection_class=InstrumentedConnection
+            )
+            rng = random.Random(self.seed)
+            async with self.db_pool.acquire() as conn:
+                self.company = await seed_company(conn, users=self.users // 4)
+                companies = {user_id: self.company['company_id'] for user_id in self.company['user_ids']}
+                self.user_ids = list(self.company['user_ids'])
+                remaining = self.users - len(self.user_ids)
+                for role, share in ROLE_MIX:
+                    self.user_ids += await seed_users(conn, max(1, int(remaining * share)), role=role)
+
+                now = datetime.now(timezone.utc)
+                rows = []
+                for _ in range(self.events):
+                    user_id = rng.choice(self.user_ids)
+                    rows.append((
+                        user_id, companies.get(user_id), rng.choice(['website', 'extension']),
+                        rng.choice(['reply', 'email']), rng.choice(LANGUAGES), rng.choice(TONES),
+                        rng.randint(20, 2000), rng.randint(100, 1500), rng.random() > 0.05,
+                        now - timedelta(seconds=rng.uniform(0, self.months * 30 * 86400))
+                    ))
+                await conn.copy_records_to_table(
+                    'ai_generations', schema_name='public', records=rows,
+                    columns=['user_id', 'company_id', 'source', 'generation_type', 'language', 'tone',
+                             'input_length', 'output_length', 'success', 'created_at']
+                )
+            print("✅ Database pool initialized")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove seeded users (generations cascade) and close the pool"""
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", self.user_ids)
+                if self.company:
+                    await conn.execute("DELETE FROM public.users WHERE company_id = $1", self.company['company_id'])
+                    await conn.execute("DELETE FROM public.companies WHERE id = $1", self.company['company_id'])
+            await self.db_pool.close()
+
+    async def test_export(self):
+        """Test 1: Binary COPY export decodes every row"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                started = time.perf_counter()
+                self.frame = await export_generations(conn, user_ids=self.user_ids)
+                elapsed = time.perf_counter() - started
+                expected = await conn.fetchval(
+                    "SELECT COUNT(*) FROM public.ai_generations WHERE user_id = ANY($1::uuid[])", self.user_ids)
+            if len(self.frame) != expected:
+                self.log_test_result("Analytics - Export", False,
+                                     f"Exported {len(self.frame)} rows, expected {expected}")
+                return False
+            self.log_test_result(
+                "Analytics - Export",
+                True,
+                f"{len(self.frame)} rows in {elapsed:.2f}s ({len(self.frame) / elapsed:,.0f} rows/s)",
+                {'rows': len(self.frame), 'elapsed_s': round(elapsed, 3)}
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Analytics - Export", False, f"Export failed: {str(e)}")
+            return False
+
+    async def compare(self, name: str, compute: Callable[[], Dict], query: str,
+                      entries=lambda row: [(tuple(row[:-1]), row[-1])],
+                      tolerance: float = 0.0, details: Optional[Dict] = None) -> bool:
+        """compute() on the exported frame against the SQL rows; values match within tolerance"""
+        try:
+            if self.frame is None:
+                self.log_test_result(name, False, "Export must succeed first")
+                return False
+            engine = compute()
+            async with self.db_pool.acquire() as conn:
+                expected = {}
+                for row in await conn.fetch(query, self.user_ids):
+                    expected.update(entries(row))
+            differing = [k for k in expected.keys() | engine.keys()
+                         if k not in engine or k not in expected or abs(engine[k] - expected[k]) > tolerance]
+            if differing:
+                self.log_test_result(name, False, f"{len(differing)} values differ from SQL",
+                                     {str(k): (engine.get(k), expected.get(k)) for k in differing[:5]})
+                return False
+            self.log_test_result(name, True, f"{len(expected)} values match SQL", details)
+            return True
+        except Exception as e:
+            self.log_test_result(name, False, f"Comparison failed: {str(e)}")
+            return False
+
+    async def test_top_companies(self):
+        """Test 2: Top companies by successful generations"""
+        return await self.compare(
+            "Analytics - Top Companies",
+            lambda: dict(self.frame.top('company', n=10,
+                                        where=self.frame.success & ~self.frame.mask('company', NIL_UUID))),
+            SQL_TOP_COMPANIES,
+            entries=lambda row: [(row[0], row[1])]
+        )
+
+    async def test_grouped_counts(self):
+        """Test 3: Generations per (role, source)"""
+        return await self.compare("Analytics - Grouped Counts",
+                                  lambda: self.frame.aggregate(['role', 'source']), SQL_ROLE_SOURCE)
+
+    async def test_grouped_means(self):
+        """Test 4: Mean output length per source"""
+        return await self.compare("Analytics - Grouped Means",
+                                  lambda: self.frame.aggregate(['source'], 'output_length', 'mean'),
+                                  SQL_OUTPUT_MEAN, tolerance=1e-6)
+
+    async def test_role_percentiles(self):
+        """Test 5: Percentiles of monthly generations per user, by role"""
+        stats = ('groups', 'p50', 'p90', 'p99')
+
+        def compute():
+            result = self.frame.percentiles(('user', 'month'), across='role', where=self.frame.success)
+            return {(role, stat): value for role, values in result.items() for stat, value in values.items()}
+
+        return await self.compare(
+            "Analytics - Role Percentiles", compute, SQL_ROLE_PERCENTILES,
+            entries=lambda row: [((row['role'], stat), float(row[stat])) for stat in stats],
+            tolerance=1e-6, details={'statistics': list(stats)}
+        )
+
+    async def test_language_mix(self):
+        """Test 6: Language counts per month behind the mix report"""
+        return await self.compare("Analytics - Language Mix",
+                                  lambda: self.frame.aggregate(['month', 'language']), SQL_LANGUAGE_MIX)
+
+    async def run_all_tests(self):
+        """Run the analytics engine checks"""
+        print("🚀 Starting Usage Analytics Engine Test")
+        print(f"   {self.events} generations from {self.users} users over {self.months} months")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_export,
+            self.test_top_companies,
+            self.test_grouped_counts,
+            self.test_grouped_means,
+            self.test_role_percentiles,
+            self.test_language_mix
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Analytics engine matches SQL!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = UsageAnalyticsTester(
+        users=scenario_option(argv, 'users', 200),
+        events=scenario_option(argv, 'events', 50000),
+        months=scenario_option(argv, 'months', 4),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
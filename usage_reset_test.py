@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Usage Reset Test
+Checks services.usage_reset and the per-user resets in can_user_generate and
+increment_user_usage at a simulated day and month rollover.
+
+Seeded free users are made stale: yesterday's daily usage, and for half of them last
+month's monthly usage. The first request after the rollover must cost about what any
+other request costs; before this change it ran reset_daily_usage() and
+reset_monthly_usage() over the whole table. The chunked job then runs while generation
+traffic keeps going. The traffic is can_user_generate followed by increment_user_usage
+when allowed, as the website does it. Afterwards every counter must equal exactly what
+the traffic added since the reset, and every user must be on the new day and month. A
+generation must never wait longer than about one chunk. An interrupted run must resume,
+and max_rate must hold.
+
+Usage: python usage_reset_test.py [--users=20000] [--chunk=1000] [--workers=8] [--rate=5000]
+"""
+
+import time
+import random
+import asyncio
+import asyncpg
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, LockSampler, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_users
+from harness.instrumentation import Histogram, InstrumentedConnection
+from services.usage_reset import UsageResetJob
+
+USER_RELATIONS = ('users', 'public.users')
+
+# Seeded usage before the rollover
+DAILY_BEFORE = 2
+MONTHLY_BEFORE = 10
+
+
+class UsageResetTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 20000, chunk: int = 1000, workers: int = 8, rate: int = 5000, **options):
+        super().__init__(**options)
+        self.users = users
+        self.chunk = chunk
+        self.workers = workers
+        self.rate = rate
+        self.db_pool = None
+        self.user_ids: List = []
+        self.month_stale: set = set()
+        self.mode_results: Dict[str, Dict] = {}
+
+    async def setup(self):
+        """Seed free users"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(),
+                min_size=2,
+                max_size=self.workers + 4,
+                connection_class=InstrumentedConnection
+            )
+            async with self.db_pool.acquire() as conn:
+                self.user_ids = await seed_users(conn, self.users, role='free')
+                self.month_stale = set(self.user_ids[::2])
+                await conn.execute("ANALYZE public.users")
+                # A run left over from an aborted earlier test would be resumed otherwise
+                await conn.execute(
+                    "UPDATE public.maintenance_checkpoints SET cutoff = NULL, started_at = NULL "
+                    "WHERE name = 'usage_reset'")
+            print(f"✅ Seeded {self.users} free users, {len(self.month_stale)} of them a month behind")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to seed users: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove the seeded users and close the pool"""
+        if self.db_pool:
+            if self.user_ids:
+                async with self.db_pool.acquire() as conn:
+                    await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", self.user_ids)
+            await self.db_pool.close()
+
+    async def roll_over(self):
+        """Make the seeded users look like it just turned midnight (on the 1st for half of them)"""
+        async with self.db_pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE public.users
+                SET daily_usage = $3, monthly_usage = $4, last_daily_reset = CURRENT_DATE - 1,
+                    last_monthly_reset = CASE WHEN id = ANY($2::uuid[])
+                                              THEN (DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '1 month')::date
+                                              ELSE DATE_TRUNC('month', CURRENT_DATE)::date END
+                WHERE id = ANY($1::uuid[])
+            """, self.user_ids, list(self.month_stale), DAILY_BEFORE, MONTHLY_BEFORE)
+            await conn.execute(
+                "UPDATE public.maintenance_checkpoints SET cutoff = NULL, started_at = NULL WHERE name = 'usage_reset'")
+
+    async def generate(self, conn, user_id) -> bool:
+        """The website's path: check, then count the generation if it was allowed"""
+        if not await conn.fetchval("SELECT public.can_user_generate($1)", user_id):
+            return False
+        await conn.execute("SELECT public.increment_user_usage($1)", user_id)
+        return True
+
+    async def verify(self, generated: Dict) -> List[Dict]:
+        """Users whose counters or reset dates differ from a reset followed by `generated` uses"""
+        async with self.db_pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT id, daily_usage, monthly_usage,
+                       last_daily_reset = CURRENT_DATE AS day_current,
+                       last_monthly_reset = DATE_TRUNC('month', CURRENT_DATE)::date AS month_current
+                FROM public.users
+                WHERE id = ANY($1::uuid[])
+            """, self.user_ids)
+        wrong = []
+        for row in rows:
+            uses = generated.get(row['id'], 0)
+            monthly = (0 if row['id'] in self.month_stale else MONTHLY_BEFORE) + uses
+            if row['daily_usage'] != uses or row['monthly_usage'] != monthly or not row['day_current'] \
+                    or not row['month_current']:
+                wrong.append({'user_id': str(row['id']), 'daily_usage': row['daily_usage'], 'expected_daily': uses,
+                              'monthly_usage': row['monthly_usage'], 'expected_monthly': monthly,
+                              'day_current': row['day_current'], 'month_current': row['month_current']})
+        return wrong
+
+    async def test_first_request(self):
+        """Test 1: The first request after the rollover costs what any other request costs"""
+        try:
+            sample = random.sample(self.user_ids, min(50, len(self.user_ids)))
+            await self.roll_over()
+            async with self.db_pool.acquire() as conn:
+                started = time.perf_counter()
+                await conn.execute("SELECT public.reset_daily_usage()")
+                await conn.execute("SELECT public.reset_monthly_usage()")
+                await conn.fetchval("SELECT public.can_user_generate($1)", sample[0])
+                whole_table_ms = (time.perf_counter() - started) * 1000
+
+            await self.roll_over()
+            first = Histogram()
+            warm = Histogram()
+            async with self.db_pool.acquire() as conn:
+                for user_id in sample:
+                    started = time.perf_counter()
+                    await conn.fetchval("SELECT public.can_user_generate($1)", user_id)
+                    first.record((time.perf_counter() - started) * 1000)
+                for user_id in sample:
+                    started = time.perf_counter()
+                    await conn.fetchval("SELECT public.can_user_generate($1)", user_id)
+                    warm.record((time.perf_counter() - started) * 1000)
+                stale_left = await conn.fetchval("""
+                    SELECT COUNT(*) FROM public.users
+                    WHERE id = ANY($1::uuid[]) AND last_daily_reset < CURRENT_DATE
+                """, self.user_ids)
+
+            first_summary, warm_summary = first.summary(), warm.summary()
+            bound_ms = max(5 * warm_summary['p50_ms'], warm_summary['p50_ms'] + 20)
+            # Only the sampled users were reset by their own requests
+            success = first_summary['max_ms'] <= bound_ms and stale_left == len(self.user_ids) - len(sample)
+            self.log_test_result(
+                "Usage Reset - First Request",
+                success,
+                f"first request after midnight max {first_summary['max_ms']:.1f} ms "
+                f"(p50 {first_summary['p50_ms']:.1f} ms, warm p50 {warm_summary['p50_ms']:.1f} ms, "
+                f"bound {bound_ms:.1f} ms); whole-table reset took {whole_table_ms:.0f} ms; "
+                f"{stale_left} users left for the job",
+                {'first': first_summary, 'warm': warm_summary, 'whole_table_ms': round(whole_table_ms, 1)}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Usage Reset - First Request", False, f"Measurement failed: {str(e)}")
+            return False
+
+    async def reset_under_traffic(self, mode: str, reset) -> Dict:
+        """Run `reset` while `workers` keep generating for random seeded users"""
+        await self.roll_over()
+        generated: Dict = {}
+        latency = Histogram()
+        done = asyncio.Event()
+
+        async def worker():
+            async with self.db_pool.acquire() as conn:
+                while not done.is_set():
+                    user_id = random.choice(self.user_ids)
+                    started = time.perf_counter()
+                    if await self.generate(conn, user_id):
+                        generated[user_id] = generated.get(user_id, 0) + 1
+                    latency.record((time.perf_counter() - started) * 1000)
+
+        async with LockSampler(0.01, label=lambda: mode) as sampler:
+            workers = [asyncio.create_task(worker()) for _ in range(self.workers)]
+            await asyncio.sleep(0.2)
+            started = time.perf_counter()
+            details = await reset()
+            elapsed = time.perf_counter() - started
+            await asyncio.sleep(0.2)
+            done.set()
+            await asyncio.gather(*workers)
+
+        locks = sampler.summary(mode)
+        wrong = await self.verify(generated)
+        result = {
+            'mode': mode,
+            'reset_s': round(elapsed, 3),
+            'generations': sum(generated.values()),
+            'requests': latency.summary(),
+            'blocked_ms': round(sum(row['blocked_ms'] for row in locks['blocked']
+                                    if row['relation'] in USER_RELATIONS), 1),
+            'wrong': len(wrong),
+            'wrong_sample': wrong[:3],
+            'reset': details
+        }
+        self.mode_results[mode] = result
+        return result
+
+    async def test_reset_under_traffic(self):
+        """Test 2: The chunked job under generation traffic leaves exact counters"""
+        try:
+            async def whole_table():
+                async with self.db_pool.acquire() as conn:
+                    await conn.execute("SELECT public.reset_daily_usage()")
+                    await conn.execute("SELECT public.reset_monthly_usage()")
+                return None
+
+            job = UsageResetJob(self.db_pool, chunk_size=self.chunk)
+
+            single = await self.reset_under_traffic('single', whole_table)
+            chunked = await self.reset_under_traffic('chunked', job.run)
+
+            # A request can queue behind one chunk, plus scheduling noise
+            bound_ms = chunked['reset']['chunk_ms']['max'] + 100
+            success = (single['wrong'] == 0 and chunked['wrong'] == 0 and chunked['reset']['finished']
+                       and chunked['requests']['max_ms'] <= bound_ms)
+            self.log_test_result(
+                "Usage Reset - Under Traffic",
+                success,
+                f"{chunked['reset']['rows']} users reset in {chunked['reset']['chunks']} chunks "
+                f"({chunked['reset']['rows_per_s']} rows/s, chunk p95 {chunked['reset']['chunk_ms']['p95']} ms) "
+                f"next to {chunked['generations']} generations; {chunked['wrong']} wrong counters; request max "
+                f"{chunked['requests']['max_ms']:.0f} ms (bound {bound_ms:.0f} ms) vs "
+                f"{single['requests']['max_ms']:.0f} ms behind the single UPDATEs",
+                {'single': single, 'chunked': chunked}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Usage Reset - Under Traffic", False, f"Run failed: {str(e)}")
+            return False
+
+    async def test_resume(self):
+        """Test 3: An interrupted run resumes; once finished, nothing is due until tomorrow"""
+        try:
+            await self.roll_over()
+            first = await UsageResetJob(self.db_pool, chunk_size=self.chunk).run(max_chunks=2)
+            job = UsageResetJob(self.db_pool, chunk_size=self.chunk)
+            due_while_interrupted = await job.due()
+            second = await job.run()
+            due_after = await job.due()
+            wrong = await self.verify({})
+
+            success = (not first['finished'] and due_while_interrupted and second['resumed']
+                       and second['finished'] and not due_after and not wrong)
+            self.log_test_result(
+                "Usage Reset - Resume",
+                success,
+                f"stopped after {first['rows']} users, resumed for {second['rows']} more; "
+                f"{'not ' if not due_after else ''}due again today; {len(wrong)} wrong counters",
+                {'first': first, 'second': second, 'wrong_sample': wrong[:3]}
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Usage Reset - Resume", False, f"Resume failed: {str(e)}")
+            return False
+
+    async def test_throttle(self):
+        """Test 4: max_rate caps the job's rows per second"""
+        try:
+            await self.roll_over()
+            job = UsageResetJob(self.db_pool, chunk_size=min(self.chunk, max(1, self.rate // 10)),
+                                max_rate=self.rate)
+            result = await job.run()
+            success = result['finished'] and result['rows_per_s'] <= self.rate * 1.15
+            self.log_test_result(
+                "Usage Reset - Throttle",
+                success,
+                f"{result['rows']} users at {result['rows_per_s']} rows/s (max_rate {self.rate}) "
+                f"in {result['elapsed_s']}s",
+                result
+            )
+            return success
+        except Exception as e:
+            self.log_test_result("Usage Reset - Throttle", False, f"Run failed: {str(e)}")
+            return False
+
+    def print_comparison(self):
+        if not self.mode_results:
+            return
+        print("📊 Generations during the reset")
+        print(f"   {'mode':<8} {'reset s':>8} {'gens':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+              f"{'blocked ms':>11} {'wrong':>6}")
+        for mode, result in self.mode_results.items():
+            requests = result['requests']
+            print(
+                f"   {mode:<8} {result['reset_s']:>8.3f} {result['generations']:>6} {requests['p50_ms']:>8.1f} "
+                f"{requests['p95_ms']:>8.1f} {requests['max_ms']:>8.1f} {result['blocked_ms']:>11.0f} "
+                f"{result['wrong']:>6}"
+            )
+
+    async def run_all_tests(self):
+        """Run the usage reset checks"""
+        print("🚀 Starting Usage Reset Test")
+        print(f"   {self.users} users, chunks of {self.chunk}, {self.workers} generating workers, "
+              f"throttle test at {self.rate} rows/s")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_first_request,
+            self.test_reset_under_traffic,
+            self.test_resume,
+            self.test_throttle
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        self.print_comparison()
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Day rollover resets usage in the background without a spike!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = UsageResetTester(
+        users=scenario_option(argv, 'users', 20000),
+        chunk=scenario_option(argv, 'chunk', 1000),
+        workers=scenario_option(argv, 'workers', 8),
+        rate=scenario_option(argv, 'rate', 5000),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Usage Rollups Verification Test
+Checks the daily rollups kept by services.rollups.UsageRollupJob against aggregating
+raw ai_generations, and measures what the dashboards save by reading them.
+
+A company and a set of individual users are seeded, then generations are written in
+waves. Later waves include events whose created_at lies days back (batched or offline
+extension deliveries), which a created_at watermark would miss. After every wave the job
+catches up, and usage_daily_user / usage_daily_company must equal a GROUP BY over the raw
+rows for the seeded users. A second refresh must change nothing, a rebuild of the same
+days must reproduce the same rows, and get_user_usage_breakdown must match raw counts
+including rows written after the last refresh.
+
+The job works on the whole table and the rebuild rewrites the rollups of every user for
+the seeded days, so point this at a test database.
+
+Requires ai_generations_rollups.sql.
+
+Usage: python usage_rollups_test.py [--users=50] [--events=20000] [--waves=4] [--days=45]
+"""
+
+import json
+import time
+import random
+import asyncio
+import asyncpg
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, depends_on, measure, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company, seed_users
+from harness.instrumentation import InstrumentedConnection
+from services.rollups import UsageRollupJob
+
+DIMENSIONS = "day, source, generation_type, language, tone"
+
+RAW_SQL = """
+SELECT {key}, (created_at AT TIME ZONE 'UTC')::date AS day, source, generation_type, language, tone,
+       COUNT(*)::int AS generations, (COUNT(*) FILTER (WHERE success))::int AS successful,
+       SUM(COALESCE(input_length, 0))::bigint AS input_chars, SUM(COALESCE(output_length, 0))::bigint AS output_chars
+FROM public.ai_generations
+WHERE {key} = ANY($1::uuid[])
+GROUP BY {key}, {dimensions}
+ORDER BY {key}, {dimensions}
+"""
+
+ROLLUP_SQL = """
+SELECT {key}, {dimensions}, generations, successful, input_chars, output_chars
+FROM public.{table}
+WHERE {key} = ANY($1::uuid[])
+ORDER BY {key}, {dimensions}
+"""
+
+RAW_BREAKDOWN_SQL = """
+SELECT COUNT(*) FILTER (WHERE source = 'website' AND created_at >= DATE_TRUNC('day', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') AS website_today,
+       COUNT(*) FILTER (WHERE source = 'extension' AND created_at >= DATE_TRUNC('day', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') AS extension_today,
+       COUNT(*) FILTER (WHERE source = 'website' AND created_at >= DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') AS website_month,
+       COUNT(*) FILTER (WHERE source = 'extension' AND created_at >= DATE_TRUNC('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC') AS extension_month,
+       COUNT(*) FILTER (WHERE source = 'website') AS total_website,
+       COUNT(*) FILTER (WHERE source = 'extension') AS total_extension
+FROM public.ai_generations
+WHERE user_id = $1 AND success
+"""
+
+RAW_COMPANY_SQL = """
+SELECT (created_at AT TIME ZONE 'UTC')::date AS day, source, generation_type, language, tone, COUNT(*)
+FROM public.ai_generations
+WHERE company_id = $1 AND created_at >= NOW() - INTERVAL '30 days'
+GROUP BY 1, 2, 3, 4, 5
+"""
+
+LANGUAGES = ['English', 'Spanish', 'French', 'German']
+TONES = ['Professional', 'Friendly', 'Concise']
+
+
+class UsageRollupsTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 50, events: int = 20000, waves: int = 4, days: int = 45, seed: int = 5,
+                 **options):
+        super().__init__(**options)
+        self.users = users
+        self.events = events
+        self.waves = waves
+        self.days = days
+        self.seed = seed
+        self.db_pool = None
+        self.job = None
+        self.company = None
+        self.user_ids: List = []
+        self.companies: Dict = {}
+
+    async def setup(self):
+        """Initialize the database connection pool and seed users"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=2, max_size=5, connection_class=InstrumentedConnection
+            )
+            # settle=0: this suite commits every write before refreshing
+            self.job = UsageRollupJob(self.db_pool, settle=0)
+            async with self.db_pool.acquire() as conn:
+                self.company = await seed_company(conn, users=self.users // 2)
+                solo = await seed_users(conn, self.users - self.users // 2, role='pro')
+            self.user_ids = self.company['user_ids'] + solo
+            self.companies = {user_id: self.company['company_id'] for user_id in self.company['user_ids']}
+            print("✅ Database pool initialized")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove seeded users (their generations and rollups cascade) and close the pool"""
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                await conn.execute("DELETE FROM public.users WHERE id = ANY($1::uuid[])", self.user_ids)
+                if self.company:
+                    await conn.execute("DELETE FROM public.users WHERE company_id = $1", self.company['company_id'])
+                    await conn.execute("DELETE FROM public.companies WHERE id = $1", self.company['company_id'])
+            await self.db_pool.close()
+
+    def wave_rows(self, rng: random.Random, count: int, late_share: float, max_age: timedelta) -> List[tuple]:
+        now = datetime.now(timezone.utc)
+        rows = []
+        for _ in range(count):
+            user_id = rng.choice(self.user_ids)
+            if rng.random() < late_share:
+                created_at = now - timedelta(seconds=rng.uniform(0, self.days * 86400))
+            else:
+                created_at = now - timedelta(seconds=rng.uniform(0, max_age.total_seconds()))
+            rows.append((
+                user_id,
+                self.companies.get(user_id),
+                rng.choice(['website', 'extension']),
+                rng.choice(['reply', 'email']),
+                rng.choice(LANGUAGES),
+                rng.choice(TONES),
+                rng.randint(20, 2000),
+                rng.randint(100, 1500),
+                rng.random() > 0.05,
+                created_at
+            ))
+        return rows
+
+    async def write(self, rows: List[tuple]):
+        async with self.db_pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                'ai_generations', schema_name='public', records=rows,
+                columns=['user_id', 'company_id', 'source', 'generation_type', 'language', 'tone',
+                         'input_length', 'output_length', 'success', 'created_at']
+            )
+
+    async def differences(self) -> Dict[str, int]:
+        """Keys whose rollup row differs from (or is missing against) raw aggregation"""
+        async with self.db_pool.acquire() as conn:
+            result = {}
+            for table, key, ids in (('usage_daily_user', 'user_id', self.user_ids),
+                                    ('usage_daily_company', 'company_id', [self.company['company_id']])):
+                raw = {tuple(row) for row in await conn.fetch(
+                    RAW_SQL.format(key=key, dimensions=DIMENSIONS), ids)}
+                rolled = {tuple(row) for row in await conn.fetch(
+                    ROLLUP_SQL.format(key=key, dimensions=DIMENSIONS, table=table), ids)}
+                result[table] = len(raw ^ rolled)
+            return result
+
+    async def test_incremental_refresh(self):
+        """Test 1: Rollups equal raw aggregation after every wave, late events included"""
+        try:
+            rng = random.Random(self.seed)
+            per_wave = self.events // self.waves
+            wave_details = []
+            for wave in range(self.waves):
+                # The first wave is history; later ones are mostly fresh with some late arrivals
+                rows = self.wave_rows(
+                    rng, per_wave,
+                    late_share=1.0 if wave == 0 else 0.1,
+                    max_age=timedelta(hours=1)
+                )
+                await self.write(rows)
+                started = time.perf_counter()
+                applied = await self.job.catch_up()
+                refresh_ms = round((time.perf_counter() - started) * 1000, 1)
+                differing = await self.differences()
+                wave_details.append({'wave': wave + 1, 'rows': len(rows), 'refresh_ms': refresh_ms,
+                                     'applied': applied, 'differing': differing})
+                if any(differing.values()):
+                    self.log_test_result("Rollups - Incremental Refresh", False,
+                                         f"Wave {wave + 1}: rollups differ from raw {differing}", wave_details)
+                    return False
+
+            self.log_test_result(
+                "Rollups - Incremental Refresh",
+                True,
+                f"{self.waves} waves of {per_wave} generations; rollups match raw after each "
+                f"(refresh {', '.join(str(w['refresh_ms']) for w in wave_details)} ms)",
+                wave_details
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Rollups - Incremental Refresh", False, f"Refresh failed: {str(e)}")
+            return False
+
+    async def test_refresh_is_idempotent(self):
+        """Test 2: Refreshing with nothing new changes nothing"""
+        try:
+            applied = await self.job.catch_up()
+            differing = await self.differences()
+            if any(differing.values()):
+                self.log_test_result("Rollups - Idempotent Refresh", False,
+                                     f"Rollups changed on an empty refresh {differing}", applied)
+                return False
+            self.log_test_result("Rollups - Idempotent Refresh", True,
+                                 "Second refresh left the rollups unchanged", applied)
+            return True
+        except Exception as e:
+            self.log_test_result("Rollups - Idempotent Refresh", False, f"Refresh failed: {str(e)}")
+            return False
+
+    async def test_rebuild_matches(self):
+        """Test 3: Rebuilding the seeded days from raw rows reproduces the rollups"""
+        try:
+            async with self.db_pool.acquire() as conn:
+                today = await conn.fetchval("SELECT (NOW() AT TIME ZONE 'UTC')::date")
+            await self.job.rebuild(today - timedelta(days=self.days + 1), today + timedelta(days=1))
+            differing = await self.differences()
+            if any(differing.values()):
+                self.log_test_result("Rollups - Rebuild", False, f"Rebuilt rollups differ from raw {differing}")
+                return False
+            self.log_test_result("Rollups - Rebuild", True, f"Rebuilt {self.days + 2} days; rollups match raw")
+            return True
+        except Exception as e:
+            self.log_test_result("Rollups - Rebuild", False, f"Rebuild failed: {str(e)}")
+            return False
+
+    async def breakdown(self, conn, user_id) -> Dict:
+        async with conn.transaction():
+            # auth.uid() reads the JWT claims PostgREST would set for this user
+            await conn.execute("SELECT set_config('request.jwt.claim.sub', $1, true)", str(user_id))
+            await conn.execute("SELECT set_config('request.jwt.claims', json_build_object('sub', $1::text)::text, true)",
+                               str(user_id))
+            return await conn.fetchval("SELECT public.get_user_usage_breakdown($1)", user_id)
+
+    @depends_on(files=('services/rollups.py', 'ai_generations_rollups.sql'),
+                tables=('ai_generations', 'usage_daily_user', 'usage_rollup_state'))
+    async def test_breakdown_matches_raw(self):
+        """Test 4: get_user_usage_breakdown equals raw counts, unrolled rows included"""
+        try:
+            # Written after the last refresh, so only the raw tail can account for them
+            await self.write(self.wave_rows(random.Random(self.seed + 1), 500, late_share=0.0,
+                                            max_age=timedelta(minutes=30)))
+            mismatched = []
+            async with self.db_pool.acquire() as conn:
+                for user_id in self.user_ids:
+                    data = await self.breakdown(conn, user_id)
+                    data = json.loads(data) if isinstance(data, str) else data
+                    raw = dict(await conn.fetchrow(RAW_BREAKDOWN_SQL, user_id))
+                    if any(data[key] != value for key, value in raw.items()):
+                        mismatched.append({'user_id': str(user_id), 'breakdown': data, 'raw': raw})
+            if mismatched:
+                self.log_test_result("Rollups - Usage Breakdown", False,
+                                     f"{len(mismatched)} users differ from raw counts", mismatched[:3])
+                return False
+            self.log_test_result("Rollups - Usage Breakdown", True,
+                                 f"Breakdown matches raw counts for all {len(self.user_ids)} users")
+            return True
+        except Exception as e:
+            self.log_test_result("Rollups - Usage Breakdown", False, f"Breakdown failed: {str(e)}")
+            return False
+
+    async def test_dashboard_read_cost(self):
+        """Test 5: Rows and time for a 30-day company dashboard, raw vs rollups"""
+        try:
+            company_id = self.company['company_id']
+            async with self.db_pool.acquire() as conn:
+                raw_rows = await conn.fetchval(
+                    "SELECT COUNT(*) FROM public.ai_generations "
+                    "WHERE company_id = $1 AND created_at >= NOW() - INTERVAL '30 days'", company_id)
+                rollup_rows = await conn.fetchval(
+                    "SELECT COUNT(*) FROM public.usage_daily_company "
+                    "WHERE company_id = $1 AND day > (NOW() AT TIME ZONE 'UTC')::date - 30", company_id)
+                raw_ms = await measure(lambda: conn.fetch(RAW_COMPANY_SQL, company_id), trials=10)
+                rollup_ms = await measure(lambda: conn.fetch("""
+                    SELECT day, source, generation_type, language, tone, generations
+                    FROM public.usage_daily_company
+                    WHERE company_id = $1 AND day > (NOW() AT TIME ZONE 'UTC')::date - 30
+                """, company_id), trials=10)
+
+            details = {
+                'raw_rows': raw_rows,
+                'rollup_rows': rollup_rows,
+                'raw_median_ms': sorted(raw_ms)[len(raw_ms) // 2],
+                'rollup_median_ms': sorted(rollup_ms)[len(rollup_ms) // 2]
+            }
+            if rollup_rows > raw_rows:
+                self.log_test_result("Rollups - Dashboard Read Cost", False,
+                                     "Rollups hold more rows than the generations they summarize", details)
+                return False
+            self.log_test_result(
+                "Rollups - Dashboard Read Cost",
+                True,
+                f"{raw_rows} generations -> {rollup_rows} rollup rows; "
+                f"{details['raw_median_ms']:.2f} ms -> {details['rollup_median_ms']:.2f} ms",
+                details
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Rollups - Dashboard Read Cost", False, f"Measurement failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the rollup verification"""
+        print("🚀 Starting Usage Rollups Verification Test")
+        print(f"   {self.events} generations from {self.users} users in {self.waves} waves over {self.days} days")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_incremental_refresh,
+            self.test_refresh_is_idempotent,
+            self.test_rebuild_matches,
+            self.test_breakdown_matches_raw,
+            self.test_dashboard_read_cost
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Usage rollups match raw aggregation!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = UsageRollupsTester(
+        users=scenario_option(argv, 'users', 50),
+        events=scenario_option(argv, 'events', 20000),
+        waves=scenario_option(argv, 'waves', 4),
+        days=scenario_option(argv, 'days', 45),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Company Usage Sketches Test
+Checks services.company_sketches.CompanySketchJob: the HyperLogLog and t-digest it keeps per
+company and day must stay within their error bounds of the exact GROUP BY answers, merge
+across days, follow late events, and be cheaper to read than the raw rows.
+
+A company is seeded with many members whose activity is skewed (a few heavy users, a long
+tail of light ones) over the last week. History is backfilled with a catch-up followed by
+a rebuild, as in production; then fresh and late generations are written and the job
+catches up again.
+
+Error bounds: distinct users within 3 standard errors of HyperLogLog at precision 12
+(3 x 1.04 / 64, about 5%); percentiles of generations per user, rounded to whole
+generations, within two percentile points of rank.
+
+The rebuild rewrites the sketches of every company for the seeded days, so point this at
+a test database.
+
+Requires company_usage_sketches.sql.
+
+Usage: python usage_sketches_test.py [--users=3000] [--events=100000] [--days=7]
+"""
+
+import math
+import random
+import asyncio
+import asyncpg
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+import sys
+
+from harness import TesterBase, measure, scenario_option, suite_options
+from harness.config import db_config
+from harness.fixtures import seed_company
+from harness.instrumentation import InstrumentedConnection
+from services.company_sketches import CompanySketchJob, company_summary
+
+DISTINCT_TOLERANCE = 3 * 1.04 / 64
+RANK_TOLERANCE = 0.02
+
+EXACT_DAYS_SQL = """
+SELECT day, SUM(n)::bigint AS generations, COUNT(*) AS distinct_users,
+       percentile_cont(0.95 - $2::float8) WITHIN GROUP (ORDER BY n) AS p95_low,
+       percentile_cont(0.95 + $2::float8) WITHIN GROUP (ORDER BY n) AS p95_high,
+       percentile_cont(0.5 - $2::float8) WITHIN GROUP (ORDER BY n) AS p50_low,
+       percentile_cont(0.5 + $2::float8) WITHIN GROUP (ORDER BY n) AS p50_high
+FROM (
+  SELECT (created_at AT TIME ZONE 'UTC')::date AS day, user_id, COUNT(*) AS n
+  FROM public.ai_generations
+  WHERE company_id = $1
+  GROUP BY 1, 2
+) per_user_day
+GROUP BY day
+"""
+
+EXACT_RANGE_SQL = """
+SELECT COUNT(DISTINCT user_id) FROM public.ai_generations
+WHERE company_id = $1
+  AND created_at >= $2::date::timestamp AT TIME ZONE 'UTC'
+  AND created_at < $3::date::timestamp AT TIME ZONE 'UTC'
+"""
+
+
+class UsageSketchesTester(TesterBase):
+    incremental_context = {'db_host': db_config()['host']}
+
+    def __init__(self, users: int = 3000, events: int = 100000, days: int = 7, seed: int = 17, **options):
+        super().__init__(**options)
+        self.users = users
+        self.events = events
+        self.days = days
+        self.seed = seed
+        self.db_pool = None
+        self.job = None
+        self.company = None
+        self.weights: List[float] = []
+        self.today = None
+
+    async def setup(self):
+        """Initialize the database connection pool, seed the company and its history"""
+        try:
+            self.db_pool = await asyncpg.create_pool(
+                **db_config(), min_size=1, max_size=3, connection_class=InstrumentedConnection
+            )
+            # settle=0: this suite commits every write before refreshing
+            self.job = CompanySketchJob(self.db_pool, settle=0)
+            async with self.db_pool.acquire() as conn:
+                self.company = await seed_company(conn, users=self.users, devices_per_user=0)
+                self.today = await conn.fetchval("SELECT (NOW() AT TIME ZONE 'UTC')::date")
+            rng = random.Random(self.seed)
+            self.weights = [rng.paretovariate(1.2) for _ in self.company['user_ids']]
+            await self.write(rng, self.events, max_age=timedelta(days=self.days))
+            print("✅ Database pool initialized")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to initialize connections: {e}")
+            return False
+
+    async def cleanup(self):
+        """Remove the seeded company (members, generations and sketches cascade) and close the pool"""
+        if self.db_pool:
+            async with self.db_pool.acquire() as conn:
+                if self.company:
+                    await conn.execute("DELETE FROM public.users WHERE company_id = $1", self.company['company_id'])
+                    await conn.execute("DELETE FROM public.companies WHERE id = $1", self.company['company_id'])
+            await self.db_pool.close()
+
+    async def write(self, rng: random.Random, count: int, max_age: timedelta, min_age: timedelta = timedelta()):
+        now = datetime.now(timezone.utc)
+        users = rng.choices(self.company['user_ids'], weights=self.weights, k=count)
+        rows = [(
+            user_id, self.company['company_id'], rng.choice(['website', 'extension']), 'reply', 'English',
+            'Professional', rng.randint(20, 2000), rng.randint(100, 1500), True,
+            now - min_age - timedelta(seconds=rng.uniform(0, (max_age - min_age).total_seconds()))
+        ) for user_id in users]
+        async with self.db_pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                'ai_generations', schema_name='public', records=rows,
+                columns=['user_id', 'company_id', 'source', 'generation_type', 'language', 'tone',
+                         'input_length', 'output_length', 'success', 'created_at']
+            )
+
+    async def compare_days(self) -> Dict:
+        """Per-day sketches against exact answers; returns the days outside their bounds"""
+        async with self.db_pool.acquire() as conn:
+            exact = {row['day']: row for row in await conn.fetch(
+                EXACT_DAYS_SQL, self.company['company_id'], RANK_TOLERANCE)}
+            stored = {row['day']: row for row in await conn.fetch(
+                "SELECT * FROM public.company_usage_sketches WHERE company_id = $1", self.company['company_id'])}
+        bad = {}
+        for day, row in exact.items():
+            sketch = stored.get(day)
+            if sketch is None:
+                bad[str(day)] = 'missing'
+                continue
+            problems = []
+            if sketch['generations'] != row['generations']:
+                problems.append(f"generations {sketch['generations']} != {row['generations']}")
+            if abs(sketch['distinct_users_estimate'] - row['distinct_users']) > max(
+                    DISTINCT_TOLERANCE * row['distinct_users'], 2):
+                problems.append(f"distinct {sketch['distinct_users_estimate']} vs {row['distinct_users']}")
+            if sketch['late_generations'] == 0:
+                for q in ('p50', 'p95'):
+                    # Counts are whole numbers; the digest interpolates between them
+                    value = sketch[f'{q}_per_user']
+                    low, high = math.floor(row[f'{q}_low']), math.ceil(row[f'{q}_high'])
+                    if value is None or not low <= round(value) <= high:
+                        problems.append(f"{q} {value} outside [{low}, {high}]")
+            if problems:
+                bad[str(day)] = problems
+        return {'days': len(exact), 'bad': bad}
+
+    async def test_backfill(self):
+        """Test 1: Catch-up plus rebuild yields per-day sketches within their error bounds"""
+        try:
+            await self.job.catch_up()
+            await self.job.rebuild(self.today - timedelta(days=self.days + 1), self.today + timedelta(days=1))
+            result = await self.compare_days()
+            if result['bad']:
+                self.log_test_result("Sketches - Backfill", False,
+                                     f"{len(result['bad'])} of {result['days']} days outside bounds", result)
+                return False
+            self.log_test_result("Sketches - Backfill", True,
+                                 f"{result['days']} days: generations exact, distinct users and "
+                                 f"p50/p95 per user within bounds", result)
+            return True
+        except Exception as e:
+            self.log_test_result("Sketches - Backfill", False, f"Backfill failed: {str(e)}")
+            return False
+
+    async def test_merge_across_days(self):
+        """Test 2: Merged daily sketches estimate distinct users over the whole range"""
+        try:
+            start, end = self.today - timedelta(days=self.days), self.today + timedelta(days=1)
+            async with self.db_pool.acquire() as conn:
+                summary = await company_summary(conn, self.company['company_id'], start, end)
+                exact = await conn.fetchval(EXACT_RANGE_SQL, self.company['company_id'], start, end)
+            daily_sum = sum(day['distinct_users'] for day in summary['days'])
+            details = {'estimate': summary['distinct_users'], 'exact': exact, 'sum_of_days': daily_sum}
+            if abs(summary['distinct_users'] - exact) > DISTINCT_TOLERANCE * exact:
+                self.log_test_result("Sketches - Merge", False, "Merged estimate outside bounds", details)
+                return False
+            self.log_test_result("Sketches - Merge", True,
+                                 f"{summary['distinct_users']} distinct users over {len(summary['days'])} days "
+                                 f"(exact {exact}; adding days would say {daily_sum})", details)
+            return True
+        except Exception as e:
+            self.log_test_result("Sketches - Merge", False, f"Merge failed: {str(e)}")
+            return False
+
+    async def test_incremental_with_late_events(self):
+        """Test 3: Fresh rows update open days; late rows merge into closed days"""
+        try:
+            rng = random.Random(self.seed + 1)
+            late = self.events // 50
+            await self.write(rng, self.events // 10, max_age=timedelta(minutes=30))
+            # Closed days: at least grace plus a day old
+            await self.write(rng, late, max_age=timedelta(days=self.days - 1),
+                             min_age=timedelta(days=2))
+            applied = await self.job.catch_up()
+            result = await self.compare_days()
+            result['applied'] = applied
+            if applied['late_generations'] != late:
+                self.log_test_result("Sketches - Incremental", False,
+                                     f"{applied['late_generations']} late generations merged, expected {late}", result)
+                return False
+            if result['bad']:
+                self.log_test_result("Sketches - Incremental", False,
+                                     f"{len(result['bad'])} of {result['days']} days outside bounds", result)
+                return False
+            self.log_test_result("Sketches - Incremental", True,
+                                 f"{applied['generations']} generations into {applied['sketches']} sketches, "
+                                 f"{late} late; all days within bounds", result)
+            return True
+        except Exception as e:
+            self.log_test_result("Sketches - Incremental", False, f"Refresh failed: {str(e)}")
+            return False
+
+    async def test_restart_reloads_open_days(self):
+        """Test 4: A new job instance rebuilds its open days and keeps the sketches exact"""
+        try:
+            self.job = CompanySketchJob(self.db_pool, settle=0)
+            await self.write(random.Random(self.seed + 2), self.events // 20, max_age=timedelta(minutes=10))
+            await self.job.catch_up()
+            result = await self.compare_days()
+            result['open_days'] = len(self.job.open_days)
+            if result['bad'] or self.job.stats['reloads'] != 1:
+                self.log_test_result("Sketches - Restart", False,
+                                     f"After restart: {len(result['bad'])} days outside bounds, "
+                                     f"{self.job.stats['reloads']} reloads", result)
+                return False
+            self.log_test_result("Sketches - Restart", True,
+                                 f"Reloaded {result['open_days']} open company days; all days within bounds", result)
+            return True
+        except Exception as e:
+            self.log_test_result("Sketches - Restart", False, f"Restart failed: {str(e)}")
+            return False
+
+    async def test_read_cost(self):
+        """Test 5: Stored size and time of a weekly company summary, raw vs sketches"""
+        try:
+            company_id = self.company['company_id']
+            start, end = self.today - timedelta(days=self.days), self.today + timedelta(days=1)
+            async with self.db_pool.acquire() as conn:
+                sizes = await conn.fetchrow(
+                    "SELECT COUNT(*) AS rows, AVG(octet_length(distinct_users) + octet_length(user_counts))::int "
+                    "AS sketch_bytes FROM public.company_usage_sketches WHERE company_id = $1", company_id)
+                raw_ms = await measure(lambda: conn.fetch(EXACT_DAYS_SQL, company_id, RANK_TOLERANCE), trials=5)
+                sketch_ms = await measure(lambda: company_summary(conn, company_id, start, end), trials=5)
+
+            details = {
+                'sketch_rows': sizes['rows'],
+                'bytes_per_sketch_row': sizes['sketch_bytes'],
+                'raw_median_ms': sorted(raw_ms)[len(raw_ms) // 2],
+                'sketch_median_ms': sorted(sketch_ms)[len(sketch_ms) // 2]
+            }
+            self.log_test_result(
+                "Sketches - Read Cost",
+                True,
+                f"{sizes['rows']} rows of ~{sizes['sketch_bytes']} bytes; "
+                f"{details['raw_median_ms']:.2f} ms raw -> {details['sketch_median_ms']:.2f} ms merged",
+                details
+            )
+            return True
+        except Exception as e:
+            self.log_test_result("Sketches - Read Cost", False, f"Measurement failed: {str(e)}")
+            return False
+
+    async def run_all_tests(self):
+        """Run the sketch checks"""
+        print("🚀 Starting Company Usage Sketches Test")
+        print(f"   {self.events} generations from {self.users} members over {self.days} days")
+        print("=" * 70)
+
+        if not await self.setup():
+            print("❌ Failed to initialize test environment")
+            return False
+
+        tests = [
+            self.test_backfill,
+            self.test_merge_across_days,
+            self.test_incremental_with_late_events,
+            self.test_restart_reloads_open_days,
+            self.test_read_cost
+        ]
+
+        passed, failed, cached = await self.run_tests(tests)
+
+        await self.cleanup()
+
+        print("=" * 70)
+        print(f"📊 TEST SUMMARY")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed == 0:
+            print("🎉 Company sketches stay within their error bounds!")
+        else:
+            print("⚠️ Some tests failed. Check the details above.")
+
+        return failed == 0
+
+
+async def main():
+    """Main test runner"""
+    argv = sys.argv[1:]
+    tester = UsageSketchesTester(
+        users=scenario_option(argv, 'users', 3000),
+        events=scenario_option(argv, 'events', 100000),
+        days=scenario_option(argv, 'days', 7),
+        **suite_options(argv)
+    )
+    success = await tester.run_all_tests()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    exit_code = asyncio.run(main())
+    sys.exit(exit_code)